@@ -0,0 +1,90 @@
+""" Benchmarks of the affine and diffeomorphic registrations """
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+
+from dipy.align.imaffine import (AffineMap, AffineRegistration,
+                                 MutualInformationMetric)
+from dipy.align.imwarp import SymmetricDiffeomorphicRegistration
+from dipy.align.metrics import CCMetric, SSDMetric
+from dipy.align.transforms import (TranslationTransform3D, RigidTransform3D,
+                                   AffineTransform3D)
+
+from .common import synthetic_volume
+
+_TRANSFORMS = {'translation': TranslationTransform3D,
+               'rigid': RigidTransform3D,
+               'affine': AffineTransform3D}
+
+
+def _rotation(angle, axis, shift):
+    """ Returns the affine rotating by `angle` (in radians) around `axis`
+    and translating by `shift` """
+    c, s = np.cos(angle), np.sin(angle)
+    i, j = [k for k in range(3) if k != axis]
+    matrix = np.eye(4)
+    matrix[i, i], matrix[i, j], matrix[j, i], matrix[j, j] = c, -s, s, c
+    matrix[:3, 3] = shift
+    return matrix
+
+
+class TimeAffineRegistration(object):
+    """ Mutual information registration of a volume and its moved copy """
+    params = (['translation', 'rigid', 'affine'], [None, 0.3])
+    param_names = ['transform', 'sampling_proportion']
+    timeout = 600
+
+    def setup(self, transform, sampling_proportion):
+        shape = (48, 48, 48)
+        self.static = synthetic_volume(shape)
+        moved = AffineMap(_rotation(0.1, 2, [2., -1., 1.]), shape, np.eye(4),
+                          shape, np.eye(4))
+        self.moving = moved.transform(self.static)
+        self.transform = _TRANSFORMS[transform]()
+
+    def _register(self, sampling_proportion):
+        metric = MutualInformationMetric(32, sampling_proportion)
+        affreg = AffineRegistration(metric, level_iters=[100, 50, 10],
+                                    verbosity=0)
+        params0 = self.transform.get_identity_parameters()
+        return affreg.optimize(self.static, self.moving, self.transform,
+                               params0, np.eye(4), np.eye(4))
+
+    def time_affine_registration(self, transform, sampling_proportion):
+        self._register(sampling_proportion)
+
+    def peakmem_affine_registration(self, transform, sampling_proportion):
+        self._register(sampling_proportion)
+
+
+class TimeSyNRegistration(object):
+    """ Symmetric diffeomorphic registration of a volume and its smoothly
+    deformed copy """
+    params = (['cc', 'ssd'], [32, 64])
+    param_names = ['metric', 'size']
+    timeout = 600
+
+    def setup(self, metric, size):
+        from scipy.ndimage import map_coordinates, gaussian_filter
+        shape = (size, size, size)
+        self.static = synthetic_volume(shape)
+        rng = np.random.RandomState(1)
+        displacement = [gaussian_filter(rng.randn(*shape), size / 8.)
+                        for _ in range(3)]
+        displacement = [3 * d / np.abs(d).max() for d in displacement]
+        grid = np.mgrid[[slice(0, n) for n in shape]].astype(float)
+        self.moving = map_coordinates(self.static, grid + displacement,
+                                      order=1)
+        self.metric = metric
+
+    def _register(self):
+        metric = CCMetric(3) if self.metric == 'cc' else SSDMetric(3)
+        sdr = SymmetricDiffeomorphicRegistration(metric, [10, 10, 5])
+        sdr.verbosity = 0
+        return sdr.optimize(self.static, self.moving)
+
+    def time_syn_registration(self, metric, size):
+        self._register()
+
+    def peakmem_syn_registration(self, metric, size):
+        self._register()
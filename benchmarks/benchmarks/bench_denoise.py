@@ -0,0 +1,27 @@
+""" Benchmarks of the non-local means denoising """
+from __future__ import division, print_function, absolute_import
+
+from dipy.denoise.nlmeans import nlmeans
+
+from .common import multi_shell_gtab, synthetic_dwi, require_arguments
+
+
+class TimeNLMeans(object):
+    """ Denoising of a 4D diffusion weighted volume """
+    params = (['classic', 'fast'], [1, 2])
+    param_names = ['method', 'patch_radius']
+    timeout = 300
+
+    def setup(self, method, patch_radius):
+        require_arguments(nlmeans, 'method')
+        gtab = multi_shell_gtab((1000,), n_directions=4)
+        self.data = synthetic_dwi((24, 24, 24), gtab)
+        self.mask = self.data[..., 0] > 0
+
+    def time_nlmeans(self, method, patch_radius):
+        nlmeans(self.data, sigma=5., mask=self.mask,
+                patch_radius=patch_radius, block_radius=3, method=method)
+
+    def peakmem_nlmeans(self, method, patch_radius):
+        nlmeans(self.data, sigma=5., mask=self.mask,
+                patch_radius=patch_radius, block_radius=3, method=method)
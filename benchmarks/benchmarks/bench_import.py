@@ -0,0 +1,44 @@
+""" Benchmarks of the time taken to import dipy modules
+
+Each import runs in a new interpreter, as a command line script would. The
+time of an interpreter starting without importing anything is subtracted.
+"""
+from __future__ import division, print_function, absolute_import
+
+import subprocess
+import sys
+import timeit
+
+MODULES = ['dipy', 'dipy.reconst.dti', 'dipy.reconst.csdeconv',
+           'dipy.direction.peaks', 'dipy.tracking.local', 'dipy.io.dpy',
+           'dipy.viz', 'dipy.workflows.reconst']
+
+
+def _run(code):
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def _best_time(code, repeat=5):
+    return min(timeit.repeat(lambda: _run(code), number=1, repeat=repeat))
+
+
+class TimeImport(object):
+    """ Importing a module in a new interpreter """
+    params = [MODULES]
+    param_names = ['module']
+    timeout = 120
+
+    def setup_cache(self):
+        return _best_time('pass')
+
+    def track_import(self, startup_time, module):
+        return _best_time('import ' + module) - startup_time
+    track_import.unit = 'seconds'
+
+    def track_modules(self, startup_time, module):
+        """ Number of modules imported by ``import module`` """
+        code = ('import sys; before = len(sys.modules); import {0}; '
+                'print(len(sys.modules) - before)').format(module)
+        output = subprocess.check_output([sys.executable, '-c', code])
+        return int(output.decode().strip().splitlines()[-1])
+    track_modules.unit = 'modules'
@@ -0,0 +1,151 @@
+""" Benchmarks of the reading and writing of tractograms and peaks """
+from __future__ import division, print_function, absolute_import
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import nibabel as nib
+
+from dipy.direction.peaks import PeaksAndMetrics
+from dipy.data import get_sphere
+
+from .common import phantom_streamlines
+
+
+def _import_from(module_name, *names):
+    """ Returns the objects `names` of module `module_name`
+
+    Raises NotImplementedError, which makes asv skip the benchmark, for the
+    versions of dipy that do not have them yet.
+    """
+    try:
+        module = __import__(module_name, fromlist=list(names))
+        return [getattr(module, name) for name in names]
+    except (ImportError, AttributeError):
+        raise NotImplementedError('{0} is not available in this version of '
+                                  'dipy'.format(module_name))
+
+
+class _TemporaryDirectory(object):
+
+    def setup(self, *params):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown(self, *params):
+        shutil.rmtree(self.tmp_dir)
+
+
+class TimeStreamlinesIO(_TemporaryDirectory):
+    """ Writing and reading a tractogram """
+    params = (['trk', 'tck', 'trk_nibabel'], [10000, 100000])
+    param_names = ['format', 'n_streamlines']
+    timeout = 300
+
+    def setup(self, fmt, n_streamlines):
+        if fmt != 'trk_nibabel':
+            (self.load_trk, self.write_trk, self.load_tck,
+             self.write_tck) = _import_from('dipy.io.streamline', 'load_trk',
+                                            'write_trk', 'load_tck',
+                                            'write_tck')
+        super(TimeStreamlinesIO, self).setup()
+        self.streamlines = phantom_streamlines(n_streamlines)
+        ext = 'tck' if fmt == 'tck' else 'trk'
+        self.fname = os.path.join(self.tmp_dir, 'tracks.' + ext)
+        self.write(fmt)
+
+    def write(self, fmt):
+        if fmt == 'trk':
+            self.write_trk(self.fname, self.streamlines)
+        elif fmt == 'tck':
+            self.write_tck(self.fname, self.streamlines)
+        else:
+            nib.trackvis.write(self.fname,
+                               ((s, None, None) for s in self.streamlines))
+
+    def read(self, fmt):
+        if fmt == 'trk':
+            streamlines, _ = self.load_trk(self.fname)
+        elif fmt == 'tck':
+            streamlines, _ = self.load_tck(self.fname)
+        else:
+            streams, _ = nib.trackvis.read(self.fname, as_generator=True)
+            streamlines = (s[0] for s in streams)
+        # The points are only read when the streamlines are used
+        for s in streamlines:
+            s.sum()
+
+    def time_write(self, fmt, n_streamlines):
+        self.write(fmt)
+
+    def time_read(self, fmt, n_streamlines):
+        self.read(fmt)
+
+    def peakmem_read(self, fmt, n_streamlines):
+        self.read(fmt)
+
+
+class TimeDpyIO(_TemporaryDirectory):
+    """ Writing and reading a tractogram in the Dpy (HDF5) format """
+    params = [10000, 100000]
+    param_names = ['n_streamlines']
+    timeout = 300
+
+    def setup(self, n_streamlines):
+        from dipy.io.dpy import Dpy, have_tables
+        if not have_tables:
+            raise NotImplementedError('PyTables is not installed')
+        super(TimeDpyIO, self).setup()
+        self.Dpy = Dpy
+        self.streamlines = phantom_streamlines(n_streamlines)
+        self.fname = os.path.join(self.tmp_dir, 'tracks.dpy')
+        self.write()
+
+    def write(self):
+        dpw = self.Dpy(self.fname, 'w')
+        dpw.write_tracks(self.streamlines)
+        dpw.close()
+
+    def time_write(self, n_streamlines):
+        self.write()
+
+    def time_read(self, n_streamlines):
+        dpr = self.Dpy(self.fname, 'r')
+        for s in dpr.iter_tracks():
+            s.sum()
+        dpr.close()
+
+
+class TimePeaksIO(_TemporaryDirectory):
+    """ Saving and loading the peaks of a volume """
+    params = [32, 64]
+    param_names = ['size']
+
+    def setup(self, size):
+        self.save_peaks, self.load_peaks = _import_from(
+            'dipy.io.peaks', 'save_peaks', 'load_peaks')
+        super(TimePeaksIO, self).setup()
+        rng = np.random.RandomState(0)
+        shape = (size, size, size)
+        sphere = get_sphere('repulsion724')
+        pam = PeaksAndMetrics()
+        pam.sphere = sphere
+        pam.gfa = rng.rand(*shape)
+        pam.qa = rng.rand(*(shape + (5,)))
+        pam.peak_values = rng.rand(*(shape + (5,)))
+        pam.peak_indices = rng.randint(len(sphere.vertices),
+                                       size=shape + (5,))
+        pam.peak_dirs = sphere.vertices[pam.peak_indices]
+        pam.shm_coeff = rng.rand(*(shape + (45,)))
+        pam.B = rng.rand(45, len(sphere.vertices))
+        self.pam = pam
+        self.dname = os.path.join(self.tmp_dir, 'peaks')
+        self.save_peaks(self.dname, pam)
+
+    def time_save_peaks(self, size):
+        self.save_peaks(self.dname, self.pam)
+
+    def time_load_peaks(self, size):
+        pam = self.load_peaks(self.dname)
+        pam.peak_dirs.sum()
@@ -0,0 +1,72 @@
+""" Benchmarks of the reconstruction models and of the peak extraction """
+from __future__ import division, print_function, absolute_import
+
+from dipy.data import get_sphere
+from dipy.direction.peaks import peaks_from_model
+from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel
+from dipy.reconst.dki import DiffusionKurtosisModel
+from dipy.reconst.dti import TensorModel
+from dipy.reconst.shore import ShoreModel
+
+from .common import (multi_shell_gtab, synthetic_dwi, require_arguments,
+                     FIBER_EVALS)
+
+
+def _make_model(name, gtab):
+    if name == 'dti':
+        return TensorModel(gtab)
+    if name == 'dki':
+        return DiffusionKurtosisModel(gtab)
+    if name == 'csd':
+        return ConstrainedSphericalDeconvModel(gtab, (FIBER_EVALS, 100.),
+                                               sh_order=8)
+    if name == 'shore':
+        return ShoreModel(gtab, radial_order=6, zeta=700, lambdaN=1e-8,
+                          lambdaL=1e-8)
+    raise ValueError(name)
+
+
+# Multi-shell acquisitions are needed by DKI and SHORE
+_SHELLS = {'dti': (1000,), 'csd': (2000,), 'dki': (1000, 2000),
+           'shore': (1000, 2000)}
+
+
+class TimeModelFit(object):
+    """ Fit of the models on a volume """
+    params = (['dti', 'dki', 'csd', 'shore'], [8, 16])
+    param_names = ['model', 'size']
+    timeout = 300
+
+    def setup(self, model, size):
+        gtab = multi_shell_gtab(_SHELLS[model], n_directions=32)
+        self.model = _make_model(model, gtab)
+        self.data = synthetic_dwi((size, size, size), gtab)
+        self.mask = self.data[..., 0] > 0
+
+    def time_fit(self, model, size):
+        self.model.fit(self.data, self.mask)
+
+    def peakmem_fit(self, model, size):
+        self.model.fit(self.data, self.mask)
+
+
+class TimePeaksFromModel(object):
+    """ Peak extraction from the ODFs of the models """
+    params = (['dti', 'csd'], [1024, 4096])
+    param_names = ['model', 'chunk_size']
+    timeout = 300
+
+    def setup(self, model, chunk_size):
+        require_arguments(peaks_from_model, 'chunk_size')
+        gtab = multi_shell_gtab(_SHELLS[model], n_directions=64)
+        self.model = _make_model(model, gtab)
+        self.data = synthetic_dwi((16, 16, 16), gtab)
+        self.sphere = get_sphere('repulsion724')
+
+    def time_peaks_from_model(self, model, chunk_size):
+        peaks_from_model(self.model, self.data, self.sphere, 0.5, 25,
+                         return_sh=False, chunk_size=chunk_size)
+
+    def peakmem_peaks_from_model(self, model, chunk_size):
+        peaks_from_model(self.model, self.data, self.sphere, 0.5, 25,
+                         return_sh=False, chunk_size=chunk_size)
@@ -0,0 +1,39 @@
+""" Benchmarks of streamline clustering and brain extraction """
+from __future__ import division, print_function, absolute_import
+
+from dipy.segment.clustering import QuickBundles
+from dipy.segment.mask import median_otsu
+
+from .common import (multi_shell_gtab, synthetic_dwi, phantom_streamlines)
+
+
+class TimeQuickBundles(object):
+    """ QuickBundles on a phantom tractogram """
+    params = ([1000, 10000], [10., 20.])
+    param_names = ['n_streamlines', 'threshold']
+    timeout = 300
+
+    def setup(self, n_streamlines, threshold):
+        self.streamlines = phantom_streamlines(n_streamlines)
+
+    def time_quickbundles(self, n_streamlines, threshold):
+        QuickBundles(threshold).cluster(self.streamlines)
+
+    def peakmem_quickbundles(self, n_streamlines, threshold):
+        QuickBundles(threshold).cluster(self.streamlines)
+
+    def track_clusters(self, n_streamlines, threshold):
+        return len(QuickBundles(threshold).cluster(self.streamlines))
+
+
+class TimeMedianOtsu(object):
+    """ Brain extraction of a diffusion weighted volume """
+    params = [32, 64]
+    param_names = ['size']
+
+    def setup(self, size):
+        gtab = multi_shell_gtab((1000,), n_directions=8)
+        self.data = synthetic_dwi((size, size, size), gtab)
+
+    def time_median_otsu(self, size):
+        median_otsu(self.data, 4, 4, vol_idx=range(3))
@@ -0,0 +1,47 @@
+""" Benchmarks of local tracking """
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+
+from dipy.data import get_sphere
+from dipy.direction.peaks import peaks_from_model
+from dipy.reconst.dti import TensorModel
+from dipy.tracking import utils
+from dipy.tracking.local import LocalTracking, ThresholdTissueClassifier
+
+from .common import multi_shell_gtab, synthetic_dwi
+
+
+class TimeLocalTracking(object):
+    """ Deterministic tracking along the tensor peaks of a volume """
+    params = ([1, 2], [0.5, 0.2])
+    param_names = ['seeds_per_axis', 'step_size']
+    timeout = 300
+
+    def setup(self, seeds_per_axis, step_size):
+        gtab = multi_shell_gtab((1000,), n_directions=32)
+        data = synthetic_dwi((24, 24, 24), gtab)
+        self.pam = peaks_from_model(TensorModel(gtab), data,
+                                    get_sphere('repulsion724'), 0.5, 25,
+                                    npeaks=2, return_sh=False)
+        self.classifier = ThresholdTissueClassifier(self.pam.gfa, 0.1)
+        seed_mask = np.zeros(self.pam.gfa.shape, dtype=bool)
+        seed_mask[4:-4, 4:-4, 10:14] = True
+        self.affine = np.eye(4)
+        self.seeds = utils.seeds_from_mask(seed_mask,
+                                           density=[seeds_per_axis] * 3,
+                                           affine=self.affine)
+
+    def _track(self, step_size):
+        streamlines = LocalTracking(self.pam, self.classifier, self.seeds,
+                                    self.affine, step_size=step_size)
+        return list(streamlines)
+
+    def time_local_tracking(self, seeds_per_axis, step_size):
+        self._track(step_size)
+
+    def peakmem_local_tracking(self, seeds_per_axis, step_size):
+        self._track(step_size)
+
+    def track_streamlines(self, seeds_per_axis, step_size):
+        return len(self._track(step_size))
@@ -0,0 +1,156 @@
+""" Synthetic data and helpers shared by the benchmarks
+
+All the data is generated with fixed seeds, so that the benchmarks of
+different commits run on the same data.
+"""
+from __future__ import division, print_function, absolute_import
+
+import inspect
+
+import numpy as np
+
+from dipy.core.gradients import gradient_table
+from dipy.core.sphere import HemiSphere, disperse_charges
+from dipy.sims.voxel import multi_tensor, add_noise
+
+# Eigenvalues of the tensors of a fiber and of the free water
+FIBER_EVALS = np.array([0.0017, 0.0003, 0.0003])
+CSF_EVALS = np.array([0.003, 0.003, 0.003])
+
+
+def gradient_directions(n_directions, seed=0):
+    """ Returns `n_directions` directions evenly spread on the half sphere,
+    as an (n_directions, 3) array """
+    rng = np.random.RandomState(seed)
+    theta = np.pi * rng.rand(n_directions)
+    phi = 2 * np.pi * rng.rand(n_directions)
+    hemi = HemiSphere(theta=theta, phi=phi)
+    hemi, _ = disperse_charges(hemi, 1000)
+    return hemi.vertices
+
+
+def multi_shell_gtab(bvals=(1000,), n_directions=64, n_b0=1):
+    """ Returns the gradient table of `n_directions` directions on each
+    shell, and `n_b0` b=0 images """
+    directions = gradient_directions(n_directions)
+    bvecs = [np.zeros((n_b0, 3))] + [directions] * len(bvals)
+    bvalues = [np.zeros(n_b0)] + [np.ones(n_directions) * b for b in bvals]
+    return gradient_table(np.concatenate(bvalues), np.concatenate(bvecs))
+
+
+def _voxel_signals(gtab, n_signals, rng, S0=100):
+    """ Signals of voxels with free water, one fiber, or two crossing
+    fibers in random directions """
+    signals = np.empty((n_signals, len(gtab.bvals)))
+    for i in range(n_signals):
+        n_fibers = i % 3
+        if n_fibers == 0:
+            mevals, fractions = np.array([CSF_EVALS]), [100]
+            angles = [(0, 0)]
+        else:
+            mevals = np.array([FIBER_EVALS] * n_fibers)
+            fractions = [100. / n_fibers] * n_fibers
+            angles = [(180 * rng.rand(), 360 * rng.rand())
+                      for _ in range(n_fibers)]
+        signals[i], _ = multi_tensor(gtab, mevals, S0, angles, fractions,
+                                     snr=None)
+    return signals
+
+
+def synthetic_dwi(shape, gtab, snr=30, n_signals=60, seed=0):
+    """ Simulates a diffusion weighted volume
+
+    Each voxel has the signal of free water, a fiber or two crossing fibers
+    (one of `n_signals` configurations simulated with
+    ``dipy.sims.voxel.multi_tensor``), with Rician noise. The fibers are
+    organized in spatially coherent blocks.
+
+    Parameters
+    ----------
+    shape : tuple of 3 ints
+        Shape of the volume.
+    gtab : GradientTable
+        The acquisition.
+    snr : float, optional
+        Signal to noise ratio of the b=0 signal.
+    n_signals : int, optional
+        Number of different voxel configurations.
+    seed : int, optional
+        Seed of the random generator.
+
+    Returns
+    -------
+    data : 4D array of float32
+    """
+    rng = np.random.RandomState(seed)
+    signals = _voxel_signals(gtab, n_signals, rng)
+    # Blocks of 4x4x4 voxels share the same configuration
+    blocks = [(n + 3) // 4 for n in shape]
+    labels = rng.randint(n_signals, size=blocks)
+    labels = labels.repeat(4, 0).repeat(4, 1).repeat(4, 2)
+    labels = labels[:shape[0], :shape[1], :shape[2]]
+    data = signals[labels]
+    data = add_noise(data, snr, 100, noise_type='rician')
+    return data.astype(np.float32)
+
+
+def synthetic_volume(shape, seed=0):
+    """ Returns a smooth 3D volume of blobs, with the intensity range of a
+    T1 weighted image """
+    from scipy.ndimage import gaussian_filter
+    rng = np.random.RandomState(seed)
+    volume = gaussian_filter(rng.rand(*shape), sigma=max(shape) / 16.)
+    volume -= volume.min()
+    volume *= 1000. / volume.max()
+    # A brain-like ellipsoid on a dark background
+    grid = np.mgrid[[slice(0, n) for n in shape]].astype(float)
+    radii = np.array(shape, dtype=float)[:, None, None, None] * 0.4
+    centers = (np.array(shape, dtype=float)[:, None, None, None] - 1) / 2
+    inside = (((grid - centers) / radii) ** 2).sum(0) <= 1
+    return volume * inside
+
+
+def phantom_streamlines(n_streamlines, n_points=50, n_bundles=5, seed=0):
+    """ Simulates a tractogram of curved bundles
+
+    Each bundle is a fan of arcs with noisy trajectories, the streamlines
+    have between `n_points` / 2 and `n_points` points.
+
+    Returns
+    -------
+    streamlines : list of (N, 3) arrays of float32
+    """
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(n_points // 2, n_points + 1, size=n_streamlines)
+    bundles = np.arange(n_streamlines) % n_bundles
+    radii = 30 + 5 * bundles + 2 * rng.randn(n_streamlines)
+    angles = 2 * np.pi * bundles / n_bundles
+    offsets = rng.randn(n_streamlines, 3) + 60
+
+    # All the points at once, with the parameters of their streamline
+    streamline = np.repeat(np.arange(n_streamlines), lengths)
+    starts = np.cumsum(lengths) - lengths
+    step = np.arange(lengths.sum()) - starts[streamline]
+    t = np.pi * step / (lengths[streamline] - 1)
+    radius, angle = radii[streamline], angles[streamline]
+    points = np.empty((len(t), 3))
+    points[:, 0] = radius * np.cos(t)
+    points[:, 1] = radius * np.sin(t) * np.cos(angle)
+    points[:, 2] = radius * np.sin(t) * np.sin(angle)
+    points += rng.randn(len(t), 3) * 0.3 + offsets[streamline]
+    return np.split(points.astype(np.float32), np.cumsum(lengths)[:-1])
+
+
+def require_arguments(func, *names):
+    """ Raises NotImplementedError, which makes asv skip the benchmark, if
+    `func` does not take the arguments `names` in this version of dipy """
+    try:
+        parameters = inspect.signature(func).parameters
+    except AttributeError:
+        # Python 2
+        parameters = inspect.getargspec(func).args
+    missing = [name for name in names if name not in parameters]
+    if missing:
+        raise NotImplementedError('{0} has no argument {1} in this version '
+                                  'of dipy'.format(func.__name__,
+                                                   ', '.join(missing)))
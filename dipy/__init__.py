@@ -38,14 +38,30 @@ if sys.version[0:3] < '2.6':
 from .info import __version__
 
 # Test callable
-from numpy.testing import Tester
-test = Tester().test
-bench = Tester().bench
-del Tester
+from .utils.tester import LazyTester
+test = LazyTester(__file__).test
+bench = LazyTester(__file__).bench
+del LazyTester
+
+
+# Subpackages are imported when they are first accessed as attributes, e.g.
+# ``dipy.reconst`` after ``import dipy`` (Python >= 3.7)
+_subpackages = ('align', 'boots', 'core', 'data', 'denoise', 'direction',
+                'external', 'io', 'reconst', 'segment', 'sims', 'tracking',
+                'viz', 'workflows')
+
+
+def __getattr__(name):
+    if name in _subpackages:
+        import importlib
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(
+        __name__, name))
+
 
 # Plumb in version etc info stuff
-from .pkg_info import get_pkg_info as _get_pkg_info
 def get_info():
     from os.path import dirname
-    return _get_pkg_info(dirname(__file__))
+    from .pkg_info import get_pkg_info
+    return get_pkg_info(dirname(__file__))
 del sys
@@ -0,0 +1,70 @@
+""" Benchmarks for the linear registration of streamlines
+
+Run this benchmark with:
+
+    nosetests -s --match '(?:^|[\\b_\\.//-])[Bb]ench' /path/to/bench_streamlinear.py
+"""
+from __future__ import print_function
+
+import time
+import numpy as np
+
+from dipy.data import two_cingulum_bundles
+from dipy.tracking.streamline import (set_number_of_points,
+                                      transform_streamlines)
+from dipy.align.streamlinear import (compose_matrix44,
+                                     BundleMinDistanceStochasticMetric,
+                                     StreamlineLinearRegistration,
+                                     MultiresolutionStreamlineLinearRegistration)
+
+
+def _cingulum_pair(nb_copies=10, nb_points=20):
+    """ Static and moving bundles made of jittered copies of a cingulum """
+    rng = np.random.RandomState(1234)
+    cb1 = set_number_of_points(two_cingulum_bundles()[0], nb_points)
+    static = [s + rng.randn(*s.shape) for i in range(nb_copies) for s in cb1]
+    mat = compose_matrix44([10, 4, 3, 5, 20, 10])
+    moving = transform_streamlines(static, mat)
+    return static, moving
+
+
+def _mean_point_error(static, moved):
+    return np.mean(np.sqrt(np.sum((np.concatenate(static) -
+                                   np.concatenate(moved)) ** 2, axis=1)))
+
+
+def _time_registration(slr, static, moving):
+    t0 = time.time()
+    slm = slr.optimize(static, moving)
+    duration = time.time() - t0
+    error = _mean_point_error(static, slm.transform(moving))
+    return duration, error, slm
+
+
+def bench_multiresolution_streamline_registration():
+    static, moving = _cingulum_pair()
+    print("Rigid registration of {0} streamlines".format(len(static)))
+
+    slr = StreamlineLinearRegistration(x0=6)
+    full_time, full_error, slm = _time_registration(slr, static, moving)
+    print("Full BMD:        {0:.3}sec, {1} evaluations, "
+          "error {2:.3}mm".format(full_time, slm.funcs, full_error))
+
+    slr = StreamlineLinearRegistration(
+        BundleMinDistanceStochasticMetric(num_samples=500,
+                                          rng=np.random.RandomState(0)),
+        x0=6)
+    sto_time, sto_error, slm = _time_registration(slr, static, moving)
+    print("Stochastic BMD:  {0:.3}sec, {1} evaluations, "
+          "error {2:.3}mm".format(sto_time, slm.funcs, sto_error))
+
+    mslr = MultiresolutionStreamlineLinearRegistration(
+        x0=6, qb_thresholds=(20., 10.), num_samples=(500, None),
+        rng=np.random.RandomState(0))
+    multi_time, multi_error, slm = _time_registration(mslr, static, moving)
+    print("Multiresolution: {0:.3}sec, {1} evaluations, "
+          "error {2:.3}mm".format(multi_time, slm.funcs, multi_error))
+
+    print("Speed up of {0:.3}x (stochastic) and {1:.3}x "
+          "(multiresolution)".format(full_time / sto_time,
+                                     full_time / multi_time))
@@ -10,7 +10,7 @@ cimport cython
 cimport safe_openmp as openmp
 from safe_openmp cimport have_openmp
 
-from cython.parallel import prange
+from cython.parallel import prange, threadid
 from libc.stdlib cimport malloc, free
 from libc.math cimport sqrt, sin, cos
 from multiprocessing import cpu_count
@@ -167,16 +167,20 @@ def _bundle_minimum_distance(double [:, ::1] stat,
     -----
     The difference with ``_bundle_minimum_distance_matrix`` is that it does not
     save the full distance matrix and therefore needs much less memory.
+
+    Each thread keeps its own buffer of minimum distances to the moving
+    streamlines, the buffers are merged at the end. This way the threads
+    never need to synchronize while the distances are computed.
     """
 
     cdef:
-        cnp.npy_intp i=0, j=0
+        cnp.npy_intp i=0, j=0, t=0, nthreads=1
         double sum_i=0, sum_j=0, tmp=0
         double inf = np.finfo('f8').max
         double dist=0
         double * min_j
         double * min_i
-        openmp.omp_lock_t lock
+        double * min_i_thread
         int all_cores = openmp.omp_get_num_procs()
         int threads_to_use = -1
 
@@ -188,40 +192,38 @@ def _bundle_minimum_distance(double [:, ::1] stat,
     if have_openmp:
         openmp.omp_set_dynamic(0)
         openmp.omp_set_num_threads(threads_to_use)
+        nthreads = openmp.omp_get_max_threads()
 
     with nogil:
 
-        if have_openmp:
-            openmp.omp_init_lock(&lock)
-
         min_j = <double *> malloc(static_size * sizeof(double))
-        min_i = <double *> malloc(moving_size * sizeof(double))
+        min_i = <double *> malloc(nthreads * moving_size * sizeof(double))
 
         for i in range(static_size):
             min_j[i] = inf
 
-        for j in range(moving_size):
+        for j in range(nthreads * moving_size):
             min_i[j] = inf
 
         for i in prange(static_size):
+            # Only the current thread updates min_j[i]
+            min_i_thread = &min_i[threadid() * moving_size]
 
             for j in range(moving_size):
 
                 tmp = min_direct_flip_dist(&stat[i * rows, 0],
-                                       &mov[j * rows, 0], rows)
+                                           &mov[j * rows, 0], rows)
 
-                if have_openmp:
-                    openmp.omp_set_lock(&lock)
                 if tmp < min_j[i]:
                     min_j[i] = tmp
 
-                if tmp < min_i[j]:
-                    min_i[j] = tmp
-                if have_openmp:
-                    openmp.omp_unset_lock(&lock)
+                if tmp < min_i_thread[j]:
+                    min_i_thread[j] = tmp
 
-        if have_openmp:
-            openmp.omp_destroy_lock(&lock)
+        for t in range(1, nthreads):
+            for j in range(moving_size):
+                if min_i[t * moving_size + j] < min_i[j]:
+                    min_i[j] = min_i[t * moving_size + j]
 
         for i in range(static_size):
             sum_i += min_j[i]
@@ -46,6 +46,7 @@ import numpy as np
 import numpy.linalg as npl
 import scipy.ndimage as ndimage
 from dipy.core.optimize import Optimizer
+from dipy.core.profile import stage, count, timed
 from dipy.core.optimize import SCIPY_LESS_0_12
 from dipy.align import vector_fields as vf
 from dipy.align import VerbosityLevels
@@ -364,7 +365,7 @@ class AffineMap(object):
 
 class MutualInformationMetric(object):
 
-    def __init__(self, nbins=32, sampling_proportion=None):
+    def __init__(self, nbins=32, sampling_proportion=None, num_threads=None):
         r""" Initializes an instance of the Mutual Information metric
 
         This class implements the methods required by Optimizer to drive the
@@ -384,6 +385,10 @@ class MutualInformationMetric(object):
             then sparse sampling is used, where `sampling_proportion`
             specifies the proportion of voxels to be used. The default is
             None.
+        num_threads : int, optional
+            number of threads used to evaluate the moving image and its
+            gradient at the sampling points (sparse sampling only). If None
+            (default) then all available threads will be used.
 
         Notes
         -----
@@ -394,9 +399,16 @@ class MutualInformationMetric(object):
         voxel to prevent sampling points from being located exactly at voxel
         coordinates. When using dense sampling, this random displacement is
         not applied.
+
+        With sparse sampling, the gradient of the moving image is computed
+        once on its own grid when `setup` is called (i.e. once per resolution
+        level) and then interpolated at the transformed sampling points
+        together with the moving intensities, instead of being re-estimated
+        by finite differences at every evaluation.
         """
         self.histogram = ParzenJointHistogram(nbins)
         self.sampling_proportion = sampling_proportion
+        self.num_threads = num_threads
         self.metric_val = None
         self.metric_grad = None
 
@@ -468,6 +480,7 @@ class MutualInformationMetric(object):
         if self.sampling_proportion is None:
             self.samples = None
             self.ns = 0
+            self.moving_grad = None
         else:
             k = int(np.ceil(1.0 / self.sampling_proportion))
             shape = np.array(static.shape, dtype=np.int32)
@@ -486,6 +499,13 @@ class MutualInformationMetric(object):
             static_p = static_p[..., :self.dim]
             self.static_vals, inside = self.interp_method(static, static_p)
             self.static_vals = np.array(self.static_vals, dtype=np.float64)
+            # Gradient of the moving image on its own grid, interpolated at
+            # the moved sampling points at each evaluation
+            self.moving_grad, _ = vf.gradient(self.moving,
+                                              self.moving_world2grid,
+                                              self.moving_spacing,
+                                              self.moving.shape,
+                                              self.moving_grid2world)
         self.histogram.setup(self.static, self.moving)
 
     def _update_histogram(self):
@@ -522,11 +542,15 @@ class MutualInformationMetric(object):
             moving_values = self.affine_map.transform(self.moving)
             self.histogram.update_pdfs_dense(static_values, moving_values)
         else:  # Sparse case
-            sp_to_moving = self.moving_world2grid.dot(self.affine_map.affine)
-            pts = sp_to_moving.dot(self.samples.T).T  # Points on moving grid
+            # Moved points in physical space, the moving intensities and
+            # gradients are interpolated at them in a single pass
+            pts = self.affine_map.affine.dot(self.samples.T).T
             pts = pts[..., :self.dim]
-            self.moving_vals, inside = self.interp_method(self.moving, pts)
-            self.moving_vals = np.array(self.moving_vals)
+            self.moving_vals, self.moving_sparse_grad, inside = \
+                vf.sparse_interpolate_with_gradient(self.moving,
+                                                    self.moving_grad,
+                                                    self.moving_world2grid,
+                                                    pts, self.num_threads)
             static_values = self.static_vals
             moving_values = self.moving_vals
             self.histogram.update_pdfs_sparse(static_values, moving_values)
@@ -589,13 +613,9 @@ class MutualInformationMetric(object):
                     static2prealigned,
                     mgrad)
             else:  # Sparse case
-                # Compute the gradient of moving at the sampling points
-                # which are already given in physical space coordinates
-                pts = current_affine.dot(self.samples.T).T  # Moved points
-                mgrad, inside = vf.sparse_gradient(self.moving,
-                                                   self.moving_world2grid,
-                                                   self.moving_spacing,
-                                                   pts)
+                # The gradient of moving at the moved sampling points was
+                # interpolated along with the intensities
+                mgrad = self.moving_sparse_grad
                 # The Jacobian must be evaluated at the pre-aligned points
                 pts = self.samples_prealigned[..., :self.dim]
                 H.update_gradient_sparse(params, self.transform, static_values,
@@ -878,6 +898,7 @@ class AffineRegistration(object):
                                         static_spacing, self.ss_sigma_factor,
                                         False)
 
+    @timed('align.affine_registration')
     def optimize(self, static, moving, transform, params0,
                  static_grid2world=None, moving_grid2world=None,
                  starting_affine=None):
@@ -979,17 +1000,23 @@ class AffineRegistration(object):
             else:
                 self.options['maxiter'] = max_iter
 
-            if SCIPY_LESS_0_12:
-                # Older versions don't expect value and gradient from
-                # the same function
-                opt = Optimizer(self.metric.distance, self.params0,
-                                method=self.method, jac=self.metric.gradient,
-                                options=self.options)
-            else:
-                opt = Optimizer(self.metric.distance_and_gradient,
-                                self.params0,
-                                method=self.method, jac=True,
-                                options=self.options)
+            with stage('align.affine_registration.level'):
+                if SCIPY_LESS_0_12:
+                    # Older versions don't expect value and gradient from
+                    # the same function
+                    opt = Optimizer(self.metric.distance, self.params0,
+                                    method=self.method,
+                                    jac=self.metric.gradient,
+                                    options=self.options)
+                else:
+                    opt = Optimizer(self.metric.distance_and_gradient,
+                                    self.params0,
+                                    method=self.method, jac=True,
+                                    options=self.options)
+            count('align.affine_registration.iterations',
+                  opt.res.get('nit', 0))
+            count('align.affine_registration.evaluations',
+                  opt.res.get('nfev', 0))
             params = opt.xopt
 
             # Update starting_affine matrix with optimal parameters
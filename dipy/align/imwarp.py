@@ -12,6 +12,7 @@ from dipy.align import floating
 from dipy.align import VerbosityLevels
 from dipy.align import Bunch
 from dipy.align.scalespace import ScaleSpace
+from dipy.core.profile import stage, count, timed
 
 RegistrationStages = Bunch(INIT_START=0,
                            INIT_END=1,
@@ -198,6 +199,87 @@ class DiffeomorphicMap(object):
         self.forward = None
         self.backward = None
 
+        # Parameters of the fixed-point algorithm used to compute a missing
+        # displacement field from the available one (see `forward` and
+        # `backward`)
+        self.inv_iter = 20
+        self.inv_tol = 1e-3
+
+    @property
+    def forward(self):
+        r"""Displacement field of the forward transformation
+
+        If only the backward displacement field is available, the forward
+        field is computed on demand by numerically inverting it (and kept for
+        later use). Setting this attribute to None releases the field, which
+        is useful to reduce memory usage when only one warping direction is
+        needed.
+        """
+        if self._forward is None and self._backward is not None:
+            self._forward = self._invert_field(self._backward)
+        return self._forward
+
+    @forward.setter
+    def forward(self, field):
+        self._forward = field
+
+    @property
+    def backward(self):
+        r"""Displacement field of the backward transformation
+
+        If only the forward displacement field is available, the backward
+        field is computed on demand by numerically inverting it (and kept for
+        later use). Setting this attribute to None releases the field, which
+        is useful to reduce memory usage when only one warping direction is
+        needed.
+        """
+        if self._backward is None and self._forward is not None:
+            self._backward = self._invert_field(self._forward)
+        return self._backward
+
+    @backward.setter
+    def backward(self, field):
+        self._backward = field
+
+    def _invert_field(self, field):
+        r"""Inverse of a displacement field on this map's discretization
+
+        Computes the inverse of the given displacement field using the
+        fixed-point algorithm with self.inv_iter iterations and tolerance
+        self.inv_tol. The field is assumed to be discretized on this map's
+        displacement field grid.
+
+        Parameters
+        ----------
+        field : array, shape (R, C, 2) or (S, R, C, 3)
+            the displacement field to be inverted
+
+        Returns
+        -------
+        inv : array, shape (R, C, 2) or (S, R, C, 3)
+            the inverse displacement field, with the same data type as `field`
+        """
+        if self.dim == 2:
+            invert_f = vfu.invert_vector_field_fixed_point_2d
+        else:
+            invert_f = vfu.invert_vector_field_fixed_point_3d
+        spacing = get_direction_and_spacings(self.disp_grid2world,
+                                             self.dim)[1]
+        inv = invert_f(field, self.disp_world2grid, spacing,
+                       self.inv_iter, self.inv_tol)
+        return np.asarray(inv)
+
+    def _copy_fields_to(self, other):
+        r"""Shares this map's displacement fields with another map
+
+        The fields are referenced without triggering the on-demand inversion
+        of a missing field.
+        """
+        other._forward = self._forward
+        other._backward = self._backward
+        other.inv_iter = self.inv_iter
+        other.inv_tol = self.inv_tol
+
     def interpret_matrix(self, obj):
         ''' Try to interpret `obj` as a matrix
 
@@ -338,6 +420,41 @@ class DiffeomorphicMap(object):
         converts the sampling grid (whose shape is given as parameter
         'out_shape' ) to space coordinates.
         """
+        affine_idx_in, affine_idx_out, affine_disp, out_shape = \
+            self._get_forward_warp_params(image_world2grid, out_shape,
+                                          out_grid2world)
+
+        # Convert the data to required types to use the cythonized functions
+        image = np.asarray(image, dtype=self._get_warped_dtype(image.dtype,
+                                                                interpolation))
+
+        warp_f = self._get_warping_function(interpolation)
+
+        warped = warp_f(image, self.forward, affine_idx_in, affine_idx_out,
+                        affine_disp, out_shape)
+        return warped
+
+    def _get_forward_warp_params(self, image_world2grid=None, out_shape=None,
+                                 out_grid2world=None):
+        r"""Matrices required to warp an image in the forward direction
+
+        See _warp_forward for the meaning of the parameters and a detailed
+        explanation of the matrices.
+
+        Returns
+        -------
+        affine_idx_in : array, shape (dim+1, dim+1)
+            the matrix to multiply the voxel coordinates by to interpolate on
+            the forward displacement field
+        affine_idx_out : array, shape (dim+1, dim+1)
+            the matrix to multiply the voxel coordinates by to add to the
+            displacement
+        affine_disp : array, shape (dim+1, dim+1)
+            the matrix to multiply the displacement vector by prior to adding
+            it to the transformed input point
+        out_shape : array, shape (dim,)
+            the shape of the sampling grid
+        """
         # if no world-to-image transform is provided, we use the codomain info
         if image_world2grid is None:
             image_world2grid = self.codomain_world2grid
@@ -371,20 +488,7 @@ class DiffeomorphicMap(object):
         # prior to adding to the transformed input point
         affine_disp = W
 
-        # Convert the data to required types to use the cythonized functions
-        if interpolation == 'nearest':
-            if image.dtype is np.dtype('float64') and floating is np.float32:
-                image = image.astype(floating)
-            elif image.dtype is np.dtype('int64'):
-                image = image.astype(np.int32)
-        else:
-            image = np.asarray(image, dtype=floating)
-
-        warp_f = self._get_warping_function(interpolation)
-
-        warped = warp_f(image, self.forward, affine_idx_in, affine_idx_out,
-                        affine_disp, out_shape)
-        return warped
+        return affine_idx_in, affine_idx_out, affine_disp, out_shape
 
     def _warp_backward(self, image, interpolation='linear',
                        image_world2grid=None, out_shape=None,
@@ -450,6 +554,41 @@ class DiffeomorphicMap(object):
         converts the sampling grid (whose shape is given as parameter
         'out_shape' ) to space coordinates.
 
+        """
+        affine_idx_in, affine_idx_out, affine_disp, out_shape = \
+            self._get_backward_warp_params(image_world2grid, out_shape,
+                                           out_grid2world)
+
+        image = np.asarray(image, dtype=self._get_warped_dtype(image.dtype,
+                                                                interpolation))
+
+        warp_f = self._get_warping_function(interpolation)
+
+        warped = warp_f(image, self.backward, affine_idx_in, affine_idx_out,
+                        affine_disp, out_shape)
+
+        return warped
+
+    def _get_backward_warp_params(self, image_world2grid=None, out_shape=None,
+                                  out_grid2world=None):
+        r"""Matrices required to warp an image in the backward direction
+
+        See _warp_backward for the meaning of the parameters and a detailed
+        explanation of the matrices.
+
+        Returns
+        -------
+        affine_idx_in : array, shape (dim+1, dim+1)
+            the matrix to multiply the voxel coordinates by to interpolate on
+            the backward displacement field
+        affine_idx_out : array, shape (dim+1, dim+1)
+            the matrix to multiply the voxel coordinates by to add to the
+            displacement
+        affine_disp : array, shape (dim+1, dim+1)
+            the matrix to multiply the displacement vector by prior to adding
+            it to the transformed input point
+        out_shape : array, shape (dim,)
+            the shape of the sampling grid
         """
         # if no world-to-image transform is provided, we use the domain info
         if image_world2grid is None:
@@ -461,6 +600,8 @@ class DiffeomorphicMap(object):
                 msg = 'Unknown sampling info. Provide a valid out_shape.'
                 raise ValueError(msg)
             out_shape = self.codomain_shape
+        else:
+            out_shape = np.asarray(out_shape, dtype=np.int32)
         if out_grid2world is None:
             out_grid2world = self.codomain_grid2world
 
@@ -483,23 +624,146 @@ class DiffeomorphicMap(object):
         # prior to adding to the transformed input point
         affine_disp = mult_aff(W, Pinv)
 
-        if interpolation == 'nearest':
-            if image.dtype is np.dtype('float64') and floating is np.float32:
-                image = image.astype(floating)
-            elif image.dtype is np.dtype('int64'):
-                image = image.astype(np.int32)
-        else:
-            image = np.asarray(image, dtype=floating)
+        return affine_idx_in, affine_idx_out, affine_disp, out_shape
 
-        warp_f = self._get_warping_function(interpolation)
+    def _get_warped_dtype(self, dtype, interpolation):
+        r"""Data type an image must be converted to before being warped
 
-        warped = warp_f(image, self.backward, affine_idx_in, affine_idx_out,
-                        affine_disp, out_shape)
+        Linear interpolation is performed on floating point images, while
+        nearest-neighbor interpolation keeps the input data type (except for
+        float64 and int64, which are converted to floating and int32).
+        """
+        dtype = np.dtype(dtype)
+        if interpolation != 'nearest':
+            return np.dtype(floating)
+        if dtype == np.dtype('float64'):
+            return np.dtype(floating)
+        if dtype == np.dtype('int64'):
+            return np.dtype(np.int32)
+        return dtype
+
+    def _warp_volumes(self, volumes, backward, interpolation='linear',
+                      image_world2grid=None, out_shape=None,
+                      out_grid2world=None, out=None, num_threads=None):
+        r"""Warps several volumes sharing the same discretization
 
-        return warped
+        The sampling coordinates are computed only once and then all volumes
+        are interpolated at them (in parallel, for 3D maps). For 2D maps the
+        images are warped one at a time.
+
+        Parameters
+        ----------
+        volumes : array, shape (S, R, C, N) or (R, C, N), or list of arrays
+            the volumes to be warped, given as the last axis of a single array
+            or as a list of arrays of the same shape. A single volume (with
+            no additional axis) is also accepted, in which case `out` and the
+            result have no additional axis either
+        backward : boolean
+            if True, the volumes are warped in the backward direction,
+            otherwise in the forward direction
+        interpolation : string, either 'linear' or 'nearest'
+            the type of interpolation to be used for warping
+        image_world2grid : array, shape (dim+1, dim+1)
+            the transformation bringing world (space) coordinates to voxel
+            coordinates of the volumes given as input
+        out_shape : array, shape (dim,)
+            the number of slices, rows and columns of the warped volumes
+        out_grid2world : array, shape (dim+1, dim+1)
+            the transformation bringing voxel coordinates of the warped
+            volumes to physical space
+        out : array, shape out_shape + (N,), optional
+            the buffer (e.g. a memory-mapped array) the warped volumes will be
+            written to. Its data type must be the one the volumes are
+            interpolated with (floating for linear interpolation)
+        num_threads : int, optional
+            number of threads to be used. If None (default) then all available
+            threads will be used.
+
+        Returns
+        -------
+        out : array, shape out_shape + (N,)
+            the warped volumes
+        """
+        is_list = isinstance(volumes, (list, tuple))
+        if not is_list and np.ndim(volumes) == self.dim:
+            if out is not None:
+                out = out[..., None]
+            warped = self._warp_volumes([volumes], backward, interpolation,
+                                        image_world2grid, out_shape,
+                                        out_grid2world, out, num_threads)
+            return warped[..., 0]
+        if is_list:
+            if len(volumes) == 0:
+                raise ValueError('Empty list of volumes')
+            nvolumes = len(volumes)
+            in_dtype = np.asarray(volumes[0]).dtype
+        else:
+            nvolumes = volumes.shape[-1]
+            in_dtype = volumes.dtype
+        dtype = self._get_warped_dtype(in_dtype, interpolation)
+
+        if backward:
+            field = self.backward
+            affine_idx_in, affine_idx_out, affine_disp, out_shape = \
+                self._get_backward_warp_params(image_world2grid, out_shape,
+                                               out_grid2world)
+        else:
+            field = self.forward
+            affine_idx_in, affine_idx_out, affine_disp, out_shape = \
+                self._get_forward_warp_params(image_world2grid, out_shape,
+                                              out_grid2world)
+        expected_shape = tuple(out_shape) + (nvolumes,)
+        if out is None:
+            out = np.zeros(expected_shape, dtype=dtype)
+        elif out.shape != expected_shape:
+            raise ValueError('The output buffer must have shape %s' %
+                             (expected_shape,))
+        elif out.dtype != dtype:
+            raise ValueError('The output buffer must have type %s' % (dtype,))
+
+        if self.dim == 2:
+            warp_f = self._get_warping_function(interpolation)
+            for v in range(nvolumes):
+                image = volumes[v] if is_list else volumes[..., v]
+                out[..., v] = warp_f(np.asarray(image, dtype=dtype), field,
+                                     affine_idx_in, affine_idx_out,
+                                     affine_disp, out_shape)
+            return out
+
+        coords = vfu.warp_coordinates_3d(field, affine_idx_in, affine_idx_out,
+                                         affine_disp, out_shape)
+        if interpolation == 'linear':
+            warp_f = vfu.warp_volumes_3d
+        else:
+            warp_f = vfu.warp_volumes_3d_nn
+
+        # Volumes requiring a type conversion are processed in small blocks
+        # to avoid a full copy of the input data
+        if is_list:
+            step = 1
+        elif in_dtype == dtype:
+            step = nvolumes
+        else:
+            step = 8
+        for start in range(0, nvolumes, step):
+            stop = min(start + step, nvolumes)
+            if is_list:
+                block = np.asarray(volumes[start], dtype=dtype)[..., None]
+            else:
+                block = np.asarray(volumes[..., start:stop], dtype=dtype)
+            warp_f(block, coords, out[..., start:stop], num_threads)
+        return out
+
+    def _is_batch(self, image, out):
+        r"""True if the image must be warped with _warp_volumes
+        """
+        if isinstance(image, (list, tuple)):
+            return True
+        return out is not None or np.ndim(image) == self.dim + 1
 
     def transform(self, image, interpolation='linear', image_world2grid=None,
-                  out_shape=None, out_grid2world=None):
+                  out_shape=None, out_grid2world=None, out=None,
+                  num_threads=None):
         r"""Warps an image in the forward direction
 
         Transforms the input image under this transformation in the forward
@@ -507,11 +771,18 @@ class DiffeomorphicMap(object):
         and "backward" (if is_inverse is False, then transform(...) warps the
         image forwards, else it warps the image backwards).
 
+        Several volumes sharing the same discretization (e.g. a 4D DWI
+        series, or a list of parameter maps) may be warped at once: the
+        sampling coordinates are then computed only once and all volumes are
+        interpolated in a single (multithreaded) pass.
+
         Parameters
         ----------
         image : array, shape (s, r, c) if dim = 3 or (r, c) if dim = 2
             the image to be warped under this transformation in the forward
-            direction
+            direction. An array with an additional last axis (e.g. shape
+            (s, r, c, n)) or a list of arrays is interpreted as a collection
+            of images to be warped
         interpolation : string, either 'linear' or 'nearest'
             the type of interpolation to be used for warping, either 'linear'
             (for k-linear interpolation) or 'nearest' for nearest neighbor
@@ -522,11 +793,21 @@ class DiffeomorphicMap(object):
             the number of slices, rows and columns of the desired warped image
         out_grid2world : the transformation bringing voxel coordinates of the
             warped image to physical space
+        out : array, optional
+            the buffer (e.g. a memory-mapped array) to write the warped
+            image(s) to. Its shape must be the shape of the result (see
+            below) and its data type must be floating for linear
+            interpolation. If None (default) a new array is created
+        num_threads : int, optional
+            number of threads used to warp several images at once. If None
+            (default) then all available threads will be used.
 
         Returns
         -------
         warped : array, shape = out_shape or self.codomain_shape if None
-            the warped image under this transformation in the forward direction
+            the warped image under this transformation in the forward
+            direction. If several images were given, the warped images are
+            stacked along the last axis
 
         Notes
         -----
@@ -535,6 +816,10 @@ class DiffeomorphicMap(object):
         """
         if out_shape is not None:
             out_shape = np.asarray(out_shape, dtype=np.int32)
+        if self._is_batch(image, out):
+            return self._warp_volumes(image, self.is_inverse, interpolation,
+                                      image_world2grid, out_shape,
+                                      out_grid2world, out, num_threads)
         if self.is_inverse:
             warped = self._warp_backward(image, interpolation,
                                          image_world2grid, out_shape,
@@ -546,7 +831,7 @@ class DiffeomorphicMap(object):
 
     def transform_inverse(self, image, interpolation='linear',
                           image_world2grid=None, out_shape=None,
-                          out_grid2world=None):
+                          out_grid2world=None, out=None, num_threads=None):
         r"""Warps an image in the backward direction
 
         Transforms the input image under this transformation in the backward
@@ -554,11 +839,16 @@ class DiffeomorphicMap(object):
         and "backward" (if is_inverse is False, then transform_inverse(...)
         warps the image backwards, else it warps the image forwards)
 
+        As in `transform`, several volumes sharing the same discretization may
+        be warped at once.
+
         Parameters
         ----------
         image : array, shape (s, r, c) if dim = 3 or (r, c) if dim = 2
             the image to be warped under this transformation in the forward
-            direction
+            direction. An array with an additional last axis (e.g. shape
+            (s, r, c, n)) or a list of arrays is interpreted as a collection
+            of images to be warped
         interpolation : string, either 'linear' or 'nearest'
             the type of interpolation to be used for warping, either 'linear'
             (for k-linear interpolation) or 'nearest' for nearest neighbor
@@ -569,17 +859,34 @@ class DiffeomorphicMap(object):
             the number of slices, rows and columns of the desired warped image
         out_grid2world : the transformation bringing voxel coordinates of the
             warped image to physical space
+        out : array, optional
+            the buffer (e.g. a memory-mapped array) to write the warped
+            image(s) to. Its shape must be the shape of the result (see
+            below) and its data type must be floating for linear
+            interpolation. If None (default) a new array is created
+        num_threads : int, optional
+            number of threads used to warp several images at once. If None
+            (default) then all available threads will be used.
 
         Returns
         -------
         warped : array, shape = out_shape or self.codomain_shape if None
-            warped image under this transformation in the backward direction
+            warped image under this transformation in the backward direction.
+            If several images were given, the warped images are stacked along
+            the last axis
 
         Notes
         -----
         See _warp_forward and _warp_backward documentation for further
         information.
         """
+        if out_shape is not None:
+            out_shape = np.asarray(out_shape, dtype=np.int32)
+        if self._is_batch(image, out):
+            return self._warp_volumes(image, not self.is_inverse,
+                                      interpolation, image_world2grid,
+                                      out_shape, out_grid2world, out,
+                                      num_threads)
         if self.is_inverse:
             warped = self._warp_forward(image, interpolation, image_world2grid,
                                         out_shape, out_grid2world)
@@ -609,8 +916,7 @@ class DiffeomorphicMap(object):
                                self.codomain_shape,
                                self.codomain_grid2world,
                                self.prealign)
-        inv.forward = self.forward
-        inv.backward = self.backward
+        self._copy_fields_to(inv)
         inv.is_inverse = True
         return inv
 
@@ -628,14 +934,23 @@ class DiffeomorphicMap(object):
         new_shape : array, shape (dim,)
             the shape of the arrays holding the up-sampled discretization
 
+        Notes
+        -----
+        Released fields (see `forward` and `backward`) are not expanded.
         """
         if self.dim == 2:
             expand_f = vfu.resample_displacement_field_2d
         else:
             expand_f = vfu.resample_displacement_field_3d
 
-        expanded_forward = expand_f(self.forward, expand_factors, new_shape)
-        expanded_backward = expand_f(self.backward, expand_factors, new_shape)
+        expanded_forward = None
+        expanded_backward = None
+        if self._forward is not None:
+            expanded_forward = expand_f(self._forward, expand_factors,
+                                        new_shape)
+        if self._backward is not None:
+            expanded_backward = expand_f(self._backward, expand_factors,
+                                         new_shape)
 
         expand_factors = np.append(expand_factors, [1])
         expanded_grid2world = mult_aff(self.disp_grid2world,
@@ -706,8 +1021,7 @@ class DiffeomorphicMap(object):
                                    self.codomain_shape,
                                    self.codomain_grid2world,
                                    self.prealign)
-        new_map.forward = self.forward
-        new_map.backward = self.backward
+        self._copy_fields_to(new_map)
         new_map.is_inverse = self.is_inverse
         return new_map
 
@@ -981,7 +1295,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
             the warped displacement field
         mean_norm : the mean norm of all vectors in current_displacement
         """
-        sq_field = np.sum((np.array(current_displacement) ** 2), -1)
+        sq_field = np.sum((np.asarray(current_displacement) ** 2), -1)
         mean_norm = np.sqrt(sq_field).mean()
         # We assume that both displacement fields have the same
         # grid2world transform, which implies premult_index=Identity
@@ -990,7 +1304,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         self.compose(current_displacement, new_displacement, None,
                      disp_world2grid, time_scaling, current_displacement)
 
-        return np.array(current_displacement), np.array(mean_norm)
+        return np.asarray(current_displacement), np.array(mean_norm)
 
     def get_map(self):
         r"""Returns the resulting diffeomorphic map
@@ -1136,9 +1450,14 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
 
     def _end_optimizer(self):
         r"""Frees the resources allocated during initialization
+
+        The partial transformation bringing the moving image to the reference
+        space is released as well, since it is already incorporated into the
+        resulting diffeomorphic map.
         """
         del self.moving_ss
         del self.static_ss
+        del self.moving_to_ref
 
     def _iterate(self):
         r"""Performs one symmetric iteration
@@ -1265,7 +1584,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
         self.energy_list.append(fw_energy + bw_energy)
 
         # Invert the forward model's forward field
-        self.static_to_ref.backward = np.array(
+        self.static_to_ref.backward = np.asarray(
             self.invert_vector_field(
                 self.static_to_ref.forward,
                 current_disp_world2grid,
@@ -1273,7 +1592,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
                 self.inv_iter, self.inv_tol, self.static_to_ref.backward))
 
         # Invert the backward model's forward field
-        self.moving_to_ref.backward = np.array(
+        self.moving_to_ref.backward = np.asarray(
             self.invert_vector_field(
                 self.moving_to_ref.forward,
                 current_disp_world2grid,
@@ -1281,7 +1600,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
                 self.inv_iter, self.inv_tol, self.moving_to_ref.backward))
 
         # Invert the forward model's backward field
-        self.static_to_ref.forward = np.array(
+        self.static_to_ref.forward = np.asarray(
             self.invert_vector_field(
                 self.static_to_ref.backward,
                 current_disp_world2grid,
@@ -1289,7 +1608,7 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
                 self.inv_iter, self.inv_tol, self.static_to_ref.forward))
 
         # Invert the backward model's backward field
-        self.moving_to_ref.forward = np.array(
+        self.moving_to_ref.forward = np.asarray(
             self.invert_vector_field(
                 self.moving_to_ref.backward,
                 current_disp_world2grid,
@@ -1382,40 +1701,46 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
             if self.callback is not None:
                 self.callback(self, RegistrationStages.SCALE_START)
 
-            while ((self.niter < self.level_iters[self.levels - 1 - level]) and
-                   (self.opt_tol < derivative)):
-                derivative = self._iterate()
-                self.niter += 1
+            with stage('align.syn_registration.level'):
+                while ((self.niter < self.level_iters[self.levels - 1 - level])
+                       and (self.opt_tol < derivative)):
+                    derivative = self._iterate()
+                    self.niter += 1
+            count('align.syn_registration.iterations', self.niter)
 
             self.full_energy_profile.extend(self.energy_list)
 
             if self.callback is not None:
                 self.callback(self, RegistrationStages.SCALE_END)
 
-        # Reporting mean and std in stats[1] and stats[2]
-        residual, stats = self.static_to_ref.compute_inversion_error()
+            # The smoothed images at this resolution won't be used again
+            self.moving_ss.release_image(level)
+            self.static_ss.release_image(level)
 
+        # Reporting mean and std in stats[1] and stats[2]. The residuals are
+        # full displacement fields, so we only compute them if requested
         if self.verbosity >= VerbosityLevels.DIAGNOSE:
+            residual, stats = self.static_to_ref.compute_inversion_error()
             print('Static-Reference Residual error: %0.6f (%0.6f)'
                   % (stats[1], stats[2]))
 
-        residual, stats = self.moving_to_ref.compute_inversion_error()
-
-        if self.verbosity >= VerbosityLevels.DIAGNOSE:
+            residual, stats = self.moving_to_ref.compute_inversion_error()
             print('Moving-Reference Residual error :%0.6f (%0.6f)'
                   % (stats[1], stats[2]))
+            del residual
 
         # Compose the two partial transformations
         self.static_to_ref = self.moving_to_ref.warp_endomorphism(
             self.static_to_ref.inverse()).inverse()
 
         # Report mean and std for the composed deformation field
-        residual, stats = self.static_to_ref.compute_inversion_error()
         if self.verbosity >= VerbosityLevels.DIAGNOSE:
+            residual, stats = self.static_to_ref.compute_inversion_error()
             print('Final residual error: %0.6f (%0.6f)' % (stats[1], stats[2]))
         if self.callback is not None:
             self.callback(self, RegistrationStages.OPT_END)
 
+    @timed('align.syn_registration')
     def optimize(self, static, moving, static_grid2world=None,
                  moving_grid2world=None, prealign=None):
         r"""
@@ -1460,6 +1785,6 @@ class SymmetricDiffeomorphicRegistration(DiffeomorphicRegistration):
                              static_grid2world, moving_grid2world, prealign)
         self._optimize()
         self._end_optimizer()
-        self.static_to_ref.forward = np.array(self.static_to_ref.forward)
-        self.static_to_ref.backward = np.array(self.static_to_ref.backward)
+        self.static_to_ref.forward = np.asarray(self.static_to_ref.forward)
+        self.static_to_ref.backward = np.asarray(self.static_to_ref.backward)
         return self.static_to_ref
@@ -1,13 +1,10 @@
-from multiprocessing import Pool, cpu_count
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 from scipy.ndimage import affine_transform
 
 
-def _affine_transform(kwargs):
-    return affine_transform(**kwargs)
-
-
 def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
             num_processes=1):
     """Reslice data with new voxel resolution defined by ``new_zooms``
@@ -15,7 +12,9 @@ def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
     Parameters
     ----------
     data : array, shape (I,J,K) or (I,J,K,N)
-        3d volume or 4d volume with datasets
+        3d volume or 4d volume with datasets. Any array-like object that
+        supports slicing, such as the ``dataobj`` proxy of a nibabel image,
+        is also accepted; 4d data is then read one volume at a time.
     affine : array, shape (4,4)
         mapping from voxel coordinates to world coordinates
     zooms : tuple, shape (3,)
@@ -33,10 +32,10 @@ def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
         Value used for points outside the boundaries of the input if
         mode='constant'.
     num_processes : int
-        Split the calculation to a pool of children processes. This only
+        Split the calculation to a pool of worker threads. This only
         applies to 4D `data` arrays. If a positive integer then it defines
-        the size of the multiprocessing pool that will be used. If 0, then
-        the size of the pool will equal the number of cores available.
+        the size of the pool that will be used. If 0, then the size of the
+        pool will equal the number of cores available.
 
     Returns
     -------
@@ -65,6 +64,13 @@ def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
     >>> data2, affine2 = reslice(data, affine, zooms, new_zooms)
     >>> data2.shape == (77, 77, 40)
     True
+
+    Notes
+    -----
+    The volumes of 4d data are resampled by threads writing directly into
+    the output array, so nothing is copied between workers and, besides the
+    output, at most one input volume per thread is held in memory when
+    ``data`` is a proxy.
     """
     new_zooms = np.array(new_zooms, dtype='f8')
     zooms = np.array(zooms, dtype='f8')
@@ -73,26 +79,31 @@ def reslice(data, affine, zooms, new_zooms, order=1, mode='constant', cval=0,
     new_shape = tuple(np.round(new_shape).astype('i8'))
     kwargs = {'matrix': R, 'output_shape': new_shape, 'order': order,
               'mode': mode, 'cval': cval}
-    if data.ndim == 3:
-        data2 = affine_transform(input=data, **kwargs)
-    if data.ndim == 4:
-        data2 = np.zeros(new_shape+(data.shape[-1],), data.dtype)
+    if len(data.shape) == 3:
+        data2 = affine_transform(input=np.asarray(data), **kwargs)
+    if len(data.shape) == 4:
+        vol = np.asarray(data[..., 0])
+        data2 = np.zeros(new_shape+(data.shape[-1],), vol.dtype)
+        del vol
+
+        def _reslice_volume(i):
+            # scipy releases the GIL while interpolating
+            affine_transform(input=np.asarray(data[..., i]),
+                             output=data2[..., i], **kwargs)
+
         if not num_processes:
             num_processes = cpu_count()
+        num_processes = min(num_processes, data.shape[-1])
         if num_processes < 2:
             for i in range(data.shape[-1]):
-                affine_transform(input=data[..., i], output=data2[..., i],
-                                 **kwargs)
+                _reslice_volume(i)
         else:
-            params = []
-            for i in range(data.shape[-1]):
-                _kwargs = {'input': data[..., i]}
-                _kwargs.update(kwargs)
-                params.append(_kwargs)
-            pool = Pool(num_processes)
-            for i, result in enumerate(pool.imap(_affine_transform, params)):
-                data2[..., i] = result
-            pool.close()
+            pool = ThreadPool(num_processes)
+            try:
+                pool.map(_reslice_volume, range(data.shape[-1]))
+            finally:
+                pool.close()
+                pool.join()
 
     Rx = np.eye(4)
     Rx[:3, :3] = np.diag(R)
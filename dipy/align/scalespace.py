@@ -191,6 +191,21 @@ class ScaleSpace(object):
         """
         return self._get_attribute(self.images, level)
 
+    def release_image(self, level):
+        r"""Frees the smoothed image at a given level
+
+        Releases the memory used by the smoothed image at the requested level
+        (e.g. once the optimization at that resolution is finished). The
+        discretization properties of the level are kept.
+
+        Parameters
+        ----------
+        level : int, 0 <= from_level < L, (L = number of resolutions)
+            the scale space level to release the smooth image from
+        """
+        self._get_attribute(self.images, level)
+        self.images[level] = None
+
     def get_domain_shape(self, level):
         r"""Shape the sub-sampled image must have at a particular level
 
@@ -108,6 +108,40 @@ class BundleMinDistanceMetric(StreamlineDistanceMetric):
                                         self.num_threads)
 
 
+class BundleMinDistanceStochasticMetric(BundleMinDistanceMetric):
+
+    def __init__(self, num_samples=1000, rng=None, num_threads=None):
+        """ Bundle-based Minimum Distance on a random subset of moving
+
+        Same cost as ``BundleMinDistanceMetric`` but only ``num_samples``
+        streamlines of the moving set take part in the evaluation. The subset
+        is drawn every time ``setup`` is called and then kept fixed, so that
+        the cost seen by the optimizer remains a deterministic function of
+        the parameters (finite differences in L-BFGS-B rely on this).
+
+        Parameters
+        ----------
+        num_samples : int
+            Number of moving streamlines to sample. If the moving set is
+            smaller, all of its streamlines are used. Default 1000.
+        rng : RandomState or None
+            Random number generator used for sampling. If None (default) then
+            ``np.random`` is used.
+        num_threads : int
+            Number of threads. If None (default) then all available threads
+            will be used.
+        """
+        super(BundleMinDistanceStochasticMetric, self).__init__(num_threads)
+        self.num_samples = num_samples
+        self.rng = np.random if rng is None else rng
+
+    def _set_moving(self, moving):
+        if len(moving) > self.num_samples:
+            index = self.rng.permutation(len(moving))[:self.num_samples]
+            moving = [moving[i] for i in np.sort(index)]
+        super(BundleMinDistanceStochasticMetric, self)._set_moving(moving)
+
+
 class BundleMinDistanceMatrixMetric(StreamlineDistanceMetric):
     """ Bundle-based Minimum Distance aka BMD
 
@@ -408,6 +442,133 @@ class StreamlineLinearRegistration(object):
         raise ValueError('Wrong input')
 
 
+class MultiresolutionStreamlineLinearRegistration(
+        StreamlineLinearRegistration):
+
+    def __init__(self, metric=None, x0="rigid", method='L-BFGS-B',
+                 bounds=None, verbose=False, options=None,
+                 evolution=False, num_threads=None,
+                 qb_thresholds=(20., 10.), num_samples=(None,), rng=None):
+        r""" Coarse-to-fine linear registration of 2 sets of streamlines
+
+        The registration is first solved on the QuickBundles centroids of
+        both sets, from the coarsest to the finest clustering threshold, and
+        then refined on random subsets of the moving streamlines. Every level
+        starts from the transformation found by the previous one, so only the
+        last levels see many streamlines and they typically need very few
+        iterations.
+
+        Parameters
+        ----------
+        metric, x0, method, bounds, verbose, options, evolution, num_threads
+            See ``StreamlineLinearRegistration``. ``x0`` is only used at the
+            first level.
+        qb_thresholds : sequence of float
+            QuickBundles distance thresholds (in mm) of the centroid levels,
+            from coarse to fine. Default (20., 10.).
+        num_samples : sequence of int or None
+            Number of moving streamlines used in each of the levels run after
+            the centroid levels. None means all streamlines. Default (None,),
+            i.e. a single final level using both full sets.
+        rng : RandomState or None
+            Random number generator used for sampling. If None (default) then
+            ``np.random`` is used.
+        """
+        super(MultiresolutionStreamlineLinearRegistration, self).__init__(
+            metric=metric, x0=x0, method=method, bounds=bounds,
+            verbose=verbose, options=options, evolution=evolution,
+            num_threads=num_threads)
+        self.qb_thresholds = qb_thresholds
+        self.num_samples = num_samples
+        self.rng = np.random if rng is None else rng
+
+    def _levels(self, static, moving):
+        """ Generate the (static, moving) pair of every level """
+
+        if len(self.qb_thresholds) > 0:
+            from dipy.segment.clustering import QuickBundles
+            from dipy.segment.metric import AveragePointwiseEuclideanMetric
+
+        for threshold in self.qb_thresholds:
+            qb = QuickBundles(threshold=threshold,
+                              metric=AveragePointwiseEuclideanMetric())
+            static_centroids = [np.asarray(c, dtype=np.float64)
+                                for c in qb.cluster(static).centroids]
+            moving_centroids = [np.asarray(c, dtype=np.float64)
+                                for c in qb.cluster(moving).centroids]
+            yield static_centroids, moving_centroids
+
+        for num in self.num_samples:
+            if num is None or num >= len(moving):
+                yield static, moving
+            else:
+                index = np.sort(self.rng.permutation(len(moving))[:num])
+                yield static, [moving[i] for i in index]
+
+    def optimize(self, static, moving, mat=None):
+        """ Find the minimum of the provided metric, level by level.
+
+        Parameters
+        ----------
+        static : streamlines
+            Reference or fixed set of streamlines.
+        moving : streamlines
+            Moving set of streamlines.
+        mat : array
+            Transformation (4, 4) matrix to start the registration. ``mat``
+            is applied to moving. Default value None which means that initial
+            transformation will be generated by shifting the centers of moving
+            and static sets of streamlines to the origin.
+
+        Returns
+        -------
+        map : StreamlineRegistrationMap
+            ``funcs`` and ``iterations`` are summed over all levels and
+            ``matrix_history`` is concatenated.
+        """
+        if mat is None:
+            static, static_shift = center_streamlines(static)
+            moving, moving_shift = center_streamlines(moving)
+            static_mat = compose_matrix44([static_shift[0], static_shift[1],
+                                           static_shift[2], 0, 0, 0])
+            moving_mat = compose_matrix44([-moving_shift[0], -moving_shift[1],
+                                           -moving_shift[2], 0, 0, 0])
+            level_mat = np.eye(4)
+        else:
+            static_mat = np.eye(4)
+            moving_mat = np.eye(4)
+            level_mat = mat
+
+        x0 = self.x0
+        funcs = 0
+        iterations = 0
+        mat_history = []
+        srm = None
+        try:
+            for static_level, moving_level in self._levels(static, moving):
+                srm = super(MultiresolutionStreamlineLinearRegistration,
+                            self).optimize(static_level, moving_level,
+                                           mat=level_mat)
+                level_mat = srm.matrix
+                funcs += srm.funcs
+                iterations += srm.iterations
+                for m in srm.matrix_history:
+                    mat_history.append(
+                        compose_transformations(moving_mat, m, static_mat))
+                # Following levels start from the identity relative to the
+                # matrix found so far
+                self.x0 = self._set_x0(len(x0))
+        finally:
+            self.x0 = x0
+
+        if srm is None:
+            raise ValueError('At least one level is needed')
+
+        mat = compose_transformations(moving_mat, level_mat, static_mat)
+        return StreamlineRegistrationMap(mat, srm.xopt, srm.fopt,
+                                         mat_history, funcs, iterations)
+
+
 class StreamlineRegistrationMap(object):
 
     def __init__(self, matopt, xopt, fopt, matopt_history, funcs, iterations):
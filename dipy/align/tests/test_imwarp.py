@@ -308,6 +308,104 @@ def test_diffeomorphic_map_simplification_3d():
     assert_equal(simplified.disp_world2grid, None)
 
 
+def test_diffeomorphic_map_lazy_inverse():
+    r""" Test on-demand inversion of the displacement fields
+
+    Define a DiffeomorphicMap providing only one of its displacement fields
+    and verify that the missing one is computed (only when requested) by
+    inverting the available field. Releasing a field must not affect the
+    other one, and the released field must be recomputed when needed.
+    """
+    shape = (32, 32, 32)
+    d, _ = vfu.create_harmonic_fields_3d(shape[0], shape[1], shape[2],
+                                         0.3, 6)
+    d = np.array(d, dtype=floating)
+    expected = vfu.invert_vector_field_fixed_point_3d(d, None, np.ones(3),
+                                                      20, 1e-3)
+
+    mapping = DiffeomorphicMap(3, shape)
+    assert_equal(mapping.forward, None)
+    assert_equal(mapping.backward, None)
+
+    mapping.forward = d
+    # Derived maps share the fields without computing the inverse
+    inv = mapping.inverse()
+    copy = mapping.shallow_copy()
+    assert_equal(inv._backward, None)
+    assert_equal(copy._backward, None)
+
+    assert_equal(mapping.backward.dtype, floating)
+    assert_array_almost_equal(mapping.backward, expected)
+    assert_array_almost_equal(inv.get_forward_field(), expected)
+    assert_array_almost_equal(copy.get_backward_field(), expected)
+    residual, stats = mapping.compute_inversion_error()
+    assert_equal(stats[1] < 0.01, True)
+
+    # Release the forward field, it must be recomputed when needed
+    mapping.forward = None
+    assert_array_almost_equal(mapping.backward, expected)
+    assert_equal(mapping.forward.shape, d.shape)
+
+
+def test_diffeomorphic_map_batch_transform():
+    r""" Test warping several volumes at once
+
+    Warp a 4D image (and a list of volumes) in both directions and verify
+    that the result is identical to warping each volume independently, also
+    when the result is written to a caller-provided buffer.
+    """
+    np.random.seed(8271)
+    shape = (20, 24, 22)
+    codomain_shape = (16, 18, 20)
+    d, dinv = vfu.create_harmonic_fields_3d(shape[0], shape[1], shape[2],
+                                            0.3, 6)
+    grid2world = np.diag([2.0, 2.0, 2.0, 1.0])
+    codomain_grid2world = np.diag([2.5, 2.5, 2.5, 1.0])
+    mapping = DiffeomorphicMap(3, shape, grid2world, shape, grid2world,
+                               codomain_shape, codomain_grid2world, None)
+    mapping.forward = np.array(d, dtype=floating)
+    mapping.backward = np.array(dinv, dtype=floating)
+
+    nvolumes = 5
+    volumes = np.random.rand(*(codomain_shape + (nvolumes,)))
+    expected = np.empty(shape + (nvolumes,), dtype=floating)
+    for v in range(nvolumes):
+        expected[..., v] = mapping.transform(volumes[..., v])
+    assert_array_equal(mapping.transform(volumes), expected)
+    assert_array_equal(mapping.transform(list(volumes.transpose(3, 0, 1, 2)),
+                                         num_threads=1), expected)
+
+    # Nearest neighbor interpolation keeps integer types
+    labels = (volumes * 10).astype(np.int32)
+    warped = mapping.transform(labels, 'nearest')
+    assert_equal(warped.dtype, np.int32)
+    for v in range(nvolumes):
+        assert_array_equal(warped[..., v],
+                           mapping.transform(labels[..., v], 'nearest'))
+
+    # Backward direction
+    volumes = np.random.rand(*(shape + (nvolumes,))).astype(floating)
+    warped = mapping.transform_inverse(volumes)
+    assert_equal(warped.shape, codomain_shape + (nvolumes,))
+    for v in range(nvolumes):
+        assert_array_equal(warped[..., v],
+                           mapping.transform_inverse(volumes[..., v]))
+
+    # Write to a caller-provided buffer
+    out = np.empty(codomain_shape + (nvolumes,), dtype=floating)
+    result = mapping.transform_inverse(volumes, out=out)
+    assert_equal(result is out, True)
+    assert_array_equal(out, warped)
+    out = np.empty(codomain_shape, dtype=floating)
+    mapping.transform_inverse(volumes[..., 0], out=out)
+    assert_array_equal(out, warped[..., 0])
+    # Invalid buffers
+    assert_raises(ValueError, mapping.transform_inverse, volumes,
+                  out=np.empty(codomain_shape + (1,), dtype=floating))
+    assert_raises(ValueError, mapping.transform_inverse, volumes,
+                  out=np.empty(codomain_shape + (nvolumes,)))
+
+
 def test_optimizer_exceptions():
     r""" Test exceptions from SyN
     """
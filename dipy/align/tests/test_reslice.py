@@ -63,6 +63,19 @@ def test_resample():
     assert_almost_equal(data2, data3)
     assert_almost_equal(affine2, affine3)
 
+    # check that volumes can be streamed from the image proxy
+    data3, affine3 = reslice(img.dataobj, affine, zooms, new_zooms,
+                             num_processes=2)
+    assert_equal(data3.dtype, data2.dtype)
+    assert_almost_equal(data2, data3)
+    assert_almost_equal(affine2, affine3)
+    img = nib.load(get_data('aniso_vox'))
+    data3, affine3 = reslice(img.dataobj, img.get_affine(), (4., 4., 5.),
+                             (3., 3., 3.))
+    data2, affine2 = reslice(img.get_data(), img.get_affine(), (4., 4., 5.),
+                             (3., 3., 3.))
+    assert_almost_equal(data2, data3)
+
 
 if __name__ == '__main__':
 
@@ -11,7 +11,9 @@ from dipy.align.streamlinear import (compose_matrix44,
                                      BundleSumDistanceMatrixMetric,
                                      BundleMinDistanceMatrixMetric,
                                      BundleMinDistanceMetric,
+                                     BundleMinDistanceStochasticMetric,
                                      StreamlineLinearRegistration,
+                                     MultiresolutionStreamlineLinearRegistration,
                                      StreamlineDistanceMetric)
 
 from dipy.tracking.streamline import (center_streamlines,
@@ -482,6 +484,68 @@ def test_cascade_of_optimizations_and_threading():
     assert_(slm3.fopt < slm2.fopt)
 
 
+def test_stochastic_metric():
+
+    static = fornix_streamlines()
+    moving = fornix_streamlines()
+    rng = np.random.RandomState(42)
+
+    metric = BundleMinDistanceStochasticMetric(num_samples=50, rng=rng)
+    metric.setup(static, moving)
+    assert_equal(metric.moving_centered_pts.shape, (50 * 12, 3))
+    assert_equal(metric.static_centered_pts.shape, (len(static) * 12, 3))
+    # Identity is still better than a shift
+    assert_(metric.distance(np.zeros(6)) <
+            metric.distance(np.array([5., 0, 0, 0, 0, 0])))
+
+    # Sets smaller than num_samples are used in full
+    metric = BundleMinDistanceStochasticMetric(num_samples=10 ** 6)
+    metric.setup(static, moving)
+    assert_equal(metric.moving_centered_pts.shape, (len(moving) * 12, 3))
+
+    bundle, shift = center_streamlines(static)
+    mat = compose_matrix44([0, 0, 20, 45., 0, 0])
+    bundle2 = transform_streamlines(bundle, mat)
+
+    metric = BundleMinDistanceStochasticMetric(num_samples=50, rng=rng)
+    srr = StreamlineLinearRegistration(metric, x0=np.zeros(6),
+                                       method='Powell')
+    new_bundle2 = srr.optimize(bundle, bundle2).transform(bundle2)
+    evaluate_convergence(bundle, new_bundle2)
+
+
+def test_multiresolution_rigid_real_bundles():
+
+    static = fornix_streamlines()
+    mat = compose_matrix44([0, 0, 20, 45., 0, 0])
+    moving = transform_streamlines(static, mat)
+
+    rng = np.random.RandomState(42)
+    mslr = MultiresolutionStreamlineLinearRegistration(
+        x0=np.zeros(6), method='Powell', qb_thresholds=(20., 10.),
+        num_samples=(50, None), rng=rng)
+    slm = mslr.optimize(static, moving)
+    evaluate_convergence(static, slm.transform(moving))
+    # x0 of the first level is left untouched
+    assert_array_equal(mslr.x0, np.zeros(6))
+    assert_(slm.funcs > 0)
+
+    # Starting from a given matrix
+    slm2 = mslr.optimize(static, moving, mat=slm.matrix)
+    evaluate_convergence(static, slm2.transform(moving))
+
+    # Without centroid levels this falls back to the usual registration
+    mslr = MultiresolutionStreamlineLinearRegistration(
+        x0=6, qb_thresholds=(), num_samples=(None,))
+    slr = StreamlineLinearRegistration(x0=6)
+    assert_array_almost_equal(mslr.optimize(static, moving).matrix,
+                              slr.optimize(static, moving).matrix)
+
+    mslr = MultiresolutionStreamlineLinearRegistration(qb_thresholds=(),
+                                                       num_samples=())
+    assert_raises(ValueError, mslr.optimize, static, moving)
+
+
 if __name__ == '__main__':
 
     run_module_suite()
@@ -1745,3 +1745,29 @@ def test_gradient_3d():
                   shape, invalid_affine)
     assert_raises(ValueError, vfu.gradient, img, sp_to_grid, invalid_spacings,
                   shape, T)
+
+    # Test interpolation of the image and its precomputed gradient
+    img_grad = (actual * inside[..., None]).astype(floating)
+    for num_threads in [1, None]:
+        vals, grad, inside_s = vfu.sparse_interpolate_with_gradient(
+            img, img_grad, sp_to_grid, sample, num_threads)
+        grid_pts = apply_affine(sp_to_grid, sample)
+        expected_vals, expected_inside = vfu.interpolate_scalar_3d(img,
+                                                                   grid_pts)
+        expected_grad, _ = vfu.interpolate_vector_3d(img_grad, grid_pts)
+        assert_array_equal(inside_s, expected_inside)
+        assert_array_almost_equal(vals, expected_vals)
+        assert_array_almost_equal(grad, expected_grad)
+    # Far from the boundary, the interpolated gradient is accurate too
+    interior = np.all((grid_pts > 1) & (grid_pts < np.array(shape) - 2), 1)
+    expected = np.empty((sample.shape[0], 3), dtype=floating)
+    expected[..., 0] =\
+        2 * a * sample[:, 0] + d * sample[:, 1] + e * sample[:, 2]
+    expected[..., 1] =\
+        2 * b * sample[:, 1] + d * sample[:, 0] + f * sample[:, 2]
+    expected[..., 2] =\
+        2 * c * sample[:, 2] + e * sample[:, 0] + f * sample[:, 1]
+    diff = np.abs(expected - grad).mean(1)[interior]
+    assert_equal(diff.max() < 1e-3, True)
+    assert_raises(ValueError, vfu.sparse_interpolate_with_gradient, img,
+                  img_grad[..., :2], sp_to_grid, sample)
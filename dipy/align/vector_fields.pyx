@@ -6,7 +6,9 @@
 import numpy as np
 cimport numpy as cnp
 cimport cython
+from cython.parallel import prange
 from .fused_types cimport floating, number
+from dipy.utils.omp import set_num_threads, restore_default_num_threads
 cdef extern from "dpy_math.h" nogil:
     double floor(double)
     double sqrt(double)
@@ -1185,7 +1187,7 @@ def invert_vector_field_fixed_point_2d(floating[:, :, :] d,
     cdef:
         double[:] stats = np.zeros(shape=(2,), dtype=np.float64)
         double[:] substats = np.empty(shape=(3,), dtype=np.float64)
-        double[:, :] norms = np.zeros(shape=(nr, nc), dtype=np.float64)
+        floating[:, :] norms = np.zeros(shape=(nr, nc), dtype=ftype)
         floating[:, :, :] p = np.zeros(shape=(nr, nc, 2), dtype=ftype)
         floating[:, :, :] q = np.zeros(shape=(nr, nc, 2), dtype=ftype)
 
@@ -1290,7 +1292,7 @@ def invert_vector_field_fixed_point_3d(floating[:, :, :, :] d,
     cdef:
         double[:] stats = np.zeros(shape=(2,), dtype=np.float64)
         double[:] substats = np.zeros(shape=(3,), dtype=np.float64)
-        double[:, :, :] norms = np.zeros(shape=(ns, nr, nc), dtype=np.float64)
+        floating[:, :, :] norms = np.zeros(shape=(ns, nr, nc), dtype=ftype)
         floating[:, :, :, :] p = np.zeros(shape=(ns, nr, nc, 3), dtype=ftype)
         floating[:, :, :, :] q = np.zeros(shape=(ns, nr, nc, 3), dtype=ftype)
 
@@ -2241,6 +2243,340 @@ def transform_3d_affine_nn(number[:, :, :] volume, int[:] ref_shape,
     return np.asarray(out)
 
 
+def warp_coordinates_3d(floating[:, :, :, :] d1,
+                        double[:, :] affine_idx_in=None,
+                        double[:, :] affine_idx_out=None,
+                        double[:, :] affine_disp=None,
+                        int[:] out_shape=None):
+    r"""Sampling coordinates of a 3D warp
+
+    Computes, for each voxel of the sampling grid, the (floating point) voxel
+    coordinates at which the input volume must be interpolated to produce
+    the warped volume. The coordinates are given by:
+
+    (1) coords[i] = C * d1[A*i] + B*i
+
+    where A = affine_idx_in, B = affine_idx_out, C = affine_disp and i denotes
+    the discrete coordinates of a voxel in the sampling grid of
+    shape = out_shape (see `warp_3d` for a detailed explanation). Computing
+    the coordinates once allows to warp any number of volumes sharing the
+    same grid (e.g. the volumes of a 4D image) without re-evaluating the
+    displacement field, see `warp_volumes_3d` and `warp_volumes_3d_nn`.
+
+    Parameters
+    ----------
+    d1 : array, shape (S', R', C', 3)
+        the displacement field driving the transformation
+    affine_idx_in : array, shape (4, 4)
+        the matrix A in eq. (1) above
+    affine_idx_out : array, shape (4, 4)
+        the matrix B in eq. (1) above
+    affine_disp : array, shape (4, 4)
+        the matrix C in eq. (1) above
+    out_shape : array, shape (3,)
+        the number of slices, rows and columns of the sampling grid
+
+    Returns
+    -------
+    coords : array, shape = out_shape + (3,)
+        the voxel coordinates to interpolate the input volume at
+    """
+    cdef:
+        cnp.npy_intp nslices = d1.shape[0]
+        cnp.npy_intp nrows = d1.shape[1]
+        cnp.npy_intp ncols = d1.shape[2]
+        cnp.npy_intp i, j, k
+        int inside
+        double dkk, dii, djj, dk, di, dj
+
+    if not is_valid_affine(affine_idx_in, 3):
+        raise ValueError("Invalid inner index multiplication matrix")
+    if not is_valid_affine(affine_idx_out, 3):
+        raise ValueError("Invalid outer index multiplication matrix")
+    if not is_valid_affine(affine_disp, 3):
+        raise ValueError("Invalid displacement multiplication matrix")
+
+    if out_shape is not None:
+        nslices = out_shape[0]
+        nrows = out_shape[1]
+        ncols = out_shape[2]
+
+    cdef double[:, :, :, :] coords = np.empty(
+        shape=(nslices, nrows, ncols, 3), dtype=np.float64)
+    cdef floating[:] tmp = np.zeros(shape=(3,), dtype=np.asarray(d1).dtype)
+
+    with nogil:
+
+        for k in range(nslices):
+            for i in range(nrows):
+                for j in range(ncols):
+                    if affine_idx_in is None:
+                        dkk = d1[k, i, j, 0]
+                        dii = d1[k, i, j, 1]
+                        djj = d1[k, i, j, 2]
+                    else:
+                        dk = _apply_affine_3d_x0(
+                            k, i, j, 1, affine_idx_in)
+                        di = _apply_affine_3d_x1(
+                            k, i, j, 1, affine_idx_in)
+                        dj = _apply_affine_3d_x2(
+                            k, i, j, 1, affine_idx_in)
+                        inside = _interpolate_vector_3d[floating](d1, dk, di,
+                                                                  dj, tmp)
+                        dkk = tmp[0]
+                        dii = tmp[1]
+                        djj = tmp[2]
+
+                    if affine_disp is not None:
+                        dk = _apply_affine_3d_x0(
+                            dkk, dii, djj, 0, affine_disp)
+                        di = _apply_affine_3d_x1(
+                            dkk, dii, djj, 0, affine_disp)
+                        dj = _apply_affine_3d_x2(
+                            dkk, dii, djj, 0, affine_disp)
+                    else:
+                        dk = dkk
+                        di = dii
+                        dj = djj
+
+                    if affine_idx_out is not None:
+                        coords[k, i, j, 0] = dk + _apply_affine_3d_x0(
+                            k, i, j, 1, affine_idx_out)
+                        coords[k, i, j, 1] = di + _apply_affine_3d_x1(
+                            k, i, j, 1, affine_idx_out)
+                        coords[k, i, j, 2] = dj + _apply_affine_3d_x2(
+                            k, i, j, 1, affine_idx_out)
+                    else:
+                        coords[k, i, j, 0] = dk + k
+                        coords[k, i, j, 1] = di + i
+                        coords[k, i, j, 2] = dj + j
+    return np.asarray(coords)
+
+
+cdef inline void _interpolate_channels_3d(floating[:, :, :, :] volumes,
+                                          double dkk, double dii, double djj,
+                                          floating[:, :, :, :] out,
+                                          cnp.npy_intp k, cnp.npy_intp i,
+                                          cnp.npy_intp j) nogil:
+    r"""Trilinear interpolation of all channels of a 4D image
+
+    Interpolates all volumes (last axis) of the 4D image at (dkk, dii, djj)
+    and stores the results in out[k, i, j, :]. The interpolation weights are
+    computed once and shared by all channels. The result for each channel is
+    identical to the one produced by _interpolate_scalar_3d.
+    """
+    cdef:
+        cnp.npy_intp ns = volumes.shape[0]
+        cnp.npy_intp nr = volumes.shape[1]
+        cnp.npy_intp nc = volumes.shape[2]
+        cnp.npy_intp nv = volumes.shape[3]
+        cnp.npy_intp kk, ii, jj, v
+        double alpha, beta, calpha, cbeta, gamma, cgamma, w
+    for v in range(nv):
+        out[k, i, j, v] = 0
+    if not (-1 < dkk < ns and -1 < dii < nr and -1 < djj < nc):
+        return
+    kk = <int>floor(dkk)
+    ii = <int>floor(dii)
+    jj = <int>floor(djj)
+
+    cgamma = dkk - kk
+    calpha = dii - ii
+    cbeta = djj - jj
+    alpha = 1 - calpha
+    beta = 1 - cbeta
+    gamma = 1 - cgamma
+
+    # The corners are visited in the same order as in _interpolate_scalar_3d
+    if (ii >= 0) and (jj >= 0) and (kk >= 0):
+        w = alpha * beta * gamma
+        for v in range(nv):
+            out[k, i, j, v] = w * volumes[kk, ii, jj, v]
+    jj += 1
+    if (ii >= 0) and (jj < nc) and (kk >= 0):
+        w = alpha * cbeta * gamma
+        for v in range(nv):
+            out[k, i, j, v] += w * volumes[kk, ii, jj, v]
+    ii += 1
+    if (ii < nr) and (jj < nc) and (kk >= 0):
+        w = calpha * cbeta * gamma
+        for v in range(nv):
+            out[k, i, j, v] += w * volumes[kk, ii, jj, v]
+    jj -= 1
+    if (ii < nr) and (jj >= 0) and (kk >= 0):
+        w = calpha * beta * gamma
+        for v in range(nv):
+            out[k, i, j, v] += w * volumes[kk, ii, jj, v]
+    kk += 1
+    if(kk < ns):
+        ii -= 1
+        if (ii >= 0) and (jj >= 0):
+            w = alpha * beta * cgamma
+            for v in range(nv):
+                out[k, i, j, v] += w * volumes[kk, ii, jj, v]
+        jj += 1
+        if (ii >= 0) and (jj < nc):
+            w = alpha * cbeta * cgamma
+            for v in range(nv):
+                out[k, i, j, v] += w * volumes[kk, ii, jj, v]
+        ii += 1
+        if (ii < nr) and (jj < nc):
+            w = calpha * cbeta * cgamma
+            for v in range(nv):
+                out[k, i, j, v] += w * volumes[kk, ii, jj, v]
+        jj -= 1
+        if (ii < nr) and (jj >= 0):
+            w = calpha * beta * cgamma
+            for v in range(nv):
+                out[k, i, j, v] += w * volumes[kk, ii, jj, v]
+
+
+cdef inline void _interpolate_channels_nn_3d(number[:, :, :, :] volumes,
+                                             double dkk, double dii,
+                                             double djj,
+                                             number[:, :, :, :] out,
+                                             cnp.npy_intp k, cnp.npy_intp i,
+                                             cnp.npy_intp j) nogil:
+    r"""Nearest-neighbor interpolation of all channels of a 4D image
+
+    Interpolates all volumes (last axis) of the 4D image at (dkk, dii, djj)
+    and stores the results in out[k, i, j, :]. The result for each channel is
+    identical to the one produced by _interpolate_scalar_nn_3d.
+    """
+    cdef:
+        cnp.npy_intp ns = volumes.shape[0]
+        cnp.npy_intp nr = volumes.shape[1]
+        cnp.npy_intp nc = volumes.shape[2]
+        cnp.npy_intp nv = volumes.shape[3]
+        cnp.npy_intp kk, ii, jj, v
+    for v in range(nv):
+        out[k, i, j, v] = 0
+    if not (0 <= dkk <= ns - 1 and 0 <= dii <= nr - 1 and 0 <= djj <= nc - 1):
+        return
+    kk = <int>floor(dkk)
+    ii = <int>floor(dii)
+    jj = <int>floor(djj)
+    if not ((0 <= kk < ns) and (0 <= ii < nr) and (0 <= jj < nc)):
+        return
+    if(1 - (dkk - kk) < dkk - kk):
+        kk += 1
+    if(1 - (dii - ii) < dii - ii):
+        ii += 1
+    if(1 - (djj - jj) < djj - jj):
+        jj += 1
+    if not ((0 <= kk < ns) and (0 <= ii < nr) and (0 <= jj < nc)):
+        return
+    for v in range(nv):
+        out[k, i, j, v] = volumes[kk, ii, jj, v]
+
+
+def warp_volumes_3d(floating[:, :, :, :] volumes, double[:, :, :, :] coords,
+                    floating[:, :, :, :] out=None, num_threads=None):
+    r"""Warps all volumes of a 4D image using trilinear interpolation
+
+    Interpolates each volume volumes[..., v] at the precomputed sampling
+    coordinates (see `warp_coordinates_3d`). The interpolation weights are
+    computed once per voxel and shared by all volumes, and the slices of the
+    sampling grid are processed in parallel.
+
+    Parameters
+    ----------
+    volumes : array, shape (S, R, C, N)
+        the N input volumes to be transformed
+    coords : array, shape (S', R', C', 3)
+        the voxel coordinates to interpolate the volumes at
+    out : array, shape (S', R', C', N), optional
+        the buffer to write the warped volumes to (e.g. a memory-mapped
+        array). It must have the same data type as `volumes`. If None, the
+        buffer will be created internally
+    num_threads : int, optional
+        number of threads to be used. If None (default) then all available
+        threads will be used.
+
+    Returns
+    -------
+    out : array, shape (S', R', C', N)
+        the transformed volumes
+    """
+    cdef:
+        cnp.npy_intp nslices = coords.shape[0]
+        cnp.npy_intp nrows = coords.shape[1]
+        cnp.npy_intp ncols = coords.shape[2]
+        cnp.npy_intp i, j, k
+
+    if out is None:
+        out = np.zeros(shape=(nslices, nrows, ncols, volumes.shape[3]),
+                       dtype=np.asarray(volumes).dtype)
+    elif (out.shape[0] != nslices or out.shape[1] != nrows or
+          out.shape[2] != ncols or out.shape[3] != volumes.shape[3]):
+        raise ValueError("Invalid output buffer shape")
+
+    changed = set_num_threads(num_threads)
+    with nogil:
+        for k in prange(nslices, schedule='guided'):
+            for i in range(nrows):
+                for j in range(ncols):
+                    _interpolate_channels_3d[floating](
+                        volumes, coords[k, i, j, 0], coords[k, i, j, 1],
+                        coords[k, i, j, 2], out, k, i, j)
+    if changed:
+        restore_default_num_threads()
+    return np.asarray(out)
+
+
+def warp_volumes_3d_nn(number[:, :, :, :] volumes, double[:, :, :, :] coords,
+                       number[:, :, :, :] out=None, num_threads=None):
+    r"""Warps all volumes of a 4D image using nearest-neighbor interpolation
+
+    Interpolates each volume volumes[..., v] at the precomputed sampling
+    coordinates (see `warp_coordinates_3d`). The slices of the sampling grid
+    are processed in parallel.
+
+    Parameters
+    ----------
+    volumes : array, shape (S, R, C, N)
+        the N input volumes to be transformed
+    coords : array, shape (S', R', C', 3)
+        the voxel coordinates to interpolate the volumes at
+    out : array, shape (S', R', C', N), optional
+        the buffer to write the warped volumes to (e.g. a memory-mapped
+        array). It must have the same data type as `volumes`. If None, the
+        buffer will be created internally
+    num_threads : int, optional
+        number of threads to be used. If None (default) then all available
+        threads will be used.
+
+    Returns
+    -------
+    out : array, shape (S', R', C', N)
+        the transformed volumes
+    """
+    cdef:
+        cnp.npy_intp nslices = coords.shape[0]
+        cnp.npy_intp nrows = coords.shape[1]
+        cnp.npy_intp ncols = coords.shape[2]
+        cnp.npy_intp i, j, k
+
+    if out is None:
+        out = np.zeros(shape=(nslices, nrows, ncols, volumes.shape[3]),
+                       dtype=np.asarray(volumes).dtype)
+    elif (out.shape[0] != nslices or out.shape[1] != nrows or
+          out.shape[2] != ncols or out.shape[3] != volumes.shape[3]):
+        raise ValueError("Invalid output buffer shape")
+
+    changed = set_num_threads(num_threads)
+    with nogil:
+        for k in prange(nslices, schedule='guided'):
+            for i in range(nrows):
+                for j in range(ncols):
+                    _interpolate_channels_nn_3d[number](
+                        volumes, coords[k, i, j, 0], coords[k, i, j, 1],
+                        coords[k, i, j, 2], out, k, i, j)
+    if changed:
+        restore_default_num_threads()
+    return np.asarray(out)
+
+
 def warp_2d(floating[:, :] image, floating[:, :, :] d1,
             double[:, :] affine_idx_in=None,
             double[:, :] affine_idx_out=None,
@@ -3457,3 +3793,119 @@ def sparse_gradient(img, img_world2grid, img_spacing, sample_points):
     jd_grad(img, img_world2grid.astype(np.float64),
             img_spacing.astype(np.float64), sample_points, out, inside)
     return np.asarray(out), np.asarray(inside)
+
+
+def _sparse_interpolate_with_gradient_2d(floating[:, :] img,
+                                         floating[:, :, :] img_grad,
+                                         double[:, :] img_world2grid,
+                                         double[:, :] sample_points,
+                                         floating[:] vals,
+                                         floating[:, :] out, int[:] inside):
+    r""" Image and precomputed gradient of a 2D image at points in space
+
+    See `sparse_interpolate_with_gradient`. The sample points are processed
+    in parallel.
+    """
+    cdef:
+        cnp.npy_intp n = sample_points.shape[0]
+        cnp.npy_intp i
+        double dii, djj
+    with nogil:
+        for i in prange(n, schedule='static'):
+            dii = _apply_affine_2d_x0(sample_points[i, 0], sample_points[i, 1],
+                                      1, img_world2grid)
+            djj = _apply_affine_2d_x1(sample_points[i, 0], sample_points[i, 1],
+                                      1, img_world2grid)
+            inside[i] = _interpolate_scalar_2d[floating](img, dii, djj,
+                                                         &vals[i])
+            _interpolate_vector_2d[floating](img_grad, dii, djj, out[i])
+
+
+def _sparse_interpolate_with_gradient_3d(floating[:, :, :] img,
+                                         floating[:, :, :, :] img_grad,
+                                         double[:, :] img_world2grid,
+                                         double[:, :] sample_points,
+                                         floating[:] vals,
+                                         floating[:, :] out, int[:] inside):
+    r""" Image and precomputed gradient of a 3D image at points in space
+
+    See `sparse_interpolate_with_gradient`. The sample points are processed
+    in parallel.
+    """
+    cdef:
+        cnp.npy_intp n = sample_points.shape[0]
+        cnp.npy_intp i
+        double dkk, dii, djj
+    with nogil:
+        for i in prange(n, schedule='static'):
+            dkk = _apply_affine_3d_x0(sample_points[i, 0], sample_points[i, 1],
+                                      sample_points[i, 2], 1, img_world2grid)
+            dii = _apply_affine_3d_x1(sample_points[i, 0], sample_points[i, 1],
+                                      sample_points[i, 2], 1, img_world2grid)
+            djj = _apply_affine_3d_x2(sample_points[i, 0], sample_points[i, 1],
+                                      sample_points[i, 2], 1, img_world2grid)
+            inside[i] = _interpolate_scalar_3d[floating](img, dkk, dii, djj,
+                                                         &vals[i])
+            _interpolate_vector_3d[floating](img_grad, dkk, dii, djj, out[i])
+
+
+def sparse_interpolate_with_gradient(img, img_grad, img_world2grid,
+                                     sample_points, num_threads=None):
+    r""" Image and precomputed gradient evaluated at points in physical space
+
+    Maps each sample point to the grid of `img` and (bi/tri)linearly
+    interpolates both `img` and its gradient `img_grad`, which must have been
+    computed on the same grid (e.g. by `gradient`). When the same image is
+    evaluated many times at moving sets of points (as in an iterative
+    registration with sparse sampling), this avoids recomputing the finite
+    differences of `sparse_gradient` at every evaluation.
+
+    Parameters
+    ----------
+    img : 2D or 3D array, shape (R, C) or (S, R, C)
+        the input image
+    img_grad : array, shape (R, C, 2) or (S, R, C, 3)
+        the gradient of `img` sampled on the grid of `img`. It must have the
+        same data type as `img`
+    img_world2grid : array, shape (dim+1, dim+1)
+        the space-to-grid transform matrix associated to img
+    sample_points: array, shape (n, dim)
+        list of points where the image and its gradient will be evaluated
+        (one point per row)
+    num_threads : int, optional
+        number of threads to be used. If None (default) then all available
+        threads will be used.
+
+    Returns
+    -------
+    vals : array, shape (n,)
+        the interpolated image at each point
+    out : array, shape (n, dim)
+        the interpolated gradient at each point stored at its corresponding
+        row
+    inside : array, shape (n,)
+        inside[i] is 1 if sample_points[i] lies inside the image grid, 0
+        otherwise
+    """
+    dim = len(img.shape)
+    if not is_valid_affine(img_world2grid, dim):
+        raise ValueError("Invalid affine transform matrix")
+    if img_grad.shape != img.shape + (dim,):
+        raise ValueError("Invalid gradient shape")
+
+    ftype = img.dtype.type
+    n = sample_points.shape[0]
+    vals = np.zeros(shape=(n,), dtype=ftype)
+    out = np.zeros(shape=(n, dim), dtype=ftype)
+    inside = np.empty(shape=(n,), dtype=np.int32)
+    if dim == 2:
+        interp = _sparse_interpolate_with_gradient_2d
+    else:
+        interp = _sparse_interpolate_with_gradient_3d
+    changed = set_num_threads(num_threads)
+    interp(img, img_grad, img_world2grid.astype(np.float64),
+           np.ascontiguousarray(sample_points, dtype=np.float64), vals, out,
+           inside)
+    if changed:
+        restore_default_num_threads()
+    return vals, out, inside
@@ -3,11 +3,6 @@ from __future__ import division, print_function, absolute_import
 from dipy.utils.six import string_types
 
 import numpy as np
-try:
-    from scipy.linalg import polar
-except ImportError:   # Some elderly scipy doesn't have polar
-    from dipy.fixes.scipy import polar
-from scipy.linalg import inv
 
 from dipy.io import gradients as io
 from dipy.core.onetime import auto_attr
@@ -285,6 +280,13 @@ def reorient_bvecs(gtab, affines):
        Subject Motion in DTI Data. Leemans, A. and Jones, D.K. (2009).
        MRM, 61: 1336-1349
     """
+    # scipy.linalg is slow to import
+    try:
+        from scipy.linalg import polar
+    except ImportError:   # Some elderly scipy doesn't have polar
+        from dipy.fixes.scipy import polar
+    from scipy.linalg import inv
+
     new_bvecs = gtab.bvecs[~gtab.b0s_mask]
 
     if new_bvecs.shape[0] != len(affines):
@@ -4,14 +4,14 @@ Only L-BFGS-B and Powell is supported in this class for versions of
 Scipy < 0.12. All optimizers are available for scipy >= 0.12.
 """
 import abc
-from distutils.version import LooseVersion
 import numpy as np
 import scipy
 import scipy.sparse as sps
 import scipy.optimize as opt
 from dipy.utils.six import with_metaclass
+from dipy.utils.optpkg import parse_version
 
-SCIPY_LESS_0_12 = LooseVersion(scipy.version.short_version) < '0.12'
+SCIPY_LESS_0_12 = parse_version(scipy.version.short_version) < (0, 12)
 
 if not SCIPY_LESS_0_12:
     from scipy.optimize import minimize
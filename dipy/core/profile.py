@@ -1,11 +1,37 @@
-""" Class for profiling cython code
+""" Class for profiling cython code, and timers and counters of the stages
+of the main algorithms
+
+The stages of the algorithms (model fits, peak extraction, tracking,
+clustering, registration) report their time and counters (voxels fitted,
+streamlines generated, iterations...) to the active `StageRecorder`. No
+recorder is active by default, and the reports then cost a test each.
+Recording is enabled for a block of code with `recording`::
+
+    with recording('stages.json') as recorder:
+        peaks = peaks_from_model(...)
+    print(recorder.summary())
+
+or for a whole program by setting the environment variable ``DIPY_PROFILE``
+to the name of the json file where the records are saved at exit.
 """
 
+import atexit
+import functools
+import json
 import os
 import subprocess
+import threading
+import time
+from contextlib import contextmanager
 
 from dipy.utils.optpkg import optional_package
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the memory is then not recorded
+    resource = None
+
 cProfile, _, _ = optional_package('cProfile')
 pstats, _, _ = optional_package('pstats',
                                 'pstats is not installed.  It is part of the'
@@ -99,3 +125,176 @@ class Profiler():
 
         '''
         self.stats.print_stats(N)
+
+
+def peak_memory():
+    """ Returns the peak resident memory of the current process in MB, or
+    None if it is not available """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on OS X, kilobytes on Linux
+    scale = 2 ** 20 if os.uname()[0] == 'Darwin' else 2 ** 10
+    return maxrss / float(scale)
+
+
+class StageRecorder(object):
+    """ Records the time spent in named stages and named counters
+
+    Attributes
+    ----------
+    timers : dict
+        For each stage, the number of ``calls``, the total ``time`` (in
+        seconds) and the ``peak_memory`` of the process at the end of the
+        stage (in MB).
+    counters : dict
+        The value of each counter.
+    """
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds, calls=1):
+        """ Adds `seconds` spent in stage `name` """
+        memory = peak_memory()
+        with self._lock:
+            timer = self.timers.setdefault(
+                name, {'calls': 0, 'time': 0., 'peak_memory': None})
+            timer['calls'] += calls
+            timer['time'] += seconds
+            if memory is not None:
+                timer['peak_memory'] = max(timer['peak_memory'] or 0, memory)
+
+    def count(self, name, value=1):
+        """ Adds `value` to counter `name` """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {'timers': self.timers, 'counters': self.counters}
+
+    def save(self, fname):
+        """ Saves the timers and counters in a json file """
+        with open(fname, 'w') as f:
+            json.dump(self.to_dict(), f, sort_keys=True, indent=2)
+
+    def summary(self):
+        """ Returns a table of the timers and counters """
+        lines = []
+        for name in sorted(self.timers):
+            timer = self.timers[name]
+            line = '{0:<40} {1:>8d} calls {2:>10.3f} s'.format(
+                name, timer['calls'], timer['time'])
+            if timer['peak_memory'] is not None:
+                line += ' {0:>8.0f} MB'.format(timer['peak_memory'])
+            lines.append(line)
+        for name in sorted(self.counters):
+            lines.append('{0:<40} {1:>14}'.format(name, self.counters[name]))
+        return '\n'.join(lines)
+
+
+_recorder = None
+
+
+def is_recording():
+    """ True if the stages are being recorded """
+    return _recorder is not None
+
+
+def get_recorder():
+    """ Returns the active `StageRecorder`, or None """
+    return _recorder
+
+
+@contextmanager
+def recording(fname=None):
+    """ Records the stages run in the block in a new `StageRecorder`
+
+    Parameters
+    ----------
+    fname : str, optional
+        Json file where the records are saved at the end of the block.
+
+    Examples
+    --------
+    >>> with recording() as recorder:
+    ...     with stage('sleep'):
+    ...         time.sleep(0.01)
+    ...     count('sheep', 3)
+    >>> recorder.timers['sleep']['calls'], recorder.counters['sheep']
+    (1, 3)
+    """
+    global _recorder
+    previous = _recorder
+    _recorder = StageRecorder()
+    try:
+        yield _recorder
+    finally:
+        recorder, _recorder = _recorder, previous
+        if fname is not None:
+            recorder.save(fname)
+
+
+class _Stage(object):
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_time(self.name, time.time() - self.start)
+
+
+class _NoStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_stage = _NoStage()
+
+
+def stage(name):
+    """ Context manager timing a block as stage `name` of the active
+    recorder (does nothing if no recorder is active) """
+    if _recorder is None:
+        return _no_stage
+    return _Stage(_recorder, name)
+
+
+def timed(name):
+    """ Decorator timing every call of a function as stage `name` """
+    def decorate(func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with _Stage(_recorder, name):
+                return func(*args, **kwargs)
+        return timed_func
+    return decorate
+
+
+def count(name, value=1):
+    """ Adds `value` to counter `name` of the active recorder (does nothing
+    if no recorder is active) """
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def _record_program(fname):
+    global _recorder
+    _recorder = StageRecorder()
+    atexit.register(_recorder.save, fname)
+
+
+if os.environ.get('DIPY_PROFILE'):
+    _record_program(os.environ['DIPY_PROFILE'])
@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import join, dirname
+
+import numpy as np
+import numpy.testing as npt
+from nibabel.tmpdirs import InTemporaryDirectory
+
+import dipy
+from dipy.core.profile import (recording, is_recording, get_recorder, stage,
+                               count, timed)
+from dipy.data import get_sphere
+from dipy.direction.peaks import peaks_from_model
+from dipy.reconst.multi_voxel import multi_voxel_fit
+
+
+@timed('test.sleep')
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def test_recording():
+    npt.assert_equal(is_recording(), False)
+    # Nothing is recorded without a recorder
+    with stage('test.stage'):
+        count('test.counter')
+    npt.assert_equal(_sleep(0), 0)
+
+    with InTemporaryDirectory():
+        with recording('stages.json') as recorder:
+            npt.assert_(get_recorder() is recorder)
+            for i in range(3):
+                with stage('test.stage'):
+                    count('test.counter', 2)
+            _sleep(0.01)
+            with recording() as inner:
+                count('test.counter')
+            npt.assert_equal(inner.counters, {'test.counter': 1})
+        npt.assert_equal(is_recording(), False)
+
+        npt.assert_equal(recorder.timers['test.stage']['calls'], 3)
+        npt.assert_(recorder.timers['test.sleep']['time'] >= 0.01)
+        npt.assert_equal(recorder.counters, {'test.counter': 6})
+        with open('stages.json') as f:
+            npt.assert_equal(json.load(f), recorder.to_dict())
+        npt.assert_('test.counter' in recorder.summary())
+
+
+def test_recording_environment_variable():
+    code = ("from dipy.core.profile import stage, count\n"
+            "with stage('test.stage'):\n"
+            "    count('test.counter', 5)\n")
+    with InTemporaryDirectory() as tmp_dir:
+        env = dict(os.environ)
+        env['DIPY_PROFILE'] = join(tmp_dir, 'program.json')
+        env['PYTHONPATH'] = os.pathsep.join(
+            [dirname(dirname(dipy.__file__))] +
+            env.get('PYTHONPATH', '').split(os.pathsep))
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        with open('program.json') as f:
+            records = json.load(f)
+    npt.assert_equal(records['counters'], {'test.counter': 5})
+    npt.assert_equal(records['timers']['test.stage']['calls'], 1)
+
+
+def test_recorded_stages():
+
+    class SillyModel(object):
+
+        @multi_voxel_fit
+        def fit(self, data):
+            return SillyFit(data)
+
+    class SillyFit(object):
+
+        def __init__(self, data):
+            self.data = data
+
+        def odf(self, sphere):
+            return np.abs(np.dot(sphere.vertices, self.data))
+
+    data = np.random.RandomState(0).randn(4, 5, 6, 3)
+    mask = np.zeros(data.shape[:-1], dtype=bool)
+    mask[1:3] = True
+    with recording() as recorder:
+        peaks_from_model(SillyModel(), data, get_sphere('repulsion100'), .5,
+                         25, mask=mask, return_sh=False, chunk_size=20)
+    npt.assert_equal(recorder.counters['reconst.voxels_fitted'], 60)
+    npt.assert_equal(recorder.counters['direction.voxels'], 60)
+    npt.assert_equal(recorder.timers['direction.peaks_from_model']['calls'],
+                     1)
+    npt.assert_(
+        recorder.timers['direction.peaks_from_model.fit']['calls'] >= 3)
+
+
+if __name__ == '__main__':
+    npt.run_module_suite()
@@ -7,7 +7,6 @@ from __future__ import division, print_function, absolute_import
 import sys
 import json
 
-from nibabel import load
 from os.path import join as pjoin, dirname
 
 import gzip
@@ -42,7 +41,9 @@ from dipy.data.fetcher import (fetch_scil_b0,
                                read_mni_template)
 
 from ..utils.arrfuncs import as_native_array
-from dipy.tracking.streamline import relist_streamlines
+from dipy.utils.optpkg import LazyModule
+
+nib = LazyModule('nibabel')
 
 if sys.version_info[0] < 3:
     import cPickle
@@ -299,7 +300,7 @@ def dsi_voxels():
     fimg, fbvals, fbvecs = get_data('small_101D')
     bvals = np.loadtxt(fbvals)
     bvecs = np.loadtxt(fbvecs).T
-    img = load(fimg)
+    img = nib.load(fimg)
     data = img.get_data()
     gtab = gradient_table(bvals, bvecs)
     return data, gtab
@@ -341,8 +342,8 @@ def mrtrix_spherical_functions():
     These coefficients were obtained by using the dwi2SH command of mrtrix.
 
     """
-    func_discrete = load(pjoin(DATA_DIR, "func_discrete.nii.gz")).get_data()
-    func_coef = load(pjoin(DATA_DIR, "func_coef.nii.gz")).get_data()
+    func_discrete = nib.load(pjoin(DATA_DIR, "func_discrete.nii.gz")).get_data()
+    func_coef = nib.load(pjoin(DATA_DIR, "func_coef.nii.gz")).get_data()
     gradients = np.loadtxt(pjoin(DATA_DIR, "sphere_grad.txt"))
     # gradients[0] and the first volume of func_discrete,
     # func_discrete[..., 0], are associated with the b=0 signal.
@@ -382,6 +383,7 @@ def get_cmap(name):
 
 
 def two_cingulum_bundles():
+    from dipy.tracking.streamline import relist_streamlines
     fname = get_data('cb_2')
     res = np.load(fname)
     cb1 = relist_streamlines(res['points'], res['offsets'])
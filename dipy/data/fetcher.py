@@ -9,12 +9,14 @@ from hashlib import md5
 from shutil import copyfileobj
 
 import numpy as np
-import nibabel as nib
 
 import tarfile
 import zipfile
 from dipy.core.gradients import gradient_table
 from dipy.io.gradients import read_bvals_bvecs
+from dipy.utils.optpkg import LazyModule
+
+nib = LazyModule('nibabel')
 
 if sys.version_info[0] < 3:
     from urllib2 import urlopen
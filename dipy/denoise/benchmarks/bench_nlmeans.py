@@ -0,0 +1,49 @@
+""" Benchmarks for the non-local means methods
+
+Run all benchmarks with::
+
+    import dipy.denoise as dipydenoise
+    dipydenoise.bench()
+
+If you have doctests enabled by default in nose (with a noserc file or
+environment variable), and you have a numpy version <= 1.6.1, this will
+also run the doctests, let's hope they pass.
+
+Run this benchmark with:
+
+    nosetests -s --match '(?:^|[\\b_\\.//-])[Bb]ench' bench_nlmeans.py
+"""
+import numpy as np
+
+from dipy.denoise.nlmeans import nlmeans
+from dipy.denoise.denspeed import nlmeans_3d
+from numpy.testing import assert_array_almost_equal, measure
+
+
+def bench_nlmeans(shape=(64, 64, 64)):
+    rng = np.random.RandomState(1234)
+    sigma = 10.
+
+    # Piecewise constant phantom with Rician noise
+    ground_truth = 100 * np.ones(shape)
+    ground_truth[shape[0] // 4:-shape[0] // 4,
+                 shape[1] // 4:-shape[1] // 4] = 200
+    ground_truth[:, :, shape[2] // 2:] += 50
+    data = np.sqrt((ground_truth + sigma * rng.standard_normal(shape)) ** 2 +
+                   (sigma * rng.standard_normal(shape)) ** 2)
+
+    print("Timing non-local means of a {0} volume".format(shape))
+    classic_time = measure("D1 = nlmeans_3d(data, sigma=sigma)", 1)
+    print("nlmeans_3d time: {0:.4}sec".format(classic_time))
+    fast_time = measure("D2 = nlmeans(data, sigma, method='fast')", 1)
+    print("nlmeans (fast) time: {0:.4}sec".format(fast_time))
+    print("Speed up of {0}x".format(classic_time/fast_time))
+
+    D1 = nlmeans_3d(data, sigma=sigma)
+    D2 = nlmeans(data, sigma, method='fast')
+    print("Largest difference: {0}".format(np.abs(D1 - D2).max()))
+    for name, denoised in [("noisy", data), ("nlmeans_3d", D1),
+                           ("nlmeans (fast)", D2)]:
+        rmse = np.sqrt(np.mean((denoised - ground_truth) ** 2))
+        print("{0} RMSE: {1:.4}".format(name, rmse))
+    assert_array_almost_equal(D1, D2)
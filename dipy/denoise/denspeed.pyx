@@ -4,6 +4,7 @@ import numpy as np
 cimport numpy as cnp
 
 cimport cython
+from cython cimport floating
 cimport safe_openmp as openmp
 from safe_openmp cimport have_openmp
 
@@ -47,108 +48,418 @@ def nlmeans_3d(arr, mask=None, sigma=None, patch_radius=1,
     if arr.ndim != 3:
         raise ValueError('data needs to be a 3D ndarray', arr.shape)
 
-    if mask is None:
-        mask = np.ones(arr.shape, dtype='f8')
-    else:
-        mask = np.ascontiguousarray(mask, dtype='f8')
-
-    if mask.ndim != 3:
+    if mask is not None and mask.ndim != 3:
         raise ValueError('mask needs to be a 3D ndarray', mask.shape)
 
-    if sigma.ndim != 3:
-        raise ValueError('sigma needs to be a 3D ndarray', sigma.shape)
-
-    arr = np.ascontiguousarray(arr, dtype='f8')
-    arr = add_padding_reflection(arr, block_radius + patch_radius)
-    mask = add_padding_reflection(
-        mask.astype('f8'),
-        block_radius + patch_radius)
-    sigma = np.ascontiguousarray(sigma, dtype='f8')
-    sigma = add_padding_reflection(
-        sigma.astype('f8'),
-        block_radius + patch_radius)
-    arrnlm = _nlmeans_3d(arr, mask, sigma, patch_radius, block_radius,
-                         rician, num_threads)
+    if np.ndim(sigma) not in (0, 3):
+        raise ValueError('sigma needs to be a float or a 3D ndarray',
+                         np.shape(sigma))
 
-    return remove_padding(arrnlm, block_radius + patch_radius)
+    arr = add_padding_reflection(np.asarray(arr, dtype='f8'),
+                                 block_radius + patch_radius)
+    out = np.zeros(np.array(arr.shape) - 2 * (block_radius + patch_radius))
+    nlmeans_block_volume(arr, out, mask, sigma, patch_radius, block_radius,
+                         rician, num_threads)
+    return out
 
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
-def _nlmeans_3d(double[:, :, ::1] arr, double[:, :, ::1] mask,
-                double[:, :, ::1] sigma, patch_radius=1, block_radius=5,
-                rician=True, num_threads=None):
-    """ This algorithm denoises the value of every voxel (i, j, k) by
-    calculating a weight between a moving 3D patch and a static 3D patch
-    centered at (i, j, k). The moving patch can only move inside a
-    3D block.
-    """
+def nlmeans_block_volume(floating[:, :, ::1] arr, floating[:, :, :] out,
+                         mask, sigma, patch_radius=1, block_radius=5,
+                         rician=True, num_threads=None):
+    """ Denoises a padded 3D volume with non-local means into `out`
+
+    This is the kernel of `nlmeans_3d`: `arr` must already be padded by
+    ``block_radius + patch_radius`` voxels on each side (see
+    `add_padding_reflection`), and `out` has the shape of the unpadded
+    volume (it can be a view of a larger array, e.g. a volume of a 4D
+    array). The computation is done in the precision of `arr`.
 
+    Parameters
+    ----------
+    arr : 3D ndarray (float32 or float64)
+        The padded, C contiguous, array to be denoised
+    out : 3D ndarray
+        The buffer the denoised volume is written to, of the same data type
+        as ``arr``.
+    mask : 3D ndarray or None
+        Only voxels where the mask is not zero are denoised, the others are
+        set to 0. If None, all voxels are denoised.
+    sigma : float or 3D array
+        standard deviation of the noise estimated from the data (of the
+        shape of ``out``)
+    patch_radius : int
+        patch size is ``2 x patch_radius + 1``. Default is 1.
+    block_radius : int
+        block size is ``2 x block_radius + 1``. Default is 5.
+    rician : boolean
+        If True the noise is estimated as Rician, otherwise Gaussian noise
+        is assumed.
+    num_threads : int
+        Number of threads. If None (default) then all available threads
+        will be used.
+    """
     cdef:
-        cnp.npy_intp i, j, k, I, J, K
-        double[:, :, ::1] out = np.zeros_like(arr)
-        double summ = 0
+        cnp.npy_intp i, j, k
+        cnp.npy_intp I = out.shape[0], J = out.shape[1], K = out.shape[2]
         cnp.npy_intp P = patch_radius
         cnp.npy_intp B = block_radius
-        int all_cores = openmp.omp_get_num_procs()
-        int threads_to_use = -1
+        cnp.npy_intp pad = block_radius + patch_radius
+        cnp.uint8_t[:, :, ::1] mask_view
+        double[:, :, ::1] sigma_view
+        double sigma_value = 0, value, s
+        int has_mask = mask is not None
+        int has_sigma_array = np.ndim(sigma) == 3
+        int is_rician = rician
+        int threads_to_use = cpu_count()
+
+    if num_threads is not None:
+        threads_to_use = num_threads
+
+    mask, sigma = _check_kernel_arguments(arr, out, mask, sigma, pad)
+    if has_mask:
+        mask_view = mask
+    if has_sigma_array:
+        sigma_view = sigma
+    else:
+        sigma_value = sigma
+
+    with nogil:
+        for i in prange(I, schedule="dynamic", num_threads=threads_to_use):
+            for j in range(J):
+                for k in range(K):
+
+                    if has_mask and mask_view[i, j, k] == 0:
+                        value = 0
+                    else:
+                        value = process_block(arr, i + pad, j + pad, k + pad, B, P)
+
+                    if is_rician:
+                        if has_sigma_array:
+                            s = sigma_view[i, j, k]
+                        else:
+                            s = sigma_value
+                        value = value - 2 * (s * s)
+                        if value < 0:
+                            value = 0
+
+                    out[i, j, k] = sqrt(value)
+
+
+def _check_kernel_arguments(arr, out, mask, sigma, pad):
+    """ Validates the arguments of the non-local means kernels
+
+    Returns the mask as a C contiguous uint8 array (or None) and sigma as a
+    float or a C contiguous float64 array.
+    """
+    shape = tuple(out.shape)
+    if tuple(arr.shape[:3]) != tuple(n + 2 * pad for n in shape):
+        raise ValueError('arr must be padded by block_radius + patch_radius')
+
+    if mask is not None:
+        # Any non zero value (e.g. 0.5 or a label of 256) is in the mask
+        mask = (np.asarray(mask) != 0).astype(np.uint8)
+        if mask.shape != shape:
+            raise ValueError('mask must have the shape of out', mask.shape)
+
+    if np.ndim(sigma) == 3:
+        sigma = np.ascontiguousarray(sigma, dtype='f8')
+        if sigma.shape != shape:
+            raise ValueError('sigma must have the shape of out', sigma.shape)
+    elif np.ndim(sigma) == 0:
+        sigma = float(sigma)
+    else:
+        raise ValueError('sigma needs to be a float or a 3D ndarray',
+                         np.shape(sigma))
+    return mask, sigma
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+@cython.cdivision(True)
+def nlmeans_fast_volume(floating[:, :, ::1] arr, floating[:, :, :] out,
+                        mask, sigma, patch_radius=1, block_radius=5,
+                        rician=True, num_threads=None):
+    """ Denoises a padded 3D volume with non-local means using box sums
+
+    Computes the same weights as `nlmeans_block_volume`, but instead of
+    comparing the patches of every pair of voxels, the squared differences
+    between the volume and its translation by each offset of the search
+    window are summed over all the patches at once, with separable running
+    (integral) sums. The cost per voxel and offset no longer depends on the
+    size of the patches. The result equals the one of
+    `nlmeans_block_volume` up to floating point rounding.
+
+    Parameters
+    ----------
+    arr : 3D ndarray (float32 or float64)
+        The padded, C contiguous, array to be denoised
+    out : 3D ndarray
+        The buffer the denoised volume is written to, of the same data type
+        as ``arr``.
+    mask : 3D ndarray or None
+        Only voxels where the mask is not zero are denoised, the others are
+        set to 0. If None, all voxels are denoised.
+    sigma : float or 3D array
+        standard deviation of the noise estimated from the data (of the
+        shape of ``out``)
+    patch_radius : int
+        patch size is ``2 x patch_radius + 1``. Default is 1.
+    block_radius : int
+        block size is ``2 x block_radius + 1``. Default is 5.
+    rician : boolean
+        If True the noise is estimated as Rician, otherwise Gaussian noise
+        is assumed.
+    num_threads : int
+        Number of threads. If None (default) then all available threads
+        will be used.
 
-    I = arr.shape[0]
-    J = arr.shape[1]
-    K = arr.shape[2]
+    Notes
+    -----
+    The sums are done in double precision and need about four float64
+    arrays of the size of the padded volume.
+    """
+    cdef:
+        cnp.npy_intp i, m, n, o
+        cnp.npy_intp I = out.shape[0], J = out.shape[1], K = out.shape[2]
+        cnp.npy_intp P = patch_radius
+        cnp.npy_intp B = block_radius
+        cnp.npy_intp pad = block_radius + patch_radius
+        cnp.uint8_t[:, :, ::1] mask_view
+        double[:, :, ::1] sigma_view
+        double[:, :, ::1] values, mean_block, diff, ssd, sum_weights, sum_values
+        double sigma_value = 0
+        double block_vol_size = (2 * B + 1) * (2 * B + 1) * (2 * B + 1)
+        int has_mask = mask is not None
+        int has_sigma_array = np.ndim(sigma) == 3
+        int is_rician = rician
+        int threads_to_use = cpu_count()
 
     if num_threads is not None:
         threads_to_use = num_threads
+
+    mask, sigma = _check_kernel_arguments(arr, out, mask, sigma, pad)
+    # The views are passed to _normalize_slice even when they are not used
+    mask_view = mask if has_mask else np.empty((0, 0, 0), dtype=np.uint8)
+    if has_sigma_array:
+        sigma_view = sigma
     else:
-        threads_to_use = all_cores
+        sigma_view = np.empty((0, 0, 0))
+        sigma_value = sigma
+
+    values = np.asarray(arr, dtype=np.float64)
+    # Means of the values in the blocks centered at each voxel of the volume
+    # padded by patch_radius
+    mean_block = np.empty((I + 2 * P, J + 2 * P, K + 2 * P))
+    _box_sums(values, mean_block, B, threads_to_use)
+    mean_block = np.asarray(mean_block) / block_vol_size
+
+    diff = np.empty((I + 2 * B, J + 2 * B, K + 2 * B))
+    ssd = np.empty((I, J, K))
+    sum_weights = np.zeros((I, J, K))
+    sum_values = np.zeros((I, J, K))
+
+    for m in range(-P, P + 1):
+        for n in range(-P, P + 1):
+            for o in range(-P, P + 1):
+                with nogil:
+                    for i in prange(I + 2 * B, num_threads=threads_to_use):
+                        _squared_differences(values, diff, i, P, m, n, o)
+
+                _box_sums(diff, ssd, B, threads_to_use)
+
+                with nogil:
+                    for i in prange(I, num_threads=threads_to_use):
+                        _accumulate_weights(values, mean_block, ssd, sum_weights,
+                                            sum_values, i, P, B, m, n, o,
+                                            block_vol_size)
+
+    with nogil:
+        for i in prange(I, num_threads=threads_to_use):
+            _normalize_slice(sum_weights, sum_values, out, mask_view,
+                             sigma_view, i, has_mask, has_sigma_array,
+                             sigma_value, is_rician)
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef void _squared_differences(double[:, :, ::1] values,
+                               double[:, :, ::1] diff, cnp.npy_intp i,
+                               cnp.npy_intp P, cnp.npy_intp m,
+                               cnp.npy_intp n, cnp.npy_intp o) nogil:
+    """ Squared differences between `values` and its translation by (m, n, o)
+
+    Only the region of `values` without its outer `P` voxels is kept.
+    """
+    cdef:
+        cnp.npy_intp j, k
+        double d
+
+    for j in range(diff.shape[1]):
+        for k in range(diff.shape[2]):
+            d = values[i + P, j + P, k + P] - values[i + P + m, j + P + n,
+                                                     k + P + o]
+            diff[i, j, k] = d * d
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+@cython.cdivision(True)
+cdef void _accumulate_weights(double[:, :, ::1] values,
+                              double[:, :, ::1] mean_block,
+                              double[:, :, ::1] ssd,
+                              double[:, :, ::1] sum_weights,
+                              double[:, :, ::1] sum_values, cnp.npy_intp i,
+                              cnp.npy_intp P, cnp.npy_intp B,
+                              cnp.npy_intp m, cnp.npy_intp n, cnp.npy_intp o,
+                              double block_vol_size) nogil:
+    """ Adds the weights of the voxels translated by (m, n, o) of slice `i`
+    """
+    cdef:
+        cnp.npy_intp j, k
+        cnp.npy_intp pad = P + B
+        double w, x, denom, mean_value
+
+    for j in range(ssd.shape[1]):
+        for k in range(ssd.shape[2]):
+            mean_value = mean_block[i + P + m, j + P + n, k + P + o]
+            denom = sqrt(2) * mean_value**2
+            w = exp(-(ssd[i, j, k] / block_vol_size) / denom)
+            x = values[i + pad + m, j + pad + n, k + pad + o]
+            sum_weights[i, j, k] += w
+            sum_values[i, j, k] += w * x * x
 
-    if have_openmp:
-        openmp.omp_set_dynamic(0)
-        openmp.omp_set_num_threads(threads_to_use)
 
-    # move the block
-    with nogil, parallel():
-        for i in prange(B + P, I - B - P, schedule="dynamic"):
-            for j in range(B + P, J - B - P):
-                for k in range(B + P, K - B - P):
+@cython.wraparound(False)
+@cython.boundscheck(False)
+@cython.cdivision(True)
+cdef void _normalize_slice(double[:, :, ::1] sum_weights,
+                           double[:, :, ::1] sum_values,
+                           floating[:, :, :] out,
+                           cnp.uint8_t[:, :, ::1] mask,
+                           double[:, :, ::1] sigma, cnp.npy_intp i,
+                           int has_mask, int has_sigma_array,
+                           double sigma_value, int is_rician) nogil:
+    """ Writes the weighted means of slice `i`, with the Rician correction
+    """
+    cdef:
+        cnp.npy_intp j, k
+        double value, s
+
+    for j in range(out.shape[1]):
+        for k in range(out.shape[2]):
+            if has_mask and mask[i, j, k] == 0:
+                value = 0
+            elif sum_weights[i, j, k] > 0:
+                value = sum_values[i, j, k] / sum_weights[i, j, k]
+            else:
+                value = 0
+
+            if is_rician:
+                if has_sigma_array:
+                    s = sigma[i, j, k]
+                else:
+                    s = sigma_value
+                value = value - 2 * (s * s)
+                if value < 0:
+                    value = 0
 
-                    if mask[i, j, k] == 0:
-                        continue
+            out[i, j, k] = sqrt(value)
 
-                    out[i, j, k] = process_block(arr, i, j, k, B, P, sigma)
 
-    if have_openmp and num_threads is not None:
-        openmp.omp_set_num_threads(all_cores)
+def _box_sums(double[:, :, ::1] arr, double[:, :, ::1] out,
+              cnp.npy_intp radius, int num_threads):
+    """ Sums of `arr` over the cubes of side ``2 x radius + 1``
 
-    new = np.asarray(out)
+    ``out[i, j, k]`` is the sum of the cube whose corner is ``(i, j, k)``,
+    so `out` is smaller than `arr` by ``2 x radius`` voxels along each
+    axis. The sums are separable running sums along each axis.
+    """
+    cdef:
+        cnp.npy_intp i, j
+        cnp.npy_intp I = arr.shape[0], J = arr.shape[1], K = arr.shape[2]
+        cnp.npy_intp R = 2 * radius
+        double[:, :, ::1] tmp0 = np.empty((I, J, K - R))
+        double[:, :, ::1] tmp1 = np.empty((I, J - R, K - R))
 
-    if rician:
-        new -= 2 * np.asarray(sigma)**2
-        new[new < 0] = 0
+    if (out.shape[0] != I - R or out.shape[1] != J - R or
+            out.shape[2] != K - R):
+        raise ValueError('out must be smaller than arr by 2 x radius')
 
-    return np.sqrt(new)
+    with nogil:
+        for i in prange(I, num_threads=num_threads):
+            _box_sums_slice(arr, tmp0, tmp1, i, R)
+        for j in prange(J - R, num_threads=num_threads):
+            _box_sums_first_axis(tmp1, out, j, R)
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef void _box_sums_slice(double[:, :, ::1] arr, double[:, :, ::1] tmp0,
+                          double[:, :, ::1] tmp1, cnp.npy_intp i,
+                          cnp.npy_intp R) nogil:
+    """ Running sums of slice `i` along the last, then the second axis """
+    cdef:
+        cnp.npy_intp j, k
+        double s
+
+    for j in range(tmp0.shape[1]):
+        s = 0
+        for k in range(R + 1):
+            s += arr[i, j, k]
+        tmp0[i, j, 0] = s
+        for k in range(1, tmp0.shape[2]):
+            s += arr[i, j, k + R] - arr[i, j, k - 1]
+            tmp0[i, j, k] = s
+
+    for k in range(tmp1.shape[2]):
+        tmp1[i, 0, k] = 0
+    for j in range(R + 1):
+        for k in range(tmp1.shape[2]):
+            tmp1[i, 0, k] += tmp0[i, j, k]
+    for j in range(1, tmp1.shape[1]):
+        for k in range(tmp1.shape[2]):
+            tmp1[i, j, k] = (tmp1[i, j - 1, k] + tmp0[i, j + R, k] -
+                             tmp0[i, j - 1, k])
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef void _box_sums_first_axis(double[:, :, ::1] tmp1,
+                               double[:, :, ::1] out, cnp.npy_intp j,
+                               cnp.npy_intp R) nogil:
+    """ Running sums of row `j` of `tmp1` along the first axis """
+    cdef cnp.npy_intp i, k
+
+    for k in range(out.shape[2]):
+        out[0, j, k] = 0
+    for i in range(R + 1):
+        for k in range(out.shape[2]):
+            out[0, j, k] += tmp1[i, j, k]
+    for i in range(1, out.shape[0]):
+        for k in range(out.shape[2]):
+            out[i, j, k] = out[i - 1, j, k] + tmp1[i + R, j, k] - tmp1[i - 1, j, k]
 
 
 @cython.wraparound(False)
 @cython.boundscheck(False)
 @cython.cdivision(True)
-cdef double process_block(double[:, :, ::1] arr,
+cdef double process_block(floating[:, :, ::1] arr,
                           cnp.npy_intp i, cnp.npy_intp j, cnp.npy_intp k,
-                          cnp.npy_intp B, cnp.npy_intp P, double[:, :, ::1] sigma) nogil:
+                          cnp.npy_intp B, cnp.npy_intp P) nogil:
     """ Process the block with center at (i, j, k)
 
     Parameters
     ----------
     arr : 3D array
-        C contiguous array of doubles
+        C contiguous array of floats or doubles
     i, j, k : int
         center of block
     B : int
         block radius
     P : int
         patch radius
-    sigma : 3D array
-        local noise standard deviation
 
     Returns
     -------
@@ -251,29 +562,11 @@ cdef double process_block(double[:, :, ::1] arr,
     return sum_out
 
 
-def add_padding_reflection(double[:, :, ::1] arr, padding):
-    cdef:
-        double[:, :, ::1] final
-        cnp.npy_intp i, j, k
-        cnp.npy_intp B = padding
-        cnp.npy_intp[::1] indices_i = correspond_indices(arr.shape[0], padding)
-        cnp.npy_intp[::1] indices_j = correspond_indices(arr.shape[1], padding)
-        cnp.npy_intp[::1] indices_k = correspond_indices(arr.shape[2], padding)
-
-    final = np.zeros(
-        np.array(
-            (arr.shape[0],
-             arr.shape[1],
-             arr.shape[2])) +
-        2 *
-        padding)
-
-    for i in range(final.shape[0]):
-        for j in range(final.shape[1]):
-            for k in range(final.shape[2]):
-                final[i, j, k] = arr[indices_i[i], indices_j[j], indices_k[k]]
-
-    return final
+def add_padding_reflection(arr, padding):
+    """ Pads a 3D array by reflection, keeping its data type """
+    indices = [correspond_indices(dim_size, padding)
+               for dim_size in arr.shape]
+    return np.ascontiguousarray(np.asarray(arr)[np.ix_(*indices)])
 
 
 def correspond_indices(dim_size, padding):
@@ -298,16 +591,22 @@ cdef cnp.npy_intp copy_block_3d(double * dest,
                                 cnp.npy_intp I,
                                 cnp.npy_intp J,
                                 cnp.npy_intp K,
-                                double[:, :, ::1] source,
+                                floating[:, :, ::1] source,
                                 cnp.npy_intp min_i,
                                 cnp.npy_intp min_j,
                                 cnp.npy_intp min_k) nogil:
 
-    cdef cnp.npy_intp i, j
+    cdef cnp.npy_intp i, j, k
 
-    for i in range(I):
-        for j in range(J):
-            memcpy(&dest[i * J * K + j * K], &source[i + min_i, j + min_j, min_k], K * sizeof(double))
+    if floating is double:
+        for i in range(I):
+            for j in range(J):
+                memcpy(&dest[i * J * K + j * K], &source[i + min_i, j + min_j, min_k], K * sizeof(double))
+    else:
+        for i in range(I):
+            for j in range(J):
+                for k in range(K):
+                    dest[i * J * K + j * K + k] = source[i + min_i, j + min_j, min_k + k]
 
     return 1
 
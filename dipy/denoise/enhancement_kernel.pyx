@@ -2,8 +2,12 @@ import numpy as np
 cimport numpy as cnp
 cimport cython
 import os.path
+import hashlib
+
+from cython.parallel import prange
 
 from dipy.data import get_sphere
+from dipy.denoise.denspeed import cpu_count
 from dipy.core.sphere import disperse_charges, Sphere, HemiSphere
 from tempfile import gettempdir
 from libc.math cimport sqrt, exp, fabs, cos, sin, tan, acos, atan2
@@ -16,12 +20,15 @@ cdef class EnhancementKernel:
     cdef double t
     cdef int kernelsize
     cdef double kernelmax
+    cdef double threshold
     cdef double [:, :] orientations_list
     cdef double [:, :, :, :, :] lookuptable
+    cdef double [:, :] pair_max
     cdef object sphere
 
     def __init__(self, D33, D44, t, force_recompute=False,
-                 orientations=None, verbose=True):
+                 orientations=None, verbose=True, threshold=0,
+                 num_threads=None):
         """ Compute a look-up table for the contextual
         enhancement kernel
 
@@ -42,25 +49,40 @@ cdef class EnhancementKernel:
             The default sphere is 'repulsion100'.
         verbose : boolean
             Enable verbose mode.
-            
+        threshold : float
+            Pairs of orientations whose kernel values are all lower than
+            ``threshold`` times the maximum of the kernel are skipped by the
+            convolution (see `get_orientation_support`). Default is 0, so
+            only pairs whose kernel is zero are skipped.
+        num_threads : int
+            Number of threads used to compute the look-up table. If None
+            (default) then all available threads will be used.
+
+        Notes
+        -----
+        The look-up table is saved in the temporary directory in a file
+        named after the parameters of the kernel and a hash of the sphere,
+        and is loaded as a memory-mapped array, so that only the parts used
+        are read from disk.
+
         References
         ----------
-        [Meesters2016_ISMRM] S. Meesters, G. Sanguinetti, E. Garyfallidis, 
-                             J. Portegies, R. Duits. (2016) Fast implementations 
-                             of contextual PDE’s for HARDI data processing in 
+        [Meesters2016_ISMRM] S. Meesters, G. Sanguinetti, E. Garyfallidis,
+                             J. Portegies, R. Duits. (2016) Fast implementations
+                             of contextual PDE’s for HARDI data processing in
                              DIPY. ISMRM 2016 conference.
-        [DuitsAndFranken_IJCV] R. Duits and E. Franken (2011) Left-invariant diffusions 
-                        on the space of positions and orientations and their 
-                        application to crossing-preserving smoothing of HARDI 
+        [DuitsAndFranken_IJCV] R. Duits and E. Franken (2011) Left-invariant diffusions
+                        on the space of positions and orientations and their
+                        application to crossing-preserving smoothing of HARDI
                         images. International Journal of Computer Vision, 92:231-264.
         [Portegies2015] J. Portegies, G. Sanguinetti, S. Meesters, and R. Duits.
-                        (2015) New Approximation of a Scale Space Kernel on SE(3) 
+                        (2015) New Approximation of a Scale Space Kernel on SE(3)
                         and Applications in Neuroimaging. Fifth International
                         Conference on Scale Space and Variational Methods in
                         Computer Vision
-        [Portegies2015b] J. Portegies, R. Fick, G. Sanguinetti, S. Meesters, 
-                         G. Girard, and R. Duits. (2015) Improving Fiber 
-                         Alignment in HARDI by Combining Contextual PDE flow with 
+        [Portegies2015b] J. Portegies, R. Fick, G. Sanguinetti, S. Meesters,
+                         G. Girard, and R. Duits. (2015) Improving Fiber
+                         Alignment in HARDI by Combining Contextual PDE flow with
                          Constrained Spherical Deconvolution. PLoS One.
         """
 
@@ -68,6 +90,7 @@ cdef class EnhancementKernel:
         self.D33 = D33
         self.D44 = D44
         self.t = t
+        self.threshold = threshold
 
         # define a sphere
         if isinstance(orientations, Sphere):
@@ -93,26 +116,48 @@ cdef class EnhancementKernel:
         else:
             self.orientations_list = np.zeros((0,0))
             self.sphere = None
-        
+
         # file location of the lut table for saving/loading
-        kernellutpath = os.path.join(gettempdir(), 
-                                     "kernel_d33@%4.2f_d44@%4.2f_t@%4.2f_numverts%d.npy" \
-                                       % (D33, D44, t, len(self.orientations_list)))
+        kernellutpath = os.path.join(gettempdir(), self.cache_name() + ".npy")
+        pairmaxpath = os.path.join(gettempdir(),
+                                   self.cache_name() + "_max.npy")
 
         # if LUT exists, load
-        if not force_recompute and os.path.isfile(kernellutpath):
+        if (not force_recompute and os.path.isfile(kernellutpath) and
+                os.path.isfile(pairmaxpath)):
             if verbose:
                 print "The kernel already exists. Loading from " + kernellutpath
-            self.lookuptable = np.load(kernellutpath)
+            # copy-on-write, so that the table can be viewed as writable
+            self.lookuptable = np.load(kernellutpath, mmap_mode='c')
+            self.pair_max = np.load(pairmaxpath)
 
         # else, create
         else:
             if verbose:
                 print "The kernel doesn't exist yet. Computing..."
-            self.create_lookup_table(verbose)
-            if self.sphere is not None:
-                np.save(kernellutpath, self.lookuptable)
-            
+            self.estimate_kernel_size(verbose)
+            if self.sphere is None:
+                self.lookuptable = self.create_lookup_table(None, num_threads)
+                self.pair_max = np.zeros((0, 0))
+            else:
+                self.save_lookup_table(kernellutpath, pairmaxpath,
+                                       num_threads)
+                self.lookuptable = np.load(kernellutpath, mmap_mode='c')
+                self.pair_max = np.load(pairmaxpath)
+
+    def cache_name(self):
+        """ Name of the cache files of the look-up table
+
+        It is made of the parameters of the kernel and a hash of their exact
+        values and of the vertices of the sphere.
+        """
+        key = hashlib.sha1(np.array([self.D33, self.D44, self.t]))
+        key.update(np.ascontiguousarray(self.orientations_list,
+                                        dtype=np.float64))
+        return "kernel_d33@%4.2f_d44@%4.2f_t@%4.2f_numverts%d_%s" \
+            % (self.D33, self.D44, self.t, len(self.orientations_list),
+               key.hexdigest()[:16])
+
     def get_lookup_table(self):
         """ Return the computed look-up table.
         """
@@ -122,12 +167,37 @@ cdef class EnhancementKernel:
         """ Return the orientations.
         """
         return self.orientations_list
-        
+
     def get_sphere(self):
         """ Get the sphere corresponding with the orientations
         """
         return self.sphere
 
+    def get_orientation_support(self):
+        """ Return the pairs of orientations used by the convolution.
+
+        The kernel of the pair of orientations ``(v, r)`` is used if one of
+        its values is larger than ``threshold`` times the maximum of the
+        kernel.
+
+        Returns
+        -------
+        offsets : 1D ndarray
+            The orientations ``r`` used with the orientation ``v`` are
+            ``indices[offsets[v]:offsets[v + 1]]``.
+        indices : 1D ndarray
+            The orientations ``r``, increasing for each ``v``.
+        """
+        pair_max = np.asarray(self.pair_max)
+        if pair_max.size == 0:
+            return np.zeros(len(pair_max) + 1, dtype=np.intp), \
+                np.zeros(0, dtype=np.intp)
+        support = pair_max > self.threshold * pair_max.max()
+        offsets = np.zeros(len(pair_max) + 1, dtype=np.intp)
+        offsets[1:] = np.cumsum(support.sum(axis=1))
+        indices = np.nonzero(support)[1].astype(np.intp)
+        return offsets, indices
+
     def evaluate_kernel(self, x, y, r, v):
         """ Evaluate the kernel at position x relative to
         position y, with orientation r relative to orientation v.
@@ -147,61 +217,75 @@ cdef class EnhancementKernel:
         -------
         kernel_value : double
         """
-        return self.k2(x, y, r, v)
-
-    @cython.wraparound(False)
-    @cython.boundscheck(False)
-    @cython.nonecheck(False)
-    @cython.cdivision(True)
-    cdef void create_lookup_table(self, verbose=True):
+        cdef double [:] a = np.subtract(x, y, dtype=np.float64)
+        cdef double [:] rv = np.array(r, dtype=np.float64)
+        cdef double [:] vv = np.array(v, dtype=np.float64)
+        return k2(&a[0], &rv[0], &vv[0], self.D33, self.D44, self.t)
+
+    def save_lookup_table(self, kernellutpath, pairmaxpath,
+                          num_threads=None):
+        """ Compute the look-up table into a file, and the maximum of the
+        kernel of each pair of orientations into another one.
+
+        The files are written under temporary names and renamed, so that
+        a partially written table is never loaded.
+        """
+        suffix = ".%d.tmp.npy" % os.getpid()
+        lut = np.lib.format.open_memmap(kernellutpath + suffix, mode='w+',
+                                        dtype=np.float64,
+                                        shape=self.lookuptable_shape())
+        self.create_lookup_table(lut, num_threads)
+        lut.flush()
+        pair_max = np.abs(lut).reshape(lut.shape[:2] + (-1,)).max(axis=2)
+        del lut
+        np.save(pairmaxpath + suffix, pair_max)
+        _replace(pairmaxpath + suffix, pairmaxpath)
+        _replace(kernellutpath + suffix, kernellutpath)
+
+    def lookuptable_shape(self):
+        """ Shape of the look-up table """
+        cdef cnp.npy_intp OR = self.orientations_list.shape[0]
+        cdef cnp.npy_intp N = self.kernelsize
+        return (OR, OR, N, N, N)
+
+    def create_lookup_table(self, lut=None, num_threads=None):
         """ Compute the look-up table based on the parameters set
         during class initialization
 
         Parameters
         ----------
-        verbose : boolean
-            Enable verbose mode.
+        lut : 5D ndarray, optional
+            C contiguous array of doubles the table is written to. If None
+            (default), a new array is created.
+        num_threads : int
+            Number of threads. If None (default) then all available threads
+            will be used. The orientations are processed in parallel.
+
+        Returns
+        -------
+        lut : 5D ndarray
         """
-        self.estimate_kernel_size(verbose)
+        if lut is None:
+            lut = np.zeros(self.lookuptable_shape())
 
         cdef:
-            double [:, :] orientations = np.copy(self.orientations_list)
-            cnp.npy_intp OR1 = orientations.shape[0]
-            cnp.npy_intp OR2 = orientations.shape[0]
-            cnp.npy_intp N = self.kernelsize
-            cnp.npy_intp hn = (N-1)/2
-            cnp.npy_intp angv, angr, xp, yp, zp
-            double [:] x
-            double [:] y
-            cdef double [:, :, :, :, :] lookuptablelocal
-            double kmax = self.kernelmax
-            double l1norm
-            double kernelval
-
-        lookuptablelocal = np.zeros((OR1, OR2, N, N, N))
-        x = np.zeros(3)
-        y = np.zeros(3) # constant at (0,0,0)
+            double [:, ::1] orientations = np.ascontiguousarray(
+                self.orientations_list, dtype=np.float64)
+            double [:, :, :, :, ::1] lookuptablelocal = lut
+            cnp.npy_intp OR = orientations.shape[0]
+            cnp.npy_intp angv
+            int threads_to_use = cpu_count()
 
-        with nogil:
+        if num_threads is not None:
+            threads_to_use = num_threads
 
-            for angv in range(OR1):
-                for angr in range(OR2):
-                    for xp in range(-hn, hn + 1):
-                        for yp in range(-hn, hn + 1):
-                            for zp in range(-hn, hn + 1):
-
-                                x[0] = xp
-                                x[1] = yp
-                                x[2] = zp
-
-                                lookuptablelocal[angv,
-                                                 angr,
-                                                 xp + hn,
-                                                 yp + hn,
-                                                 zp + hn] = self.k2(x, y, orientations[angr,:], orientations[angv,:])
+        with nogil:
+            for angv in prange(OR, schedule='guided',
+                               num_threads=threads_to_use):
+                _lookup_table_orientation(lookuptablelocal, orientations,
+                                          angv, self.D33, self.D44, self.t)
 
-        # save to class member
-        self.lookuptable = lookuptablelocal
+        return lut
 
     @cython.wraparound(False)
     @cython.boundscheck(False)
@@ -218,19 +302,17 @@ cdef class EnhancementKernel:
         """
 
         cdef:
-            double [:] x
-            double [:] y
-            double [:] r
-            double [:] v
+            double x[3]
+            double r[3]
             double i
+            double kval
 
-        x = np.array([0., 0., 0.])
-        y = np.array([0., 0., 0.])
-        r = np.array([0., 0., 1.])
-        v = np.array([0., 0., 1.])
+        x[0] = x[1] = x[2] = 0
+        r[0] = r[1] = 0
+        r[2] = 1
 
         # evaluate at origin
-        self.kernelmax = self.k2(x, y, r, v);
+        self.kernelmax = k2(x, r, r, self.D33, self.D44, self.t)
 
         with nogil:
 
@@ -239,7 +321,7 @@ cdef class EnhancementKernel:
             while True:
                 i += 0.1
                 x[2] = i
-                kval = self.k2(x, y, r, v) / self.kernelmax
+                kval = k2(x, r, r, self.D33, self.D44, self.t) / self.kernelmax
                 if(kval < 0.1):
                     break;
 
@@ -252,171 +334,179 @@ cdef class EnhancementKernel:
 
         self.kernelsize = N
 
-    @cython.wraparound(False)
-    @cython.boundscheck(False)
-    @cython.nonecheck(False)
-    cdef double k2(self, double [:] x, double [:] y,
-                   double [:] r, double [:] v) nogil:
-        """ Evaluate the kernel at position x relative to
-        position y, with orientation r relative to orientation v.
 
-        Parameters
-        ----------
-        x : 1D ndarray
-            Position x
-        y : 1D ndarray
-            Position y
-        r : 1D ndarray
-            Orientation r
-        v : 1D ndarray
-            Orientation v
+def _replace(src, dst):
+    """ Renames the file `src` to `dst`, replacing `dst` if it exists """
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
 
-        Returns
-        -------
-        kernel_value : double
-        """
-        cdef:
-            double [:] a
-            double [:,:] transm
-            double [:] arg1
-            double [:] arg2p
-            double [:] arg2
-            double [:] c
-            double kernelval
-
-        with gil:
-
-            a = np.subtract(x, y)
-            transm = np.transpose(R(euler_angles(v)))
-            arg1 = np.dot(transm, a)
-            arg2p = np.dot(transm, r)
-            arg2 = euler_angles(arg2p)
-            c = self.coordinate_map(arg1[0], arg1[1], arg1[2],
-                                    arg2[0], arg2[1])
-            kernelval = self.kernel(c)
-
-        return kernelval
 
-    @cython.wraparound(False)
-    @cython.boundscheck(False)
-    @cython.nonecheck(False)
-    @cython.cdivision(True)
-    cdef double [:] coordinate_map(self, double x, double y,
-                                   double z, double beta,
-                                   double gamma) nogil:
-        """ Compute a coordinate map for the kernel
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef void _lookup_table_orientation(double [:, :, :, :, ::1] lut,
+                                    double [:, ::1] orientations,
+                                    cnp.npy_intp angv, double D33,
+                                    double D44, double t) nogil:
+    """ Compute the look-up table of the orientation v = `angv`
+    """
+    cdef:
+        cnp.npy_intp N = lut.shape[2]
+        cnp.npy_intp hn = (N - 1) / 2
+        cnp.npy_intp angr, xp, yp, zp
+        double x[3]
 
-        Parameters
-        ----------
-        x : double
-            X position
-        y : double
-            Y position
-        z : double
-            Z position
-        beta : double
-            First Euler angle
-        gamma : double
-            Second Euler angle
+    for angr in range(orientations.shape[0]):
+        for xp in range(-hn, hn + 1):
+            for yp in range(-hn, hn + 1):
+                for zp in range(-hn, hn + 1):
 
-        Returns
-        -------
-        c : 1D ndarray
-            array of coordinates for kernel
-        """
+                    x[0] = xp
+                    x[1] = yp
+                    x[2] = zp
 
-        cdef:
-            double [:] c
-            double q
-            double cg
-            double cotq2
+                    lut[angv, angr, xp + hn, yp + hn, zp + hn] = \
+                        k2(x, &orientations[angr, 0], &orientations[angv, 0],
+                           D33, D44, t)
 
-        with gil:
 
-            c = np.zeros(6)
+@cython.cdivision(True)
+cdef double k2(double * a, double * r, double * v, double D33, double D44,
+               double t) nogil:
+    """ Evaluate the kernel at position x relative to
+    position y, with orientation r relative to orientation v.
 
-        if beta == 0:
-            c[0] = x
-            c[1] = y
-            c[2] = z
-            c[3] = c[4] = c[5] = 0
+    Parameters
+    ----------
+    a : double[3]
+        Position x relative to position y
+    r : double[3]
+        Orientation r
+    v : double[3]
+        Orientation v
 
-        else:
-            q = fabs(beta)
-            cg = cos(gamma)
-            sg = sin(gamma)
-            cotq2 = 1.0 / tan(q/2)
-
-            c[0] = -0.5*z*beta*cg + \
-                    x*(1 - (beta*beta*cg*cg * (1 - 0.5*q*cotq2)) / (q*q)) - \
-                    (y*beta*beta*cg*sg * (1 - 0.5*q*cotq2)) / (q*q)
-            c[1] = -0.5*z*beta*sg - \
-                    (x*beta*beta*cg*sg * (1 - 0.5*q*cotq2)) / (q*q) + \
-                    y * (1 - (beta*beta*sg*sg * (1 - 0.5*q*cotq2)) / (q*q))
-            c[2] = 0.5*x*beta*cg + 0.5*y*beta*sg + \
-                   z * (1 + ((1 - 0.5*q*cotq2) * (-beta*beta*cg*cg - \
-                        beta*beta*sg*sg)) / (q*q))
-            c[3] = beta * (-sg)
-            c[4] = beta * cg
-            c[5] = 0
-
-        return c
+    Returns
+    -------
+    kernel_value : double
+    """
+    cdef:
+        cnp.npy_intp i
+        double rot[9]
+        double angles[2]
+        double arg1[3]
+        double arg2p[3]
+        double arg2[2]
+        double c[6]
 
-    @cython.wraparound(False)
-    @cython.boundscheck(False)
-    @cython.nonecheck(False)
-    @cython.cdivision(True)
-    cdef double kernel(self, double [:] c) nogil:
-        """ Internal function, evaluates the kernel based on the coordinate map.
+    euler_angles(v, angles)
+    R(angles, rot)
 
-        Parameters
-        ----------
-        c : 1D ndarray
-            array of coordinates for kernel
+    # multiply by the transpose of the rotation matrix
+    for i in range(3):
+        arg1[i] = rot[i] * a[0] + rot[3 + i] * a[1] + rot[6 + i] * a[2]
+        arg2p[i] = rot[i] * r[0] + rot[3 + i] * r[1] + rot[6 + i] * r[2]
 
-        Returns
-        -------
-        kernel_value : double
-        """
-        cdef double output = 1 / (8*sqrt(2))
-        output *= sqrt(PI)*self.t*sqrt(self.t*self.D33)*sqrt(self.D33*self.D44)
-        output *= 1 / (16*PI*PI*self.D33*self.D33*self.D44*self.D44*self.t*self.t*self.t*self.t)
-        output *= exp(-sqrt((c[0]*c[0] + c[1]*c[1]) / (self.D33*self.D44) + \
-                   (c[2]*c[2] / self.D33 + (c[3]*c[3]+c[4]*c[4]) / self.D44) * \
-                   (c[2]*c[2] / self.D33 + (c[3]*c[3]+c[4]*c[4]) / self.D44) + \
-                    c[5]*c[5]/self.D44) / (4*self.t));
-        return output
+    euler_angles(arg2p, arg2)
+    coordinate_map(arg1[0], arg1[1], arg1[2], arg2[0], arg2[1], c)
+    return kernel(c, D33, D44, t)
 
-cdef double PI = 3.1415926535897932
 
-@cython.wraparound(False)
-@cython.boundscheck(False)
-cdef double [:] euler_angles(double [:] inp) nogil:
-    """ Compute the Euler angles for a given input vector
+@cython.cdivision(True)
+cdef void coordinate_map(double x, double y, double z, double beta,
+                         double gamma, double * c) nogil:
+    """ Compute a coordinate map for the kernel
 
     Parameters
     ----------
-    inp : 1D ndarray
-        Input vector
+    x : double
+        X position
+    y : double
+        Y position
+    z : double
+        Z position
+    beta : double
+        First Euler angle
+    gamma : double
+        Second Euler angle
+    c : double[6]
+        array of coordinates for kernel (output)
+    """
+
+    cdef:
+        double q
+        double cg
+        double sg
+        double cotq2
+
+    if beta == 0:
+        c[0] = x
+        c[1] = y
+        c[2] = z
+        c[3] = c[4] = c[5] = 0
+
+    else:
+        q = fabs(beta)
+        cg = cos(gamma)
+        sg = sin(gamma)
+        cotq2 = 1.0 / tan(q/2)
+
+        c[0] = -0.5*z*beta*cg + \
+                x*(1 - (beta*beta*cg*cg * (1 - 0.5*q*cotq2)) / (q*q)) - \
+                (y*beta*beta*cg*sg * (1 - 0.5*q*cotq2)) / (q*q)
+        c[1] = -0.5*z*beta*sg - \
+                (x*beta*beta*cg*sg * (1 - 0.5*q*cotq2)) / (q*q) + \
+                y * (1 - (beta*beta*sg*sg * (1 - 0.5*q*cotq2)) / (q*q))
+        c[2] = 0.5*x*beta*cg + 0.5*y*beta*sg + \
+               z * (1 + ((1 - 0.5*q*cotq2) * (-beta*beta*cg*cg - \
+                    beta*beta*sg*sg)) / (q*q))
+        c[3] = beta * (-sg)
+        c[4] = beta * cg
+        c[5] = 0
+
+
+@cython.cdivision(True)
+cdef double kernel(double * c, double D33, double D44, double t) nogil:
+    """ Internal function, evaluates the kernel based on the coordinate map.
+
+    Parameters
+    ----------
+    c : double[6]
+        array of coordinates for kernel
 
     Returns
     -------
-    euler_angles : 1D ndarray
+    kernel_value : double
+    """
+    cdef double output = 1 / (8*sqrt(2))
+    output *= sqrt(PI)*t*sqrt(t*D33)*sqrt(D33*D44)
+    output *= 1 / (16*PI*PI*D33*D33*D44*D44*t*t*t*t)
+    output *= exp(-sqrt((c[0]*c[0] + c[1]*c[1]) / (D33*D44) + \
+               (c[2]*c[2] / D33 + (c[3]*c[3]+c[4]*c[4]) / D44) * \
+               (c[2]*c[2] / D33 + (c[3]*c[3]+c[4]*c[4]) / D44) + \
+                c[5]*c[5]/D44) / (4*t));
+    return output
+
+cdef double PI = 3.1415926535897932
+
+cdef void euler_angles(double * inp, double * output) nogil:
+    """ Compute the Euler angles for a given input vector
+
+    Parameters
+    ----------
+    inp : double[3]
+        Input vector
+    output : double[2]
+        The Euler angles (output)
     """
     cdef:
         double x
         double y
         double z
-        double [:] output
 
     x = inp[0]
     y = inp[1]
     z = inp[2]
 
-    with gil:
-
-        output = np.zeros(3)
-
     # handle the case (0,0,1)
     if x*x < 10e-6 and y*y < 10e-6 and (z-1) * (z-1) < 10e-6:
         output[0] = 0
@@ -432,26 +522,19 @@ cdef double [:] euler_angles(double [:] inp) nogil:
         output[0] = acos(z)
         output[1] = atan2(y, x)
 
-    return output
-
-@cython.wraparound(False)
-@cython.boundscheck(False)
-cdef double [:,:] R(double [:] inp) nogil:
+cdef void R(double * inp, double * output) nogil:
     """ Compute the Rotation matrix for a given input vector
 
     Parameters
     ----------
-    inp : 1D ndarray
-        Input vector
-
-    Returns
-    -------
-    rotation_matrix : 2D ndarray
+    inp : double[2]
+        The Euler angles
+    output : double[9]
+        The rotation matrix, row by row (output)
     """
     cdef:
         double beta
         double gamma
-        double [:] output
         double cb
         double sb
         double cg
@@ -459,10 +542,6 @@ cdef double [:,:] R(double [:] inp) nogil:
 
     beta = inp[0]
     gamma = inp[1]
-    
-    with gil:
-        
-        output = np.zeros(9)
 
     cb = cos(beta)
     sb = sin(beta)
@@ -478,7 +557,3 @@ cdef double [:,:] R(double [:] inp) nogil:
     output[6] = -sb
     output[7] = 0
     output[8] = cb
-
-    with gil:
-
-        return np.reshape(output, (3,3))
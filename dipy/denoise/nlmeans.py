@@ -1,20 +1,34 @@
 from __future__ import division, print_function
 
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
-from dipy.denoise.denspeed import nlmeans_3d
+from dipy.denoise.denspeed import (nlmeans_block_volume,
+                                   nlmeans_fast_volume,
+                                   add_padding_reflection, cpu_count)
+
+_KERNELS = {'classic': nlmeans_block_volume,
+            'fast': nlmeans_fast_volume}
 
 
 def nlmeans(arr, sigma, mask=None, patch_radius=1, block_radius=5,
-            rician=True, num_threads=None):
+            rician=True, num_threads=None, out=None, num_volumes=2,
+            method='classic'):
     """ Non-local means for denoising 3D and 4D images
 
     Parameters
     ----------
     arr : 3D or 4D ndarray
-        The array to be denoised
+        The array to be denoised. A 4D array can also be any array-like
+        object supporting ``arr[..., i]`` (e.g. a
+        `dipy.io.image.ImageDataProxy`), so that volumes are read from disk
+        only when denoised.
     mask : 3D ndarray
-    sigma : float or 3D array
-        standard deviation of the noise estimated from the data
+    sigma : float, 1D, 3D or 4D array
+        standard deviation of the noise estimated from the data. A 1D array
+        gives the standard deviation of each volume (see
+        `dipy.denoise.noise_estimate.estimate_sigma`) and a 3D array is used
+        for every volume of a 4D ``arr``.
     patch_radius : int
         patch size is ``2 x patch_radius + 1``. Default is 1.
     block_radius : int
@@ -25,38 +39,97 @@ def nlmeans(arr, sigma, mask=None, patch_radius=1, block_radius=5,
     num_threads : int
         Number of threads. If None (default) then all available threads
         will be used (all CPU cores).
+    out : ndarray, optional
+        The buffer the denoised array is written to (e.g. a memory-mapped
+        array, see `dipy.io.utils.nifti1_memmap`). If None (default), a new
+        array of the data type of ``arr`` is created.
+    num_volumes : int, optional
+        Maximum number of volumes of a 4D ``arr`` being denoised at the same
+        time, sharing the threads. Only these volumes (and their padded
+        copies) are held in memory. Default is 2, so that reading and
+        writing volumes overlap with the denoising.
+    method : {'classic', 'fast'}, optional
+        'classic' (default) compares the patches of every pair of voxels.
+        'fast' gives the same result, up to floating point rounding, by
+        summing the squared differences between the volume and each of its
+        translations over all the patches at once with running (integral)
+        sums: its cost no longer grows with the size of the patches, but it
+        needs a few float64 copies of each volume in memory.
 
     Returns
     -------
     denoised_arr : ndarray
         the denoised ``arr`` which has the same shape as ``arr``.
+
+    Notes
+    -----
+    The computation is done in single precision for float32 data and in
+    double precision otherwise.
     """
+    ndim = len(arr.shape)
+    if ndim not in (3, 4):
+        raise ValueError("Only 3D or 4D array are supported!", arr.shape)
+
+    if method not in _KERNELS:
+        raise ValueError("Unknown method '%s', expected one of %s"
+                         % (method, sorted(_KERNELS)))
+    kernel = _KERNELS[method]
 
-    if arr.ndim == 3:
-        sigma = np.ones(arr.shape, dtype=np.float64) * sigma
-        return nlmeans_3d(arr, mask, sigma,
-                          patch_radius, block_radius,
-                          rician, num_threads).astype(arr.dtype)
+    if num_threads is None:
+        num_threads = cpu_count()
 
-    elif arr.ndim == 4:
-        denoised_arr = np.zeros_like(arr)
+    if ndim == 3:
+        arr = np.asarray(arr)
+        if out is None:
+            out = np.zeros(arr.shape, dtype=arr.dtype)
+        out[...] = _nlmeans_volume(arr, _volume_sigma(sigma, 0), mask,
+                                   patch_radius, block_radius, rician,
+                                   num_threads, kernel)
+        return out
 
-        if isinstance(sigma, np.ndarray) and sigma.ndim == 3:
-            sigma = (np.ones(arr.shape, dtype=np.float64) *
-                     sigma[..., np.newaxis])
-        else:
-            sigma = np.ones(arr.shape, dtype=np.float64) * sigma
+    nb_volumes = arr.shape[-1]
+    if out is None:
+        out = np.zeros(arr.shape, dtype=np.asarray(arr[..., 0]).dtype)
 
-        for i in range(arr.shape[-1]):
-            denoised_arr[..., i] = nlmeans_3d(arr[..., i],
-                                              mask,
-                                              sigma[..., i],
-                                              patch_radius,
-                                              block_radius,
-                                              rician,
-                                              num_threads).astype(arr.dtype)
+    num_volumes = max(1, min(num_volumes, nb_volumes, num_threads))
+    threads_per_volume = max(1, num_threads // num_volumes)
 
-        return denoised_arr
+    def denoise(i):
+        out[..., i] = _nlmeans_volume(np.asarray(arr[..., i]),
+                                      _volume_sigma(sigma, i), mask,
+                                      patch_radius, block_radius, rician,
+                                      threads_per_volume, kernel)
 
+    if num_volumes == 1:
+        for i in range(nb_volumes):
+            denoise(i)
     else:
-        raise ValueError("Only 3D or 4D array are supported!", arr.shape)
+        pool = ThreadPool(num_volumes)
+        try:
+            pool.map(denoise, range(nb_volumes), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return out
+
+
+def _volume_sigma(sigma, i):
+    """ Returns the standard deviation of the noise of the i-th volume """
+    if np.ndim(sigma) == 1:
+        return sigma[i] if len(sigma) > 1 else sigma[0]
+    elif np.ndim(sigma) == 4:
+        return sigma[..., i]
+    return sigma
+
+
+def _nlmeans_volume(arr, sigma, mask, patch_radius, block_radius, rician,
+                    num_threads, kernel=nlmeans_block_volume):
+    """ Denoises a 3D volume, returns it with the data type of `arr` """
+    dtype = np.float32 if arr.dtype == np.float32 else np.float64
+    padded = add_padding_reflection(arr.astype(dtype, copy=False),
+                                    block_radius + patch_radius)
+    denoised = np.zeros(arr.shape, dtype=dtype)
+    kernel(padded, denoised, mask, sigma, patch_radius, block_radius, rician,
+           num_threads)
+    return denoised.astype(arr.dtype, copy=False)
@@ -1,15 +1,26 @@
 from __future__ import division, print_function
 
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 
 from scipy.special import gammainccinv
 from scipy.ndimage.filters import convolve
 
 
+_inv_nchi_cdf_cache = {}
+
+
 def _inv_nchi_cdf(N, K, alpha):
     """Inverse CDF for the noncentral chi distribution
-    See [1]_ p.3 section 2.3"""
-    return gammainccinv(N * K, 1 - alpha) / K
+    See [1]_ p.3 section 2.3
+
+    The values are cached for each (N, K, alpha)."""
+    key = (N, K, alpha)
+    if key not in _inv_nchi_cdf_cache:
+        _inv_nchi_cdf_cache[key] = gammainccinv(N * K, 1 - alpha) / K
+    return _inv_nchi_cdf_cache[key]
 
 
 # List of optimal quantile for PIESNO.
@@ -25,7 +36,7 @@ opt_quantile = {1: 0.79681213002002,
 
 
 def piesno(data, N, alpha=0.01, l=100, itermax=100, eps=1e-5,
-           return_mask=False):
+           return_mask=False, num_threads=None):
     """
     Probabilistic Identification and Estimation of Noise (PIESNO).
 
@@ -60,6 +71,10 @@ def piesno(data, N, alpha=0.01, l=100, itermax=100, eps=1e-5,
         If True, return a mask identyfing all the pure noise voxel
         that were found.
 
+    num_threads : int (optional)
+        Number of slices of 4D data processed at the same time. If None
+        (default), one per CPU core.
+
     Returns
     --------
     sigma : float
@@ -113,8 +128,8 @@ def piesno(data, N, alpha=0.01, l=100, itermax=100, eps=1e-5,
         sigma = np.zeros(data.shape[-2], dtype=np.float32)
         mask_noise = np.zeros(data.shape[:-1], dtype=np.bool)
 
-        for idx in range(data.shape[-2]):
-            sigma[idx], mask_noise[..., idx] = _piesno_3D(data[..., idx, :], 
+        def process_slice(idx):
+            sigma[idx], mask_noise[..., idx] = _piesno_3D(data[..., idx, :],
                                                           N,
                                                           alpha=alpha,
                                                           l=l,
@@ -123,6 +138,22 @@ def piesno(data, N, alpha=0.01, l=100, itermax=100, eps=1e-5,
                                                           return_mask=True,
                                                           initial_estimation=initial_estimation)
 
+        if num_threads is None:
+            num_threads = cpu_count()
+        num_threads = max(1, min(num_threads, data.shape[-2]))
+
+        # The sorts and percentiles of numpy release the GIL
+        if num_threads == 1:
+            for idx in range(data.shape[-2]):
+                process_slice(idx)
+        else:
+            pool = ThreadPool(num_threads)
+            try:
+                pool.map(process_slice, range(data.shape[-2]))
+            finally:
+                pool.close()
+                pool.join()
+
     else:
         sigma, mask_noise = _piesno_3D(data,
                                        N,
@@ -188,6 +219,11 @@ def _piesno_3D(data, N, alpha=0.01, l=100, itermax=100, eps=1e-5,
 
     Notes
     ------
+    All the ``l`` initial estimates are evaluated at once: a voxel is
+    counted for a candidate sigma if its sum of squares lies between
+    ``2 K sigma^2 lambda_minus`` and ``2 K sigma^2 lambda_plus``, which is
+    found by a binary search in the sorted sums of squares.
+
     This function assumes two things : 1. The data has a noisy, non-masked
     background and 2. The data is a repetition of the same measurements
     along the last axis, i.e. dMRI or fMRI data, not structural data like
@@ -237,22 +273,30 @@ def _piesno_3D(data, N, alpha=0.01, l=100, itermax=100, eps=1e-5,
     lambda_minus = _inv_nchi_cdf(N, K, alpha/2)
     lambda_plus = _inv_nchi_cdf(N, K, 1 - alpha/2)
 
-    for sigma_init in phi:
-
-        s = sum_m2 / (2 * K * sigma_init**2)
-        found_idx = np.sum(np.logical_and(lambda_minus <= s, s <= lambda_plus),
-                           dtype=np.int16)
+    # Number of voxels identified as noise for each initial estimate
+    sorted_sum_m2 = np.sort(sum_m2, axis=None)
+    found = (np.searchsorted(sorted_sum_m2, 2 * K * phi**2 * lambda_plus,
+                             side='right') -
+             np.searchsorted(sorted_sum_m2, 2 * K * phi**2 * lambda_minus,
+                             side='left'))
 
-        if found_idx > prev_idx:
-            sigma = sigma_init
-            prev_idx = found_idx
+    # The first estimate identifying the most voxels
+    best = np.argmax(found)
+    if found[best] > prev_idx:
+        sigma = phi[best]
 
     for n in range(itermax):
         if np.abs(sigma - sigma_prev) < eps:
             break
 
         s = sum_m2 / (2 * K * sigma**2)
-        mask[...] = np.logical_and(lambda_minus <= s, s <= lambda_plus)
+        new_mask = np.logical_and(lambda_minus <= s, s <= lambda_plus)
+
+        # The same voxels give the same estimate, which has converged
+        if n > 0 and np.array_equal(new_mask, mask):
+            break
+
+        mask[...] = new_mask
         omega = data[mask, :]
 
         # If no point meets the criterion, exit
@@ -261,8 +305,9 @@ def _piesno_3D(data, N, alpha=0.01, l=100, itermax=100, eps=1e-5,
 
         sigma_prev = sigma
 
-        # Numpy percentile must range in 0 to 100, hence q*100
-        sigma = np.percentile(omega, q * 100) / denom
+        # Numpy percentile must range in 0 to 100, hence q*100. omega is a
+        # copy, so it can be partitioned in place.
+        sigma = np.percentile(omega, q * 100, overwrite_input=True) / denom
 
     if return_mask:
         return sigma, mask
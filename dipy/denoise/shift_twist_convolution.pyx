@@ -63,8 +63,11 @@ def convolve(odfs_sh, kernel, sh_order, test_mode=False, num_threads=None, norma
     odfs_dsf = sh_to_sf(odfs_sh, sphere, sh_order=sh_order, basis_type=None)
 
     # perform the convolution
+    offsets, indices = kernel.get_orientation_support()
     output = perform_convolution(odfs_dsf, 
                                  kernel.get_lookup_table(),
+                                 offsets,
+                                 indices,
                                  test_mode,
                                  num_threads)
     
@@ -102,8 +105,11 @@ def convolve_sf(odfs_sf, kernel, test_mode=False, num_threads=None, normalize=Tr
         The ODF data after convolution enhancement, sampled on a sphere
     """
     # perform the convolution
+    offsets, indices = kernel.get_orientation_support()
     output = perform_convolution(odfs_sf, 
                                  kernel.get_lookup_table(),
+                                 offsets,
+                                 indices,
                                  test_mode,
                                  num_threads)
 
@@ -119,6 +125,8 @@ def convolve_sf(odfs_sf, kernel, test_mode=False, num_threads=None, normalize=Tr
 @cython.cdivision(True)
 cdef double [:, :, :, ::1] perform_convolution (double [:, :, :, ::1] odfs, 
                                                 double [:, :, :, :, ::1] lut,
+                                                cnp.npy_intp [::1] offsets,
+                                                cnp.npy_intp [::1] indices,
                                                 cnp.npy_intp test_mode,
                                                 num_threads=None):
     """ Perform the shift-twist convolution with the ODF data 
@@ -130,6 +138,12 @@ cdef double [:, :, :, ::1] perform_convolution (double [:, :, :, ::1] odfs,
         The ODF data sampled on a sphere
     lut : array of double
         The 5D lookup table
+    offsets : array of npy_intp
+        The orientations used with the orientation ``v`` are
+        ``indices[offsets[v]:offsets[v + 1]]``
+    indices : array of npy_intp
+        The orientations with a non negligible kernel for each orientation
+        (see `EnhancementKernel.get_orientation_support`)
     test_mode : boolean
         Reduced convolution in one direction only for testing
     num_threads : int
@@ -155,7 +169,7 @@ cdef double [:, :, :, ::1] perform_convolution (double [:, :, :, ::1] odfs,
         cnp.npy_intp nz = odfs.shape[2]
         cnp.npy_intp threads_to_use = -1
         cnp.npy_intp all_cores = openmp.omp_get_num_procs()
-        cnp.npy_intp corient, orient, cx, cy, cz, x, y, z
+        cnp.npy_intp corient, orient, cx, cy, cz, x, y, z, k
         cnp.npy_intp expectedvox
         cnp.npy_intp edgeNormalization = True
 
@@ -192,7 +206,12 @@ cdef double [:, :, :, ::1] perform_convolution (double [:, :, :, ::1] odfs,
                                  for z in range(int_max(cz - hn, 0), 
                                                 int_min(cz + hn + 1, nz - 1)):
                                     voxcount[corient, cx, cy, cz] += 1.0
-                                    for orient in range(0, OR2):
+                                    # skip the negligible orientations
+                                    for k in range(offsets[corient],
+                                                   offsets[corient + 1]):
+                                        orient = indices[k]
+                                        if orient >= OR2:
+                                            break
                                         totalval[corient, cx, cy, cz] += \
                                             odfs[x, y, z, orient] * \
                                             lut[corient, orient, x - (cx - hn), y - (cy - hn), z - (cz - hn)]
@@ -118,5 +118,50 @@ def test_kernel_input():
     k = EnhancementKernel(D33, D44, t, orientations=0, force_recompute=True)
     npt.assert_equal(k.get_lookup_table().shape, (0, 0, 7, 7, 7))
 
+
+def test_kernel_cache():
+    """ Test the look-up table saved on disk and the sparsity threshold"""
+    D33 = 1.0
+    D44 = 0.04
+    t = 1
+    sphere = Sphere(xyz=get_sphere('repulsion100').vertices[:10])
+    k = EnhancementKernel(D33, D44, t, orientations=sphere,
+                          force_recompute=True, num_threads=1)
+    lut = np.array(k.get_lookup_table())
+
+    # The table is computed in parallel and loaded from the cache
+    k2 = EnhancementKernel(D33, D44, t, orientations=sphere,
+                           force_recompute=True, num_threads=2)
+    npt.assert_array_equal(np.array(k2.get_lookup_table()), lut)
+    k3 = EnhancementKernel(D33, D44, t, orientations=sphere)
+    npt.assert_equal(k3.cache_name(), k.cache_name())
+    npt.assert_array_equal(np.array(k3.get_lookup_table()), lut)
+
+    # Another sphere or other parameters use another table
+    sphere2 = Sphere(xyz=get_sphere('repulsion100').vertices[10:20])
+    k4 = EnhancementKernel(D33, D44, t, orientations=sphere2)
+    npt.assert_(k4.cache_name() != k.cache_name())
+    k5 = EnhancementKernel(D33, D44 + 1e-6, t, orientations=sphere)
+    npt.assert_(k5.cache_name() != k.cache_name())
+
+    # By default, every pair of orientations is used
+    offsets, indices = k.get_orientation_support()
+    npt.assert_array_equal(offsets, np.arange(11) * 10)
+    npt.assert_array_equal(indices, np.tile(np.arange(10), 10))
+
+    # The pairs with a negligible kernel are skipped by the convolution
+    ks = EnhancementKernel(D33, D44, t, orientations=sphere, threshold=1e-2)
+    offsets, indices = ks.get_orientation_support()
+    pair_max = np.abs(lut).reshape((10, 10, -1)).max(axis=2)
+    npt.assert_equal(len(indices), np.sum(pair_max > 1e-2 * lut.max()))
+    npt.assert_(len(indices) < 100)
+
+    odfs = np.random.RandomState(0).rand(5, 5, 5, 10)
+    dense = convolve_sf(odfs, k, normalize=False)
+    sparse = convolve_sf(odfs, ks, normalize=False)
+    npt.assert_(np.abs(np.array(dense) - np.array(sparse)).max() <
+                1e-2 * np.abs(np.array(dense)).max())
+
+
 if __name__ == '__main__':
     npt.run_module_suite()
@@ -1,11 +1,16 @@
 import numpy as np
+import nibabel as nib
+from nibabel.tmpdirs import InTemporaryDirectory
 from numpy.testing import (run_module_suite,
                            assert_,
                            assert_equal,
-                           assert_array_almost_equal)
+                           assert_array_almost_equal,
+                           assert_array_equal,
+                           assert_raises)
 from dipy.denoise.nlmeans import nlmeans
 from dipy.denoise.denspeed import (add_padding_reflection, remove_padding,
-                                   cpu_count)
+                                   cpu_count, nlmeans_3d)
+from dipy.io.utils import nifti1_memmap
 from time import time
 
 
@@ -126,6 +131,103 @@ def test_nlmeans_4d_3dsigma_and_threads():
         assert_equal(duration_2core < duration_1core, True)
 
 
+def test_nlmeans_4d_volumes():
+    rng = np.random.RandomState(0)
+    data = 100 + 10 * rng.standard_normal((15, 16, 17, 4))
+    mask = rng.rand(15, 16, 17) > 0.3
+    sigma = 1 + rng.rand(15, 16, 17)
+
+    # Every volume is denoised as a 3D image with the same sigma
+    expected = np.zeros(data.shape)
+    for i in range(data.shape[-1]):
+        expected[..., i] = nlmeans_3d(data[..., i], mask, sigma,
+                                      num_threads=1)
+
+    for num_volumes in [1, 3, 10]:
+        denoised = nlmeans(data, sigma, mask, num_volumes=num_volumes)
+        assert_array_equal(denoised, expected)
+
+    # Scalar, 3D and 4D sigma
+    assert_array_equal(nlmeans(data, 2., mask),
+                       nlmeans(data, 2 * np.ones(data.shape[:3]), mask))
+    assert_array_equal(nlmeans(data, 2., mask),
+                       nlmeans(data, 2 * np.ones(data.shape), mask))
+    sigma_volumes = np.array([1., 2., 3., 4.])
+    assert_array_equal(nlmeans(data, sigma_volumes, mask),
+                       nlmeans(data, np.ones(data.shape) * sigma_volumes,
+                               mask))
+
+    # float32 data is denoised in single precision
+    denoised = nlmeans(data.astype(np.float32), sigma, mask)
+    assert_equal(denoised.dtype, np.float32)
+    assert_array_almost_equal(denoised, expected, decimal=3)
+
+    assert_raises(ValueError, nlmeans, data[..., None], 1.)
+    assert_raises(ValueError, nlmeans, data, np.ones((3, 3)))
+
+
+def test_nlmeans_nifti_streaming():
+    rng = np.random.RandomState(0)
+    data = (100 + 10 * rng.standard_normal((15, 16, 17, 3))).astype('f4')
+    affine = np.diag([2., 2., 2., 1.])
+
+    with InTemporaryDirectory():
+        nib.save(nib.Nifti1Image(data, affine), 'dwi.nii')
+        img = nib.load('dwi.nii')
+
+        # Volumes are read from and written to disk one at a time
+        out = nifti1_memmap('denoised.nii', img.shape, np.float32,
+                            img.affine, img.header)
+        nlmeans(img.dataobj, 2., out=out)
+        del out
+
+        denoised = nib.load('denoised.nii')
+        assert_array_equal(denoised.affine, affine)
+        assert_array_equal(denoised.get_data(), nlmeans(data, 2.))
+
+
+def test_nlmeans_fast():
+    rng = np.random.RandomState(0)
+    data = 100 + 10 * rng.standard_normal((20, 21, 22))
+    mask = rng.rand(20, 21, 22) > 0.3
+    sigma = 5 + rng.rand(20, 21, 22)
+
+    # The fast method computes the same weights with box sums
+    for rician in [True, False]:
+        for s in [5., sigma]:
+            expected = nlmeans_3d(data, mask, s, rician=rician)
+            denoised = nlmeans(data, s, mask, rician=rician, method='fast')
+            assert_array_almost_equal(denoised, expected)
+
+    expected = nlmeans_3d(data, sigma=5., patch_radius=2, block_radius=3)
+    denoised = nlmeans(data, 5., patch_radius=2, block_radius=3,
+                       method='fast')
+    assert_array_almost_equal(denoised, expected)
+
+    data4d = np.concatenate([data[..., None], data[..., None] + 10], -1)
+    denoised = nlmeans(data4d.astype('f4'), 5., method='fast')
+    assert_equal(denoised.dtype, np.float32)
+    assert_array_almost_equal(denoised[..., 1],
+                              nlmeans_3d(data4d[..., 1], sigma=5.),
+                              decimal=3)
+
+    assert_raises(ValueError, nlmeans, data, 5., method='unknown')
+
+
+def test_nlmeans_nonbinary_mask():
+    rng = np.random.RandomState(0)
+    data = 100 + 10 * rng.standard_normal((10, 11, 12))
+    labels = rng.randint(0, 4, size=data.shape)
+    # Fractions and labels that are multiples of 256 are all in the mask
+    mask = np.choose(labels, [0, 0.5, 256, -1])
+
+    for method in ['classic', 'fast']:
+        expected = nlmeans(data, 5., mask != 0, method=method)
+        assert_array_equal(nlmeans(data, 5., mask, method=method), expected)
+        assert_array_equal(nlmeans(data, 5., (256 * labels).astype(int),
+                                   method=method), expected)
+
+
 if __name__ == '__main__':
 
     # test_nlmeans_4d_3dsigma_and_threads()
@@ -6,7 +6,7 @@ import nibabel as nib
 from numpy.testing import (assert_almost_equal, assert_equal, assert_,
                            assert_array_almost_equal)
 from dipy.denoise.noise_estimate import _inv_nchi_cdf, piesno, estimate_sigma
-from dipy.denoise.noise_estimate import _piesno_3D
+from dipy.denoise.noise_estimate import _piesno_3D, opt_quantile
 import dipy.data
 
 # See page 5 of the reference paper for tested values
@@ -77,6 +77,35 @@ def test_piesno():
     assert_(np.all(sigma == 10))
 
 
+def test_piesno_4d_threads():
+    rng = np.random.RandomState(0)
+    noise1 = rng.standard_normal((40, 40, 6, 20)) * 50 + 10
+    noise2 = rng.standard_normal((40, 40, 6, 20)) * 50 + 10
+    data = np.sqrt(noise1**2 + noise2**2)
+    data[10:30, 10:30] += 500
+
+    sigma, mask = piesno(data, N=1, return_mask=True, num_threads=1)
+    assert_equal(sigma.shape, (6,))
+    assert_equal(mask.shape, (40, 40, 6))
+    assert_(np.all(np.abs(sigma - 50) / sigma < 0.1))
+    assert_(not np.any(mask[15:25, 15:25]))
+
+    # Slices processed in parallel give the same estimates
+    sigma2, mask2 = piesno(data, N=1, return_mask=True, num_threads=4)
+    assert_equal(sigma2, sigma)
+    assert_equal(mask2, mask)
+
+    # Each slice is estimated independently
+    q = opt_quantile[1]
+    initial_estimation = (np.percentile(data, q * 100) /
+                          np.sqrt(2 * _inv_nchi_cdf(1, 1, q)))
+    for idx in range(6):
+        sigma3, mask3 = _piesno_3D(data[..., idx, :], N=1, return_mask=True,
+                                   initial_estimation=initial_estimation)
+        assert_almost_equal(sigma[idx], sigma3, decimal=4)
+        assert_equal(mask[..., idx], mask3)
+
+
 def test_estimate_sigma():
 
     sigma = estimate_sigma(np.ones((7, 7, 7)), disable_background_masking=True)
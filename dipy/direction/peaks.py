@@ -2,23 +2,28 @@ from __future__ import division, print_function, absolute_import
 
 from multiprocessing import cpu_count, Pool
 from itertools import repeat
+import os
 from os import path
 from warnings import warn
 
 from dipy.utils.six.moves import xrange
 
-from nibabel.tmpdirs import InTemporaryDirectory
-
 import numpy as np
-import scipy.optimize as opt
+from numpy.lib.format import open_memmap
 
 from dipy.reconst.recspeed import (local_maxima, remove_similar_vertices,
+                                   peak_directions_batch,
                                    search_descending)
 from dipy.core.sphere import HemiSphere, Sphere
 from dipy.data import default_sphere
-from dipy.core.ndindex import ndindex
+from dipy.core.profile import stage, count, timed
+from dipy.io.image import ImageDataProxy
+from dipy.io.peaks import save_peaks
 from dipy.reconst.shm import sh_to_sf_matrix
 from dipy.reconst.peak_direction_getter import PeaksAndMetricsDirectionGetter
+from dipy.utils.optpkg import LazyModule
+
+opt = LazyModule('scipy.optimize')
 
 
 def peak_directions_nl(sphere_eval, relative_peak_threshold=.25,
@@ -164,7 +169,9 @@ class PeaksAndMetrics(PeaksAndMetricsDirectionGetter):
 def _peaks_from_model_parallel(model, data, sphere, relative_peak_threshold,
                                min_separation_angle, mask, return_odf,
                                return_sh, gfa_thr, normalize_peaks, sh_order,
-                               sh_basis_type, npeaks, B, invB, nbr_processes):
+                               sh_basis_type, npeaks, B, invB, nbr_processes,
+                               chunk_size=4096, out_dir=None,
+                               num_threads=None):
 
     if nbr_processes is None:
         try:
@@ -177,16 +184,18 @@ def _peaks_from_model_parallel(model, data, sphere, relative_peak_threshold,
                                     min_separation_angle, mask, return_odf,
                                     return_sh, gfa_thr, normalize_peaks,
                                     sh_order, sh_basis_type, npeaks,
-                                    parallel=False)
+                                    parallel=False, chunk_size=chunk_size,
+                                    out_dir=out_dir, num_threads=num_threads)
 
     shape = list(data.shape)
     data = np.reshape(data, (-1, shape[-1]))
     n = data.shape[0]
     nbr_chunks = nbr_processes ** 2
-    chunk_size = int(np.ceil(n / nbr_chunks))
-    indices = list(zip(np.arange(0, n, chunk_size),
-                       np.arange(0, n, chunk_size) + chunk_size))
+    voxels_per_chunk = int(np.ceil(n / nbr_chunks))
+    indices = list(zip(np.arange(0, n, voxels_per_chunk),
+                       np.arange(0, n, voxels_per_chunk) + voxels_per_chunk))
 
+    from nibabel.tmpdirs import InTemporaryDirectory
     with InTemporaryDirectory() as tmpdir:
 
         data_file_name = path.join(tmpdir, 'data.npy')
@@ -215,76 +224,33 @@ def _peaks_from_model_parallel(model, data, sphere, relative_peak_threshold,
                                repeat(sh_basis_type),
                                repeat(npeaks),
                                repeat(B),
-                               repeat(invB)))
+                               repeat(invB),
+                               repeat(chunk_size),
+                               repeat(1)))
         pool.close()
 
-        pam = PeaksAndMetrics()
-        pam.sphere = sphere
-        # use memmap to reduce the memory usage
-        pam.gfa = np.memmap(path.join(tmpdir, 'gfa.npy'),
-                            dtype=pam_res[0].gfa.dtype,
-                            mode='w+',
-                            shape=(data.shape[0]))
-
-        pam.peak_dirs = np.memmap(path.join(tmpdir, 'peak_dirs.npy'),
-                                  dtype=pam_res[0].peak_dirs.dtype,
-                                  mode='w+',
-                                  shape=(data.shape[0], npeaks, 3))
-        pam.peak_values = np.memmap(path.join(tmpdir, 'peak_values.npy'),
-                                    dtype=pam_res[0].peak_values.dtype,
-                                    mode='w+',
-                                    shape=(data.shape[0], npeaks))
-        pam.peak_indices = np.memmap(path.join(tmpdir, 'peak_indices.npy'),
-                                     dtype=pam_res[0].peak_indices.dtype,
-                                     mode='w+',
-                                     shape=(data.shape[0], npeaks))
-        pam.qa = np.memmap(path.join(tmpdir, 'qa.npy'),
-                           dtype=pam_res[0].qa.dtype,
-                           mode='w+',
-                           shape=(data.shape[0], npeaks))
+        # The results of the subprocesses are copied to the output arrays,
+        # which are memory-mapped in out_dir if requested
+        pam = _allocate_peaks_and_metrics(tuple(shape[:-1]), sphere, npeaks,
+                                          return_odf, return_sh, sh_order,
+                                          out_dir)
         if return_sh:
-            nbr_shm_coeff = (sh_order + 2) * (sh_order + 1) // 2
-            pam.shm_coeff = np.memmap(path.join(tmpdir, 'shm.npy'),
-                                      dtype=pam_res[0].shm_coeff.dtype,
-                                      mode='w+',
-                                      shape=(data.shape[0], nbr_shm_coeff))
             pam.B = pam_res[0].B
-        else:
-            pam.shm_coeff = None
-            pam.invB = None
-        if return_odf:
-            pam.odf = np.memmap(path.join(tmpdir, 'odf.npy'),
-                                dtype=pam_res[0].odf.dtype,
-                                mode='w+',
-                                shape=(data.shape[0], len(sphere.vertices)))
-        else:
-            pam.odf = None
-
-        # copy subprocesses pam to a single pam (memmaps)
-        for i, (start_pos, end_pos) in enumerate(indices):
-            pam.gfa[start_pos: end_pos] = pam_res[i].gfa
-            pam.peak_dirs[start_pos: end_pos] = pam_res[i].peak_dirs
-            pam.peak_values[start_pos: end_pos] = pam_res[i].peak_values
-            pam.peak_indices[start_pos: end_pos] = pam_res[i].peak_indices
-            pam.qa[start_pos: end_pos] = pam_res[i].qa
-            if return_sh:
-                pam.shm_coeff[start_pos: end_pos] = pam_res[i].shm_coeff
-            if return_odf:
-                pam.odf[start_pos: end_pos] = pam_res[i].odf
 
-        pam_res = None
-
-        # load memmaps to arrays and reshape the metric
-        shape[-1] = -1
-        pam.gfa = np.reshape(np.array(pam.gfa), shape[:-1])
-        pam.peak_dirs = np.reshape(np.array(pam.peak_dirs), shape + [3])
-        pam.peak_values = np.reshape(np.array(pam.peak_values), shape)
-        pam.peak_indices = np.reshape(np.array(pam.peak_indices), shape)
-        pam.qa = np.reshape(np.array(pam.qa), shape)
+        outputs = ['gfa', 'peak_dirs', 'peak_values', 'peak_indices', 'qa']
         if return_sh:
-            pam.shm_coeff = np.reshape(np.array(pam.shm_coeff), shape)
+            outputs.append('shm_coeff')
         if return_odf:
-            pam.odf = np.reshape(np.array(pam.odf), shape)
+            outputs.append('odf')
+        for name in outputs:
+            flat = getattr(pam, name).reshape((n, -1))
+            for i, (start_pos, end_pos) in enumerate(indices):
+                result = getattr(pam_res[i], name)
+                flat[start_pos: end_pos] = result.reshape((len(result), -1))
+
+        pam_res = None
+        if out_dir is not None:
+            save_peaks(out_dir, pam)
 
         # Make sure all worker processes have exited before leaving context
         # manager in order to prevent temporary file deletion errors in windows
@@ -309,6 +275,8 @@ def _peaks_from_model_parallel_sub(args):
     npeaks = args[12]
     B = args[13]
     invB = args[14]
+    chunk_size = args[15]
+    num_threads = args[16]
 
     data = np.load(data_file_name, mmap_mode='r')[start_pos:end_pos]
     if mask_file_name is not None:
@@ -320,20 +288,26 @@ def _peaks_from_model_parallel_sub(args):
                             min_separation_angle, mask, return_odf,
                             return_sh, gfa_thr, normalize_peaks,
                             sh_order, sh_basis_type, npeaks, B, invB,
-                            parallel=False, nbr_processes=None)
+                            parallel=False, nbr_processes=None,
+                            chunk_size=chunk_size, num_threads=num_threads)
 
 
+@timed('direction.peaks_from_model')
 def peaks_from_model(model, data, sphere, relative_peak_threshold,
                      min_separation_angle, mask=None, return_odf=False,
                      return_sh=True, gfa_thr=0, normalize_peaks=False,
                      sh_order=8, sh_basis_type=None, npeaks=5, B=None,
-                     invB=None, parallel=False, nbr_processes=None):
+                     invB=None, parallel=False, nbr_processes=None,
+                     chunk_size=4096, out_dir=None, num_threads=None):
     """Fits the model to data and computes peaks and metrics
 
     Parameters
     ----------
     model : a model instance
         `model` will be used to fit the data.
+    data : ndarray or ImageDataProxy
+        Diffusion data. The data of an ImageDataProxy is read from the file
+        one slab at a time (unless `parallel` is True).
     sphere : Sphere
         The Sphere providing discrete directions for evaluation.
     relative_peak_threshold : float
@@ -377,6 +351,24 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
     nbr_processes: int
         If `parallel` is True, the number of subprocesses to use
         (default multiprocessing.cpu_count()).
+    chunk_size : int, optional
+        Number of voxels that are fit, evaluated on the sphere and searched
+        for peaks at once (default 4096). The odfs are only held in memory
+        for one chunk at a time. The result does not depend on `chunk_size`:
+        the voxels of a chunk are only fit at once with models whose
+        `fits_voxels_independently` is True (e.g. CsaOdfModel, or a fit
+        decorated with `multi_voxel_fit`), and one at a time otherwise.
+    out_dir : str, optional
+        If given, the output arrays are memory-mapped ``.npy`` files created
+        in this directory (``gfa.npy``, ``qa.npy``, ``peak_dirs.npy``,
+        ``peak_values.npy``, ``peak_indices.npy`` and, if requested,
+        ``shm_coeff.npy`` and ``odf.npy``), instead of arrays in memory.
+        Existing files are overwritten. The directory can be loaded back
+        with ``dipy.io.peaks.load_peaks``.
+    num_threads : int, optional
+        Number of threads used to search the peaks of a chunk. If None
+        (default) then all available threads will be used, unless `parallel`
+        is True: each subprocess then uses a single thread.
 
     Returns
     -------
@@ -407,7 +399,10 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
                                           npeaks,
                                           B,
                                           invB,
-                                          nbr_processes)
+                                          nbr_processes,
+                                          chunk_size,
+                                          out_dir,
+                                          num_threads)
 
     shape = data.shape[:-1]
     if mask is None:
@@ -416,84 +411,184 @@ def peaks_from_model(model, data, sphere, relative_peak_threshold,
         if mask.shape != shape:
             raise ValueError("Mask is not the same shape as data.")
 
-    gfa_array = np.zeros(shape)
-    qa_array = np.zeros((shape + (npeaks,)))
-
-    peak_dirs = np.zeros((shape + (npeaks, 3)))
-    peak_values = np.zeros((shape + (npeaks,)))
-    peak_indices = np.zeros((shape + (npeaks,)), dtype='int')
-    peak_indices.fill(-1)
-
+    pam = _allocate_peaks_and_metrics(shape, sphere, npeaks, return_odf,
+                                      return_sh, sh_order, out_dir)
     if return_sh:
-        n_shm_coeff = (sh_order + 2) * (sh_order + 1) // 2
-        shm_coeff = np.zeros((shape + (n_shm_coeff,)))
+        pam.B = B
 
+    # The outputs are written at the flat (C-order) index of the voxels
+    gfa_array = pam.gfa.reshape(-1)
+    peaks_arrays = (pam.qa.reshape((-1, npeaks)),
+                    pam.peak_dirs.reshape((-1, npeaks, 3)),
+                    pam.peak_values.reshape((-1, npeaks)),
+                    pam.peak_indices.reshape((-1, npeaks)))
+    if return_sh:
+        shm_coeff = pam.shm_coeff.reshape((gfa_array.size, -1))
     if return_odf:
-        odf_array = np.zeros((shape + (len(sphere.vertices),)))
+        odf_array = pam.odf.reshape((gfa_array.size, -1))
 
     global_max = -np.inf
-    for idx in ndindex(shape):
-        if not mask[idx]:
-            continue
-
-        odf = model.fit(data[idx]).odf(sphere)
+    for flat_indices, voxels in _masked_voxel_chunks(data, mask, chunk_size):
+        count('direction.voxels', len(flat_indices))
+        with stage('direction.peaks_from_model.fit'):
+            odfs = _fit_odfs(model, voxels, sphere)
 
         if return_sh:
-            shm_coeff[idx] = np.dot(odf, invB)
+            shm_coeff[flat_indices] = np.dot(odfs, invB)
 
         if return_odf:
-            odf_array[idx] = odf
-
-        gfa_array[idx] = gfa(odf)
-        if gfa_array[idx] < gfa_thr:
-            global_max = max(global_max, odf.max())
-            continue
+            odf_array[flat_indices] = odfs
+
+        chunk_gfa = gfa(odfs)
+        gfa_array[flat_indices] = chunk_gfa
+        skipped = chunk_gfa < gfa_thr
+        if skipped.any():
+            global_max = max(global_max, odfs[skipped].max())
+            odfs = odfs[~skipped]
+            flat_indices = flat_indices[~skipped]
+            if not len(flat_indices):
+                continue
+
+        with stage('direction.peaks_from_model.peaks'):
+            global_max = max(global_max,
+                             _batch_peaks(odfs, flat_indices, sphere,
+                                          relative_peak_threshold,
+                                          min_separation_angle,
+                                          normalize_peaks, peaks_arrays,
+                                          num_threads))
 
-        # Get peaks of odf
-        direction, pk, ind = peak_directions(odf, sphere,
-                                             relative_peak_threshold,
-                                             min_separation_angle)
+    pam.qa /= global_max
+    if out_dir is not None:
+        save_peaks(out_dir, pam)
 
-        # Calculate peak metrics
-        if pk.shape[0] != 0:
-            global_max = max(global_max, pk[0])
+    return pam
 
-            n = min(npeaks, pk.shape[0])
-            qa_array[idx][:n] = pk[:n] - odf.min()
 
-            peak_dirs[idx][:n] = direction[:n]
-            peak_indices[idx][:n] = ind[:n]
-            peak_values[idx][:n] = pk[:n]
+def _allocate_peaks_and_metrics(shape, sphere, npeaks, return_odf, return_sh,
+                                sh_order, out_dir=None):
+    """ Creates a PeaksAndMetrics with zeroed output arrays for a volume of
+    the given shape
 
-            if normalize_peaks:
-                peak_values[idx][:n] /= pk[0]
-                peak_dirs[idx] *= peak_values[idx][:, None]
+    If `out_dir` is not None, the arrays are memory-mapped ``.npy`` files
+    in that directory, named after the attributes of the PeaksAndMetrics.
+    """
+    if out_dir is not None and not path.isdir(out_dir):
+        os.makedirs(out_dir)
 
-    qa_array /= global_max
+    def allocate(name, array_shape, dtype=np.float64):
+        count('direction.bytes_allocated',
+              int(np.prod(array_shape)) * np.dtype(dtype).itemsize)
+        if out_dir is None:
+            return np.zeros(array_shape, dtype=dtype)
+        return open_memmap(path.join(out_dir, name + '.npy'), mode='w+',
+                           dtype=dtype, shape=array_shape)
 
     pam = PeaksAndMetrics()
     pam.sphere = sphere
-    pam.peak_dirs = peak_dirs
-    pam.peak_values = peak_values
-    pam.peak_indices = peak_indices
-    pam.gfa = gfa_array
-    pam.qa = qa_array
+    pam.gfa = allocate('gfa', shape)
+    pam.qa = allocate('qa', shape + (npeaks,))
+    pam.peak_dirs = allocate('peak_dirs', shape + (npeaks, 3))
+    pam.peak_values = allocate('peak_values', shape + (npeaks,))
+    pam.peak_indices = allocate('peak_indices', shape + (npeaks,),
+                                dtype='int')
+    pam.peak_indices.fill(-1)
+    pam.B = None
+    pam.shm_coeff = None
+    pam.odf = None
 
     if return_sh:
-        pam.shm_coeff = shm_coeff
-        pam.B = B
-    else:
-        pam.shm_coeff = None
-        pam.B = None
+        n_shm_coeff = (sh_order + 2) * (sh_order + 1) // 2
+        pam.shm_coeff = allocate('shm_coeff', shape + (n_shm_coeff,))
 
     if return_odf:
-        pam.odf = odf_array
-    else:
-        pam.odf = None
+        pam.odf = allocate('odf', shape + (len(sphere.vertices),))
 
     return pam
 
 
+def _masked_voxel_chunks(data, mask, chunk_size):
+    """ Yields the flat (C-order) indices and the data of the voxels in
+    `mask`, `chunk_size` voxels at a time
+
+    An ImageDataProxy is read slab by slab, so that only a slab of the data
+    is in memory at a time.
+    """
+    shape = data.shape[:-1]
+    if isinstance(data, ImageDataProxy) and len(shape) == 3:
+        for indices, voxels in data.iter_masked(mask, max_voxels=chunk_size):
+            flat_indices = np.ravel_multi_index(indices, shape)
+            for start in xrange(0, len(flat_indices), chunk_size):
+                yield (flat_indices[start:start + chunk_size],
+                       voxels[start:start + chunk_size])
+        return
+
+    mask = np.ravel(mask)
+    for chunk_start in xrange(0, mask.size, chunk_size):
+        chunk_mask = mask[chunk_start:chunk_start + chunk_size]
+        flat_indices = chunk_start + np.flatnonzero(chunk_mask)
+        if not len(flat_indices):
+            continue
+        if shape:
+            voxels = data[np.unravel_index(flat_indices, shape)]
+        else:
+            voxels = np.reshape(data, (1, -1))
+        yield flat_indices, voxels
+
+
+def _fit_odfs(model, data, sphere):
+    """ Fits `model` to the voxels of `data` (N, K) and returns their odfs
+    on `sphere` (N, len(sphere.vertices))
+
+    The voxels are fit at once only if the `fits_voxels_independently`
+    attribute of the model (or of its fit method, as set by
+    `multi_voxel_fit`) is True and the odfs come out one per voxel. Other
+    models, such as a TensorModel with the default `min_signal` (which is
+    derived from all the data given to `fit`), are fit voxel by voxel, so
+    that the odfs do not depend on `chunk_size`.
+    """
+    if getattr(model, 'fits_voxels_independently',
+               getattr(model.fit, 'fits_voxels_independently', False)):
+        odfs = np.asarray(model.fit(data).odf(sphere))
+        if odfs.shape == (len(data), len(sphere.vertices)):
+            return odfs
+    return np.array([model.fit(voxel).odf(sphere) for voxel in data])
+
+
+def _batch_peaks(odfs, flat_indices, sphere, relative_peak_threshold,
+                 min_separation_angle, normalize_peaks, peaks_arrays,
+                 num_threads=None):
+    """ Finds the peaks of `odfs` and writes their metrics at `flat_indices`
+
+    `peaks_arrays` are the qa, peak directions, values and indices arrays
+    of `peaks_from_model` with the voxels flattened. Returns the largest
+    peak value (-inf if there are no peaks). The odfs are searched with
+    `num_threads` threads (all available threads if None).
+    """
+    qa_array, peak_dirs, peak_values, peak_indices = peaks_arrays
+    npeaks = peak_values.shape[-1]
+    directions, values, indices = peak_directions_batch(
+        odfs, sphere, relative_peak_threshold, min_separation_angle, npeaks,
+        num_threads)
+
+    has_peaks = indices >= 0
+    qa = values - odfs.min(axis=1)[:, None]
+    qa[~has_peaks] = 0
+
+    first = values[:, 0]
+    global_max = first[has_peaks[:, 0]].max() if has_peaks[:, 0].any() \
+        else -np.inf
+    if normalize_peaks:
+        scale = np.where(has_peaks[:, 0], first, 1.)
+        values /= scale[:, None]
+        directions *= values[..., None]
+
+    qa_array[flat_indices] = qa
+    peak_dirs[flat_indices] = directions
+    peak_values[flat_indices] = values
+    peak_indices[flat_indices] = indices
+    return global_max
+
+
 def gfa(samples):
     """The general fractional anisotropy of a function evaluated
     on the unit sphere"""
@@ -1,11 +1,19 @@
+import os
+
 import numpy as np
+import nibabel as nib
+from nibabel.tmpdirs import InTemporaryDirectory
 from numpy.testing import (assert_array_equal, assert_array_almost_equal,
                            assert_almost_equal, run_module_suite,
-                           assert_equal, assert_)
+                           assert_equal, assert_, assert_raises)
 from dipy.reconst.odf import (OdfFit, OdfModel, gfa)
+from dipy.reconst.dti import TensorModel
+from dipy.reconst.shm import CsaOdfModel
+from dipy.io.image import ImageDataProxy
 
 from dipy.direction.peaks import (peaks_from_model,
                                   peak_directions,
+                                  peak_directions_batch,
                                   peak_directions_nl,
                                   reshape_peaks_for_visualization)
 from dipy.core.subdivide_octahedron import create_unit_hemisphere
@@ -442,6 +450,54 @@ def test_degenerative_cases():
     assert_equal(len(values), 1)
 
 
+def test_peak_directions_batch():
+    sphere = get_sphere('symmetric724')
+    rng = np.random.RandomState(0)
+    mevals = np.array([[0.0015, 0.0003, 0.0003]] * 3)
+
+    odfs = []
+    for i in range(50):
+        angles = [(rng.uniform(0, 180), rng.uniform(0, 360))
+                  for _ in range(3)]
+        odf = multi_tensor_odf(sphere.vertices, mevals, angles,
+                               [50, 30, 20])
+        odfs.append(odf + 0.05 * odf.max() * rng.randn(len(odf)))
+    # degenerate cases
+    odfs.append(np.zeros(len(sphere.vertices)))
+    odfs.append(-np.ones(len(sphere.vertices)))
+    odf = np.zeros(len(sphere.vertices))
+    odf[0] = 0.020
+    odf[1] = 0.018
+    odfs.append(odf)
+    odfs = np.array(odfs)
+
+    for relative_peak_threshold, min_separation_angle, npeaks in [
+            (.5, 25, 5), (.1, 15, 3), (0., 45, 10)]:
+        for num_threads in [1, 2]:
+            directions, values, indices = peak_directions_batch(
+                odfs, sphere, relative_peak_threshold, min_separation_angle,
+                npeaks, num_threads=num_threads)
+            assert_equal(directions.shape, (len(odfs), npeaks, 3))
+            assert_equal(values.shape, (len(odfs), npeaks))
+            assert_equal(indices.shape, (len(odfs), npeaks))
+
+            for odf, d, v, ind in zip(odfs, directions, values, indices):
+                d2, v2, ind2 = peak_directions(odf, sphere,
+                                               relative_peak_threshold,
+                                               min_separation_angle)
+                n = min(npeaks, len(v2))
+                assert_array_equal(d[:n], d2[:n])
+                assert_array_equal(v[:n], v2[:n])
+                assert_array_equal(ind[:n], ind2[:n])
+                assert_array_equal(d[n:], 0)
+                assert_array_equal(v[n:], 0)
+                assert_array_equal(ind[n:], -1)
+
+    odfs[0, 0] = np.nan
+    assert_raises(ValueError, peak_directions_batch, odfs, sphere)
+    assert_raises(ValueError, peak_directions_batch, odfs[:, :10], sphere)
+
+
 def test_peaksFromModel():
     data = np.zeros((10, 2))
 
@@ -541,6 +597,116 @@ def test_peaksFromModelParallel():
     assert_array_almost_equal(pam_multi.odf, pam_single.odf)
 
 
+def test_peaksFromModel_chunks():
+    _, fbvals, fbvecs = get_data('small_64D')
+    gtab = gradient_table(np.load(fbvals), np.load(fbvecs))
+    mevals = np.array(([0.0015, 0.0003, 0.0003],
+                       [0.0015, 0.0003, 0.0003]))
+
+    rng = np.random.RandomState(0)
+    data = np.zeros((4, 5, 6, len(gtab.bvals)))
+    for idx in np.ndindex(data.shape[:-1]):
+        angles = [(rng.uniform(0, 180), rng.uniform(0, 360))
+                  for _ in range(2)]
+        data[idx], _ = multi_tensor(gtab, mevals, 100, angles=angles,
+                                    fractions=[50, 50], snr=30)
+    mask = rng.rand(*data.shape[:-1]) > .2
+
+    # A model fit to all the voxels of a chunk at once, and a model fit
+    # voxel by voxel
+    for model in [TensorModel(gtab), SimpleOdfModel(gtab)]:
+        pam = peaks_from_model(model, data, _sphere, .5, 25, mask=mask,
+                               return_odf=True, return_sh=False,
+                               gfa_thr=.1, normalize_peaks=True)
+        assert_array_equal(pam.peak_indices[~mask], -1)
+
+        with InTemporaryDirectory() as tmpdir:
+            pam_chunks = peaks_from_model(model, data, _sphere, .5, 25,
+                                          mask=mask, return_odf=True,
+                                          return_sh=False, gfa_thr=.1,
+                                          normalize_peaks=True,
+                                          chunk_size=7, out_dir=tmpdir,
+                                          num_threads=1)
+            for name in ['gfa', 'qa', 'peak_dirs', 'peak_values',
+                         'peak_indices', 'odf']:
+                result = getattr(pam_chunks, name)
+                assert_(isinstance(result, np.memmap))
+                assert_(os.path.exists(os.path.join(tmpdir, name + '.npy')))
+                assert_array_almost_equal(result, getattr(pam, name))
+            del pam_chunks, result
+
+
+class SingleVoxelCsaOdfModel(CsaOdfModel):
+    """ A model whose fit fails on more than one voxel """
+    fits_voxels_independently = False
+
+    def fit(self, data, mask=None):
+        if data.ndim > 1:
+            raise ValueError("Only one voxel can be fit at a time")
+        return CsaOdfModel.fit(self, data, mask)
+
+
+def test_peaksFromModel_chunk_size():
+    _, fbvals, fbvecs = get_data('small_64D')
+    gtab = gradient_table(np.load(fbvals), np.load(fbvecs))
+    mevals = np.array(([0.0015, 0.0003, 0.0003],
+                       [0.0015, 0.0003, 0.0003]))
+
+    rng = np.random.RandomState(1)
+    data = np.zeros((3, 4, 5, len(gtab.bvals)))
+    for idx in np.ndindex(data.shape[:-1]):
+        angles = [(rng.uniform(0, 180), rng.uniform(0, 360))
+                  for _ in range(2)]
+        data[idx], _ = multi_tensor(gtab, mevals, rng.uniform(1, 1000),
+                                    angles=angles, fractions=[50, 50],
+                                    snr=None)
+    # Voxels with small signals change the default min_signal of
+    # TensorModel, which is computed from all the voxels being fit
+    data[0, 0, :2] *= 1e-3
+    data[1, 2, 3, 5] = 0
+    assert_equal(TensorModel(gtab).fits_voxels_independently, False)
+    assert_equal(TensorModel(gtab, min_signal=1e-3).fits_voxels_independently,
+                 True)
+    assert_equal(CsaOdfModel(gtab, 4).fits_voxels_independently, True)
+
+    for model in [TensorModel(gtab), TensorModel(gtab, min_signal=1e-3),
+                  CsaOdfModel(gtab, 4), SingleVoxelCsaOdfModel(gtab, 4)]:
+        # One voxel at a time, as if the model were fit in a loop. The gfa
+        # threshold skips the flat odfs, whose peaks are ties
+        expected = peaks_from_model(model, data, _sphere, .5, 25,
+                                    return_odf=True, return_sh=False,
+                                    gfa_thr=1e-3, chunk_size=1)
+        for chunk_size in [7, 4096]:
+            pam = peaks_from_model(model, data, _sphere, .5, 25,
+                                   return_odf=True, return_sh=False,
+                                   gfa_thr=1e-3, chunk_size=chunk_size)
+            assert_array_almost_equal(pam.odf, expected.odf)
+            assert_array_almost_equal(pam.gfa, expected.gfa)
+            assert_array_almost_equal(pam.peak_values, expected.peak_values)
+            assert_array_equal(pam.peak_indices, expected.peak_indices)
+
+
+def test_peaksFromModel_image_data_proxy():
+    fimg, fbvals, fbvecs = get_data('small_64D')
+    img = nib.load(fimg)
+    gtab = gradient_table(np.load(fbvals), np.load(fbvecs))
+    # Chunks of voxels with zeros are fit with different minimum signals
+    data = img.get_data() + 1
+    proxy = ImageDataProxy(nib.Nifti1Image(data, img.get_affine()))
+    mask = data[..., 0] > data[..., 0].mean()
+
+    model = TensorModel(gtab)
+    for m in [None, mask]:
+        pam = peaks_from_model(model, data, _sphere, .5, 25, mask=m,
+                               return_sh=False, chunk_size=50)
+        pam2 = peaks_from_model(model, proxy, _sphere, .5, 25, mask=m,
+                                return_sh=False, chunk_size=50)
+        for name in ['gfa', 'qa', 'peak_dirs', 'peak_values',
+                     'peak_indices']:
+            assert_array_almost_equal(getattr(pam2, name),
+                                      getattr(pam, name))
+
+
 def test_peaks_shm_coeff():
 
     SNR = 100
@@ -2,6 +2,6 @@
 """ Calls to external packages """
 
 # Test callable
-from numpy.testing import Tester
-test = Tester().test
-del Tester
+from dipy.utils.tester import LazyTester
+test = LazyTester(__file__).test
+del LazyTester
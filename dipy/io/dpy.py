@@ -14,15 +14,24 @@ import numpy as np
 from dipy.utils.optpkg import optional_package
 
 # Allow import, but disable doctests, if we don't have pytables
-tables, have_tables, setup_module = optional_package('tables')
+tables, have_tables, setup_module = optional_package('tables', lazy=True)
 
 # Make sure not to carry across setup module from * import
 __all__ = ['Dpy']
 
 
+# Number of rows of the HDF5 chunks of the points (12 bytes per row) and of
+# the offsets (8 bytes per row). Streamlines are read and written in runs of
+# consecutive points, so chunks of a few hundred kilobytes keep both the
+# number of reads and the amount of data decompressed for a single
+# streamline small.
+TRACKS_CHUNK_ROWS = 2 ** 14
+OFFSETS_CHUNK_ROWS = 2 ** 14
+
+
 class Dpy(object):
 
-    def __init__(self, fname, mode='r', compression=0):
+    def __init__(self, fname, mode='r', compression=0, chunk_size=2 ** 20):
         ''' Advanced storage system for tractography based on HDF5
 
         Parameters
@@ -33,6 +42,10 @@ class Dpy(object):
          'r+' read and write only if file already exists
          'a'  read and write even if file doesn't exist (not used yet)
         compression : 0 no compression to 9 maximum compression
+        chunk_size : int, optional
+            Number of points buffered by ``write_tracks`` before they are
+            appended to the file, and read at once by ``iter_tracks``.
+            (Default: 2**20)
 
         Examples
         ----------
@@ -62,6 +75,8 @@ class Dpy(object):
         self.f = tables.openFile(fname, mode=self.mode)
         self.N = 5 * 10**9
         self.compression = compression
+        self.chunk_size = chunk_size
+        self._offsets = None
 
         if self.mode == 'w':
             self.streamlines = self.f.createGroup(self.f.root, 'streamlines')
@@ -69,28 +84,34 @@ class Dpy(object):
             self.version = self.f.createArray(self.f.root, 'version',
                                               ['0.0.1'], 'Dpy Version Number')
 
+            filters = tables.Filters(self.compression)
             self.tracks = self.f.createEArray(self.f.root.streamlines,
                                               'tracks',
                                               tables.Float32Atom(),
                                               (0, 3),
                                               "scalar Float32 earray",
-                                              tables.Filters(self.compression),
-                                              expectedrows=self.N)
+                                              filters,
+                                              expectedrows=self.N,
+                                              chunkshape=(TRACKS_CHUNK_ROWS,
+                                                          3))
             self.offsets = self.f.createEArray(self.f.root.streamlines,
                                                'offsets',
                                                tables.Int64Atom(), (0,),
                                                "scalar Int64 earray",
-                                               tables.Filters(
-                                                self.compression),
-                                               expectedrows=self.N + 1)
+                                               filters,
+                                               expectedrows=self.N + 1,
+                                               chunkshape=(
+                                                OFFSETS_CHUNK_ROWS,))
             self.curr_pos = 0
             self.offsets.append(np.array([self.curr_pos]).astype(np.int64))
 
-        if self.mode == 'r':
+        if self.mode in ('r', 'r+'):
             self.tracks = self.f.root.streamlines.tracks
             self.offsets = self.f.root.streamlines.offsets
             self.track_no = len(self.offsets) - 1
             self.offs_pos = 0
+            # Tracks written in 'r+' mode are appended after the last one
+            self.curr_pos = int(self.offsets[-1])
 
     def version(self):
         ver = self.f.root.version[:]
@@ -102,14 +123,64 @@ class Dpy(object):
         self.tracks.append(track.astype(np.float32))
         self.curr_pos += track.shape[0]
         self.offsets.append(np.array([self.curr_pos]).astype(np.int64))
+        self._offsets = None
 
     def write_tracks(self, T):
         ''' write many tracks together
+
+        The tracks of `T` (a sequence or any iterable of (N, 3) arrays) are
+        buffered and appended to the file with one write of points and one
+        write of offsets per ``chunk_size`` points.
         '''
+        batch = []
+        nb_points = 0
         for track in T:
-            self.tracks.append(track.astype(np.float32))
-            self.curr_pos += track.shape[0]
-            self.offsets.append(np.array([self.curr_pos]).astype(np.int64))
+            batch.append(track)
+            nb_points += len(track)
+            if nb_points >= self.chunk_size:
+                self._write_batch(batch)
+                batch = []
+                nb_points = 0
+        if batch:
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        lengths = np.array([len(track) for track in batch], dtype=np.int64)
+        points = np.concatenate([np.asarray(track).reshape((-1, 3))
+                                 for track in batch])
+        self.write_points(points, lengths)
+
+    def write_points(self, points, lengths):
+        ''' write many tracks given as a flat buffer of points
+
+        Parameters
+        ----------
+        points : (P, 3) array
+            The points of the tracks, one track after the other.
+        lengths : (T,) array of int
+            Number of points of each track, with ``sum(lengths) == P``.
+        '''
+        points = np.asarray(points, dtype=np.float32).reshape((-1, 3))
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if lengths.sum() != len(points):
+            raise ValueError("The lengths of the tracks do not add up to the "
+                             "number of points")
+        if not len(lengths):
+            return
+        offsets = self.curr_pos + np.cumsum(lengths)
+        self.tracks.append(points)
+        self.offsets.append(offsets)
+        self.curr_pos = int(offsets[-1])
+        self._offsets = None
+
+    def read_offsets(self):
+        ''' read (once) and return the offsets of all the tracks
+
+        Track ``i`` is made of points ``offsets[i]`` to ``offsets[i + 1]``.
+        '''
+        if self._offsets is None:
+            self._offsets = self.offsets[:]
+        return self._offsets
 
     def read_track(self):
         ''' read one track each time
@@ -120,28 +191,106 @@ class Dpy(object):
 
     def read_tracksi(self, indices):
         ''' read tracks with specific indices
+
+        The requested tracks that are next to each other in the file are read
+        together, so that reading many tracks takes few reads of the file.
+        Repeated indices give the same track array.
         '''
-        T = []
-        for i in indices:
-            # print(self.offsets[i:i+2])
-            off0, off1 = self.offsets[i:i + 2]
-            T.append(self.tracks[off0:off1])
-        return T
+        offsets = self.read_offsets()
+        indices = np.asarray(indices, dtype=np.intp).ravel()
+        if not len(indices):
+            return []
+        unique, inverse = np.unique(indices, return_inverse=True)
+        if unique[0] < 0 or unique[-1] >= len(offsets) - 1:
+            raise IndexError('Track index out of range')
+        starts = offsets[unique]
+        ends = offsets[unique + 1]
+
+        # Runs of tracks stored one after the other
+        breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+        run_starts = np.concatenate(([0], breaks))
+        run_ends = np.concatenate((breaks, [len(unique)]))
+
+        tracks = []
+        for first, last in zip(run_starts, run_ends):
+            start = starts[first]
+            points = self.tracks[start:ends[last - 1]]
+            for k in range(first, last):
+                tracks.append(points[starts[k] - start:ends[k] - start])
+        return [tracks[k] for k in inverse]
+
+    def iter_tracks(self, chunk_size=None):
+        ''' iterate over all the tracks, reading them in chunks
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            Number of points read at once (at least one track is read).
+            Default is the ``chunk_size`` of this Dpy.
+        '''
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        offsets = self.read_offsets()
+        nb_tracks = len(offsets) - 1
+        i = 0
+        while i < nb_tracks:
+            start = offsets[i]
+            j = max(np.searchsorted(offsets, start + chunk_size,
+                                    side='right') - 1, i + 1)
+            chunk = self.tracks[start:offsets[j]]
+            for k in range(i, j):
+                yield chunk[offsets[k] - start:offsets[k + 1] - start]
+            i = j
 
     def read_tracks(self):
         ''' read the entire tractography
         '''
         I = self.offsets[:]
         TR = self.tracks[:]
-        T = []
-        for i in range(len(I) - 1):
-            off0, off1 = I[i:i + 2]
-            T.append(TR[off0:off1])
-        return T
+        return [TR[off0:off1] for off0, off1 in zip(I[:-1], I[1:])]
 
     def close(self):
         self.f.close()
 
 
+class DpyStreamlines(object):
+    """ Read-only sequence of the streamlines of a Dpy file on disk.
+
+    Only the offsets of the streamlines are loaded in memory; the points are
+    read from the file when accessed, and iteration reads them in chunks of
+    ``chunk_size`` points. It can be used as ``refdata`` of a ``ClusterMap``.
+
+    Parameters
+    ----------
+    fname : str
+        Dpy (.dpy) file.
+    chunk_size : int, optional
+        Number of points read at once when iterating. (Default: 2**20)
+    """
+    def __init__(self, fname, chunk_size=2 ** 20):
+        self.dpy = Dpy(fname, 'r', chunk_size=chunk_size)
+        self.offsets = self.dpy.read_offsets()
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Streamline index out of range')
+        off0, off1 = self.offsets[idx:idx + 2]
+        return self.dpy.tracks[off0:off1]
+
+    def __iter__(self):
+        return self.dpy.iter_tracks(self.chunk_size)
+
+    def close(self):
+        self.dpy.close()
+
+
 if __name__ == '__main__':
     pass
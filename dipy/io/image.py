@@ -0,0 +1,152 @@
+""" Lazy access to the data of large images """
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+
+from dipy.utils.optpkg import LazyModule
+from dipy.utils.six import string_types
+
+# nibabel is slow to import, the models only check for proxies
+nib = LazyModule('nibabel')
+
+
+class ImageDataProxy(object):
+    """ Data of a NIfTI image, read from the file only when it is indexed
+
+    Indexing the proxy reads the requested part of the image (with
+    nibabel's array proxy) and returns it as an ndarray of type `dtype`.
+    The volumes of a 4D image (``data[..., i]``) and slabs along the third
+    axis (see `iter_slabs`) are stored in a few contiguous blocks of the
+    file, so they are cheap to read. The proxy can be passed instead of a
+    4D array to ``TensorModel.fit``, ``peaks_from_model``, ``nlmeans`` and
+    ``median_otsu``, which then only hold parts of the data in memory.
+
+    Parameters
+    ----------
+    img : str or nibabel image
+        The image, or the name of its file.
+    dtype : data type, optional
+        Data type of the returned arrays. Default is the type of the data
+        as returned by nibabel (after the scaling of the NIfTI header).
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> import nibabel as nib
+    >>> img = nib.Nifti1Image(np.ones((4, 5, 6, 3), dtype=np.int16), np.eye(4))
+    >>> data = ImageDataProxy(img, dtype=np.float32)
+    >>> data.shape
+    (4, 5, 6, 3)
+    >>> data[..., 0].dtype
+    dtype('float32')
+    """
+    def __init__(self, img, dtype=None):
+        if isinstance(img, string_types):
+            img = nib.load(img)
+        self.img = img
+        # nibabel < 2.0 has no array proxy, the data is read at once
+        self._proxy = getattr(img, 'dataobj', None)
+        if self._proxy is None:
+            self._proxy = img.get_data()
+        self.shape = tuple(img.shape)
+        if dtype is None:
+            dtype = np.asarray(self._proxy[(0,) * len(self.shape)]).dtype
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[...], dtype=dtype)
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, tuple):
+            idx = (idx,)
+        if any(isinstance(i, (np.ndarray, list)) for i in idx):
+            return self._take(idx)
+        return np.asarray(self._proxy[idx], dtype=self.dtype)
+
+    def _take(self, idx):
+        """ Advanced indexing: a boolean mask, or integer index arrays, of
+        the first axes. Only the bounding box of the indexed voxels is read.
+        """
+        first = np.asarray(idx[0])
+        if first.dtype == np.bool_:
+            if len(idx) > 1:
+                raise IndexError('Only a boolean mask of the first axes is '
+                                 'supported')
+            idx = np.nonzero(first)
+        idx = [np.asarray(i, dtype=np.intp) for i in idx]
+        if len(idx) > len(self.shape):
+            raise IndexError('Too many indices')
+
+        box = []
+        local = []
+        for i, n in zip(idx, self.shape):
+            if i.size == 0:
+                return np.zeros((0,) + self.shape[len(idx):],
+                                dtype=self.dtype)
+            i = np.where(i < 0, i + n, i)
+            lo, hi = i.min(), i.max() + 1
+            if lo < 0 or hi > n:
+                raise IndexError('Index out of range')
+            box.append(slice(lo, hi))
+            local.append(i - lo)
+        return self[tuple(box)][tuple(local)]
+
+    def iter_slabs(self, max_voxels=2 ** 16):
+        """ Iterates over slabs of slices along the third axis
+
+        Parameters
+        ----------
+        max_voxels : int, optional
+            Maximum number of voxels (of the first three axes) of a slab,
+            at least one slice is read at once. Default is 2**16.
+
+        Yields
+        ------
+        k : int
+            Index of the first slice of the slab.
+        slab : ndarray
+            ``data[:, :, k:k + n]`` for a slab of n slices.
+        """
+        nb_slices = self.shape[2] if len(self.shape) > 2 else 1
+        slice_size = int(np.prod(self.shape[:2]))
+        step = max(1, max_voxels // max(slice_size, 1))
+        for k in range(0, nb_slices, step):
+            yield k, self[:, :, k:k + step]
+
+    def iter_masked(self, mask=None, max_voxels=2 ** 16):
+        """ Iterates over the voxels in `mask`, slab by slab
+
+        Parameters
+        ----------
+        mask : 3D array, optional
+            Boolean mask of the first three axes. All the voxels are used if
+            None.
+        max_voxels : int, optional
+            Maximum number of voxels of the slabs read at once (see
+            `iter_slabs`).
+
+        Yields
+        ------
+        indices : tuple of three arrays
+            Indices of the voxels of the chunk.
+        voxels : (N, ...) ndarray
+            The data of these voxels, ``data[indices]``.
+        """
+        if mask is not None and np.shape(mask) != self.shape[:3]:
+            raise ValueError("Mask is not the same shape as data.")
+        for k, slab in self.iter_slabs(max_voxels):
+            if mask is None:
+                slab_mask = np.ones(slab.shape[:3], dtype=bool)
+            else:
+                slab_mask = np.asarray(mask[:, :, k:k + slab.shape[2]],
+                                       dtype=bool)
+            i, j, l = np.nonzero(slab_mask)
+            if len(i):
+                yield (i, j, l + k), slab[slab_mask]
@@ -0,0 +1,125 @@
+""" Save and load PeaksAndMetrics as a directory of memory-mapped arrays
+
+A PeaksAndMetrics is stored as a directory holding one ``.npy`` file per
+array attribute (``gfa.npy``, ``qa.npy``, ``peak_dirs.npy``,
+``peak_values.npy``, ``peak_indices.npy`` and, when present,
+``shm_coeff.npy``, ``B.npy``, ``invB.npy`` and ``odf.npy``) and its
+sphere in ``sphere.npz`` (the spherical coordinates of the vertices, the
+faces, the edges and whether it is a ``HemiSphere``). This is also the
+layout written by ``peaks_from_model(..., out_dir=...)``.
+
+The arrays are loaded as memory maps, so that a PeaksAndMetrics can be
+opened without reading its arrays, and only the parts that are used (e.g.
+the peaks of the voxels reached by tracking) are read from the disk.
+"""
+from __future__ import division, print_function, absolute_import
+
+import os
+from os.path import join as pjoin
+
+import numpy as np
+
+from dipy.core.sphere import Sphere, HemiSphere
+
+
+# Array attributes of a PeaksAndMetrics, in the order they are saved
+_PAM_ARRAYS = ('gfa', 'qa', 'peak_dirs', 'peak_values', 'peak_indices',
+               'shm_coeff', 'B', 'invB', 'odf')
+_REQUIRED_ARRAYS = ('peak_dirs', 'peak_values', 'peak_indices')
+_SPHERE_FILE = 'sphere.npz'
+
+
+def save_peaks(dname, pam):
+    """ Save a PeaksAndMetrics in directory `dname`
+
+    Parameters
+    ----------
+    dname : str
+        Directory where the arrays are saved. It is created if it does not
+        exist. The arrays of a PeaksAndMetrics previously saved in this
+        directory are replaced.
+    pam : PeaksAndMetrics
+        The attributes that are missing or None (e.g. ``odf`` when it was
+        not returned by ``peaks_from_model``) are not saved. The
+        ``peak_dirs``, ``peak_values``, ``peak_indices`` and ``sphere``
+        attributes are required.
+
+    See also
+    --------
+    dipy.io.peaks.load_peaks
+    """
+    for name in _REQUIRED_ARRAYS + ('sphere',):
+        if getattr(pam, name, None) is None:
+            raise ValueError("PeaksAndMetrics has no %s attribute" % name)
+
+    if not os.path.isdir(dname):
+        os.makedirs(dname)
+
+    for name in _PAM_ARRAYS:
+        array = getattr(pam, name, None)
+        fname = pjoin(dname, name + '.npy')
+        if array is None:
+            # Do not leave the array of a previous save in the directory
+            if os.path.exists(fname):
+                os.remove(fname)
+            continue
+        # Arrays memory-mapped from the file they would be saved to (e.g.
+        # the outputs of peaks_from_model with out_dir) only need a flush
+        if (isinstance(array, np.memmap) and array.filename is not None and
+                os.path.abspath(array.filename) == os.path.abspath(fname)):
+            array.flush()
+        else:
+            np.save(fname, array)
+
+    sphere = pam.sphere
+    np.savez(pjoin(dname, _SPHERE_FILE), theta=sphere.theta, phi=sphere.phi,
+             faces=sphere.faces, edges=sphere.edges,
+             hemisphere=isinstance(sphere, HemiSphere))
+
+
+def load_peaks(dname, mmap_mode='c'):
+    """ Load a PeaksAndMetrics saved by `save_peaks`
+
+    Parameters
+    ----------
+    dname : str
+        Directory where the PeaksAndMetrics was saved.
+    mmap_mode : {None, 'r', 'r+', 'c'}, optional
+        Memory-map mode of the arrays, as for ``numpy.load``. With the
+        default, 'c' (copy-on-write), the arrays are writable but changes are
+        never written to the files. Read-only ('r') arrays cannot be used
+        for tracking. With None, the arrays are read in memory.
+
+    Returns
+    -------
+    pam : PeaksAndMetrics
+        The attributes that were not saved are None. The sphere is a
+        ``HemiSphere`` if the saved sphere was one and a ``Sphere``
+        otherwise, with the vertices (in the same order), faces and edges of
+        the saved sphere.
+
+    See also
+    --------
+    dipy.io.peaks.save_peaks
+    """
+    from dipy.direction.peaks import PeaksAndMetrics
+
+    for fname in [name + '.npy' for name in _REQUIRED_ARRAYS] + \
+            [_SPHERE_FILE]:
+        if not os.path.exists(pjoin(dname, fname)):
+            raise IOError("%s is not a PeaksAndMetrics directory, %s is "
+                          "missing" % (dname, fname))
+
+    pam = PeaksAndMetrics()
+    for name in _PAM_ARRAYS:
+        fname = pjoin(dname, name + '.npy')
+        if os.path.exists(fname):
+            setattr(pam, name, np.load(fname, mmap_mode=mmap_mode))
+        else:
+            setattr(pam, name, None)
+
+    with np.load(pjoin(dname, _SPHERE_FILE)) as sphere:
+        klass = HemiSphere if sphere['hemisphere'] else Sphere
+        pam.sphere = klass(theta=sphere['theta'], phi=sphere['phi'],
+                           faces=sphere['faces'], edges=sphere['edges'])
+    return pam
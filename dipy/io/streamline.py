@@ -0,0 +1,319 @@
+""" Memory-mapped reading and bulk writing of TrackVis and MRtrix tractograms
+
+The points of TrackVis (.trk) and MRtrix (.tck) files are memory-mapped and
+the streamlines are views into the file, so that tractograms larger than
+the available memory can be opened at once and iterated over lazily. The
+streamlines are found with a single pass over the file, and writing
+encodes all the streamlines in one buffer written with a single call.
+"""
+from __future__ import division, print_function, absolute_import
+
+import os
+
+import numpy as np
+import nibabel as nib
+
+from dipy.io.trackvis import read_trk_header
+from dipy.io.trkspeed import trk_streamlines_offsets
+
+# Number of points checked at once when looking for the delimiters of the
+# streamlines of a .tck file
+TCK_SCAN_POINTS = 2 ** 22
+
+_TCK_DTYPES = {'Float32LE': '<f4', 'Float32BE': '>f4',
+               'Float64LE': '<f8', 'Float64BE': '>f8'}
+
+
+class MappedStreamlines(object):
+    """ Read-only sequence of streamlines stored in a flat buffer of values
+
+    Streamline ``i`` is made of ``lengths[i]`` points of ``n_floats``
+    values, starting at value ``starts[i]`` of `data`; its first 3 values
+    per point are the coordinates. Indexing returns views of `data`
+    (copies if `data` is not in the native byte order), so the values are
+    only read from a memory-mapped file when they are used.
+
+    Parameters
+    ----------
+    data : 1D array
+        The buffer of values, e.g. a memory-mapped file.
+    starts : 1D array of int
+        Index of the first value of every streamline.
+    lengths : 1D array of int
+        Number of points of every streamline.
+    n_floats : int, optional
+        Number of values per point (default 3).
+    """
+    def __init__(self, data, starts, lengths, n_floats=3):
+        self.data = data
+        # Slicing a plain view is much faster than slicing a np.memmap
+        self._values = data.view(np.ndarray)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.n_floats = n_floats
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _streamline(self, start, length):
+        n_floats = self.n_floats
+        points = self._values[start:start + length * n_floats]
+        points = points.reshape((length, n_floats))
+        if n_floats != 3:
+            points = points[:, :3]
+        if not points.dtype.isnative:
+            points = points.astype(points.dtype.newbyteorder('='))
+        return points
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            if idx < 0:
+                idx += len(self)
+            if not 0 <= idx < len(self):
+                raise IndexError('Streamline index out of range')
+            return self._streamline(self.starts[idx], self.lengths[idx])
+        # Slices and arrays of indices select a sub-sequence
+        return MappedStreamlines(self.data, self.starts[idx],
+                                 self.lengths[idx], self.n_floats)
+
+    def __iter__(self):
+        starts, lengths = self.starts.tolist(), self.lengths.tolist()
+        for start, length in zip(starts, lengths):
+            yield self._streamline(start, length)
+
+    def get_points(self):
+        """ Returns the points of all the streamlines, one after the other,
+        as a (sum(lengths), 3) array """
+        if not len(self):
+            return np.zeros((0, 3), dtype=self.data.dtype.newbyteorder('='))
+        return np.concatenate(list(self))
+
+
+def _flatten(streamlines, lengths=None):
+    """ Returns the points and lengths of streamlines given as a sequence of
+    arrays, or as their points if `lengths` is given """
+    if lengths is None:
+        if isinstance(streamlines, MappedStreamlines):
+            return streamlines.get_points(), streamlines.lengths
+        streamlines = [np.asarray(s).reshape((-1, 3)) for s in streamlines]
+        lengths = np.array([len(s) for s in streamlines], dtype=np.int64)
+        if len(streamlines):
+            points = np.concatenate(streamlines)
+        else:
+            points = np.zeros((0, 3))
+    else:
+        points = np.asarray(streamlines).reshape((-1, 3))
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if lengths.sum() != len(points):
+            raise ValueError("The lengths of the streamlines do not add up "
+                             "to the number of points")
+    return points, lengths
+
+
+def load_trk(filename):
+    """ Memory-maps the streamlines of a TrackVis file
+
+    Parameters
+    ----------
+    filename : str
+        TrackVis (.trk) file.
+
+    Returns
+    -------
+    streamlines : MappedStreamlines
+        The streamlines, in the coordinates stored in the file (voxmm), as
+        with ``nibabel.trackvis.read``. Scalars and properties are skipped.
+    header : structured array
+        The header of the file.
+    """
+    hdr, endianness = read_trk_header(filename)
+    offset = hdr.dtype.itemsize
+    n_words = (os.path.getsize(filename) - offset) // 4
+    if n_words:
+        words = np.memmap(filename, dtype=np.uint32, mode='r',
+                          offset=offset, shape=(n_words,))
+    else:
+        words = np.zeros(0, dtype=np.uint32)
+    n_floats = 3 + int(hdr['n_scalars'])
+    swap = np.dtype(endianness + 'u4') != np.dtype(np.uint32)
+    starts, lengths = trk_streamlines_offsets(words, n_floats,
+                                              int(hdr['n_properties']), swap)
+    data = words.view(endianness + 'f4')
+    return MappedStreamlines(data, starts, lengths, n_floats), hdr
+
+
+def write_trk(filename, streamlines, header=None, lengths=None):
+    """ Writes streamlines to a TrackVis file
+
+    The streamlines are encoded in a single buffer, written at once.
+
+    Parameters
+    ----------
+    filename : str
+        TrackVis (.trk) file.
+    streamlines : sequence of (N, 3) arrays, or (P, 3) array
+        The streamlines, in voxmm coordinates. If `lengths` is given, the
+        points of all the streamlines, one after the other.
+    header : structured array or dict, optional
+        Fields of the TrackVis header (e.g. ``dim``, ``voxel_size``,
+        ``voxel_order``, ``vox_to_ras``). ``n_count``, ``n_scalars`` and
+        ``n_properties`` are set from the streamlines written.
+    lengths : 1D array of int, optional
+        Number of points of every streamline, if `streamlines` is a flat
+        array of points.
+    """
+    points, lengths = _flatten(streamlines, lengths)
+
+    hdr = nib.trackvis.empty_header('<')
+    if header is not None:
+        names = header.dtype.names if hasattr(header, 'dtype') else header
+        for name in names:
+            hdr[name] = header[name]
+    hdr['n_count'] = len(lengths)
+    hdr['n_scalars'] = 0
+    hdr['n_properties'] = 0
+    hdr['hdr_size'] = 1000
+
+    # Each streamline is its number of points (int32) followed by its points
+    counts = np.arange(len(lengths)) + 3 * (np.cumsum(lengths) - lengths)
+    words = np.empty(len(lengths) + 3 * len(points), dtype='<f4')
+    is_point = np.ones(len(words), dtype=bool)
+    is_point[counts] = False
+    words[is_point] = points.ravel()
+    words.view('<i4')[counts] = lengths
+
+    with open(filename, 'wb') as f:
+        hdr.tofile(f)
+        words.tofile(f)
+
+
+def read_tck_header(filename):
+    """ Reads the text header of an MRtrix tracks file
+
+    Parameters
+    ----------
+    filename : str
+        MRtrix tracks (.tck) file.
+
+    Returns
+    -------
+    header : dict
+        The ``key: value`` fields of the header, as strings.
+    """
+    header = {}
+    with open(filename, 'rb') as f:
+        if f.readline().rstrip() != b'mrtrix tracks':
+            raise ValueError('Invalid MRtrix tracks file ' + filename)
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError('Unterminated header in ' + filename)
+            line = line.decode('latin-1').rstrip('\r\n')
+            if line == 'END':
+                break
+            key, _, value = line.partition(':')
+            header[key.strip()] = value.strip()
+    return header
+
+
+def load_tck(filename):
+    """ Memory-maps the streamlines of an MRtrix tracks file
+
+    Parameters
+    ----------
+    filename : str
+        MRtrix tracks (.tck) file.
+
+    Returns
+    -------
+    streamlines : MappedStreamlines
+        The streamlines, in the (world) coordinates of the file. Points
+        after the last complete streamline are ignored.
+    header : dict
+        The fields of the header, as strings.
+    """
+    header = read_tck_header(filename)
+    try:
+        dtype = np.dtype(_TCK_DTYPES[header.get('datatype', 'Float32LE')])
+    except KeyError:
+        raise ValueError('Unsupported datatype in ' + filename)
+    offset = int(header['file'].split()[1])
+    n_points = (os.path.getsize(filename) - offset) // (3 * dtype.itemsize)
+    if n_points:
+        data = np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                         shape=(3 * n_points,))
+    else:
+        data = np.zeros(0, dtype=dtype)
+
+    # Streamlines are delimited by a point of NaNs, and the data ends with a
+    # point of infinite values
+    first_coordinates = data[::3]
+    delimiters = []
+    for start in range(0, n_points, TCK_SCAN_POINTS):
+        block = first_coordinates[start:start + TCK_SCAN_POINTS]
+        delimiters.append(np.flatnonzero(np.isnan(block)) + start)
+        end = np.flatnonzero(np.isinf(block))
+        if len(end):
+            delimiters[-1] = delimiters[-1][delimiters[-1] < start + end[0]]
+            break
+    if delimiters:
+        delimiters = np.concatenate(delimiters)
+    else:
+        delimiters = np.zeros(0, dtype=np.intp)
+    starts = np.concatenate(([0], delimiters + 1))[:-1]
+    lengths = delimiters - starts
+    return MappedStreamlines(data, 3 * starts, lengths), header
+
+
+def write_tck(filename, streamlines, header=None, lengths=None):
+    """ Writes streamlines to an MRtrix tracks file
+
+    The streamlines are encoded in a single buffer, written at once.
+
+    Parameters
+    ----------
+    filename : str
+        MRtrix tracks (.tck) file.
+    streamlines : sequence of (N, 3) arrays, or (P, 3) array
+        The streamlines, in world coordinates. If `lengths` is given, the
+        points of all the streamlines, one after the other.
+    header : dict, optional
+        Additional ``key: value`` fields of the header. ``count``,
+        ``datatype`` and ``file`` are set by this function.
+    lengths : 1D array of int, optional
+        Number of points of every streamline, if `streamlines` is a flat
+        array of points.
+    """
+    points, lengths = _flatten(streamlines, lengths)
+
+    fields = {}
+    if header is not None:
+        fields.update(header)
+    fields['count'] = '%010d' % len(lengths)
+    fields['datatype'] = 'Float32LE'
+    fields.pop('file', None)
+    lines = ['mrtrix tracks'] + ['%s: %s' % (key, fields[key])
+                                 for key in sorted(fields)]
+    text = '\n'.join(lines) + '\n'
+    # The offset of the data is written in the header, so its length
+    # depends on the number of digits of the offset
+    offset = len(text) + len('file: . \nEND\n')
+    while offset < len(text) + len('file: . %d\nEND\n' % offset):
+        offset += 1
+    text += 'file: . %d\nEND\n' % offset
+    text += '\0' * (offset - len(text))
+
+    # A point of NaNs after each streamline and a point of infinite values
+    # at the end
+    delimiters = np.cumsum(lengths + 1) - 1
+    rows = np.empty((len(points) + len(lengths) + 1, 3), dtype='<f4')
+    is_point = np.ones(len(rows), dtype=bool)
+    is_point[delimiters] = False
+    is_point[-1] = False
+    rows[is_point] = points
+    rows[delimiters] = np.nan
+    rows[-1] = np.inf
+
+    with open(filename, 'wb') as f:
+        f.write(text.encode('latin-1'))
+        rows.tofile(f)
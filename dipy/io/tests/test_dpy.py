@@ -3,7 +3,7 @@ import numpy as np
 
 from nibabel.tmpdirs import InTemporaryDirectory
 
-from dipy.io.dpy import Dpy, have_tables
+from dipy.io.dpy import Dpy, DpyStreamlines, have_tables
 
 
 from nose.tools import assert_true, assert_false, \
@@ -38,3 +38,85 @@ def test_dpy():
         dpr.close()
         assert_array_equal(A, T[0])
         assert_array_equal(C, T[5])
+
+
+@iftables
+def test_dpy_streamlines():
+    fname = 'test.dpy'
+    rng = np.random.RandomState(0)
+    T = [rng.rand(n, 3).astype(np.float32) for n in [5, 1, 12, 7, 3]]
+    with InTemporaryDirectory():
+        dpw = Dpy(fname, 'w')
+        dpw.write_tracks(T)
+        dpw.close()
+        for chunk_size in [1, 10, 2 ** 20]:
+            streamlines = DpyStreamlines(fname, chunk_size=chunk_size)
+            assert_equal(len(streamlines), len(T))
+            for s, t in zip(streamlines, T):
+                assert_array_equal(s, t)
+            assert_array_equal(streamlines[2], T[2])
+            assert_array_equal(streamlines[-1], T[-1])
+            assert_equal(len(streamlines[1:4]), 3)
+            assert_raises(IndexError, streamlines.__getitem__, len(T))
+            streamlines.close()
+
+
+@iftables
+def test_dpy_bulk():
+    fname = 'test.dpy'
+    rng = np.random.RandomState(0)
+    T = [rng.rand(n, 3).astype(np.float32)
+         for n in rng.randint(1, 20, size=100)]
+    with InTemporaryDirectory():
+        dpw = Dpy(fname, 'w', compression=1, chunk_size=50)
+        dpw.write_tracks(T[:60])
+        dpw.write_points(np.concatenate(T[60:]), [len(t) for t in T[60:]])
+        assert_raises(ValueError, dpw.write_points, T[0], [len(T[0]) + 1])
+        dpw.close()
+
+        dpr = Dpy(fname, 'r')
+        assert_equal(len(dpr.read_offsets()), len(T) + 1)
+        indices = [5, 6, 7, 99, 0, 6, 50, 51]
+        for t, i in zip(dpr.read_tracksi(indices), indices):
+            assert_array_equal(t, T[i])
+        assert_equal(dpr.read_tracksi([]), [])
+        assert_raises(IndexError, dpr.read_tracksi, [len(T)])
+
+        for chunk_size in [1, 30, 2 ** 20]:
+            tracks = list(dpr.iter_tracks(chunk_size))
+            assert_equal(len(tracks), len(T))
+            for t, t2 in zip(tracks, T):
+                assert_array_equal(t, t2)
+        dpr.close()
+
+
+@iftables
+def test_dpy_append():
+    fname = 'test.dpy'
+    rng = np.random.RandomState(0)
+    T = [rng.rand(n, 3).astype(np.float32)
+         for n in rng.randint(1, 20, size=10)]
+    with InTemporaryDirectory():
+        dpw = Dpy(fname, 'w')
+        dpw.write_tracks(T[:4])
+        dpw.close()
+
+        # Tracks written in 'r+' mode are appended to the existing ones, and
+        # the offsets read before a write are read again after it
+        dpa = Dpy(fname, 'r+')
+        assert_equal(len(dpa.read_offsets()), 5)
+        dpa.write_track(T[4])
+        assert_equal(len(dpa.read_offsets()), 6)
+        dpa.write_tracks(T[5:8])
+        dpa.write_points(np.concatenate(T[8:]), [len(t) for t in T[8:]])
+        assert_equal(len(dpa.read_offsets()), len(T) + 1)
+        for t, t2 in zip(dpa.read_tracksi(range(len(T))), T):
+            assert_array_equal(t, t2)
+        dpa.close()
+
+        dpr = Dpy(fname, 'r')
+        tracks = dpr.read_tracks()
+        assert_equal(len(tracks), len(T))
+        for t, t2 in zip(tracks, T):
+            assert_array_equal(t, t2)
+        dpr.close()
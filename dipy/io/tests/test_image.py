@@ -0,0 +1,53 @@
+import numpy as np
+import nibabel as nib
+
+from nibabel.tmpdirs import InTemporaryDirectory
+from nose.tools import assert_equal, assert_raises
+from numpy.testing import assert_array_equal, run_module_suite
+
+from dipy.io.image import ImageDataProxy
+
+
+def test_image_data_proxy():
+    rng = np.random.RandomState(0)
+    data = rng.randint(0, 100, size=(5, 6, 7, 4)).astype(np.int16)
+    with InTemporaryDirectory():
+        nib.save(nib.Nifti1Image(data, np.eye(4)), 'data.nii.gz')
+        proxy = ImageDataProxy('data.nii.gz')
+        assert_equal(proxy.shape, data.shape)
+        assert_equal(proxy.ndim, 4)
+        assert_equal(proxy.dtype, np.int16)
+        assert_array_equal(np.asarray(proxy), data)
+        assert_array_equal(proxy[..., 2], data[..., 2])
+        assert_array_equal(proxy[1:3, :, 4], data[1:3, :, 4])
+
+        # Advanced indexing of the first axes
+        mask = data[..., 0] > 50
+        assert_array_equal(proxy[mask], data[mask])
+        indices = np.nonzero(mask)
+        assert_array_equal(proxy[indices], data[indices])
+        assert_array_equal(proxy[[0, -1], [2, 3]], data[[0, -1], [2, 3]])
+        assert_equal(proxy[np.zeros(mask.shape, bool)].shape, (0, 4))
+        assert_raises(IndexError, proxy.__getitem__, ([0, 5], [0, 0]))
+
+        proxy = ImageDataProxy(nib.load('data.nii.gz'), dtype=np.float32)
+        assert_equal(proxy[0].dtype, np.float32)
+
+        for max_voxels in [1, 60, 10 ** 6]:
+            slabs = list(proxy.iter_slabs(max_voxels))
+            assert_equal(len(slabs), 7 if max_voxels < 60 else
+                         int(np.ceil(7. / (max_voxels // 30))))
+            assert_array_equal(np.concatenate([s for _, s in slabs], axis=2),
+                               data)
+
+            values = np.zeros(data.shape, dtype=np.float32)
+            for (i, j, k), voxels in proxy.iter_masked(mask, max_voxels):
+                assert_array_equal(mask[i, j, k], True)
+                values[i, j, k] = voxels
+            assert_array_equal(values[mask], data[mask])
+            assert_array_equal(values[~mask], 0)
+        assert_raises(ValueError, next, proxy.iter_masked(mask[0]))
+
+
+if __name__ == '__main__':
+    run_module_suite()
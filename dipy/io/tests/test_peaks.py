@@ -0,0 +1,115 @@
+import os
+import numpy as np
+
+from nibabel.tmpdirs import InTemporaryDirectory
+
+from dipy.data import get_sphere, default_sphere
+from dipy.direction.peaks import PeaksAndMetrics, peaks_from_model
+from dipy.io.peaks import save_peaks, load_peaks
+
+from nose.tools import assert_true, assert_equal, assert_raises
+
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+import numpy.testing as npt
+
+
+def _random_pam(shape, sphere, npeaks=5):
+    rng = np.random.RandomState(0)
+    pam = PeaksAndMetrics()
+    pam.sphere = sphere
+    pam.gfa = rng.rand(*shape)
+    pam.qa = rng.rand(*(shape + (npeaks,)))
+    pam.peak_values = rng.rand(*(shape + (npeaks,)))
+    pam.peak_indices = rng.randint(len(sphere.vertices),
+                                   size=shape + (npeaks,))
+    pam.peak_dirs = sphere.vertices[pam.peak_indices]
+    pam.shm_coeff = rng.rand(*(shape + (15,)))
+    pam.B = rng.rand(15, len(sphere.vertices))
+    pam.odf = None
+    return pam
+
+
+def test_save_load_peaks():
+    sphere = get_sphere('repulsion100')
+    pam = _random_pam((4, 5, 6), sphere)
+
+    with InTemporaryDirectory():
+        # A previous odf should not be loaded with the new arrays
+        os.mkdir('pam')
+        np.save(os.path.join('pam', 'odf.npy'), np.zeros(3))
+        save_peaks('pam', pam)
+        assert_true(not os.path.exists(os.path.join('pam', 'odf.npy')))
+
+        for mmap_mode in ['c', 'r', None]:
+            pam2 = load_peaks('pam', mmap_mode=mmap_mode)
+            for name in ['gfa', 'qa', 'peak_values', 'peak_indices',
+                         'peak_dirs', 'shm_coeff', 'B']:
+                array = getattr(pam2, name)
+                assert_equal(isinstance(array, np.memmap),
+                             mmap_mode is not None)
+                assert_array_equal(array, getattr(pam, name))
+            assert_equal(pam2.odf, None)
+            assert_equal(pam2.invB, None)
+            assert_array_equal(pam2.sphere.vertices, sphere.vertices)
+            del pam2, array
+
+        # The loaded peaks can be used for tracking
+        pam2 = load_peaks('pam')
+        point = np.array([1., 2., 3.])
+        assert_array_almost_equal(pam2.initial_direction(point),
+                                  pam.initial_direction(point))
+
+        # Directories without the peaks cannot be loaded
+        os.remove(os.path.join('pam', 'peak_values.npy'))
+        assert_raises(IOError, load_peaks, 'pam')
+
+        pam.peak_dirs = None
+        assert_raises(ValueError, save_peaks, 'pam', pam)
+        del pam2
+
+
+def test_save_load_peaks_sphere():
+    # The class, faces and edges of the sphere are kept
+    for sphere in [default_sphere, get_sphere('repulsion100')]:
+        pam = _random_pam((2, 3, 4), sphere)
+        with InTemporaryDirectory():
+            save_peaks('pam', pam)
+            pam2 = load_peaks('pam')
+            assert_equal(type(pam2.sphere), type(sphere))
+            assert_array_almost_equal(pam2.sphere.vertices, sphere.vertices)
+            assert_array_equal(pam2.sphere.faces, sphere.faces)
+            assert_array_equal(pam2.sphere.edges, sphere.edges)
+            del pam2
+
+
+def test_load_peaks_from_model():
+
+    class SillyModel(object):
+        def fit(self, data, mask=None):
+            return SillyFit(data)
+
+    class SillyFit(object):
+
+        def __init__(self, data):
+            self.data = data
+
+        def odf(self, sphere):
+            return np.abs(np.dot(self.data, sphere.vertices.T))
+
+    sphere = get_sphere('repulsion100')
+    data = np.random.RandomState(1).randn(3, 4, 5, 3)
+
+    with InTemporaryDirectory():
+        pam = peaks_from_model(SillyModel(), data, sphere, .5, 25,
+                               return_sh=False, return_odf=True,
+                               out_dir='pam')
+        pam2 = load_peaks('pam')
+        for name in ['gfa', 'qa', 'peak_values', 'peak_indices', 'peak_dirs',
+                     'odf']:
+            assert_array_equal(getattr(pam2, name), getattr(pam, name))
+        assert_equal(pam2.shm_coeff, None)
+        del pam, pam2
+
+
+if __name__ == '__main__':
+    npt.run_module_suite()
@@ -0,0 +1,113 @@
+import numpy as np
+import nibabel as nib
+
+from nibabel.tmpdirs import InTemporaryDirectory
+from nose.tools import assert_equal, assert_raises, assert_true
+from numpy.testing import assert_array_equal, run_module_suite
+
+from dipy.data import get_data
+from dipy.io.streamline import (MappedStreamlines, load_trk, write_trk,
+                                load_tck, write_tck, read_tck_header)
+
+
+def _assert_streamlines_equal(streamlines, expected):
+    assert_equal(len(streamlines), len(expected))
+    for s, e in zip(streamlines, expected):
+        assert_equal(s.dtype, np.float32)
+        assert_array_equal(s, e)
+
+
+def test_load_write_trk():
+    streams, hdr = nib.trackvis.read(get_data('fornix'))
+    expected = [s[0] for s in streams]
+
+    streamlines, hdr2 = load_trk(get_data('fornix'))
+    assert_true(isinstance(streamlines, MappedStreamlines))
+    _assert_streamlines_equal(streamlines, expected)
+    assert_array_equal(streamlines[-1], expected[-1])
+    assert_raises(IndexError, streamlines.__getitem__, len(expected))
+    _assert_streamlines_equal(streamlines[10:20], expected[10:20])
+    _assert_streamlines_equal(streamlines[[3, 1, 3]],
+                              [expected[3], expected[1], expected[3]])
+    assert_array_equal(hdr2['dim'], hdr['dim'])
+
+    with InTemporaryDirectory():
+        write_trk('test.trk', streamlines, hdr2)
+        streamlines2, hdr3 = load_trk('test.trk')
+        _assert_streamlines_equal(streamlines2, expected)
+        assert_equal(hdr3['n_count'], len(expected))
+        assert_array_equal(hdr3['voxel_size'], hdr['voxel_size'])
+        # The file can be read by nibabel
+        streams2, _ = nib.trackvis.read('test.trk')
+        _assert_streamlines_equal([s[0] for s in streams2], expected)
+
+        # From a flat buffer of points
+        lengths = [len(s) for s in expected]
+        write_trk('flat.trk', np.concatenate(expected),
+                  {'dim': hdr['dim']}, lengths=lengths)
+        _assert_streamlines_equal(load_trk('flat.trk')[0], expected)
+        assert_raises(ValueError, write_trk, 'flat.trk', expected[0],
+                      lengths=[len(expected[0]) + 1])
+
+        write_trk('empty.trk', [])
+        assert_equal(len(load_trk('empty.trk')[0]), 0)
+
+        # Truncated files are detected
+        with open('test.trk', 'rb') as f:
+            data = f.read()
+        with open('truncated.trk', 'wb') as f:
+            f.write(data[:-5])
+        assert_raises(IOError, load_trk, 'truncated.trk')
+
+
+def test_load_trk_scalars_properties():
+    rng = np.random.RandomState(0)
+    streams = [(rng.rand(n, 3).astype('f4'), rng.rand(n, 2).astype('f4'),
+                rng.rand(3).astype('f4')) for n in [4, 1, 9]]
+    with InTemporaryDirectory():
+        for endianness in ['<', '>']:
+            nib.trackvis.write('test.trk', streams, endianness=endianness)
+            expected = [s[0] for s in nib.trackvis.read('test.trk')[0]]
+            streamlines, _ = load_trk('test.trk')
+            _assert_streamlines_equal(streamlines, expected)
+            assert_array_equal(streamlines[1], expected[1])
+
+        with open('bad.trk', 'wb') as f:
+            f.write(b'\0' * 1000)
+        assert_raises(ValueError, load_trk, 'bad.trk')
+
+
+def test_load_write_tck():
+    rng = np.random.RandomState(0)
+    expected = [rng.rand(n, 3).astype('f4') for n in [4, 1, 9, 20]]
+    with InTemporaryDirectory():
+        write_tck('test.tck', expected, {'step_size': '0.5'})
+        header = read_tck_header('test.tck')
+        assert_equal(header['step_size'], '0.5')
+        assert_equal(int(header['count']), len(expected))
+
+        streamlines, header = load_tck('test.tck')
+        _assert_streamlines_equal(streamlines, expected)
+        _assert_streamlines_equal(streamlines[2:], expected[2:])
+
+        # Rewriting the memory-mapped streamlines
+        write_tck('test2.tck', streamlines[::-1])
+        _assert_streamlines_equal(load_tck('test2.tck')[0], expected[::-1])
+
+        # Points after the last complete streamline are ignored
+        with open('test.tck', 'rb') as f:
+            data = f.read()
+        with open('partial.tck', 'wb') as f:
+            f.write(data[:-12 * 5])
+        _assert_streamlines_equal(load_tck('partial.tck')[0], expected[:3])
+
+        write_tck('empty.tck', [])
+        assert_equal(len(load_tck('empty.tck')[0]), 0)
+
+        with open('bad.tck', 'wb') as f:
+            f.write(b'not mrtrix\n')
+        assert_raises(ValueError, load_tck, 'bad.tck')
+
+
+if __name__ == '__main__':
+    run_module_suite()
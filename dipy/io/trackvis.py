@@ -30,3 +30,31 @@ def save_trk(filename, points, vox_to_ras, shape):
     hdr['voxel_size'] = zooms[:3]
 
     nib.trackvis.write(filename, data, hdr)
+
+
+def read_trk_header(filename):
+    """ Reads the header of a TrackVis file and finds its byte order
+
+    Parameters
+    ----------
+    filename : str
+        TrackVis (.trk) file.
+
+    Returns
+    -------
+    header : structured array
+        The header, of dtype ``nibabel.trackvis.header_2_dtype`` in the byte
+        order of the file.
+    endianness : {'<', '>'}
+        Byte order of the file.
+    """
+    with open(filename, 'rb') as f:
+        hdr_str = f.read(nib.trackvis.header_2_dtype.itemsize)
+    if len(hdr_str) < nib.trackvis.header_2_dtype.itemsize:
+        raise ValueError('Invalid TrackVis header in ' + filename)
+    for endianness in '<>':
+        dt = nib.trackvis.header_2_dtype.newbyteorder(endianness)
+        hdr = np.ndarray(shape=(), dtype=dt, buffer=hdr_str)
+        if hdr['hdr_size'] == 1000:
+            return hdr.copy(), endianness
+    raise ValueError('Invalid TrackVis header in ' + filename)
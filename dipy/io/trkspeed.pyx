@@ -0,0 +1,82 @@
+# cython: wraparound=False, cdivision=True, boundscheck=False
+
+import numpy as np
+cimport numpy as cnp
+
+cimport cython
+
+
+cdef inline cnp.uint32_t _swap(cnp.uint32_t x) nogil:
+    return (((x & 0xff) << 24) | ((x & 0xff00) << 8) |
+            ((x >> 8) & 0xff00) | (x >> 24))
+
+
+def trk_streamlines_offsets(const cnp.uint32_t[::1] words, int n_floats,
+                            int n_properties, int swap=False):
+    """ Finds the streamlines in the data of a TrackVis file
+
+    The data of a TrackVis file (after its header) is a sequence of 4 bytes
+    words: for each streamline, the number of points N (int32), then N
+    points of `n_floats` float32 values (the 3 coordinates followed by the
+    scalars) and `n_properties` float32 values.
+
+    Parameters
+    ----------
+    words : 1D array of uint32
+        The data of the file, e.g. a memory map of the file after its
+        header.
+    n_floats : int
+        Number of values per point (3 plus the number of scalars).
+    n_properties : int
+        Number of properties per streamline.
+    swap : bool, optional
+        True if the byte order of the file is not the native one.
+
+    Returns
+    -------
+    starts : 1D array of int64
+        Index in `words` of the first point of every streamline.
+    lengths : 1D array of int64
+        Number of points of every streamline.
+    """
+    cdef:
+        cnp.npy_intp n_words = words.shape[0]
+        cnp.npy_intp pos, i, n_streamlines
+        cnp.int32_t n_points
+        cnp.int64_t[::1] starts_view, lengths_view
+        int truncated = 0
+
+    # First pass to count the streamlines, second pass to record them
+    with nogil:
+        pos = 0
+        n_streamlines = 0
+        while pos < n_words:
+            n_points = <cnp.int32_t> (_swap(words[pos]) if swap
+                                      else words[pos])
+            if n_points < 0:
+                truncated = 1
+                break
+            pos += 1 + <cnp.npy_intp> n_points * n_floats + n_properties
+            if pos > n_words:
+                truncated = 1
+                break
+            n_streamlines += 1
+
+    if truncated:
+        raise IOError('The TrackVis data is truncated or corrupted')
+
+    starts = np.empty(n_streamlines, dtype=np.int64)
+    lengths = np.empty(n_streamlines, dtype=np.int64)
+    starts_view = starts
+    lengths_view = lengths
+
+    with nogil:
+        pos = 0
+        for i in range(n_streamlines):
+            n_points = <cnp.int32_t> (_swap(words[pos]) if swap
+                                      else words[pos])
+            starts_view[i] = pos + 1
+            lengths_view[i] = n_points
+            pos += 1 + <cnp.npy_intp> n_points * n_floats + n_properties
+
+    return starts, lengths
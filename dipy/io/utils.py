@@ -2,7 +2,10 @@
 from __future__ import division, print_function, absolute_import
 
 import numpy as np
-from nibabel import Nifti1Image
+
+from dipy.utils.optpkg import LazyModule
+
+nib = LazyModule('nibabel')
 
 
 def nifti1_symmat(image_data, *args, **kwargs):
@@ -28,7 +31,7 @@ def nifti1_symmat(image_data, *args, **kwargs):
     if (n % 1) != 0:
         raise ValueError("input_data does not seem to have matrix elements")
 
-    image = Nifti1Image(image_data, *args, **kwargs)
+    image = nib.Nifti1Image(image_data, *args, **kwargs)
     hdr = image.get_header()
     hdr.set_intent('symmetric matrix', (n,))
     return image
@@ -44,3 +47,60 @@ def make5d(input):
     shape = input.shape
     shape = shape[:-1] + (1,)*(5-len(shape)) + shape[-1:]
     return input.reshape(shape)
+
+
+def nifti1_memmap(filename, shape, dtype, affine=None, header=None):
+    """Creates an uncompressed NIfTI-1 file and memory-maps its data
+
+    Writing into the returned array writes into the file, so that large
+    images (e.g. denoised 4D data) can be saved one part at a time without
+    holding the whole image in memory.
+
+    Parameters:
+    -----------
+    filename : str
+        Path of the .nii file to create (it cannot be compressed).
+    shape : tuple
+        Shape of the image data.
+    dtype : data type
+        Data type of the image data.
+    affine : 4x4 array, optional
+        Voxel to world transform, saved as both the sform and the qform.
+    header : nibabel header, optional
+        Header to copy the other fields (e.g. voxel sizes, units) from.
+
+    Returns:
+    --------
+    data : np.memmap
+        Data of the image (all zeros), in Fortran order as stored in the
+        file.
+    """
+    if not filename.endswith('.nii'):
+        raise ValueError("Only uncompressed single file NIfTI-1 (.nii) "
+                         "images can be memory-mapped")
+
+    if header is None:
+        hdr = nib.Nifti1Header()
+    else:
+        hdr = nib.Nifti1Header.from_header(header)
+    hdr.set_data_shape(shape)
+    hdr.set_data_dtype(dtype)
+    hdr.set_slope_inter(1, 0)
+    if affine is not None:
+        hdr.set_qform(affine, 'scanner')
+        hdr.set_sform(affine, 'scanner')
+
+    # The data starts after the header and its extensions
+    offset = int(max(hdr.get_data_offset(),
+                     hdr.single_vox_offset + hdr.extensions.get_sizeondisk()))
+    hdr.set_data_offset(offset)
+    dtype = hdr.get_data_dtype()
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    with open(filename, 'wb') as f:
+        hdr.write_to(f)
+        # Allocate the data
+        f.seek(offset + nbytes - 1)
+        f.write(b'\0')
+
+    return np.memmap(filename, dtype=dtype, mode='r+', offset=offset,
+                     shape=tuple(shape), order='F')
@@ -27,6 +27,16 @@ class ReconstModel(object):
     def fit(self, data, mask=None,**kwargs):
         return ReconstFit(self, data)
 
+    @property
+    def fits_voxels_independently(self):
+        """ True if fitting many voxels at once gives the same fit in each
+        voxel as fitting the voxels one at a time
+
+        This is the case of fit methods decorated with `multi_voxel_fit`.
+        Models whose fit handles several voxels at once override it.
+        """
+        return getattr(self.fit, 'fits_voxels_independently', False)
+
 class ReconstFit(object):
     """ Abstract class which holds the fit result of ReconstModel
 
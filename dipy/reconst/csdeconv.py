@@ -2,7 +2,6 @@ from __future__ import division, print_function, absolute_import
 import warnings
 
 import numpy as np
-from scipy.integrate import quad
 from scipy.special import lpn, gamma
 import scipy.linalg as la
 import scipy.linalg.lapack as ll
@@ -370,6 +369,8 @@ def forward_sdt_deconv_mat(ratio, n, r2_term=False):
     .. [1] Descoteaux, M. PhD Thesis. INRIA Sophia-Antipolis. 2008.
 
     """
+    from scipy.integrate import quad
+
     if np.any(n % 2):
         raise ValueError("n has odd degrees, expecting only even degrees")
     n_degrees = n.max() // 2 + 1
@@ -8,11 +8,10 @@ import functools
 
 import numpy as np
 
-import scipy.optimize as opt
-
 from dipy.utils.six.moves import range
+from dipy.utils.optpkg import LazyModule
 from dipy.utils.arrfuncs import pinv, eigh
-from dipy.data import get_sphere
+from dipy.io.image import ImageDataProxy
 from ..core.gradients import gradient_table
 from ..core.geometry import vector_norm
 from ..core.sphere import Sphere
@@ -20,6 +19,8 @@ from .vec_val_sum import vec_val_vect
 from ..core.onetime import auto_attr
 from .base import ReconstModel
 
+opt = LazyModule('scipy.optimize')
+
 
 def _roll_evals(evals, axis=-1):
     """
@@ -765,19 +766,31 @@ class TensorModel(ReconstModel):
             e_s += " positive."
             raise ValueError(e_s)
 
+    @property
+    def fits_voxels_independently(self):
+        """ True if `min_signal` is given, otherwise it defaults to the
+        smallest positive signal of all the voxels being fit """
+        return self.min_signal is not None
+
     def fit(self, data, mask=None):
         """ Fit method of the DTI model class
 
         Parameters
         ----------
-        data : array
-            The measured signal from one voxel.
+        data : array or ImageDataProxy
+            The measured signal from one voxel. The 4D data of an
+            ImageDataProxy is read from the file and fit one slab at a time.
 
         mask : array
             A boolean array used to mark the coordinates in the data that
             should be analyzed that has the shape data.shape[:-1]
 
         """
+        if isinstance(data, ImageDataProxy):
+            if data.ndim == 4:
+                return self._fit_slabs(data, mask)
+            data = np.asarray(data)
+
         if mask is None:
             # Flatten it to 2D either way:
             data_in_mask = np.reshape(data, (-1, data.shape[-1]))
@@ -806,6 +819,29 @@ class TensorModel(ReconstModel):
 
         return TensorFit(self, dti_params)
 
+    def _fit_slabs(self, data, mask):
+        """ Fits the voxels of a 4D ImageDataProxy slab by slab """
+        if mask is not None and mask.shape != data.shape[:-1]:
+            raise ValueError("Mask is not the same shape as data.")
+
+        min_signal = self.min_signal
+        if min_signal is None:
+            # Same as _min_positive_signal, with one slab in memory at a time
+            for _, slab in data.iter_slabs():
+                positive = slab[slab > 0]
+                if positive.size and (min_signal is None or
+                                      positive.min() < min_signal):
+                    min_signal = positive.min()
+            if min_signal is None:
+                min_signal = 0.0001
+
+        dti_params = np.zeros(data.shape[:-1] + (12,))
+        for indices, voxels in data.iter_masked(mask):
+            voxels = np.maximum(voxels, min_signal)
+            dti_params[indices] = self.fit_method(self.design_matrix, voxels,
+                                                  *self.args, **self.kwargs)
+        return TensorFit(self, dti_params)
+
     def predict(self, dti_params, S0=1):
         """
         Predict a signal for this TensorModel class instance given parameters.
@@ -1888,6 +1924,7 @@ def quantize_evecs(evecs, odf_vertices=None):
     """
     max_evecs = evecs[..., :, 0]
     if odf_vertices is None:
+        from dipy.data import get_sphere
         odf_vertices = get_sphere('symmetric362').vertices
     tup = max_evecs.shape[:-1]
     mec = max_evecs.reshape(np.prod(np.array(tup)), 3)
@@ -8,7 +8,7 @@ from warnings import warn
 from dipy.core.gradients import gradient_table
 from ..utils.optpkg import optional_package
 
-cvxopt, have_cvxopt, _ = optional_package("cvxopt")
+cvxopt, have_cvxopt, _ = optional_package("cvxopt", lazy=True)
 
 
 class MapmriModel(ReconstModel):
@@ -3,6 +3,7 @@ import numpy as np
 from numpy.lib.stride_tricks import as_strided
 
 from ..core.ndindex import ndindex
+from ..core.profile import stage, count
 from .quick_squash import quick_squash as _squash
 from .base import ReconstFit
 
@@ -28,10 +29,17 @@ def multi_voxel_fit(single_voxel_fit):
 
         # Fit data where mask is True
         fit_array = np.empty(data.shape[:-1], dtype=object)
-        for ijk in ndindex(data.shape[:-1]):
-            if mask[ijk]:
-                fit_array[ijk] = single_voxel_fit(self, data[ijk])
+        nb_fitted = 0
+        with stage('reconst.multi_voxel_fit'):
+            for ijk in ndindex(data.shape[:-1]):
+                if mask[ijk]:
+                    fit_array[ijk] = single_voxel_fit(self, data[ijk])
+                    nb_fitted += 1
+        count('reconst.voxels_fitted', nb_fitted)
         return MultiVoxelFit(self, fit_array, mask)
+    # Each voxel is fit on its own, so fitting many voxels at once gives the
+    # same fits as fitting them one at a time
+    new_fit.fits_voxels_independently = True
     return new_fit
 
 
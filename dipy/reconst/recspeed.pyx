@@ -10,8 +10,12 @@ cimport cython
 import numpy as np
 cimport numpy as cnp
 
+from cython.parallel import parallel, prange
+
 from libc.stdlib cimport malloc, free
-from libc.string cimport memcpy
+from libc.string cimport memcpy, memset
+
+from dipy.denoise.denspeed import cpu_count
 
 cdef extern from "dpy_math.h" nogil:
     double floor(double x)
@@ -317,8 +321,15 @@ def local_maxima(cnp.ndarray odf, cnp.ndarray edges):
 @cython.boundscheck(False)
 cdef void _cosort(double[::1] A, cnp.npy_intp[::1] B) nogil:
     """Sorts `A` in-place and applies the same reordering to `B`"""
+    if A.shape[0] > 1:
+        _cosort_ptr(&A[0], &B[0], A.shape[0])
+
+
+@cython.profile(False)
+cdef void _cosort_ptr(double *A, cnp.npy_intp *B, size_t n) nogil:
+    """Sorts the `n` values of `A` in-place in descending order and applies
+    the same reordering to `B`"""
     cdef:
-        size_t n = A.shape[0]
         size_t hole
         double insert_A
         long insert_B
@@ -419,6 +430,187 @@ cdef long _compare_neighbors(double[:] odf, cnp.uint16_t[:, :] edges,
     return count
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def peak_directions_batch(odfs, sphere, double relative_peak_threshold=.5,
+                          double min_separation_angle=25,
+                          cnp.npy_intp npeaks=5, num_threads=None):
+    """Get the directions of the odf peaks of many voxels
+
+    Gives, for each odf, the first `npeaks` peaks returned by
+    `dipy.direction.peaks.peak_directions`: the local maxima of the odf are
+    sorted in descending order, the ones lower than
+    ``min + relative_peak_threshold * (max - min)`` are removed (with
+    ``min = max(0, odf.min())``), then the ones closer than
+    `min_separation_angle` to a larger peak. The odfs are processed in
+    parallel.
+
+    Parameters
+    ----------
+    odfs : 2d ndarray
+        The odf function of each voxel (one per row) evaluated on the
+        vertices of `sphere`
+    sphere : Sphere
+        The Sphere providing discrete directions for evaluation.
+    relative_peak_threshold : float in [0., 1.]
+        Only peaks greater than ``min + relative_peak_threshold * scale`` are
+        kept, where ``min = max(0, odf.min())`` and
+        ``scale = odf.max() - min``.
+    min_separation_angle : float in [0, 90]
+        The minimum distance between directions. If two peaks are too close
+        only the larger of the two is returned.
+    npeaks : int
+        Maximum number of peaks returned for each voxel (default 5).
+    num_threads : int
+        Number of threads. If None (default) then all available threads
+        will be used.
+
+    Returns
+    -------
+    directions : (N, npeaks, 3) ndarray
+        The directions of the peaks of each voxel, zeros when there are less
+        than `npeaks` peaks
+    values : (N, npeaks) ndarray
+        peak values, zeros when there are less than `npeaks` peaks
+    indices : (N, npeaks) ndarray
+        peak indices of the directions on the sphere, -1 when there are less
+        than `npeaks` peaks
+    """
+    odfs = np.ascontiguousarray(odfs, dtype=np.float64)
+    if odfs.ndim != 2:
+        raise ValueError("odfs must be a 2D array", odfs.shape)
+    vertices = np.ascontiguousarray(sphere.vertices, dtype=np.float64)
+    edges = np.ascontiguousarray(sphere.edges, dtype=np.uint16)
+    if odfs.shape[1] != vertices.shape[0]:
+        raise ValueError("odfs must have one value per vertex of sphere")
+    if vertices.shape[0] >= 2**16:
+        raise ValueError("too many vertices")
+    if edges.size and edges.max() >= vertices.shape[0]:
+        raise IndexError("Values in edges must be < len(odf)")
+
+    cdef:
+        cnp.npy_intp i
+        cnp.npy_intp n = odfs.shape[0]
+        cnp.npy_intp nverts = odfs.shape[1]
+        double cos_similarity = cos(DPY_PI/180 * min_separation_angle)
+        double[:, ::1] odfs_view = odfs
+        double[:, ::1] vertices_view = vertices
+        cnp.uint16_t[:, ::1] edges_view = edges
+        double[:, ::1] values_view
+        cnp.npy_intp[:, ::1] indices_view
+        cnp.uint8_t[::1] nan_view
+        cnp.npy_intp *wpeak
+        double *pvalues
+        int threads_to_use = cpu_count()
+
+    if num_threads is not None:
+        threads_to_use = num_threads
+
+    values = np.zeros((n, npeaks))
+    indices = np.empty((n, npeaks), dtype=np.intp)
+    indices.fill(-1)
+    has_nan = np.zeros(n, dtype=np.uint8)
+    values_view = values
+    indices_view = indices
+    nan_view = has_nan
+
+    if npeaks > 0:
+        with nogil, parallel(num_threads=threads_to_use):
+            wpeak = <cnp.npy_intp *> malloc(nverts * sizeof(cnp.npy_intp))
+            pvalues = <double *> malloc(nverts * sizeof(double))
+            for i in prange(n, schedule='guided'):
+                nan_view[i] = _voxel_peaks(odfs_view, i, edges_view,
+                                           vertices_view,
+                                           relative_peak_threshold,
+                                           cos_similarity, wpeak, pvalues,
+                                           values_view, indices_view)
+            free(wpeak)
+            free(pvalues)
+
+    if has_nan.any():
+        raise ValueError("odf can not have nans")
+
+    directions = vertices[indices]
+    directions[indices < 0] = 0
+    return directions, values, indices
+
+
+@cython.profile(False)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _voxel_peaks(double[:, ::1] odfs, cnp.npy_intp i,
+                      cnp.uint16_t[:, ::1] edges, double[:, ::1] vertices,
+                      double relative_peak_threshold, double cos_similarity,
+                      cnp.npy_intp *wpeak, double *pvalues,
+                      double[:, ::1] out_values,
+                      cnp.npy_intp[:, ::1] out_indices) nogil:
+    """Writes the peaks of the odf `i` in row `i` of the outputs
+
+    `wpeak` and `pvalues` must hold one value per vertex. Returns 1 if the
+    odf has nans, 0 otherwise.
+    """
+    cdef:
+        cnp.npy_intp nverts = odfs.shape[1]
+        cnp.npy_intp npeaks = out_values.shape[1]
+        cnp.npy_intp j, k, count, n, nunique, ind
+        double odf_min, threshold, a, b, c, sim
+        bint similar
+
+    memset(wpeak, 0, nverts * sizeof(cnp.npy_intp))
+    count = _compare_neighbors(odfs[i], edges, wpeak)
+    if count == -2:
+        return 1
+
+    for k in range(count):
+        pvalues[k] = odfs[i, wpeak[k]]
+    _cosort_ptr(pvalues, wpeak, count)
+
+    # If there is only one peak return
+    if count == 0 or pvalues[0] < 0.:
+        return 0
+    elif count == 1:
+        out_values[i, 0] = pvalues[0]
+        out_indices[i, 0] = wpeak[0]
+        return 0
+
+    odf_min = odfs[i, 0]
+    for k in range(1, nverts):
+        if odfs[i, k] < odf_min:
+            odf_min = odfs[i, k]
+    if not odf_min >= 0.:
+        odf_min = 0.
+
+    # Remove small peaks
+    threshold = relative_peak_threshold * (pvalues[0] - odf_min)
+    n = 0
+    while n < count and pvalues[n] - odf_min >= threshold:
+        n += 1
+
+    # Remove peaks too close together, stop after npeaks peaks
+    nunique = 0
+    for k in range(n):
+        if nunique == npeaks:
+            break
+        a = vertices[wpeak[k], 0]
+        b = vertices[wpeak[k], 1]
+        c = vertices[wpeak[k], 2]
+        similar = 0
+        for j in range(nunique):
+            ind = out_indices[i, j]
+            sim = fabs(a * vertices[ind, 0] +
+                       b * vertices[ind, 1] +
+                       c * vertices[ind, 2])
+            if sim > cos_similarity:
+                similar = 1
+                break
+        if not similar:
+            out_values[i, nunique] = pvalues[k]
+            out_indices[i, nunique] = wpeak[k]
+            nunique += 1
+    return 0
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def le_to_odf(cnp.ndarray[double, ndim=1] odf, \
@@ -35,7 +35,7 @@ from dipy.reconst.base import ReconstModel, ReconstFit
 from dipy.reconst.cache import Cache
 from dipy.core.onetime import auto_attr
 
-lm, has_sklearn, _ = optional_package('sklearn.linear_model')
+lm, has_sklearn, _ = optional_package('sklearn.linear_model', lazy=True)
 
 # If sklearn is unavailable, we can fall back on nnls (but we also warn the
 # user that we are about to do that):
@@ -33,12 +33,12 @@ from dipy.reconst.odf import OdfModel, OdfFit
 from dipy.core.geometry import cart2sphere
 from dipy.core.onetime import auto_attr
 from dipy.reconst.cache import Cache
+from dipy.utils.optpkg import parse_version
 
-from distutils.version import LooseVersion
 import scipy
 from scipy.special import lpn, lpmv, gammaln
 
-if LooseVersion(scipy.version.short_version) >= LooseVersion('0.15.0'):
+if parse_version(scipy.version.short_version) >= (0, 15, 0):
     SCIPY_15_PLUS = True
     import scipy.special as sps
 else:
@@ -362,7 +362,7 @@ def sph_harm_ind_list(sh_order):
     n_range = np.arange(0, sh_order + 1, 2, dtype=int)
     n_list = np.repeat(n_range, n_range * 2 + 1)
 
-    ncoef = (sh_order + 2) * (sh_order + 1) / 2
+    ncoef = (sh_order + 2) * (sh_order + 1) // 2
     offset = 0
     m_list = empty(ncoef, 'int')
     for ii in n_range:
@@ -491,6 +491,9 @@ class SphHarmModel(OdfModel, Cache):
 
 class QballBaseModel(SphHarmModel):
     """To be subclassed by Qball type models."""
+    # The coefficients of each voxel only depend on its own signal
+    fits_voxels_independently = True
+
     def __init__(self, gtab, sh_order, smooth=0.006, min_signal=1.,
                  assume_normed=False):
         """Creates a model that can be used to fit or sample diffusion data
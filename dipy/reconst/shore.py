@@ -14,7 +14,7 @@ from ..core.geometry import cart2sphere
 
 from ..utils.optpkg import optional_package
 
-cvxopt, have_cvxopt, _ = optional_package("cvxopt")
+cvxopt, have_cvxopt, _ = optional_package("cvxopt", lazy=True)
 if have_cvxopt:
     import cvxopt.solvers
 
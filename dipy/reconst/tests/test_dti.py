@@ -22,6 +22,7 @@ from dipy.reconst.dti import (axial_diffusivity, color_fa,
                               sphericity)
 
 from dipy.io.bvectxt import read_bvec_file
+from dipy.io.image import ImageDataProxy
 from dipy.data import get_data, dsi_voxels, get_sphere
 
 from dipy.core.subdivide_octahedron import create_unit_sphere
@@ -481,6 +482,21 @@ def test_mask():
     assert_almost_equal(dtifit_w_mask.fa[0, 0, 0], dtifit.fa[0, 0, 0])
 
 
+def test_fit_image_data_proxy():
+    fimg, fbvals, fbvecs = get_data('small_64D')
+    img = nib.load(fimg)
+    data = img.get_data()
+    gtab = grad.gradient_table(np.load(fbvals), np.load(fbvecs))
+    mask = data[..., 0] > data[..., 0].mean()
+    proxy = ImageDataProxy(img)
+    for fit_method in ['WLS', 'LS']:
+        dm = dti.TensorModel(gtab, fit_method)
+        for m in [None, mask]:
+            assert_array_equal(dm.fit(proxy, m).model_params,
+                               dm.fit(data, m).model_params)
+    assert_raises(ValueError, dm.fit, proxy, mask[0])
+
+
 def test_nnls_jacobian_fucn():
     b0 = 1000.
     bvecs, bval = read_bvec_file(get_data('55dir_grad.bvec'))
@@ -0,0 +1,71 @@
+""" Benchmarks for the distance matrices of streamlines
+
+Run all benchmarks with::
+
+    import dipy.segment as dipysegment
+    dipysegment.bench()
+
+If you have doctests enabled by default in nose (with a noserc file or
+environment variable), and you have a numpy version <= 1.6.1, this will
+also run the doctests, let's hope they pass.
+
+Run this benchmark with:
+
+    nosetests -s --match '(?:^|[\\b_\\.//-])[Bb]ench' bench_metric.py
+"""
+import numpy as np
+import nibabel as nib
+
+from dipy.data import get_data
+
+import dipy.tracking.streamline as streamline_utils
+from dipy.segment.metric import (MinimumAverageDirectFlipMetric,
+                                 distance_matrix,
+                                 distance_matrix_sparse,
+                                 nearest_neighbors)
+from dipy.tracking.distances import bundles_distances_mdf
+from nose.tools import assert_equal
+from numpy.testing import assert_array_almost_equal, measure
+
+
+def bench_distance_matrix(nb_streamlines=5000):
+    dtype = "float32"
+    nb_points = 12
+    threshold = 5.
+    rng = np.random.RandomState(1234)
+
+    streams, hdr = nib.trackvis.read(get_data('fornix'))
+    fornix = [s[0].astype(dtype) for s in streams]
+    fornix = streamline_utils.set_number_of_points(fornix, nb_points)
+
+    # Randomly shifted copies of the fornix
+    nb_copies = int(np.ceil(nb_streamlines / float(len(fornix))))
+    shifts = rng.uniform(-40, 40, size=(nb_copies, 3)).astype(dtype)
+    streamlines = [s + shift for shift in shifts for s in fornix]
+    streamlines = streamlines[:nb_streamlines]
+
+    metric = MinimumAverageDirectFlipMetric()
+    print("Timing MDF distances of {0} streamlines".format(len(streamlines)))
+
+    old_time = measure("D1 = bundles_distances_mdf(streamlines, streamlines)",
+                       1)
+    print("bundles_distances_mdf time: {0:.4}sec".format(old_time))
+    dense_time = measure("D2 = distance_matrix(metric, streamlines)", 1)
+    print("distance_matrix time: {0:.4}sec".format(dense_time))
+    print("Speed up of {0}x".format(old_time/dense_time))
+
+    sparse_time = measure("distance_matrix_sparse(metric, streamlines, "
+                          "threshold=threshold)", 1)
+    print("distance_matrix_sparse time: {0:.4}sec".format(sparse_time))
+    print("Speed up of {0}x".format(old_time/sparse_time))
+
+    knn_time = measure("nearest_neighbors(metric, streamlines, k=10)", 1)
+    print("nearest_neighbors time: {0:.4}sec".format(knn_time))
+    print("Speed up of {0}x".format(old_time/knn_time))
+
+    D1 = bundles_distances_mdf(streamlines, streamlines)
+    D2 = distance_matrix(metric, streamlines)
+    assert_array_almost_equal(D1, D2, decimal=4)
+    rows, cols, distances = distance_matrix_sparse(metric, streamlines,
+                                                   threshold=threshold)
+    assert_equal(len(rows), np.sum(D2 <= threshold))
@@ -19,9 +19,10 @@ import nibabel as nib
 from dipy.data import get_data
 
 import dipy.tracking.streamline as streamline_utils
-from dipy.segment.metric import Metric
+from dipy.segment.metric import Metric, AveragePointwiseEuclideanMetric
 from dipy.segment.quickbundles import QuickBundles as QB_Old
 from dipy.segment.clustering import QuickBundles as QB_New
+from dipy.segment.clustering_algorithms import quickbundles
 from nose.tools import assert_equal
 
 from dipy.testing import assert_arrays_equal
@@ -93,3 +94,40 @@ def bench_quickbundles():
     assert_equal(len(clusters), expected_nb_clusters)
     assert_array_equal(sizes3, sizes1)
     assert_arrays_equal(indices3, indices1)
+
+
+def bench_quickbundles_pruning(nb_streamlines=int(1e6)):
+    dtype = "float32"
+    nb_points = 12
+    threshold = 10.
+    rng = np.random.RandomState(1234)
+
+    streams, hdr = nib.trackvis.read(get_data('fornix'))
+    fornix = [s[0].astype(dtype) for s in streams]
+    fornix = streamline_utils.set_number_of_points(fornix, nb_points)
+
+    # Randomly shifted copies of the fornix spread over a whole-brain sized
+    # volume, so that many clusters are created.
+    nb_copies = int(np.ceil(nb_streamlines / float(len(fornix))))
+    shifts = rng.uniform(-80, 80, size=(nb_copies, 3)).astype(dtype)
+    streamlines = [s + shift for shift in shifts for s in fornix]
+    streamlines = streamlines[:nb_streamlines]
+
+    metric = AveragePointwiseEuclideanMetric()
+    print("Timing QuickBundles with and without centroid pruning "
+          "({0} streamlines)".format(len(streamlines)))
+
+    exhaustive_time = measure("exhaustive = quickbundles(streamlines, metric, "
+                              "threshold, prune=False)", 1)
+    print("Exhaustive search time: {0:.4}sec".format(exhaustive_time))
+    pruning_time = measure("pruned = quickbundles(streamlines, metric, "
+                           "threshold)", 1)
+    print("Pruned search time: {0:.4}sec".format(pruning_time))
+    print("Speed up of {0}x".format(exhaustive_time/pruning_time))
+
+    exhaustive = quickbundles(streamlines, metric, threshold, prune=False)
+    pruned = quickbundles(streamlines, metric, threshold)
+    print("Number of clusters: {0}".format(len(pruned)))
+    assert_equal(len(pruned), len(exhaustive))
+    assert_arrays_equal(map(lambda c: c.indices, pruned),
+                        map(lambda c: c.indices, exhaustive))
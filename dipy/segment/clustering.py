@@ -3,6 +3,7 @@ import numpy as np
 
 from abc import ABCMeta, abstractmethod
 
+from dipy.core.profile import timed, count
 from dipy.segment.metric import Metric
 from dipy.segment.metric import ResampleFeature
 from dipy.segment.metric import AveragePointwiseEuclideanMetric
@@ -86,7 +87,8 @@ class Cluster(object):
         return "Cluster(" + str(self) + ")"
 
     def __eq__(self, other):
-        return isinstance(other, Cluster) and self.indices == other.indices
+        return (isinstance(other, Cluster) and
+                np.array_equal(self.indices, other.indices))
 
     def __ne__(self, other):
         return not self == other
@@ -102,6 +104,10 @@ class Cluster(object):
         *indices : list of indices
             Indices to add to this cluster.
         """
+        if isinstance(self.indices, np.ndarray):
+            # Indices viewed from an array (e.g. of a compact cluster map)
+            # are copied once to a list, which then grows in place.
+            self.indices = self.indices.tolist()
         self.indices += indices
 
 
@@ -386,6 +392,261 @@ class ClusterMapCentroid(ClusterMap):
         return [cluster.centroid for cluster in self.clusters]
 
 
+class CompactClusterMapCentroid(ClusterMapCentroid):
+    """ Provides functionalities for interacting with clustering outputs
+    that have centroids, stored in a few arrays.
+
+    The indices of all clusters are stored in a single int32 array, one
+    cluster after the other (CSR format), i.e. the indices of the i-th
+    cluster are ``indices[offsets[i]:offsets[i+1]]``, and the centroids are
+    stacked in a single array. Sizes filtering, comparison with an integer
+    and serialization are vectorized. `ClusterCentroid` objects are only
+    created, as views, when clusters are accessed; modifying them does not
+    modify the cluster map.
+
+    Parameters
+    ----------
+    indices : 1D array (int32), optional
+        Indices of the elements of every cluster, one cluster after the other.
+    offsets : 1D array (int64), optional
+        Position in `indices` where each cluster starts, followed by the
+        length of `indices` (size: number of clusters + 1).
+    centroids : ndarray, optional
+        Centroids of the clusters stacked along the first axis.
+    refdata : list, optional
+        Actual elements that clustered indices refer to.
+    """
+    def __init__(self, indices=None, offsets=None, centroids=None,
+                 refdata=Identity()):
+        self._indices = np.asarray(indices if indices is not None else [],
+                                   dtype=np.int32)
+        self._offsets = np.asarray(offsets if offsets is not None else [0],
+                                   dtype=np.int64)
+        if centroids is None:
+            centroids = np.zeros((len(self._offsets) - 1, 0), np.float32)
+        self._centroids = np.asarray(centroids)
+
+        if self._offsets[0] != 0 or self._offsets[-1] != len(self._indices):
+            raise ValueError("'offsets' must start at 0 and end at the "
+                             "length of 'indices'.")
+        if len(self._centroids) != len(self._offsets) - 1:
+            raise ValueError("There must be one centroid per cluster.")
+
+        self.refdata = refdata
+
+    @classmethod
+    def from_cluster_map(cls, cluster_map):
+        """ Creates a compact copy of a `ClusterMapCentroid` object. """
+        sizes = cluster_map.clusters_sizes()
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes)
+        indices = np.zeros(offsets[-1], dtype=np.int32)
+        for cluster, start, end in zip(cluster_map, offsets[:-1], offsets[1:]):
+            indices[start:end] = cluster.indices
+        centroids = np.array(cluster_map.centroids)
+        return cls(indices, offsets, centroids, refdata=cluster_map.refdata)
+
+    @classmethod
+    def load(cls, filename, refdata=None):
+        """ Loads a cluster map saved with `save`.
+
+        Parameters
+        ----------
+        filename : str
+            File (.npz) the cluster map was saved to.
+        refdata : list, optional
+            Actual elements that clustered indices refer to.
+        """
+        with np.load(filename) as f:
+            return cls(f['indices'], f['offsets'], f['centroids'],
+                       refdata=refdata)
+
+    def save(self, filename):
+        """ Saves this cluster map (without `refdata`) in a .npz file. """
+        np.savez(filename, indices=self._indices, offsets=self._offsets,
+                 centroids=self._centroids)
+
+    @property
+    def refdata(self):
+        return self._refdata
+
+    @refdata.setter
+    def refdata(self, value):
+        if value is None:
+            value = Identity()
+
+        self._refdata = value
+
+    @property
+    def indices(self):
+        """ Indices of every cluster, one cluster after the other. """
+        return self._indices
+
+    @property
+    def offsets(self):
+        """ Position in `indices` where each cluster starts. """
+        return self._offsets
+
+    @property
+    def centroids_array(self):
+        """ Centroids of the clusters stacked along the first axis. """
+        return self._centroids
+
+    @property
+    def centroids(self):
+        return list(self._centroids)
+
+    @property
+    def clusters(self):
+        return [self._cluster(i) for i in range(len(self))]
+
+    def _cluster(self, i):
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return ClusterCentroid(self._centroids[i], id=i,
+                               indices=self._indices[start:end],
+                               refdata=self.refdata)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        """ Gets cluster(s) through indexing.
+
+        Parameters
+        ----------
+        idx : int, slice, list or boolean array
+            Index of the element(s) to get.
+
+        Returns
+        -------
+        `ClusterCentroid` object(s)
+            When `idx` is a int, returns a single `ClusterCentroid` object.
+
+            When `idx`is either a slice, list or boolean array, returns
+            a list of `ClusterCentroid` objects.
+        """
+        if isinstance(idx, np.ndarray) and idx.dtype == np.bool_:
+            return [self._cluster(i) for i in np.flatnonzero(idx)]
+        elif type(idx) is slice:
+            return [self._cluster(i) for i in range(*idx.indices(len(self)))]
+        elif type(idx) is list:
+            return [self[i] for i in idx]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("Cluster index out of range")
+
+        return self._cluster(idx)
+
+    def __iter__(self):
+        return (self._cluster(i) for i in range(len(self)))
+
+    def __repr__(self):
+        return "CompactClusterMapCentroid(" + str(self) + ")"
+
+    def _richcmp(self, other, op):
+        if isinstance(other, (int, np.integer)):
+            return op(self.clusters_sizes(), other)
+
+        return super(CompactClusterMapCentroid, self)._richcmp(other, op)
+
+    def _select(self, keep):
+        """ Keeps only the clusters for which `keep` is True. """
+        sizes = self.clusters_sizes()
+        self._indices = self._indices[np.repeat(keep, sizes)]
+        offsets = np.zeros(np.sum(keep) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes[keep])
+        self._offsets = offsets
+        self._centroids = self._centroids[keep]
+
+    def add_cluster(self, *clusters):
+        """ Adds one or multiple clusters to this cluster map.
+
+        Parameters
+        ----------
+        *clusters : `ClusterCentroid` object, ...
+            Cluster(s) to be added in this cluster map.
+        """
+        if len(clusters) == 0:
+            return
+
+        sizes = [len(cluster) for cluster in clusters]
+        centroids = np.array([cluster.centroid for cluster in clusters])
+        if len(self) == 0:
+            self._centroids = centroids
+        else:
+            self._centroids = np.concatenate([self._centroids, centroids])
+
+        indices = [np.asarray(cluster.indices, dtype=np.int32).ravel()
+                   for cluster in clusters]
+        self._indices = np.concatenate([self._indices] + indices)
+        self._offsets = np.concatenate(
+            [self._offsets, self._offsets[-1] + np.cumsum(sizes)])
+
+    def remove_cluster(self, *clusters):
+        """ Remove one or multiple clusters from this cluster map.
+
+        Parameters
+        ----------
+        *clusters : `ClusterCentroid` object, ...
+            Cluster(s) to be removed from this cluster map.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        for cluster in clusters:
+            for i in np.flatnonzero(keep):
+                if self._cluster(i) == cluster:
+                    keep[i] = False
+                    break
+            else:
+                raise ValueError("Cluster is not in this cluster map.")
+
+        self._select(keep)
+
+    def clear(self):
+        """ Remove all clusters from this cluster map. """
+        self._select(np.zeros(len(self), dtype=bool))
+
+    def clusters_sizes(self):
+        """ Gets the size of every cluster contained in this cluster map.
+
+        Returns
+        -------
+        1D array (int)
+            Sizes of every cluster in this cluster map.
+        """
+        return np.diff(self._offsets)
+
+    def get_labels(self, nb_data=None):
+        """ Gets the cluster label of every clustered element.
+
+        Parameters
+        ----------
+        nb_data : int, optional
+            Number of elements. By default, it is the length of `refdata`
+            if provided, otherwise the largest clustered index + 1.
+
+        Returns
+        -------
+        1D array (int32)
+            Label (i.e. position in this cluster map) of the cluster
+            containing each element, or -1 if it does not belong to any
+            cluster. An element in several clusters gets the last label.
+        """
+        if nb_data is None:
+            if not isinstance(self.refdata, Identity):
+                nb_data = len(self.refdata)
+            elif len(self._indices) > 0:
+                nb_data = self._indices.max() + 1
+            else:
+                nb_data = 0
+
+        labels = -np.ones(nb_data, dtype=np.int32)
+        labels[self._indices] = np.repeat(np.arange(len(self), dtype=np.int32),
+                                          self.clusters_sizes())
+        return labels
+
+
 class Clustering(object):
     __metaclass__ = ABCMeta
 
@@ -419,7 +680,10 @@ class QuickBundles(Clustering):
     $N$ is the number of streamlines and $k$ is the final number of bundles.
     If for a given streamline its closest bundle is farther than `threshold`,
     a new bundle is created and the streamline is assigned to it except if the
-    number of bundles has already exceeded `max_nb_clusters`.
+    number of bundles has already exceeded `max_nb_clusters`. With the
+    pointwise Euclidean metrics (such as the default MDF), a cheap lower bound
+    on the distance is used to skip most of the $k$ comparisons, without
+    changing the result.
 
     Parameters
     ----------
@@ -433,6 +697,18 @@ class QuickBundles(Clustering):
         12 points.
     max_nb_clusters : int
         Limits the creation of bundles.
+    num_threads : int or None, optional
+        If 1 (default), the sequential QuickBundles algorithm is used. Otherwise
+        the streamlines are clustered in parallel by that many threads (all
+        available cores if None) by partitioning them into shards, clustering
+        each shard, clustering the shards' centroids and reassigning every
+        streamline to its nearest resulting centroid (see
+        `dipy.segment.clustering_algorithms.quickbundles_parallel` for how
+        the result relates to the sequential one).
+    compact : bool, optional
+        If True, the result is a `CompactClusterMapCentroid` object, which
+        stores the clusters in arrays rather than in Python objects (useful
+        for large number of streamlines or clusters). (Default: False)
 
     Examples
     --------
@@ -471,9 +747,12 @@ class QuickBundles(Clustering):
     """
 
     def __init__(self, threshold, metric="MDF_12points",
-                 max_nb_clusters=np.iinfo('i4').max):
+                 max_nb_clusters=np.iinfo('i4').max, num_threads=1,
+                 compact=False):
         self.threshold = threshold
         self.max_nb_clusters = max_nb_clusters
+        self.num_threads = num_threads
+        self.compact = compact
 
         if isinstance(metric, Metric):
             self.metric = metric
@@ -483,6 +762,7 @@ class QuickBundles(Clustering):
         else:
             raise ValueError("Unknown metric: {0}".format(metric))
 
+    @timed('segment.quickbundles')
     def cluster(self, streamlines, ordering=None):
         """ Clusters `streamlines` into bundles.
 
@@ -500,11 +780,61 @@ class QuickBundles(Clustering):
         `ClusterMapCentroid` object
             Result of the clustering.
         """
-        from dipy.segment.clustering_algorithms import quickbundles
-        cluster_map = quickbundles(streamlines, self.metric,
-                                   threshold=self.threshold,
-                                   max_nb_clusters=self.max_nb_clusters,
-                                   ordering=ordering)
+        from dipy.segment.clustering_algorithms import (quickbundles,
+                                                        quickbundles_parallel)
+        if self.num_threads == 1:
+            cluster_map = quickbundles(streamlines, self.metric,
+                                       threshold=self.threshold,
+                                       max_nb_clusters=self.max_nb_clusters,
+                                       ordering=ordering,
+                                       compact=self.compact)
+        else:
+            cluster_map = quickbundles_parallel(
+                streamlines, self.metric, threshold=self.threshold,
+                max_nb_clusters=self.max_nb_clusters, ordering=ordering,
+                num_threads=self.num_threads)
+            if self.compact:
+                cluster_map = CompactClusterMapCentroid.from_cluster_map(
+                    cluster_map)
+
+        cluster_map.refdata = streamlines
+        count('segment.streamlines_clustered', len(streamlines))
+        count('segment.clusters', len(cluster_map))
+        return cluster_map
+
+    def cluster_file(self, filename):
+        """ Clusters the streamlines of a file without loading them in memory.
+
+        Streamlines are read one at a time from a TrackVis (.trk) file,
+        which is memory-mapped (see `dipy.io.streamline.load_trk`), or from a
+        Dpy (.dpy) file. Only the centroids and the indices of the bundles'
+        members are kept in memory; the streamlines of a bundle are read
+        from the file when accessed.
+
+        Parameters
+        ----------
+        filename : str
+            TrackVis (.trk) or Dpy (.dpy) file.
+
+        Returns
+        -------
+        `CompactClusterMapCentroid` object
+            Result of the clustering. Its `refdata` is a lazy sequence of the
+            streamlines of the file.
+        """
+        from dipy.segment.clustering_algorithms import quickbundles_streaming
+        if filename.endswith('.trk'):
+            from dipy.io.streamline import load_trk
+            streamlines, _ = load_trk(filename)
+        elif filename.endswith('.dpy'):
+            from dipy.io.dpy import DpyStreamlines
+            streamlines = DpyStreamlines(filename)
+        else:
+            raise ValueError("Unknown streamlines file format: "
+                             "{0}".format(filename))
 
+        cluster_map = quickbundles_streaming(
+            streamlines, self.metric, threshold=self.threshold,
+            max_nb_clusters=self.max_nb_clusters)
         cluster_map.refdata = streamlines
         return cluster_map
@@ -2,12 +2,17 @@
 # cython: wraparound=False, cdivision=True, boundscheck=False
 
 import itertools
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
+cimport numpy as cnp
 
 from cythonutils cimport Data2D, shape2tuple
 from metricspeed cimport Metric
-from clusteringspeed cimport ClustersCentroid, Centroid, QuickBundles
-from dipy.segment.clustering import ClusterMapCentroid, ClusterCentroid
+from clusteringspeed cimport ClustersCentroid, Centroid, QuickBundles, NearestCluster
+from dipy.segment.clustering import (ClusterMapCentroid, ClusterCentroid,
+                                     CompactClusterMapCentroid)
 
 cdef extern from "stdlib.h" nogil:
     ctypedef unsigned long size_t
@@ -22,7 +27,7 @@ DEF BIGGEST_FLOAT = 3.4028235e+38  # np.finfo('f4').max
 DEF BIGGEST_INT = 2147483647  # np.iinfo('i4').max
 
 
-def clusters_centroid2clustermap_centroid(ClustersCentroid clusters_list):
+def clusters_centroid2clustermap_centroid(ClustersCentroid clusters_list, compact=False):
     """ Converts a `ClustersCentroid` object (Cython) to a `ClusterMapCentroid`
     object (Python).
 
@@ -34,12 +39,32 @@ def clusters_centroid2clustermap_centroid(ClustersCentroid clusters_list):
     ----------
     clusters_list : `ClustersCentroid` object
         Result of the clustering contained in a Cython's object.
+    compact : bool, optional
+        If True, returns a `CompactClusterMapCentroid` object storing the
+        indices and the centroids of all clusters in arrays. (Default: False)
 
     Returns
     -------
     `ClusterMapCentroid` object
         Result of the clustering contained in a Python's object.
     """
+    cdef int i
+    cdef cnp.npy_intp[:] offsets
+
+    if compact:
+        offsets = np.zeros(clusters_list._nb_clusters + 1, dtype=np.intp)
+        for i in range(clusters_list._nb_clusters):
+            offsets[i + 1] = offsets[i] + clusters_list.clusters_size[i]
+
+        indices = np.zeros(offsets[clusters_list._nb_clusters], dtype=np.int32)
+        centroids = np.zeros((clusters_list._nb_clusters,) + shape2tuple(clusters_list._centroid_shape), dtype=DTYPE)
+        for i in range(clusters_list._nb_clusters):
+            if clusters_list.clusters_size[i] > 0:
+                indices[offsets[i]:offsets[i + 1]] = <int[:clusters_list.clusters_size[i]]> clusters_list.clusters_indices[i]
+            centroids[i] = clusters_list.centroids[i].features
+
+        return CompactClusterMapCentroid(indices, np.asarray(offsets), centroids)
+
     clusters = ClusterMapCentroid()
     for i in range(clusters_list._nb_clusters):
         centroid = np.asarray(clusters_list.centroids[i].features)
@@ -57,7 +82,7 @@ def peek(iterable):
     return first, iterator
 
 
-def quickbundles(streamlines, Metric metric, double threshold, long max_nb_clusters=BIGGEST_INT, ordering=None):
+def quickbundles(streamlines, Metric metric, double threshold, long max_nb_clusters=BIGGEST_INT, ordering=None, prune=True, compact=False):
     """ Clusters streamlines using QuickBundles.
 
     Parameters
@@ -73,6 +98,14 @@ def quickbundles(streamlines, Metric metric, double threshold, long max_nb_clust
         Limits the creation of bundles. (Default: inf)
     ordering : iterable of indices, optional
         Iterate through `data` using the given ordering.
+    prune : bool, optional
+        Skip the clusters that a lower bound on the distance proves to be
+        farther than the nearest one found so far (only supported by the
+        pointwise Euclidean metrics). It does not change the result.
+        (Default: True)
+    compact : bool, optional
+        If True, returns a `CompactClusterMapCentroid` object, which stores
+        the clusters in arrays instead of Python objects. (Default: False)
 
     Returns
     -------
@@ -96,10 +129,10 @@ def quickbundles(streamlines, Metric metric, double threshold, long max_nb_clust
     # Check if `ordering` or `streamlines` are empty
     first_idx, ordering = peek(ordering)
     if first_idx is None or len(streamlines) == 0:
-        return ClusterMapCentroid()
+        return CompactClusterMapCentroid() if compact else ClusterMapCentroid()
 
     features_shape = shape2tuple(metric.feature.c_infer_shape(streamlines[first_idx].astype(DTYPE)))
-    cdef QuickBundles qb = QuickBundles(features_shape, metric, threshold, max_nb_clusters)
+    cdef QuickBundles qb = QuickBundles(features_shape, metric, threshold, max_nb_clusters, prune)
     cdef int idx
 
     for idx in ordering:
@@ -112,4 +145,272 @@ def quickbundles(streamlines, Metric metric, double threshold, long max_nb_clust
         # of after all streamlines have been assigned like k-means algorithm.
         qb.update_step(cluster_id)
 
-    return clusters_centroid2clustermap_centroid(qb.clusters)
+    return clusters_centroid2clustermap_centroid(qb.clusters, compact)
+
+
+def quickbundles_streaming(streamlines, Metric metric, double threshold, long max_nb_clusters=BIGGEST_INT):
+    """ Clusters streamlines using QuickBundles, reading them one at a time.
+
+    The result is the same as `quickbundles` without `ordering`, but
+    `streamlines` can be any iterable, e.g. a generator reading them from
+    disk. Only the centroids and the indices of the clusters' members are
+    kept in memory.
+
+    Parameters
+    ----------
+    streamlines : iterable of 2D arrays
+        Streamlines to cluster.
+    metric : `Metric` object
+        Tells how to compute the distance between two streamlines.
+    threshold : double
+        The maximum distance from a cluster for a streamline to be still
+        considered as part of it.
+    max_nb_clusters : int, optional
+        Limits the creation of bundles. (Default: inf)
+
+    Returns
+    -------
+    `CompactClusterMapCentroid` object
+        Result of the clustering. The indices refer to the position of the
+        streamlines in the iteration.
+    """
+    cdef QuickBundles qb = None
+    cdef int idx = 0
+    cdef int cluster_id
+
+    # Threshold of np.inf is not supported, set it to 'biggest_double'
+    threshold = min(threshold, BIGGEST_DOUBLE)
+    # Threshold of -np.inf is not supported, set it to 0
+    threshold = max(threshold, 0)
+
+    for streamline in streamlines:
+        if not streamline.flags.writeable or streamline.dtype != DTYPE:
+            streamline = streamline.astype(DTYPE)
+
+        if qb is None:
+            features_shape = shape2tuple(metric.feature.c_infer_shape(streamline))
+            qb = QuickBundles(features_shape, metric, threshold, max_nb_clusters)
+
+        cluster_id = qb.assignment_step(streamline, idx)
+        qb.update_step(cluster_id)
+        idx += 1
+
+    if qb is None:
+        return CompactClusterMapCentroid()
+
+    return clusters_centroid2clustermap_centroid(qb.clusters, compact=True)
+
+
+def _quickbundles_shard(QuickBundles qb, Data2D points, cnp.npy_intp[:] offsets, int[:] indices):
+    """ Runs QuickBundles on streamlines stored contiguously, without the GIL.
+
+    Parameters
+    ----------
+    qb : `QuickBundles` object
+        QuickBundles state the streamlines are clustered into.
+    points : 2D array
+        Points of all the streamlines, one after the other.
+    offsets : 1D array
+        Streamline `i` is made of `points[offsets[i]:offsets[i+1]]`.
+    indices : 1D array
+        Index of each streamline in the original data.
+    """
+    cdef cnp.npy_intp i
+    cdef int cluster_id
+
+    with nogil:
+        for i in range(indices.shape[0]):
+            cluster_id = qb.assignment_step(points[offsets[i]:offsets[i+1]], indices[i])
+            qb.update_step(cluster_id)
+
+
+def _reassign_shard(QuickBundles qb, Data2D points, cnp.npy_intp[:] offsets, int[:] labels, double[:, :] sums, int[:] sizes):
+    """ Assigns each streamline to its nearest centroid, without the GIL.
+
+    Parameters
+    ----------
+    qb : `QuickBundles` object
+        QuickBundles state whose clusters hold the reference centroids.
+    points : 2D array
+        Points of all the streamlines, one after the other.
+    offsets : 1D array
+        Streamline `i` is made of `points[offsets[i]:offsets[i+1]]`.
+    labels : 1D array
+        Receives the index of the nearest centroid of each streamline.
+    sums : 2D array
+        Accumulates the (flattened) features of the streamlines assigned to
+        each centroid, in the orientation closest to it.
+    sizes : 1D array
+        Accumulates the number of streamlines assigned to each centroid.
+    """
+    cdef:
+        cnp.npy_intp i, n, d
+        cnp.npy_intp N = qb.features.shape[0], D = qb.features.shape[1]
+        NearestCluster nearest_cluster, nearest_cluster_flip
+        Data2D features_to_add
+
+    with nogil:
+        for i in range(labels.shape[0]):
+            features_to_add = qb.features
+            qb.metric.feature.c_extract(points[offsets[i]:offsets[i+1]], qb.features)
+            nearest_cluster = qb.find_nearest_cluster(qb.features)
+
+            if not qb.metric.feature.is_order_invariant:
+                qb.metric.feature.c_extract(points[offsets[i]:offsets[i+1]][::-1], qb.features_flip)
+                nearest_cluster_flip = qb.find_nearest_cluster(qb.features_flip)
+                if nearest_cluster_flip.dist < nearest_cluster.dist:
+                    nearest_cluster = nearest_cluster_flip
+                    features_to_add = qb.features_flip
+
+            qb.last_cluster_id = nearest_cluster.id
+            labels[i] = nearest_cluster.id
+            sizes[nearest_cluster.id] += 1
+            for n in range(N):
+                for d in range(D):
+                    sums[nearest_cluster.id, n*D + d] += features_to_add[n, d]
+
+
+cdef _seed_clusters(QuickBundles qb, centroids):
+    """ Creates one cluster per centroid, in order. """
+    cdef int cluster_id
+    for centroid in centroids:
+        cluster_id = qb.c_create_cluster()
+        qb.clusters.c_assign(cluster_id, cluster_id, centroid)
+        qb.update_step(cluster_id)
+
+
+def quickbundles_parallel(streamlines, Metric metric, double threshold, long max_nb_clusters=BIGGEST_INT, ordering=None, num_threads=None):
+    """ Clusters streamlines using a parallel version of QuickBundles.
+
+    The streamlines (taken in the order given by `ordering`) are split into
+    one contiguous shard per thread and each shard is clustered independently
+    with QuickBundles. The centroids of all shards are then clustered with
+    QuickBundles (same metric and threshold), which gives the final
+    centroids. Finally, each streamline is reassigned to its nearest final
+    centroid and the centroids are recomputed as the mean of their members.
+    The first and last steps run in parallel threads.
+
+    Parameters
+    ----------
+    streamlines : list of 2D arrays
+        List of streamlines to cluster.
+    metric : `Metric` object
+        Tells how to compute the distance between two streamlines.
+    threshold : double
+        The maximum distance from a cluster for a streamline to be still
+        considered as part of it.
+    max_nb_clusters : int, optional
+        Limits the creation of bundles. (Default: inf)
+    ordering : iterable of indices, optional
+        Iterate through `data` using the given ordering.
+    num_threads : int, optional
+        Number of threads (and shards). If None (default) then all available
+        cores are used.
+
+    Returns
+    -------
+    `ClusterMapCentroid` object
+        Result of the clustering.
+
+    Notes
+    -----
+    The result is in general not identical to the sequential `quickbundles`
+    (which itself depends on `ordering`), but it is fully determined by the
+    three passes, none of which depends on how the threads are scheduled:
+
+    * the clusters of each shard are those of `quickbundles` on the shard's
+      streamlines, in order; with a single thread, they are therefore the
+      clusters of the sequential `quickbundles`;
+    * the merged centroids are the centroids of `quickbundles` on the shards'
+      centroids, taken shard after shard;
+    * every streamline belongs to the cluster of its nearest merged centroid
+      (the first one in case of ties) and the returned centroids are the
+      means of their members, each taken in the orientation closest to the
+      merged centroid. Clusters left without members are dropped.
+
+    Flipped features of a centroid are taken as its reversed features when
+    the metric is not order invariant, as is the case for the resampling
+    feature used by the MDF metric.
+    """
+    cdef QuickBundles qb, merge_qb
+
+    # Threshold of np.inf is not supported, set it to 'biggest_double'
+    threshold = min(threshold, BIGGEST_DOUBLE)
+    # Threshold of -np.inf is not supported, set it to 0
+    threshold = max(threshold, 0)
+
+    if ordering is None:
+        ordering = xrange(len(streamlines))
+
+    ordering = np.fromiter(ordering, dtype=np.int32)
+    if len(ordering) == 0 or len(streamlines) == 0:
+        return ClusterMapCentroid()
+
+    if num_threads is None:
+        num_threads = cpu_count()
+    num_threads = max(1, min(num_threads, len(ordering)))
+
+    first = streamlines[ordering[0]].astype(DTYPE)
+    features_shape = shape2tuple(metric.feature.c_infer_shape(first))
+    nb_features = int(np.prod(features_shape))
+
+    # Points of each shard stored contiguously so they can be processed
+    # without the GIL
+    shards = []
+    for indices in np.array_split(ordering, num_threads):
+        shard = [streamlines[i] for i in indices]
+        lengths = np.array([len(s) for s in shard], dtype=np.intp)
+        offsets = np.zeros(len(shard) + 1, dtype=np.intp)
+        np.cumsum(lengths, out=offsets[1:])
+        points = np.concatenate(shard, axis=0).astype(DTYPE)
+        shards.append((points, offsets, np.ascontiguousarray(indices)))
+
+    pool = ThreadPool(num_threads)
+    try:
+        # Shard pass
+        shard_qbs = [QuickBundles(features_shape, metric, threshold, max_nb_clusters) for i in range(num_threads)]
+        pool.map(lambda args: _quickbundles_shard(*args),
+                 [(qb,) + shard for qb, shard in zip(shard_qbs, shards)])
+
+        # Merge pass, on the features of the shard centroids
+        merge_qb = QuickBundles(features_shape, metric, threshold, max_nb_clusters)
+        centroid_id = 0
+        for qb in shard_qbs:
+            for centroid in clusters_centroid2clustermap_centroid(qb.clusters).centroids:
+                centroid = np.ascontiguousarray(centroid, dtype=DTYPE)
+                merge_qb.c_assign_features(centroid, np.ascontiguousarray(centroid[::-1]), centroid_id)
+                merge_qb.update_step(merge_qb.last_cluster_id)
+                centroid_id += 1
+        del shard_qbs
+        centroids = clusters_centroid2clustermap_centroid(merge_qb.clusters).centroids
+        nb_clusters = len(centroids)
+        del merge_qb
+
+        # Reassignment pass
+        reassign_args = []
+        for points, offsets, indices in shards:
+            qb = QuickBundles(features_shape, metric, threshold, nb_clusters)
+            _seed_clusters(qb, centroids)
+            reassign_args.append((qb, points, offsets,
+                                  np.empty(len(indices), dtype=np.int32),
+                                  np.zeros((nb_clusters, nb_features)),
+                                  np.zeros(nb_clusters, dtype=np.int32)))
+        pool.map(lambda args: _reassign_shard(*args), reassign_args)
+    finally:
+        pool.close()
+        pool.join()
+
+    labels = np.concatenate([args[3] for args in reassign_args])
+    sums = np.sum([args[4] for args in reassign_args], axis=0)
+    sizes = np.sum([args[5] for args in reassign_args], axis=0)
+
+    # Members are listed in the order they were processed
+    members = ordering[np.argsort(labels, kind='mergesort')]
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    clusters = ClusterMapCentroid()
+    for k in np.flatnonzero(sizes):
+        centroid = (sums[k] / sizes[k]).astype(DTYPE).reshape(features_shape)
+        indices = members[starts[k]:starts[k+1]].tolist()
+        clusters.add_cluster(ClusterCentroid(id=len(clusters), centroid=centroid, indices=indices))
+
+    return clusters
@@ -41,7 +41,14 @@ cdef class QuickBundles(object):
     cdef Metric metric
     cdef double threshold
     cdef int max_nb_clusters
+    cdef double bound_scale
+    cdef double* centroids_mean
+    cdef double* features_mean
+    cdef int last_cluster_id
 
+    cdef void c_mean(QuickBundles self, Data2D features, double* mean) nogil
+    cdef int c_create_cluster(QuickBundles self) nogil except -1
     cdef NearestCluster find_nearest_cluster(QuickBundles self, Data2D features) nogil except *
     cdef int assignment_step(QuickBundles self, Data2D datum, int datum_id) nogil except -1
+    cdef int c_assign_features(QuickBundles self, Data2D features, Data2D features_flip, int datum_id) nogil except -1
     cdef void update_step(QuickBundles self, int cluster_id) nogil except *
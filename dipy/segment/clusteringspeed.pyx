@@ -4,8 +4,12 @@
 import numpy as np
 cimport numpy as cnp
 
-from libc.math cimport fabs
+from libc.math cimport fabs, sqrt
 from cythonutils cimport Data2D, Shape, shape2tuple, tuple2shape, same_shape
+from metricspeed cimport Metric
+from dipy.segment.metricspeed import (SumPointwiseEuclideanMetric,
+                                      AveragePointwiseEuclideanMetric,
+                                      MinimumAverageDirectFlipMetric)
 
 
 cdef extern from "stdlib.h" nogil:
@@ -18,6 +22,9 @@ cdef extern from "stdlib.h" nogil:
 DTYPE = np.float32
 DEF BIGGEST_DOUBLE = 1.7976931348623157e+308  # np.finfo('f8').max
 DEF BIGGEST_INT = 2147483647  # np.iinfo('i4').max
+# Relative slack given to the lower bound on distances so that rounding
+# errors never prune the actual nearest cluster
+DEF BOUND_TOLERANCE = 1e-5
 
 
 cdef class Clusters:
@@ -206,7 +213,29 @@ cdef class ClustersCentroid(Clusters):
 
 
 cdef class QuickBundles(object):
-    def __init__(QuickBundles self, features_shape, Metric metric, double threshold, int max_nb_clusters=BIGGEST_INT):
+    """ Provides Cython functionalities to run the QuickBundles algorithm.
+
+    Parameters
+    ----------
+    features_shape : tuple of int
+        Shape of the features extracted from each datum.
+    metric : `Metric` object
+        Tells how to compute the distance between two data.
+    threshold : double
+        The maximum distance from a cluster for a datum to be still
+        considered as part of it.
+    max_nb_clusters : int, optional
+        Limits the creation of clusters. (Default: inf)
+    prune : bool, optional
+        If True and `metric` is one of the pointwise Euclidean metrics, the
+        distance between the mean point of a datum's features and the mean
+        point of a centroid is used as a lower bound on their distance (by
+        the triangle inequality, it does not depend on the orientation of
+        the datum). Clusters whose bound already exceeds the distance to the
+        nearest cluster found so far are skipped without computing the
+        metric. The resulting clusters are the same. (Default: True)
+    """
+    def __init__(QuickBundles self, features_shape, Metric metric, double threshold, int max_nb_clusters=BIGGEST_INT, prune=True):
         self.metric = metric
         self.features_shape = tuple2shape(features_shape)
         self.threshold = threshold
@@ -215,6 +244,71 @@ cdef class QuickBundles(object):
         self.features = np.empty(features_shape, dtype=DTYPE)
         self.features_flip = np.empty(features_shape, dtype=DTYPE)
 
+        # Exact types only: subclasses may define a different distance
+        self.bound_scale = 0
+        if prune and type(metric) in (AveragePointwiseEuclideanMetric,
+                                      MinimumAverageDirectFlipMetric):
+            self.bound_scale = 1
+        elif prune and type(metric) is SumPointwiseEuclideanMetric:
+            self.bound_scale = self.features_shape.dims[0]
+
+        self.centroids_mean = NULL
+        self.features_mean = <double*> calloc(self.features_shape.dims[1], sizeof(double))
+        if self.features_mean == NULL:
+            raise MemoryError()
+        self.last_cluster_id = -1
+
+    def __dealloc__(QuickBundles self):
+        free(self.centroids_mean)
+        self.centroids_mean = NULL
+        free(self.features_mean)
+        self.features_mean = NULL
+
+    cdef void c_mean(QuickBundles self, Data2D features, double* mean) nogil:
+        """ Computes the mean point (row) of a features vector.
+
+        Parameters
+        ----------
+        features : 2D array
+            Features of a datum or a centroid.
+        mean : double pointer
+            Buffer of size `features.shape[1]` receiving the mean point.
+        """
+        cdef cnp.npy_intp N = features.shape[0], D = features.shape[1]
+        cdef cnp.npy_intp n, d
+
+        for d in range(D):
+            mean[d] = 0
+        for n in range(N):
+            for d in range(D):
+                mean[d] += features[n, d]
+        for d in range(D):
+            mean[d] /= N
+
+    cdef int c_create_cluster(QuickBundles self) nogil except -1:
+        """ Creates an empty cluster and adds it at the end of the list.
+
+        Returns
+        -------
+        id_cluster : int
+            Index of the new cluster.
+        """
+        cdef int id_cluster = self.clusters.c_create_cluster()
+        cdef cnp.npy_intp D = self.features_shape.dims[1]
+        cdef double* centroids_mean
+
+        if self.bound_scale != 0:
+            centroids_mean = <double*> realloc(self.centroids_mean, self.clusters.c_size()*D*sizeof(double))
+            if centroids_mean == NULL:
+                # The previous buffer is still valid and freed on dealloc
+                with gil:
+                    raise MemoryError()
+            self.centroids_mean = centroids_mean
+            # The centroid of a new cluster is zero until updated
+            memset(&self.centroids_mean[id_cluster*D], 0, D*sizeof(double))
+
+        return id_cluster
+
     cdef NearestCluster find_nearest_cluster(QuickBundles self, Data2D features) nogil except *:
         """ Finds the nearest cluster of a datum given its `features` vector.
 
@@ -229,18 +323,51 @@ cdef class QuickBundles(object):
             Nearest cluster to `features` according to the given metric.
         """
         cdef:
-            cnp.npy_intp k
-            double dist
+            cnp.npy_intp k, d
+            cnp.npy_intp K = self.clusters.c_size()
+            cnp.npy_intp D = self.features_shape.dims[1]
+            double dist, dd, bound
             NearestCluster nearest_cluster
 
         nearest_cluster.id = -1
         nearest_cluster.dist = BIGGEST_DOUBLE
 
-        for k in range(self.clusters.c_size()):
+        if self.bound_scale == 0:
+            for k in range(K):
+                dist = self.metric.c_dist(self.clusters.centroids[k].features, features)
+
+                # Keep track of the nearest cluster
+                if dist < nearest_cluster.dist:
+                    nearest_cluster.dist = dist
+                    nearest_cluster.id = k
+
+            return nearest_cluster
+
+        self.c_mean(features, self.features_mean)
+
+        # Consecutive data are often close to each other, starting from the
+        # last assigned cluster gives a tight bound early on.
+        if 0 <= self.last_cluster_id < K:
+            nearest_cluster.id = self.last_cluster_id
+            nearest_cluster.dist = self.metric.c_dist(self.clusters.centroids[nearest_cluster.id].features, features)
+
+        for k in range(K):
+            if k == self.last_cluster_id:
+                continue
+
+            bound = 0
+            for d in range(D):
+                dd = self.centroids_mean[k*D + d] - self.features_mean[d]
+                bound += dd*dd
+            bound = self.bound_scale * sqrt(bound)
+            if bound > nearest_cluster.dist * (1 + BOUND_TOLERANCE) + BOUND_TOLERANCE:
+                continue
+
             dist = self.metric.c_dist(self.clusters.centroids[k].features, features)
 
-            # Keep track of the nearest cluster
-            if dist < nearest_cluster.dist:
+            # Keep track of the nearest cluster, ties go to the lowest index
+            # as in the exhaustive search.
+            if dist < nearest_cluster.dist or (dist == nearest_cluster.dist and k < nearest_cluster.id):
                 nearest_cluster.dist = dist
                 nearest_cluster.id = k
 
@@ -266,10 +393,7 @@ cdef class QuickBundles(object):
         int
             Index of the cluster the datum has been assigned to.
         """
-        cdef:
-            Data2D features_to_add = self.features
-            NearestCluster nearest_cluster, nearest_cluster_flip
-            Shape features_shape = self.metric.feature.c_infer_shape(datum)
+        cdef Shape features_shape = self.metric.feature.c_infer_shape(datum)
 
         # Check if datum is compatible with the metric
         if not same_shape(features_shape, self.features_shape):
@@ -281,30 +405,60 @@ cdef class QuickBundles(object):
             with gil:
                 raise ValueError("Data features' shapes must be compatible according to the metric used!")
 
-        # Find nearest cluster to datum
         self.metric.feature.c_extract(datum, self.features)
-        nearest_cluster = self.find_nearest_cluster(self.features)
+        if not self.metric.feature.is_order_invariant:
+            self.metric.feature.c_extract(datum[::-1], self.features_flip)
+
+        return self.c_assign_features(self.features, self.features_flip, datum_id)
+
+    cdef int c_assign_features(QuickBundles self, Data2D features, Data2D features_flip, int datum_id) nogil except -1:
+        """ Assigns already extracted features to their closest cluster.
+
+        This is the assignment step of `assignment_step` once the features
+        of the datum have been extracted.
+
+        Parameters
+        ----------
+        features : 2D array
+            Features of the datum.
+        features_flip : 2D array
+            Features of the flipped datum, only used if the features are not
+            order invariant.
+        datum_id : int
+            ID of the datum, usually its index.
+
+        Returns
+        -------
+        int
+            Index of the cluster the datum has been assigned to.
+        """
+        cdef:
+            Data2D features_to_add = features
+            NearestCluster nearest_cluster, nearest_cluster_flip
+
+        # Find nearest cluster to datum
+        nearest_cluster = self.find_nearest_cluster(features)
 
         # Find nearest cluster to s_i_flip if metric is not order invariant
         if not self.metric.feature.is_order_invariant:
-            self.metric.feature.c_extract(datum[::-1], self.features_flip)
-            nearest_cluster_flip = self.find_nearest_cluster(self.features_flip)
+            nearest_cluster_flip = self.find_nearest_cluster(features_flip)
 
             # If we found a lower distance using a flipped datum,
             #  add the flipped version instead
             if nearest_cluster_flip.dist < nearest_cluster.dist:
                 nearest_cluster.id = nearest_cluster_flip.id
                 nearest_cluster.dist = nearest_cluster_flip.dist
-                features_to_add = self.features_flip
+                features_to_add = features_flip
 
         # Check if distance with the nearest cluster is below some threshold
         # or if we already have the maximum number of clusters.
         # If the former or the latter is true, assign datum to its nearest cluster
         # otherwise create a new cluster and assign the datum to it.
         if not (nearest_cluster.dist < self.threshold or self.clusters.c_size() >= self.max_nb_clusters):
-            nearest_cluster.id = self.clusters.c_create_cluster()
+            nearest_cluster.id = self.c_create_cluster()
 
         self.clusters.c_assign(nearest_cluster.id, datum_id, features_to_add)
+        self.last_cluster_id = nearest_cluster.id
         return nearest_cluster.id
 
     cdef void update_step(QuickBundles self, int cluster_id) nogil except *:
@@ -319,3 +473,6 @@ cdef class QuickBundles(object):
 
         """
         self.clusters.c_update(cluster_id)
+        if self.bound_scale != 0:
+            self.c_mean(self.clusters.centroids[cluster_id].features,
+                        &self.centroids_mean[cluster_id*self.features_shape.dims[1]])
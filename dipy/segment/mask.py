@@ -7,6 +7,7 @@ import numpy as np
 from dipy.reconst.dti import fractional_anisotropy, color_fa
 
 from scipy.ndimage.filters import median_filter
+from dipy.segment.medianspeed import median_filter_3d
 try:
     from skimage.filters import threshold_otsu as otsu
 except:
@@ -15,7 +16,7 @@ except:
 from scipy.ndimage import binary_dilation, generate_binary_structure
 
 
-def multi_median(input, median_radius, numpass):
+def multi_median(input, median_radius, numpass, num_threads=None):
     """ Applies median filter multiple times on input data.
 
     Parameters
@@ -26,12 +27,25 @@ def multi_median(input, median_radius, numpass):
         Radius (in voxels) of the applied median filter
     numpass: int
         Number of pass of the median filter
+    num_threads : int, optional
+        Number of threads used to filter a 3D volume. If None (default) then
+        all available threads will be used.
 
     Returns
     -------
     input : ndarray
         Filtered input volume.
+
+    Notes
+    -----
+    3D volumes are filtered with `dipy.segment.medianspeed.median_filter_3d`,
+    which gives the same result as ``scipy.ndimage.median_filter``.
     """
+    if input.ndim == 3:
+        input[...] = median_filter_3d(input, median_radius, numpass,
+                                      num_threads)
+        return input
+
     # Array representing the size of the median window in each dimension.
     medarr = np.ones_like(input.shape) * ((median_radius * 2) + 1)
 
@@ -47,7 +61,8 @@ def applymask(vol, mask):
     Parameters
     ----------
     vol : ndarray
-        Array with $V$ dimensions
+        Array with $V$ dimensions, or array-like object (e.g. an
+        ImageDataProxy) with one more dimension than `mask`
     mask : ndarray
         Binary mask.  Has $M$ dimensions where $M <= V$. When $M < V$, we
         append $V - M$ dimensions with axis length 1 to `mask` so that `mask`
@@ -62,6 +77,17 @@ def applymask(vol, mask):
         `vol` multiplied by `mask` where `mask` may have been extended to match
         extra dimensions in `vol`
     """
+    if not isinstance(vol, np.ndarray):
+        if vol.ndim != mask.ndim + 1:
+            vol = np.asarray(vol)
+        else:
+            # Array-like data (e.g. an ImageDataProxy) is read one volume at
+            # a time
+            masked_vol = np.empty(vol.shape,
+                                  dtype=np.result_type(vol.dtype, mask.dtype))
+            for i in range(vol.shape[-1]):
+                masked_vol[..., i] = vol[..., i] * mask
+            return masked_vol
     mask = mask.reshape(mask.shape + (vol.ndim - mask.ndim) * (1,))
     return vol * mask
 
@@ -120,7 +146,7 @@ def crop(vol, mins, maxs):
 
 
 def median_otsu(input_volume, median_radius=4, numpass=4,
-                autocrop=False, vol_idx=None, dilate=None):
+                autocrop=False, vol_idx=None, dilate=None, num_threads=None):
     """Simple brain extraction tool method for images from DWI data.
 
     It uses a median filter smoothing of the input_volumes `vol_idx` and an
@@ -135,7 +161,8 @@ def median_otsu(input_volume, median_radius=4, numpass=4,
     Parameters
     ----------
     input_volume : ndarray
-        ndarray of the brain volume
+        ndarray of the brain volume. A 4D volume can also be an
+        ImageDataProxy, which is then read one volume at a time.
     median_radius : int
         Radius (in voxels) of the applied median filter (default: 4).
     numpass: int
@@ -151,6 +178,9 @@ def median_otsu(input_volume, median_radius=4, numpass=4,
 
     dilate : None or int, optional
         number of iterations for binary dilation
+    num_threads : None or int, optional
+        Number of threads of the median filter. None (the default) uses all
+        available threads.
 
     Returns
     -------
@@ -192,14 +222,17 @@ def median_otsu(input_volume, median_radius=4, numpass=4,
     """
     if len(input_volume.shape) == 4:
         if vol_idx is not None:
-            b0vol = np.mean(input_volume[..., tuple(vol_idx)], axis=3)
+            # Read one volume at a time from array-like data
+            b0vols = np.concatenate([input_volume[..., i:i + 1]
+                                     for i in vol_idx], axis=3)
+            b0vol = np.mean(b0vols, axis=3)
         else:
-            b0vol = input_volume[..., 0].copy()
+            b0vol = np.array(input_volume[..., 0])
     else:
-        b0vol = input_volume.copy()
+        b0vol = np.array(input_volume)
     # Make a mask using a multiple pass median filter and histogram
     # thresholding.
-    mask = multi_median(b0vol, median_radius, numpass)
+    mask = multi_median(b0vol, median_radius, numpass, num_threads)
     thresh = otsu(mask)
     mask = mask > thresh
 
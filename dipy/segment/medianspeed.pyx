@@ -0,0 +1,212 @@
+# cython: wraparound=False, cdivision=True, boundscheck=False
+
+import numpy as np
+cimport numpy as cnp
+
+cimport cython
+
+from cython.parallel import parallel, prange
+
+from libc.stdlib cimport calloc, free
+
+from dipy.denoise.denspeed import cpu_count
+
+# Number of values in each bin of the coarse and of the coarser histograms
+DEF COARSE_SIZE = 32
+DEF COARSER_SIZE = 1024
+
+
+def median_filter_3d(arr, median_radius, numpass=1, num_threads=None):
+    """ Median filter of a 3D volume with a sliding window histogram
+
+    Gives the same result as ``scipy.ndimage.median_filter(arr,
+    2 * median_radius + 1)`` applied `numpass` times. The values of `arr`
+    are replaced by their rank among the distinct values of the volume, so
+    that the window of the filter can be represented by a histogram. The
+    histogram is updated as the window slides back and forth along the last
+    axis, moving down one row at the end of each row (Huang's algorithm),
+    and the median is found by moving from the median of the previous
+    window, skipping whole bins of two coarser histograms.
+
+    Parameters
+    ----------
+    arr : 3D ndarray
+        The volume to filter, of any real data type.
+    median_radius : int
+        Radius (in voxels) of the cubic window of the filter.
+    numpass : int, optional
+        Number of times the filter is applied. Default is 1.
+    num_threads : int, optional
+        Number of threads. If None (default) then all available threads
+        will be used. The slices of the volume are processed in parallel.
+
+    Returns
+    -------
+    filtered : 3D ndarray
+        The filtered volume, of the data type of `arr`.
+
+    Notes
+    -----
+    The border of the volume is extended by reflection, as for the
+    'reflect' mode of scipy.
+    """
+    cdef:
+        cnp.npy_intp i, nb_values, nb_coarse, nb_coarser
+        cnp.npy_intp R = median_radius
+        int threads_to_use = cpu_count()
+        int[:, :, ::1] ranks, padded, out
+        cnp.uint8_t[::1] failed_view
+        int * hist
+        int * coarse
+        int * coarser
+
+    arr = np.asarray(arr)
+    if arr.ndim != 3:
+        raise ValueError('arr needs to be a 3D ndarray', arr.shape)
+    if median_radius < 0:
+        raise ValueError('median_radius must be positive', median_radius)
+    if num_threads is not None:
+        threads_to_use = num_threads
+
+    values, inverse = np.unique(arr, return_inverse=True)
+    ranks = inverse.reshape(arr.shape).astype(np.int32)
+    nb_values = len(values)
+    nb_coarse = nb_values // COARSE_SIZE + 1
+    nb_coarser = nb_values // COARSER_SIZE + 1
+
+    for _ in range(numpass):
+        padded = np.pad(ranks, R, mode='symmetric').astype(np.int32)
+        out = np.empty(arr.shape, dtype=np.int32)
+
+        failed = np.zeros(out.shape[0], dtype=np.uint8)
+        failed_view = failed
+
+        with nogil, parallel(num_threads=threads_to_use):
+            hist = <int *> calloc(nb_values, sizeof(int))
+            coarse = <int *> calloc(nb_coarse, sizeof(int))
+            coarser = <int *> calloc(nb_coarser, sizeof(int))
+            for i in prange(out.shape[0], schedule='dynamic'):
+                if hist == NULL or coarse == NULL or coarser == NULL:
+                    failed_view[i] = 1
+                else:
+                    _median_slice(padded, out, i, R, hist, coarse, coarser)
+            free(hist)
+            free(coarse)
+            free(coarser)
+
+        if failed.any():
+            raise MemoryError('Could not allocate the histograms of the '
+                              'median filter')
+        ranks = out
+
+    return values[np.asarray(ranks)]
+
+
+cdef inline void _update_box(int[:, :, ::1] padded, cnp.npy_intp a0,
+                             cnp.npy_intp a1, cnp.npy_intp b0,
+                             cnp.npy_intp b1, cnp.npy_intp c0,
+                             cnp.npy_intp c1, int step, int * hist,
+                             int * coarse, int * coarser, int med,
+                             int * lower) nogil:
+    """ Adds (step=1) or removes (step=-1) the values of
+    ``padded[a0:a1, b0:b1, c0:c1]`` to the histograms """
+    cdef:
+        cnp.npy_intp a, b, c
+        int v
+
+    for a in range(a0, a1):
+        for b in range(b0, b1):
+            for c in range(c0, c1):
+                v = padded[a, b, c]
+                hist[v] += step
+                coarse[v // COARSE_SIZE] += step
+                coarser[v // COARSER_SIZE] += step
+                if v < med:
+                    lower[0] += step
+
+
+cdef inline void _move_median(int * hist, int * coarse, int * coarser,
+                              int rank, int * med, int * lower) nogil:
+    """ Moves `med` from the median of the previous window to the value of
+    rank `rank` of the histogram, keeping `lower` up to date """
+    # Move down until fewer than rank + 1 values are lower
+    while lower[0] > rank:
+        if (med[0] % COARSER_SIZE == 0 and
+                lower[0] - coarser[med[0] // COARSER_SIZE - 1] > rank):
+            med[0] -= COARSER_SIZE
+            lower[0] -= coarser[med[0] // COARSER_SIZE]
+        elif (med[0] % COARSE_SIZE == 0 and
+                lower[0] - coarse[med[0] // COARSE_SIZE - 1] > rank):
+            med[0] -= COARSE_SIZE
+            lower[0] -= coarse[med[0] // COARSE_SIZE]
+        else:
+            med[0] -= 1
+            lower[0] -= hist[med[0]]
+
+    # Move up until more than rank values are lower or equal
+    while lower[0] + hist[med[0]] <= rank:
+        if (med[0] % COARSER_SIZE == 0 and
+                lower[0] + coarser[med[0] // COARSER_SIZE] <= rank):
+            lower[0] += coarser[med[0] // COARSER_SIZE]
+            med[0] += COARSER_SIZE
+        elif (med[0] % COARSE_SIZE == 0 and
+                lower[0] + coarse[med[0] // COARSE_SIZE] <= rank):
+            lower[0] += coarse[med[0] // COARSE_SIZE]
+            med[0] += COARSE_SIZE
+        else:
+            lower[0] += hist[med[0]]
+            med[0] += 1
+
+
+cdef void _median_slice(int[:, :, ::1] padded, int[:, :, ::1] out,
+                        cnp.npy_intp i, cnp.npy_intp R, int * hist,
+                        int * coarse, int * coarser) nogil:
+    """ Filters slice `i`, sliding the window back and forth along the last
+    axis and down one row at the end of each row.
+
+    The window, and therefore the median, never restarts from scratch: the
+    median only moves by the change between two neighbouring windows. The
+    histograms are empty when called and are emptied before returning.
+    """
+    cdef:
+        cnp.npy_intp j, k, t, add, remove
+        cnp.npy_intp W = 2 * R + 1
+        cnp.npy_intp J = out.shape[1], K = out.shape[2]
+        # Rank of the median in the window
+        int rank = (W * W * W) // 2
+        # The median, and the number of values lower than the median
+        int med = 0, lower = 0
+
+    # Start with the window of the first voxel of the slice
+    k = 0
+    _update_box(padded, i, i + W, 0, W, 0, W, 1, hist, coarse, coarser, med,
+                &lower)
+    for j in range(J):
+        if j > 0:
+            # Slide down one row, where the previous row ended
+            _update_box(padded, i, i + W, j - 1, j, k, k + W, -1, hist,
+                        coarse, coarser, med, &lower)
+            _update_box(padded, i, i + W, j + W - 1, j + W, k, k + W, 1,
+                        hist, coarse, coarser, med, &lower)
+        for t in range(K):
+            if t > 0:
+                # Even rows go forward and odd rows backward
+                if j % 2 == 0:
+                    k += 1
+                    remove = k - 1
+                    add = k + W - 1
+                else:
+                    k -= 1
+                    remove = k + W
+                    add = k
+                _update_box(padded, i, i + W, j, j + W, remove, remove + 1,
+                            -1, hist, coarse, coarser, med, &lower)
+                _update_box(padded, i, i + W, j, j + W, add, add + 1, 1,
+                            hist, coarse, coarser, med, &lower)
+            _move_median(hist, coarse, coarser, rank, &med, &lower)
+            out[i, j, k] = med
+
+    # Empty the histograms for the next slice
+    _update_box(padded, i, i + W, J - 1, J - 1 + W, k, k + W, -1, hist,
+                coarse, coarser, med, &lower)
+
@@ -13,7 +13,9 @@ from dipy.segment.metricspeed import (Metric,
                                       CosineMetric)
 
 from dipy.segment.metricspeed import (dist,
-                                      distance_matrix)
+                                      distance_matrix,
+                                      distance_matrix_sparse,
+                                      nearest_neighbors)
 
 # Creates aliases
 EuclideanMetric = SumPointwiseEuclideanMetric
@@ -2,13 +2,25 @@
 # cython: wraparound=False, cdivision=True, boundscheck=False
 
 import numpy as np
+cimport numpy as cnp
 
 from libc.math cimport sqrt, acos
+from cython.parallel import prange
 
 from cythonutils cimport tuple2shape, shape2tuple, same_shape
 from featurespeed cimport IdentityFeature, ResampleFeature
 
+from dipy.utils.omp import set_num_threads, restore_default_num_threads
+
 DEF biggest_double = 1.7976931348623157e+308  #  np.finfo('f8').max
+# Number of rows and columns of the blocks of the distance matrix computed
+# by a thread, so the features of a block stay in cache
+DEF BLOCK_SIZE = 64
+# Relative slack given to the lower bound on distances so that rounding
+# errors never discard a pair that is within the threshold
+DEF BOUND_TOLERANCE = 1e-5
+# Maximum number of distances held in memory at once by `distance_matrix_sparse`
+DEF MAX_TILE_SIZE = 4194304
 
 import math
 cdef double PI = math.pi
@@ -317,9 +329,27 @@ cdef class MinimumAverageDirectFlipMetric(AveragePointwiseEuclideanMetric):
             return True  # Ordering is handled in the distance computation
 
     cdef double c_dist(MinimumAverageDirectFlipMetric self, Data2D features1, Data2D features2) nogil except -1:
-        cdef double dist_direct = AveragePointwiseEuclideanMetric.c_dist(self, features1, features2)
-        cdef double dist_flipped = AveragePointwiseEuclideanMetric.c_dist(self, features1, features2[::-1])
-        return min(dist_direct, dist_flipped)
+        # Both distances are computed in a single pass, without creating a
+        # flipped view of `features2`
+        cdef :
+            int N = features1.shape[0], D = features1.shape[1]
+            int n, d
+            double dd, dist_n, dist_flipped_n
+            double dist_direct = 0.0, dist_flipped = 0.0
+
+        for n in range(N):
+            dist_n = 0.0
+            dist_flipped_n = 0.0
+            for d in range(D):
+                dd = features1[n, d] - features2[n, d]
+                dist_n += dd*dd
+                dd = features1[n, d] - features2[N-1-n, d]
+                dist_flipped_n += dd*dd
+
+            dist_direct += sqrt(dist_n)
+            dist_flipped += sqrt(dist_flipped_n)
+
+        return min(dist_direct / N, dist_flipped / N)
 
 
 cdef class CosineMetric(CythonMetric):
@@ -365,7 +395,133 @@ cdef class CosineMetric(CythonMetric):
         return acos(cos_theta) / PI  # Normalized cosine distance
 
 
-cpdef distance_matrix(Metric metric, data1, data2=None):
+def _extract_features(Metric metric, data):
+    """ Extracts the features of every datum in a single 2D array.
+
+    Returns
+    -------
+    features : 2D array (float32)
+        Features of all data stacked along the first axis.
+    offsets : 1D array (intp)
+        Row of `features` where the features of each datum start, followed
+        by the number of rows of `features`.
+    shapes : list of tuples
+        Distinct shapes of the features.
+    """
+    cdef Shape shape
+    offsets = np.zeros(len(data) + 1, dtype=np.intp)
+    features = []
+    shapes = set()
+    for i in range(len(data)):
+        datum = data[i] if data[i].flags.writeable and data[i].dtype == np.float32 else data[i].astype(np.float32)
+        shape = metric.feature.c_infer_shape(datum)
+        features_i = np.empty(shape2tuple(shape), np.float32)
+        metric.feature.c_extract(datum, features_i)
+        features.append(features_i)
+        offsets[i + 1] = offsets[i] + features_i.shape[0]
+        shapes.add(features_i.shape)
+
+    return np.concatenate(features), offsets, list(shapes)
+
+
+def _prepare_distances(Metric metric, data1, data2, bound=False):
+    """ Extracts the features of `data1` and `data2` for the distance engine.
+
+    When `bound` is True and the metric is a pointwise Euclidean metric,
+    the mean point of every datum's features is also returned along with
+    the factor `scale` such that `scale` times the distance between the mean
+    points is a lower bound on the metric distance (otherwise `scale` is 0).
+    """
+    features1, offsets1, shapes1 = _extract_features(metric, data1)
+    if data2 is data1:
+        features2, offsets2, shapes2 = features1, offsets1, shapes1
+    else:
+        features2, offsets2, shapes2 = _extract_features(metric, data2)
+
+    for shape1 in shapes1:
+        for shape2 in shapes2:
+            if not metric.are_compatible(shape1, shape2):
+                raise ValueError("Features of shape {0} and {1} are not compatible with the metric.".format(shape1, shape2))
+
+    # Exact types only: subclasses may define a different distance
+    scale = 0
+    means1 = means2 = np.zeros((0, 0), dtype=np.float64)
+    if bound and len(shapes1) == 1 and shapes1 == shapes2:
+        if type(metric) in (AveragePointwiseEuclideanMetric, MinimumAverageDirectFlipMetric):
+            scale = 1
+        elif type(metric) is SumPointwiseEuclideanMetric:
+            scale = shapes1[0][0]
+
+    if scale > 0:
+        means1 = features1.reshape((len(data1),) + shapes1[0]).mean(axis=1, dtype=np.float64)
+        means2 = features2.reshape((len(data2),) + shapes2[0]).mean(axis=1, dtype=np.float64)
+
+    return features1, offsets1, features2, offsets2, means1, means2, scale
+
+
+cdef inline double _lower_bound(double[:, :] means1, double[:, :] means2, Py_ssize_t i, Py_ssize_t j, double scale) nogil:
+    """ Lower bound on the distance between the i-th and the j-th data. """
+    cdef:
+        Py_ssize_t d
+        double dd, sqr_dist = 0.0
+
+    for d in range(means1.shape[1]):
+        dd = means1[i, d] - means2[j, d]
+        sqr_dist += dd*dd
+
+    return scale * sqrt(sqr_dist)
+
+
+cdef int _row_distances(Metric metric, Data2D features_i, Data2D features2, cnp.npy_intp[:] offsets2,
+                        Py_ssize_t j_start, Py_ssize_t j_end, double[:] out,
+                        double[:, :] means1, double[:, :] means2, Py_ssize_t i,
+                        double scale, double limit) nogil except -1:
+    """ Computes the distances between the i-th datum and the data j_start to
+    j_end-1. When `scale` is positive, distances whose lower bound is larger
+    than `limit` are not computed and set to the biggest double instead.
+    """
+    cdef Py_ssize_t j
+    for j in range(j_start, j_end):
+        if scale > 0 and _lower_bound(means1, means2, i, j, scale) > limit:
+            out[j] = biggest_double
+        else:
+            out[j] = metric.c_dist(features_i, features2[offsets2[j]:offsets2[j + 1]])
+
+    return 0
+
+
+cdef int _row_nearest(Metric metric, Data2D features_i, Data2D features2, cnp.npy_intp[:] offsets2,
+                      Py_ssize_t j_start, Py_ssize_t j_end, cnp.npy_intp[:] indices, double[:] distances,
+                      double[:, :] means1, double[:, :] means2, Py_ssize_t i, double scale) nogil except -1:
+    """ Updates the sorted nearest neighbors of the i-th datum (`indices` and
+    `distances`) with the data j_start to j_end-1.
+    """
+    cdef:
+        Py_ssize_t j, m, k = indices.shape[0]
+        double dist
+
+    for j in range(j_start, j_end):
+        if scale > 0 and (_lower_bound(means1, means2, i, j, scale) >
+                          distances[k - 1] * (1 + BOUND_TOLERANCE) + BOUND_TOLERANCE):
+            continue
+
+        dist = metric.c_dist(features_i, features2[offsets2[j]:offsets2[j + 1]])
+        if indices[k - 1] != -1 and dist >= distances[k - 1]:
+            continue
+
+        # Insert the neighbor, keeping the neighbors sorted
+        m = k - 1
+        while m > 0 and (indices[m - 1] == -1 or distances[m - 1] > dist):
+            distances[m] = distances[m - 1]
+            indices[m] = indices[m - 1]
+            m -= 1
+        distances[m] = dist
+        indices[m] = j
+
+    return 0
+
+
+cpdef distance_matrix(Metric metric, data1, data2=None, num_threads=None):
     """ Computes the distance matrix between two lists of sequential data.
 
     The distance matrix is obtained by computing the pairwise distance of all
@@ -374,6 +530,9 @@ cpdef distance_matrix(Metric metric, data1, data2=None):
     instead. A sequence of N-dimensional points is represented as a 2D array with
     shape (nb_points, nb_dimensions).
 
+    The features of every sequence are extracted once, then blocks of the
+    matrix are computed in parallel.
+
     Parameters
     ----------
     metric : `Metric` object
@@ -382,33 +541,206 @@ cpdef distance_matrix(Metric metric, data1, data2=None):
         List of sequences of N-dimensional points.
     data2 : list of 2D arrays
         Llist of sequences of N-dimensional points.
+    num_threads : int, optional
+        Number of threads to be used. If None (default) then all available
+        threads will be used.
 
     Returns
     -------
     2D array (double)
         Distance matrix.
     """
-    cdef int i, j
     if data2 is None:
         data2 = data1
 
-    shape = metric.feature.infer_shape(data1[0].astype(np.float32))
     distance_matrix = np.zeros((len(data1), len(data2)), dtype=np.float64)
-    cdef:
-        Data2D features1 = np.empty(shape, np.float32)
-        Data2D features2 = np.empty(shape, np.float32)
+    if len(data1) == 0 or len(data2) == 0:
+        return distance_matrix
 
-    for i in range(len(data1)):
-        datum1 = data1[i] if data1[i].flags.writeable and data1[i].dtype is np.float32 else data1[i].astype(np.float32)
-        metric.feature.c_extract(datum1, features1)
-        for j in range(len(data2)):
-            datum2 = data2[j] if data2[j].flags.writeable and data2[j].dtype is np.float32 else data2[j].astype(np.float32)
-            metric.feature.c_extract(datum2, features2)
-            distance_matrix[i, j] = metric.c_dist(features1, features2)
+    cdef:
+        Data2D features1, features2
+        cnp.npy_intp[:] offsets1, offsets2
+        double[:, :] D = distance_matrix
+        double[:, :] empty = np.zeros((0, 0), dtype=np.float64)
+        Py_ssize_t n1 = len(data1), n2 = len(data2)
+        Py_ssize_t block, i, j_block
+
+    features1, offsets1, features2, offsets2, _, _, _ = _prepare_distances(metric, data1, data2)
+
+    changed = set_num_threads(num_threads)
+    try:
+        with nogil:
+            for block in prange((n1 + BLOCK_SIZE - 1) // BLOCK_SIZE, schedule='dynamic'):
+                for j_block in range(0, n2, BLOCK_SIZE):
+                    for i in range(block * BLOCK_SIZE, min((block + 1) * BLOCK_SIZE, n1)):
+                        _row_distances(metric, features1[offsets1[i]:offsets1[i + 1]], features2, offsets2,
+                                       j_block, min(j_block + BLOCK_SIZE, n2), D[i], empty, empty, i, 0, 0)
+    finally:
+        if changed:
+            restore_default_num_threads()
 
     return distance_matrix
 
 
+def distance_matrix_sparse(Metric metric, data1, data2=None, double threshold=0, num_threads=None):
+    """ Finds all pairs of sequential data closer than a threshold.
+
+    Returns the sparse distance matrix between `data1` and `data2` (or
+    `data1` with itself) as (i, j, distance) triplets of the pairs whose
+    distance is smaller or equal to `threshold`. Rows of the matrix are
+    processed by blocks in parallel, so the memory used does not depend on
+    the number of pairs that are farther apart than the threshold. With
+    the pointwise Euclidean metrics (e.g. MDF), a cheap lower bound on the
+    distance avoids computing most of the distances above the threshold.
+
+    Parameters
+    ----------
+    metric : `Metric` object
+        Tells how to compute the distance between two sequential data.
+    data1 : list of 2D arrays
+        List of sequences of N-dimensional points.
+    data2 : list of 2D arrays, optional
+        List of sequences of N-dimensional points.
+    threshold : double
+        Maximum distance between the sequences of a pair.
+    num_threads : int, optional
+        Number of threads to be used. If None (default) then all available
+        threads will be used.
+
+    Returns
+    -------
+    rows : 1D array (intp)
+        Index in `data1` of every pair.
+    cols : 1D array (intp)
+        Index in `data2` of every pair.
+    distances : 1D array (double)
+        Distance of every pair.
+
+    Notes
+    -----
+    The triplets can be given to ``scipy.sparse.coo_matrix((distances, (rows,
+    cols)))``; beware that pairs at distance zero would then be dropped by
+    some of the sparse operations.
+    """
+    if data2 is None:
+        data2 = data1
+
+    rows, cols, distances = [], [], []
+    if len(data1) == 0 or len(data2) == 0:
+        return (np.zeros(0, np.intp), np.zeros(0, np.intp), np.zeros(0, np.float64))
+
+    cdef:
+        Data2D features1, features2
+        cnp.npy_intp[:] offsets1, offsets2
+        double[:, :] means1, means2, tile
+        double scale, limit = threshold * (1 + BOUND_TOLERANCE) + BOUND_TOLERANCE
+        Py_ssize_t n1 = len(data1), n2 = len(data2)
+        Py_ssize_t start, nb_rows, block, i, j_block
+
+    features1, offsets1, features2, offsets2, means1, means2, scale = _prepare_distances(metric, data1, data2, bound=True)
+
+    nb_rows = max(BLOCK_SIZE, (MAX_TILE_SIZE // n2) // BLOCK_SIZE * BLOCK_SIZE)
+    changed = set_num_threads(num_threads)
+    try:
+        for start in range(0, n1, nb_rows):
+            nb_rows = min(nb_rows, n1 - start)
+            tile_arr = np.empty((nb_rows, n2), dtype=np.float64)
+            tile = tile_arr
+            with nogil:
+                for block in prange((nb_rows + BLOCK_SIZE - 1) // BLOCK_SIZE, schedule='dynamic'):
+                    for j_block in range(0, n2, BLOCK_SIZE):
+                        for i in range(block * BLOCK_SIZE, min((block + 1) * BLOCK_SIZE, nb_rows)):
+                            _row_distances(metric, features1[offsets1[start + i]:offsets1[start + i + 1]],
+                                           features2, offsets2, j_block, min(j_block + BLOCK_SIZE, n2),
+                                           tile[i], means1, means2, start + i, scale, limit)
+
+            tile_rows, tile_cols = np.nonzero(tile_arr <= threshold)
+            rows.append(tile_rows + start)
+            cols.append(tile_cols)
+            distances.append(tile_arr[tile_rows, tile_cols])
+    finally:
+        if changed:
+            restore_default_num_threads()
+
+    return (np.concatenate(rows).astype(np.intp), np.concatenate(cols).astype(np.intp),
+            np.concatenate(distances))
+
+
+def nearest_neighbors(Metric metric, data1, data2=None, int k=1, num_threads=None):
+    """ Finds the `k` nearest neighbors in `data2` of every sequence of `data1`.
+
+    Rows of the distance matrix between `data1` and `data2` (or `data1` with
+    itself, in which case every sequence is its own nearest neighbor) are
+    processed by blocks in parallel, keeping only the `k` smallest distances
+    of each row. With the pointwise Euclidean metrics (e.g. MDF), a cheap
+    lower bound on the distance avoids computing most of the distances larger
+    than the current k-th smallest one.
+
+    Parameters
+    ----------
+    metric : `Metric` object
+        Tells how to compute the distance between two sequential data.
+    data1 : list of 2D arrays
+        List of sequences of N-dimensional points.
+    data2 : list of 2D arrays, optional
+        List of sequences of N-dimensional points.
+    k : int, optional
+        Number of neighbors to find; it is reduced to ``len(data2)`` if
+        larger. (Default: 1)
+    num_threads : int, optional
+        Number of threads to be used. If None (default) then all available
+        threads will be used.
+
+    Returns
+    -------
+    indices : 2D array (intp)
+        Indices in `data2` of the neighbors of every sequence of `data1`,
+        sorted by increasing distance (ties are sorted by index), with shape
+        (len(data1), k).
+    distances : 2D array (double)
+        Distances to the neighbors, with shape (len(data1), k).
+    """
+    if data2 is None:
+        data2 = data1
+
+    if k < 1:
+        raise ValueError("'k' must be at least 1.")
+    k = min(k, len(data2))
+
+    indices_arr = -np.ones((len(data1), k), dtype=np.intp)
+    distances_arr = np.empty((len(data1), k), dtype=np.float64)
+    distances_arr.fill(np.inf)
+    if len(data1) == 0 or len(data2) == 0:
+        return indices_arr, distances_arr
+
+    cdef:
+        Data2D features1, features2
+        cnp.npy_intp[:] offsets1, offsets2
+        double[:, :] means1, means2
+        cnp.npy_intp[:, :] indices = indices_arr
+        double[:, :] distances = distances_arr
+        double scale
+        Py_ssize_t n1 = len(data1), n2 = len(data2)
+        Py_ssize_t block, i, j_block
+
+    features1, offsets1, features2, offsets2, means1, means2, scale = _prepare_distances(metric, data1, data2, bound=True)
+
+    changed = set_num_threads(num_threads)
+    try:
+        with nogil:
+            for block in prange((n1 + BLOCK_SIZE - 1) // BLOCK_SIZE, schedule='dynamic'):
+                for j_block in range(0, n2, BLOCK_SIZE):
+                    for i in range(block * BLOCK_SIZE, min((block + 1) * BLOCK_SIZE, n1)):
+                        _row_nearest(metric, features1[offsets1[i]:offsets1[i + 1]], features2, offsets2,
+                                     j_block, min(j_block + BLOCK_SIZE, n2), indices[i], distances[i],
+                                     means1, means2, i, scale)
+    finally:
+        if changed:
+            restore_default_num_threads()
+
+    return indices_arr, distances_arr
+
+
 cpdef double dist(Metric metric, datum1, datum2) except -1:
     """ Computes a distance between `datum1` and `datum2`.
 
@@ -3,8 +3,11 @@ import numpy as np
 import itertools
 import copy
 
+from nibabel.tmpdirs import InTemporaryDirectory
+
 from dipy.segment.clustering import Cluster, ClusterCentroid
 from dipy.segment.clustering import ClusterMap, ClusterMapCentroid
+from dipy.segment.clustering import CompactClusterMapCentroid
 from dipy.segment.clustering import Clustering
 
 from nose.tools import assert_equal, assert_true, assert_false
@@ -61,6 +64,15 @@ def test_cluster_assign():
     cluster.assign(*range(1, 10))
     assert_array_equal(cluster.indices, indices)
 
+    # Indices given as an array (e.g. a view of a compact cluster map) are
+    # not modified
+    array_indices = np.arange(1, 5, dtype=np.int32)
+    cluster = Cluster(indices=array_indices)
+    for idx in range(5, 10):
+        cluster.assign(idx)
+    assert_array_equal(cluster.indices, indices)
+    assert_array_equal(array_indices, indices[:4])
+
 
 def test_cluster_iter():
     indices = list(range(len(data)))
@@ -745,6 +757,64 @@ def test_cluster_map_centroid_comparison_with_int():
     assert_array_equal(list(clusters[subset][1]), clusters2_indices)
 
 
+def test_compact_cluster_map_centroid():
+    rng = np.random.RandomState(42)
+    cluster_map = ClusterMapCentroid()
+    permutation = rng.permutation(len(data)).tolist()
+    for start, end in [(0, 2), (2, 2), (2, 4), (4, 5)]:
+        centroid = rng.rand(*features_shape).astype(dtype)
+        indices = permutation[start:end]
+        cluster_map.add_cluster(ClusterCentroid(centroid, indices=indices))
+
+    compact = CompactClusterMapCentroid.from_cluster_map(cluster_map)
+    assert_equal(len(compact), len(cluster_map))
+    assert_equal(compact, cluster_map)
+    assert_equal(compact.indices.dtype, np.int32)
+    assert_array_equal(compact.offsets, [0, 2, 2, 4, 5])
+    assert_array_equal(compact.centroids, cluster_map.centroids)
+    assert_array_equal(compact.clusters_sizes(), cluster_map.clusters_sizes())
+    assert_array_equal(compact >= 2, cluster_map >= 2)
+    assert_array_equal(compact.get_large_clusters(2),
+                       cluster_map.get_large_clusters(2))
+    assert_array_equal(compact.get_small_clusters(1),
+                       cluster_map.get_small_clusters(1))
+    assert_equal(compact[-1], cluster_map[-1])
+    assert_array_equal(compact[1:3], cluster_map[1:3])
+    assert_array_equal(compact[[3, 0]], cluster_map[[3, 0]])
+    assert_raises(IndexError, compact.__getitem__, len(compact))
+
+    # Label of every element
+    labels = compact.get_labels(len(data))
+    for label, cluster in enumerate(cluster_map):
+        assert_array_equal(labels[cluster.indices], label)
+    assert_array_equal(labels >= 0, True)
+
+    # Clusters are views returning elements of refdata
+    compact.refdata = data
+    assert_equal(len(compact.get_labels()), len(data))
+    assert_arrays_equal(list(compact[0]), [data[i] for i in compact[0].indices])
+
+    # Serialization
+    filename = 'clusters.npz'
+    with InTemporaryDirectory():
+        compact.save(filename)
+        loaded = CompactClusterMapCentroid.load(filename)
+        assert_equal(loaded, compact)
+        assert_array_equal(loaded.centroids_array, compact.centroids_array)
+
+    # Adding and removing clusters
+    compact.remove_cluster(cluster_map[2], cluster_map[0])
+    assert_equal(compact.clusters, cluster_map[1::2])
+    compact.add_cluster(cluster_map[0])
+    assert_equal(compact.clusters, cluster_map[1::2] + cluster_map[:1])
+    assert_raises(ValueError, compact.remove_cluster, cluster_map[2])
+    compact.clear()
+    assert_equal(len(compact), 0)
+    assert_equal(len(compact.indices), 0)
+
+    assert_raises(ValueError, CompactClusterMapCentroid, [1, 2], [0, 1])
+
+
 def test_subclassing_clustering():
     class SubClustering(Clustering):
         def cluster(self, data, ordering=None):
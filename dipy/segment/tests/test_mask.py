@@ -7,11 +7,15 @@ from scipy.ndimage.filters import median_filter
 
 from dipy.segment.mask import (otsu, bounding_box, crop, applymask,
                                multi_median, median_otsu)
+from dipy.segment.medianspeed import median_filter_3d
 
 from numpy.testing import (assert_equal,
                            assert_almost_equal,
+                           assert_array_equal,
+                           assert_raises,
                            run_module_suite)
 from dipy.data import get_data
+from dipy.io.image import ImageDataProxy
 
 
 def test_mask():
@@ -48,6 +52,30 @@ def test_mask():
     assert_equal(median_test, median_control)
 
 
+def test_median_filter_3d():
+    rng = np.random.RandomState(0)
+    for shape, radius, dtype in [((20, 21, 22), 1, 'f8'),
+                                 ((30, 30, 30), 4, 'u2'),
+                                 ((3, 40, 9), 2, 'f4'),
+                                 ((5, 6, 7), 3, 'i2'),
+                                 ((10, 10, 10), 0, 'i4')]:
+        vol = (rng.rand(*shape) * 1000).astype(dtype)
+        expected = vol.copy()
+        for _ in range(2):
+            median_filter(expected, 2 * radius + 1, output=expected)
+
+        for num_threads in [1, 2, None]:
+            filtered = median_filter_3d(vol, radius, 2, num_threads)
+            assert_equal(filtered.dtype, vol.dtype)
+            assert_array_equal(filtered, expected)
+
+        filtered = multi_median(vol.copy(), radius, 2)
+        assert_array_equal(filtered, expected)
+
+    assert_raises(ValueError, median_filter_3d, np.ones((3, 3)), 1)
+    assert_raises(ValueError, median_filter_3d, np.ones((3, 3, 3)), -1)
+
+
 def test_bounding_box():
     vol = np.zeros((100, 100, 50), dtype=int)
 
@@ -112,5 +140,19 @@ def test_median_otsu():
     assert_equal(mask3.sum() < mask4.sum(), True)
 
 
+def test_median_otsu_proxy():
+    fimg, _, _ = get_data('small_64D')
+    img = nib.load(fimg)
+    data = img.get_data()
+    proxy = ImageDataProxy(img)
+    for vol_idx, autocrop in [(None, False), ([0, 1, 2], False),
+                              ([0], True)]:
+        masked, mask = median_otsu(data, 2, 1, autocrop, vol_idx)
+        masked2, mask2 = median_otsu(proxy, 2, 1, autocrop, vol_idx)
+        assert_array_equal(mask2, mask)
+        assert_array_equal(masked2, masked)
+        assert_equal(masked2.dtype, masked.dtype)
+
+
 if __name__ == '__main__':
     run_module_suite()
@@ -254,5 +254,65 @@ def test_distance_matrix():
                                                       data2[j]))
 
 
+def test_distance_matrix_sparse():
+    rng = np.random.RandomState(42)
+    data = [(rng.rand(10, 3)*10).astype(np.float32) + rng.randint(0, 20, 3)
+            for i in range(150)]
+    data2 = data[:70]
+
+    for metric in [dipymetric.SumPointwiseEuclideanMetric(),
+                   dipymetric.AveragePointwiseEuclideanMetric(),
+                   dipymetric.MinimumAverageDirectFlipMetric(),
+                   dipymetric.CosineMetric(dipymetric.ArcLengthFeature())]:
+        D = dipymetric.distance_matrix(metric, data, data2)
+        for num_threads in [1, 2]:
+            assert_array_equal(dipymetric.distance_matrix(
+                metric, data, data2, num_threads=num_threads), D)
+
+        threshold = np.median(D)
+        rows, cols, distances = dipymetric.distance_matrix_sparse(
+            metric, data, data2, threshold=threshold, num_threads=2)
+        expected_rows, expected_cols = np.nonzero(D <= threshold)
+        assert_array_equal(rows, expected_rows)
+        assert_array_equal(cols, expected_cols)
+        assert_array_equal(distances, D[D <= threshold])
+
+    rows, cols, distances = dipymetric.distance_matrix_sparse(metric, [],
+                                                              data)
+    assert_equal(len(rows), 0)
+
+    # Features of incompatible shapes
+    metric = dipymetric.SumPointwiseEuclideanMetric()
+    assert_raises(ValueError, dipymetric.distance_matrix_sparse, metric,
+                  data, [np.ones((5, 3), dtype=np.float32)])
+
+
+def test_nearest_neighbors():
+    rng = np.random.RandomState(42)
+    data = [(rng.rand(10, 3)*10).astype(np.float32) + rng.randint(0, 20, 3)
+            for i in range(150)]
+    # Duplicates test the ordering of ties
+    data2 = data[:50] + data[:20]
+
+    for metric in [dipymetric.SumPointwiseEuclideanMetric(),
+                   dipymetric.MinimumAverageDirectFlipMetric(),
+                   dipymetric.CosineMetric(dipymetric.ArcLengthFeature())]:
+        D = dipymetric.distance_matrix(metric, data, data2)
+        expected = np.argsort(D, axis=1, kind='mergesort')
+        for k in [1, 5, len(data2) + 1]:
+            indices, distances = dipymetric.nearest_neighbors(
+                metric, data, data2, k=k, num_threads=2)
+            k = min(k, len(data2))
+            assert_array_equal(indices, expected[:, :k])
+            assert_array_equal(distances, np.sort(D, axis=1)[:, :k])
+
+        # A sequence is at distance 0 of itself
+        indices, distances = dipymetric.nearest_neighbors(metric, data)
+        assert_array_equal(distances[:, 0], 0)
+
+    assert_raises(ValueError, dipymetric.nearest_neighbors, metric, data,
+                  k=0)
+
+
 if __name__ == '__main__':
     run_module_suite()
@@ -2,14 +2,17 @@ import numpy as np
 import itertools
 
 
-from nose.tools import assert_equal, assert_raises
-from numpy.testing import assert_array_equal, run_module_suite
+from nose.tools import assert_equal, assert_true, assert_raises
+from numpy.testing import (assert_array_equal, assert_array_almost_equal,
+                           run_module_suite)
 from dipy.testing.memory import get_type_refcount
 
 from dipy.segment.clustering import QuickBundles
 
 import dipy.segment.metric as dipymetric
-from dipy.segment.clustering_algorithms import quickbundles
+from dipy.segment.clustering_algorithms import (quickbundles,
+                                                quickbundles_parallel,
+                                                quickbundles_streaming)
 import dipy.tracking.streamline as streamline_utils
 
 
@@ -162,6 +165,149 @@ def test_quickbundles_with_not_order_invariant_metric():
     assert_array_equal(clusters[0].centroid, streamline)
 
 
+def test_quickbundles_pruning():
+    rng = np.random.RandomState(42)
+    streamlines = [np.cumsum(rng.randn(20, 3), axis=0).astype(dtype) +
+                   rng.randn(3).astype(dtype) * 10 for i in range(300)]
+    feature = dipymetric.ResampleFeature(nb_points=12)
+    metrics = [dipymetric.AveragePointwiseEuclideanMetric(feature),
+               dipymetric.SumPointwiseEuclideanMetric(feature),
+               dipymetric.MinimumAverageDirectFlipMetric(feature)]
+    ordering = rng.permutation(len(streamlines))
+
+    for metric, threshold, max_nb_clusters in itertools.product(
+            metrics, [1., 5., 10., 50.], [np.iinfo('i4').max, 10]):
+        # The lower bound only prunes clusters that cannot be the nearest,
+        # the result must be exactly the one of the exhaustive search.
+        for order in [None, ordering]:
+            expected = quickbundles(streamlines, metric, threshold,
+                                    max_nb_clusters, order, prune=False)
+            clusters = quickbundles(streamlines, metric, threshold,
+                                    max_nb_clusters, order)
+            assert_equal(len(clusters), len(expected))
+            for cluster, cluster_expected in zip(clusters, expected):
+                assert_array_equal(cluster.indices, cluster_expected.indices)
+                assert_array_equal(cluster.centroid,
+                                   cluster_expected.centroid)
+
+
+def _nearest_centroid(metric, centroids, streamline):
+    """ Returns the index of the centroid nearest to `streamline` and the
+    orientation of `streamline` it was found with. """
+    flipped = streamline[::-1].copy()
+    dists = [metric.dist(c, streamline) for c in centroids]
+    dists_flip = [metric.dist(c, flipped) for c in centroids]
+    k, k_flip = np.argmin(dists), np.argmin(dists_flip)
+    if dists_flip[k_flip] < dists[k]:
+        return k_flip, flipped
+    return k, streamline
+
+
+def test_quickbundles_parallel():
+    metric = dipymetric.SumPointwiseEuclideanMetric()
+    assert_equal(len(quickbundles_parallel([], metric, threshold)), 0)
+
+    # Eight copies of a random bundle, far apart from each other
+    rng = np.random.RandomState(42)
+    bundle = [np.cumsum(rng.randn(12, 3), axis=0).astype(dtype) +
+              rng.randn(3).astype(dtype) for i in range(50)]
+    shifts = np.array(list(itertools.product([-100, 100], repeat=3)), dtype)
+    streamlines = [s + shift for shift in shifts for s in bundle]
+    ordering = rng.permutation(len(streamlines))
+
+    metric = dipymetric.AveragePointwiseEuclideanMetric()
+    expected = quickbundles(streamlines, metric, 5., ordering=ordering)
+    for num_threads in [1, 2, 3, 8]:
+        qb = QuickBundles(5., metric=metric, num_threads=num_threads)
+        clusters = qb.cluster(streamlines, ordering=ordering)
+        assert_equal(clusters.refdata, streamlines)
+        clusters.refdata = None
+
+        # Shard pass: sequential QuickBundles on each shard, which is the
+        # sequential result itself when there is a single shard
+        shards = [quickbundles(streamlines, metric, 5., ordering=indices)
+                  for indices in np.array_split(ordering, num_threads)]
+        if num_threads == 1:
+            assert_equal(shards[0], expected)
+
+        # Merge pass: sequential QuickBundles on the shards' centroids
+        shards_centroids = list(itertools.chain(*[shard.centroids
+                                                  for shard in shards]))
+        merged = quickbundles(shards_centroids, metric, 5.).centroids
+
+        # Reassignment pass: every streamline goes to its nearest merged
+        # centroid and the centroids are the means of their members, in the
+        # orientation closest to the merged centroid
+        labels = []
+        sums = np.zeros((len(merged),) + merged[0].shape)
+        for i in ordering:
+            k, features = _nearest_centroid(metric, merged, streamlines[i])
+            labels.append(k)
+            sums[k] += features
+        labels = np.array(labels)
+        nonempty = [k for k in range(len(merged)) if np.any(labels == k)]
+        assert_equal(len(clusters), len(nonempty))
+        for cluster, k in zip(clusters, nonempty):
+            assert_array_equal(cluster.indices, ordering[labels == k])
+            assert_array_almost_equal(cluster.centroid,
+                                      sums[k] / np.sum(labels == k),
+                                      decimal=4)
+
+        # Every streamline is assigned exactly once and bundles farther apart
+        # than the threshold are never merged
+        indices = np.sort(list(itertools.chain(*clusters)))
+        assert_array_equal(indices, np.arange(len(streamlines)))
+        for cluster in clusters:
+            assert_equal(len(set(np.array(cluster.indices) // len(bundle))), 1)
+
+
+def test_quickbundles_streaming():
+    metric = dipymetric.SumPointwiseEuclideanMetric()
+    assert_equal(len(quickbundles_streaming(iter([]), metric, threshold)), 0)
+
+    rdata = streamline_utils.set_number_of_points(data, 10)
+    expected = quickbundles(rdata, metric, threshold)
+    clusters = quickbundles_streaming(iter(rdata), metric, threshold)
+    assert_equal(len(clusters), len(expected))
+    for c1, c2 in zip(clusters, expected):
+        assert_equal(c1.indices.dtype, np.int32)
+        assert_array_equal(c1.indices, c2.indices)
+        assert_array_equal(c1.centroid, c2.centroid)
+        assert_equal(c1, c2)
+
+    # Compact indices can still be extended, they are then copied to a list
+    cluster = clusters[0]
+    cluster.assign(7, cluster.centroid)
+    assert_true(isinstance(cluster.indices, list))
+    assert_array_equal(cluster.indices, expected[0].indices + [7])
+    assert_array_equal(clusters[0].indices, expected[0].indices)
+
+    # The compact and the object representations are equivalent
+    compact = quickbundles(rdata, metric, threshold, compact=True)
+    assert_equal(compact, expected)
+    assert_array_equal(compact.clusters_sizes(), expected.clusters_sizes())
+    qb = QuickBundles(threshold, metric=metric, compact=True)
+    assert_equal(qb.cluster(rdata), expected)
+    qb = QuickBundles(threshold, metric=metric, compact=True, num_threads=2)
+    assert_equal(len(qb.cluster(rdata).indices), len(rdata))
+
+    # Clustering a file, the bundles' streamlines are read from it
+    from dipy.data import get_data
+    from nibabel import trackvis as tv
+    streams, hdr = tv.read(get_data('fornix'))
+    fornix = [s[0] for s in streams]
+    qb = QuickBundles(threshold=10.)
+    expected = qb.cluster(fornix)
+    clusters = qb.cluster_file(get_data('fornix'))
+    assert_equal(len(clusters), len(expected))
+    for c1, c2 in zip(clusters, expected):
+        assert_array_equal(c1.indices, c2.indices)
+        assert_array_equal(c1.centroid, c2.centroid)
+        for s1, s2 in zip(c1, c2):
+            assert_array_equal(s1, s2)
+    assert_raises(ValueError, qb.cluster_file, "streamlines.txt")
+
+
 def test_quickbundles_memory_leaks():
     qb = QuickBundles(threshold=2*threshold)
 
@@ -0,0 +1,55 @@
+""" Test that heavy modules are only imported when they are used
+
+Each import is checked in a new interpreter.
+"""
+from __future__ import division, print_function, absolute_import
+
+import json
+import os
+import subprocess
+import sys
+from os.path import dirname
+
+from nose.tools import assert_equal
+
+import dipy
+
+# Modules slow to import (or optional) that dipy modules should only import
+# when they need them
+HEAVY_MODULES = ('numpy.testing', 'nose', 'nibabel', 'scipy.optimize',
+                 'scipy.integrate', 'scipy.interpolate', 'tables', 'sklearn',
+                 'vtk', 'matplotlib')
+
+
+def imported_heavy_modules(module_name, heavy_modules=HEAVY_MODULES):
+    """ Returns the heavy modules imported by ``import module_name`` """
+    code = ('import json, sys, warnings\n'
+            'warnings.simplefilter("ignore")\n'
+            'import {0}\n'
+            'print(json.dumps([m for m in {1!r} if m in sys.modules]))'
+            ).format(module_name, list(heavy_modules))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [dirname(dirname(dipy.__file__))] +
+        [p for p in [env.get('PYTHONPATH')] if p])
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_import_dipy():
+    # Not even numpy is needed to import dipy
+    assert_equal(imported_heavy_modules('dipy', HEAVY_MODULES + ('numpy',)),
+                 [])
+
+
+def test_lazy_imports():
+    for module_name in ['dipy.reconst.dti', 'dipy.reconst.csdeconv',
+                        'dipy.direction.peaks', 'dipy.tracking.local',
+                        'dipy.io.dpy', 'dipy.viz',
+                        'dipy.workflows.reconst', 'dipy.workflows.segment',
+                        'dipy.workflows.tracking']:
+        assert_equal((module_name, imported_heavy_modules(module_name)),
+                     (module_name, []))
+    # The optimizers of dipy.core.optimize are needed, but not sklearn
+    assert_equal(imported_heavy_modules('dipy.reconst.sfm',
+                                        ('sklearn', 'nibabel')), [])
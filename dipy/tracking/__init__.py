@@ -2,7 +2,7 @@
 """ Tracking objects """
 
 # Test callable
-from numpy.testing import Tester
-test = Tester().test
-bench = Tester().bench
-del Tester
+from dipy.utils.tester import LazyTester
+test = LazyTester(__file__).test
+bench = LazyTester(__file__).bench
+del LazyTester
@@ -2,6 +2,7 @@ import numpy as np
 
 from .localtrack import local_tracker
 from dipy.align import Bunch
+from dipy.core.profile import stage, count
 from dipy.tracking import utils
 
 # enum TissueClass (tissue_classifier.pxd) is not accessible
@@ -104,22 +105,27 @@ class LocalTracking(object):
         F = np.empty((N + 1, 3), dtype=float)
         B = F.copy()
         for s in self.seeds:
+            count('tracking.seeds')
             s = np.dot(lin, s) + offset
-            directions = dg.initial_direction(s)
+            with stage('tracking.local_tracking'):
+                directions = dg.initial_direction(s)
             if directions.size == 0 and self.return_all:
                 # only the seed position
+                count('tracking.streamlines')
                 yield [s]
             directions = directions[:max_cross]
             for first_step in directions:
-                stepsF, tissue_class = local_tracker(dg, tc, s, first_step,
-                                                     vs, F, ss, fixed)
+                with stage('tracking.local_tracking'):
+                    stepsF, tissue_class = local_tracker(dg, tc, s, first_step,
+                                                         vs, F, ss, fixed)
                 if not (self.return_all or
                         tissue_class == TissueTypes.ENDPOINT or
                         tissue_class == TissueTypes.OUTSIDEIMAGE):
                     continue
                 first_step = -first_step
-                stepsB, tissue_class = local_tracker(dg, tc, s, first_step,
-                                                     vs, B, ss, fixed)
+                with stage('tracking.local_tracking'):
+                    stepsB, tissue_class = local_tracker(dg, tc, s, first_step,
+                                                         vs, B, ss, fixed)
                 if not (self.return_all or
                         tissue_class == TissueTypes.ENDPOINT or
                         tissue_class == TissueTypes.OUTSIDEIMAGE):
@@ -130,4 +136,6 @@ class LocalTracking(object):
                 else:
                     parts = (B[stepsB-1:0:-1], F[:stepsF])
                     streamline = np.concatenate(parts, axis=0)
+                count('tracking.streamlines')
+                count('tracking.steps', len(streamline) - 1)
                 yield streamline
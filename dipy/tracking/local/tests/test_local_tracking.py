@@ -3,6 +3,7 @@ import numpy.testing as npt
 
 from dipy.core.sphere import HemiSphere, unit_octahedron
 from dipy.core.gradients import gradient_table
+from dipy.core.profile import recording
 from dipy.tracking.local import (LocalTracking, ThresholdTissueClassifier,
                                  DirectionGetter, TissueClassifier)
 from dipy.direction import (ProbabilisticDirectionGetter,
@@ -348,5 +349,13 @@ def test_MaximumDeterministicTracker():
     for sl in streamlines:
         npt.assert_(np.allclose(sl, expected[2]))
 
+    # The stages and counters of the tracking are recorded
+    with recording() as recorder:
+        streamlines = list(LocalTracking(dg, tc, seeds, np.eye(4), 1.))
+    npt.assert_equal(recorder.counters['tracking.seeds'], 30)
+    npt.assert_equal(recorder.counters['tracking.streamlines'], 30)
+    npt.assert_equal(recorder.counters['tracking.steps'], 60)
+    npt.assert_(recorder.timers['tracking.local_tracking']['calls'] >= 30)
+
 if __name__ == "__main__":
     npt.run_module_suite()
@@ -4,7 +4,6 @@ from __future__ import division, print_function, absolute_import
 from ..utils.six.moves import xrange
 
 import numpy as np
-from scipy.interpolate import splprep, splev
 
 
 def winding(xyz):
@@ -636,6 +635,8 @@ def spline(xyz, s=3, k=2, nest=-1):
     scipy.interpolate.splprep
     scipy.interpolate.splev
     '''
+    from scipy.interpolate import splprep, splev
+
     # find the knot points
     tckp, u = splprep([xyz[:, 0], xyz[:, 1], xyz[:, 2]], s=s, k=k, nest=nest)
     # evaluate spline, including interpolated points
@@ -51,9 +51,6 @@ from __future__ import division, print_function, absolute_import
 from functools import wraps
 from warnings import warn
 
-from nibabel.affines import apply_affine
-from scipy.spatial.distance import cdist
-
 from dipy.core.geometry import dist_to_corner
 
 from collections import defaultdict
@@ -639,6 +636,7 @@ def streamline_near_roi(streamline, roi_coords, tol, mode='any'):
         e_s += "'either_end', but you entered: %s." % mode
         raise ValueError(e_s)
 
+    from scipy.spatial.distance import cdist
     dist = cdist(s, roi_coords, 'euclidean')
 
     if mode == "any" or mode == "either_end":
@@ -699,6 +697,7 @@ def near_roi(streamlines, region_of_interest, affine=None, tol=None,
         warn(w_s)
         tol = dtc
 
+    from nibabel.affines import apply_affine
     roi_coords = np.array(np.where(region_of_interest)).T
     x_roi_coords = apply_affine(affine, roi_coords)
 
@@ -1,14 +1,16 @@
 """ Utilities to manipulate numpy arrays """
 
 import sys
-from distutils.version import LooseVersion
-
 import numpy as np
 
-from nibabel.volumeutils import endian_codes, native_code, swapped_code
+from dipy.utils.optpkg import parse_version
+
+# Byte order codes, as in nibabel.volumeutils
+native_code = sys.byteorder == 'little' and '<' or '>'
+swapped_code = sys.byteorder == 'little' and '>' or '<'
 
 
-NUMPY_LESS_1_8 = LooseVersion(np.version.short_version) < '1.8'
+NUMPY_LESS_1_8 = parse_version(np.version.short_version) < (1, 8)
 
 
 def as_native_array(arr):
@@ -28,7 +30,8 @@ def as_native_array(arr):
         array such that ``np.all(native_arr == arr)``, with native byte
         ordering.
     """
-    if endian_codes[arr.dtype.byteorder] == native_code:
+    # '=' and '|' (not applicable) are native
+    if arr.dtype.byteorder != swapped_code:
         return arr
     return arr.byteswap().newbyteorder()
 
@@ -0,0 +1,31 @@
+#!python
+
+cimport safe_openmp as openmp
+from safe_openmp cimport have_openmp
+
+
+def set_num_threads(num_threads):
+    r"""Sets the number of OpenMP threads, returns True if it was changed
+
+    Parameters
+    ----------
+    num_threads : int or None
+        Number of threads to use. If None, or if dipy was built without
+        OpenMP, nothing is changed.
+
+    Returns
+    -------
+    changed : bool
+        True if the number of threads was set, in which case
+        `restore_default_num_threads` should be called once done.
+    """
+    if not have_openmp or num_threads is None:
+        return False
+    openmp.omp_set_dynamic(0)
+    openmp.omp_set_num_threads(num_threads)
+    return True
+
+
+def restore_default_num_threads():
+    r"""Restores the default number of OpenMP threads (all cores)"""
+    openmp.omp_set_num_threads(openmp.omp_get_num_procs())
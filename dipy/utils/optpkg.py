@@ -1,28 +1,161 @@
-""" Routines to support optional packages """
+""" Routines to support optional and lazily imported packages """
+
+import re
+import sys
 
 try:
     import importlib
 except ImportError:
     import dipy.utils._importlib as importlib
 
+# nose's SkipTest is the one of unittest, nose itself is slow to import
 try:
-    import nose
-except ImportError:
-    have_nose = False
-else:
-    have_nose = True
+    from unittest import SkipTest
+except ImportError:  # Python 2.6
+    try:
+        from nose import SkipTest
+    except ImportError:
+        SkipTest = None
 
 from dipy.utils.tripwire import TripWire
 
-if have_nose:
-    class OptionalImportError(ImportError, nose.SkipTest):
+if SkipTest is not None:
+    class OptionalImportError(ImportError, SkipTest):
         pass
 else:
     class OptionalImportError(ImportError):
         pass
 
 
-def optional_package(name, trip_msg=None):
+def parse_version(version):
+    """ Returns the leading numbers of a version string as a tuple of ints
+
+    Examples
+    --------
+    >>> parse_version('0.15.0rc1')
+    (0, 15, 0)
+    >>> parse_version('1.8') < (1, 9)
+    True
+    """
+    match = re.match(r'\d+(\.\d+)*', version)
+    if match is None:
+        return ()
+    return tuple(int(n) for n in match.group().split('.'))
+
+
+def is_importable(name):
+    """ Returns True if the module `name` can be found
+
+    The module is only looked for: neither it, nor its parent packages (if
+    they are not imported yet) are imported.
+
+    Examples
+    --------
+    >>> is_importable('os.path')
+    True
+    >>> is_importable('not_a_package.module')
+    False
+    """
+    if name in sys.modules:
+        return True
+    path = None
+    parts = name.split('.')
+    for i in range(len(parts)):
+        sub_name = '.'.join(parts[:i + 1])
+        if sub_name in sys.modules:
+            path = getattr(sys.modules[sub_name], '__path__', None)
+        else:
+            path = _find_module_path(sub_name, path)
+            if path is False:
+                return False
+        if path is None and i < len(parts) - 1:
+            # Not a package
+            return False
+    return True
+
+
+def _find_module_path(name, path):
+    """ Returns the search path of the submodules of `name` (None if it is not
+    a package), or False if it cannot be found in `path` """
+    try:
+        from importlib.util import find_spec
+        from importlib.machinery import PathFinder
+    except ImportError:  # Python 2
+        import imp
+        try:
+            fobj, pathname, desc = imp.find_module(name.split('.')[-1],
+                                                   path)
+        except ImportError:
+            return False
+        if fobj is not None:
+            fobj.close()
+        return [pathname] if desc[2] == imp.PKG_DIRECTORY else None
+    if path is None:
+        spec = find_spec(name)
+    else:
+        spec = PathFinder.find_spec(name, path)
+    if spec is None:
+        return False
+    return spec.submodule_search_locations
+
+
+class LazyModule(object):
+    """ Module imported the first time one of its attributes is accessed
+
+    Heavy modules used in a few functions only can be bound at the top of a
+    module without slowing down its import.
+
+    Parameters
+    ----------
+    name : str
+        Name of the module.
+    trip_msg : None or str
+        Message of the ``TripWireError`` raised when an attribute is
+        accessed, if the module cannot be imported. Default message if None.
+
+    Examples
+    --------
+    >>> opt = LazyModule('scipy.optimize')
+    >>> opt
+    <lazily imported module 'scipy.optimize'>
+    >>> callable(opt.leastsq)
+    True
+    """
+    def __init__(self, name, trip_msg=None):
+        if trip_msg is None:
+            trip_msg = ('We need package %s for these functions, but '
+                        '``import %s`` raised an ImportError'
+                        % (name, name))
+        self.__dict__['_name'] = name
+        self.__dict__['_trip_msg'] = trip_msg
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            try:
+                module = importlib.import_module(self._name)
+            except ImportError:
+                module = TripWire(self._trip_msg)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr_name):
+        return getattr(self._load(), attr_name)
+
+    def __setattr__(self, attr_name, value):
+        setattr(self._load(), attr_name, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self.__dict__['_module'] is None:
+            return '<lazily imported module %r>' % self._name
+        return repr(self._module)
+
+
+def optional_package(name, trip_msg=None, lazy=False):
     """ Return package-like thing and module setup for package `name`
 
     Parameters
@@ -33,14 +166,19 @@ def optional_package(name, trip_msg=None):
         message to give when someone tries to use the return package, but we
         could not import it, and have returned a TripWire object instead.
         Default message if None.
+    lazy : bool, optional
+        If True and the package can be found without importing it (see
+        `is_importable`), it is imported the first time one of its
+        attributes is accessed. Default False.
 
     Returns
     -------
-    pkg_like : module or ``TripWire`` instance
-        If we can import the package, return it.  Otherwise return an object
-        raising an error when accessed
+    pkg_like : module, ``LazyModule`` or ``TripWire`` instance
+        If we can import the package, return it (a ``LazyModule`` if `lazy`
+        is True).  Otherwise return an object raising an error when accessed
     have_pkg : bool
-        True if import for package was successful, false otherwise
+        True if import for package was successful (or, if `lazy` is True,
+        if the package was found), false otherwise
     module_setup : function
         callable usually set as ``setup_module`` in calling namespace, to allow
         skipping tests.
@@ -76,7 +214,23 @@ def optional_package(name, trip_msg=None):
     >>> subpkg, _, _ = optional_package('os.path')
     >>> hasattr(subpkg, 'dirname')
     True
+
+    A heavy package can be imported only when it is used
+
+    >>> pkg, have_pkg, _ = optional_package('os.path', lazy=True)
+    >>> pkg
+    <lazily imported module 'os.path'>
+    >>> have_pkg, hasattr(pkg, 'dirname')
+    (True, True)
     """
+    if trip_msg is None:
+        trip_msg = ('We need package %s for these functions, but '
+                    '``import %s`` raised an ImportError'
+                    % (name, name))
+    if lazy and is_importable(name):
+        return LazyModule(name, trip_msg), True, lambda: None
+    # Modules added by their package when it is imported cannot be found
+    # without importing it
     try:
         pkg = importlib.import_module(name)
     except ImportError:
@@ -84,14 +238,9 @@ def optional_package(name, trip_msg=None):
     else:  # import worked
         # top level module
         return pkg, True, lambda: None
-    if trip_msg is None:
-        trip_msg = ('We need package %s for these functions, but '
-                    '``import %s`` raised an ImportError'
-                    % (name, name))
     pkg = TripWire(trip_msg)
 
     def setup_module():
-        if have_nose:
-            raise nose.plugins.skip.SkipTest('No %s for these tests'
-                                             % name)
+        if SkipTest is not None:
+            raise SkipTest('No %s for these tests' % name)
     return pkg, False, setup_module
@@ -0,0 +1,35 @@
+""" Test callables of the packages, importing numpy.testing only when the
+tests are run """
+from os.path import dirname
+
+
+class LazyTester(object):
+    """ ``numpy.testing.Tester`` of a package, created when it is used
+
+    Parameters
+    ----------
+    package_file : str
+        The ``__file__`` of the package.
+
+    Examples
+    --------
+    >>> import dipy.core
+    >>> tester = LazyTester(dipy.core.__file__)
+    >>> tester.package_path == dirname(dipy.core.__file__)
+    True
+    """
+    def __init__(self, package_file):
+        self.package_path = dirname(package_file)
+
+    def _tester(self):
+        from numpy.testing import Tester
+        return Tester(self.package_path)
+
+    def test(self, *args, **kwargs):
+        """ Runs the tests of the package, see ``numpy.testing.Tester`` """
+        return self._tester().test(*args, **kwargs)
+
+    def bench(self, *args, **kwargs):
+        """ Runs the benchmarks of the package, see
+        ``numpy.testing.Tester`` """
+        return self._tester().bench(*args, **kwargs)
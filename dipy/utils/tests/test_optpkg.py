@@ -0,0 +1,63 @@
+""" Testing optpkg module.
+"""
+import sys
+
+from dipy.utils.optpkg import (optional_package, is_importable, LazyModule,
+                               parse_version, SkipTest)
+from dipy.utils.tripwire import TripWire, TripWireError, is_tripwire
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal)
+
+
+def test_parse_version():
+    assert_equal(parse_version('1.8'), (1, 8))
+    assert_equal(parse_version('0.15.0rc1'), (0, 15, 0))
+    assert_equal(parse_version('1.10.1'), (1, 10, 1))
+    assert_equal(parse_version('dev'), ())
+    assert_true(parse_version('1.10.1') > (1, 8))
+    assert_true(parse_version('0.9.0') < (0, 12))
+
+
+def test_is_importable():
+    assert_true(is_importable('os'))
+    assert_true(is_importable('os.path'))
+    assert_true(is_importable('json.decoder'))
+    assert_false(is_importable('not_a_package'))
+    assert_false(is_importable('json.not_a_module'))
+    # json.decoder is a module, not a package
+    assert_false(is_importable('json.decoder.not_a_module'))
+
+
+def test_lazy_module():
+    # A module of the standard library that we do not use
+    sys.modules.pop('colorsys', None)
+    colorsys = LazyModule('colorsys')
+    assert_false('colorsys' in sys.modules)
+    assert_equal(repr(colorsys), "<lazily imported module 'colorsys'>")
+    assert_equal(colorsys.rgb_to_hsv(1, 0, 0), (0, 1, 1))
+    assert_true('colorsys' in sys.modules)
+    assert_true(repr(colorsys).startswith("<module 'colorsys'"))
+    assert_true('rgb_to_hsv' in dir(colorsys))
+
+    missing = LazyModule('not_a_package', 'We do not have not_a_package')
+    assert_true(is_tripwire(missing))
+    assert_raises(TripWireError, getattr, missing, 'some_function')
+
+
+def test_optional_package_lazy():
+    sys.modules.pop('colorsys', None)
+    colorsys, have_colorsys, setup_module = optional_package('colorsys',
+                                                             lazy=True)
+    assert_true(have_colorsys)
+    assert_true(isinstance(colorsys, LazyModule))
+    assert_false('colorsys' in sys.modules)
+    setup_module()
+    assert_equal(colorsys.hsv_to_rgb(0, 0, 1), (1, 1, 1))
+
+    pkg, have_pkg, setup_module = optional_package('not_a_package',
+                                                   lazy=True)
+    assert_false(have_pkg)
+    assert_true(isinstance(pkg, TripWire))
+    if SkipTest is not None:
+        assert_raises(SkipTest, setup_module)
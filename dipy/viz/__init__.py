@@ -1,16 +1,15 @@
 # Init file for visualization package
 from __future__ import division, print_function, absolute_import
 
-# We make the visualization requirements optional imports:
+from dipy.utils.optpkg import optional_package
 
-try:
-    import matplotlib
-    has_mpl = True
-except ImportError:
+# We make the visualization requirements optional imports, matplotlib is only
+# imported when the projections are used:
+_, has_mpl, _ = optional_package('matplotlib', lazy=True)
+if not has_mpl:
     e_s = "You do not have Matplotlib installed. Some visualization functions"
     e_s += " might not work for you."
     print(e_s)
-    has_mpl = False
 
 if has_mpl:
-    from . import projections
+    projections, _, _ = optional_package('dipy.viz.projections', lazy=True)
@@ -10,9 +10,10 @@ from dipy.viz.utils import set_input
 from dipy.utils.optpkg import optional_package
 
 # Allow import, but disable doctests if we don't have vtk
-vtk, have_vtk, setup_module = optional_package('vtk')
-colors, have_vtk_colors, _ = optional_package('vtk.util.colors')
-numpy_support, have_ns, _ = optional_package('vtk.util.numpy_support')
+vtk, have_vtk, setup_module = optional_package('vtk', lazy=True)
+colors, have_vtk_colors, _ = optional_package('vtk.util.colors', lazy=True)
+numpy_support, have_ns, _ = optional_package('vtk.util.numpy_support',
+                                            lazy=True)
 
 if have_vtk:
 
@@ -4,7 +4,7 @@ import numpy as np
 from dipy.utils.optpkg import optional_package
 
 # Allow import, but disable doctests if we don't have vtk
-vtk, have_vtk, setup_module = optional_package('vtk')
+vtk, have_vtk, setup_module = optional_package('vtk', lazy=True)
 
 
 def colormap_lookup_table(scale_range=(0, 1), hue_range=(0.8, 0),
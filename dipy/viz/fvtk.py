@@ -30,10 +30,10 @@ from dipy.core.ndindex import ndindex
 from dipy.utils.optpkg import optional_package
 
 # Allow import, but disable doctests if we don't have vtk
-vtk, have_vtk, setup_module = optional_package('vtk')
-colors, have_vtk_colors, _ = optional_package('vtk.util.colors')
+vtk, have_vtk, setup_module = optional_package('vtk', lazy=True)
+colors, have_vtk_colors, _ = optional_package('vtk.util.colors', lazy=True)
 
-cm, have_matplotlib, _ = optional_package('matplotlib.cm')
+cm, have_matplotlib, _ = optional_package('matplotlib.cm', lazy=True)
 
 if have_matplotlib:
     get_cmap = cm.get_cmap
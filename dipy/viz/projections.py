@@ -11,10 +11,10 @@ from dipy.utils.optpkg import optional_package
 import dipy.core.geometry as geo
 from dipy.testing import doctest_skip_parser
 
-matplotlib, has_mpl, setup_module = optional_package("matplotlib")
-plt, _, _ = optional_package("matplotlib.pyplot")
-tri, _, _ = optional_package("matplotlib.tri")
-bm, has_basemap, _ = optional_package("mpl_toolkits.basemap")
+matplotlib, has_mpl, setup_module = optional_package("matplotlib", lazy=True)
+plt, _, _ = optional_package("matplotlib.pyplot", lazy=True)
+tri, _, _ = optional_package("matplotlib.tri", lazy=True)
+bm, has_basemap, _ = optional_package("mpl_toolkits.basemap", lazy=True)
 
 
 @doctest_skip_parser
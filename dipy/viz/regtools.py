@@ -1,7 +1,7 @@
 import numpy as np
 from dipy.utils.optpkg import optional_package
-matplotlib, has_mpl, setup_module = optional_package("matplotlib")
-plt, _, _ = optional_package("matplotlib.pyplot")
+matplotlib, has_mpl, setup_module = optional_package("matplotlib", lazy=True)
+plt, _, _ = optional_package("matplotlib.pyplot", lazy=True)
 
 
 def _tile_plot(imgs, titles, **kwargs):
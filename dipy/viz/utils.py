@@ -10,8 +10,9 @@ from dipy.utils.optpkg import optional_package
 
 # import vtk
 # Allow import, but disable doctests if we don't have vtk
-vtk, have_vtk, setup_module = optional_package('vtk')
-ns, have_numpy_support, _ = optional_package('vtk.util.numpy_support')
+vtk, have_vtk, setup_module = optional_package('vtk', lazy=True)
+ns, have_numpy_support, _ = optional_package('vtk.util.numpy_support',
+                                             lazy=True)
 
 
 def numpy_to_vtk_points(points):
@@ -31,12 +31,13 @@ from dipy.utils.six import string_types
 
 # import vtk
 # Allow import, but disable doctests if we don't have vtk
-vtk, have_vtk, setup_module = optional_package('vtk')
-colors, have_vtk_colors, _ = optional_package('vtk.util.colors')
-numpy_support, have_ns, _ = optional_package('vtk.util.numpy_support')
-_, have_imread, _ = optional_package('Image')
+vtk, have_vtk, setup_module = optional_package('vtk', lazy=True)
+colors, have_vtk_colors, _ = optional_package('vtk.util.colors', lazy=True)
+numpy_support, have_ns, _ = optional_package('vtk.util.numpy_support',
+                                            lazy=True)
+_, have_imread, _ = optional_package('Image', lazy=True)
 if not have_imread:
-    _, have_imread, _ = optional_package('PIL')
+    _, have_imread, _ = optional_package('PIL', lazy=True)
 
 if have_vtk:
     version = vtk.vtkVersion.GetVTKSourceVersion().split(' ')[-1]
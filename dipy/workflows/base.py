@@ -3,6 +3,7 @@ from dipy.fixes import argparse as arg
 import inspect
 
 from dipy.workflows.docstring_parser import NumpyDocString
+from dipy.workflows.runner import SKIP_CHECKS
 
 
 class IntrospectiveArgumentParser(arg.ArgumentParser):
@@ -60,7 +61,10 @@ class IntrospectiveArgumentParser(arg.ArgumentParser):
         self.doc = None
 
     def add_workflow(self, workflow):
-        specs = inspect.getargspec(workflow)
+        try:
+            specs = inspect.getfullargspec(workflow)
+        except AttributeError:
+            specs = inspect.getargspec(workflow)
         doc = inspect.getdoc(workflow)
         self.doc = NumpyDocString(doc)['Parameters']
 
@@ -122,6 +126,32 @@ class IntrospectiveArgumentParser(arg.ArgumentParser):
 
         return dict((k, v) for k, v in dct.items() if v is not None)
 
+    def add_runner_arguments(self):
+        """ Adds the options of ``dipy.workflows.runner.run_flow``, to
+        process many subjects at once """
+        self.add_argument('--processes', type=int, default=1,
+                          metavar='int',
+                          help='Number of subjects processed in parallel '
+                               '(default 1)')
+        self.add_argument('--skip', choices=SKIP_CHECKS, default='mtime',
+                          help='Skip the subjects whose outputs are more '
+                               'recent than the inputs (mtime), or were '
+                               'computed from the same inputs and '
+                               'parameters (hash) (default mtime)')
+        self.add_argument('--log_file', type=str, metavar='str',
+                          help='JSON file where the time and memory used '
+                               'for each subject are saved')
+
+    def get_run_args(self, args=None, namespace=None):
+        """ Returns the arguments of the workflow and the arguments of
+        ``run_flow``, as two dictionaries """
+        flow_args = self.get_flow_args(args, namespace)
+        run_args = {}
+        for name in ('processes', 'skip', 'log_file'):
+            if name in flow_args:
+                run_args[name] = flow_args.pop(name)
+        return flow_args, run_args
+
     def update_argument(self, *args, **kargs):
         self.add_argument(*args, **kargs)
 
@@ -0,0 +1,192 @@
+from __future__ import division, print_function, absolute_import
+
+from os.path import join
+
+import numpy as np
+
+from dipy.core.gradients import gradient_table
+from dipy.io.gradients import read_bvals_bvecs
+from dipy.io.image import ImageDataProxy
+from dipy.io.utils import nifti1_symmat
+from dipy.utils.optpkg import LazyModule
+from dipy.workflows.utils import choose_create_out_dir, split_image_name
+from dipy.workflows.runner import workflow, iter_inputs
+
+nib = LazyModule('nibabel')
+
+
+def _load_subject(fpath, fbvals, fbvecs, mask_fpath, b0_threshold):
+    img = nib.load(fpath)
+    # The models read the data slab by slab
+    data = ImageDataProxy(img)
+    bvals, bvecs = read_bvals_bvecs(fbvals, fbvecs)
+    gtab = gradient_table(bvals, bvecs, b0_threshold=b0_threshold)
+    mask = None
+    if mask_fpath is not None:
+        mask = nib.load(mask_fpath).get_data() > 0
+    return img, data, gtab, mask
+
+
+@workflow(outputs=['{name}_tensors{ext}', '{name}_fa{ext}', '{name}_md{ext}',
+                   '{name}_ad{ext}', '{name}_rd{ext}', '{name}_rgb{ext}',
+                   '{name}_evecs{ext}', '{name}_evals{ext}'],
+          inputs=['input_files', 'bvalues', 'bvectors', 'mask_files'])
+def dti_flow(input_files, bvalues, bvectors, mask_files='', out_dir='',
+             b0_threshold=0.0):
+    """ Workflow fitting the diffusion tensor model.
+
+    It fits the tensor model on each file found by 'globing' ``input_files``
+    and saves the tensors and the maps of their metrics in a directory
+    specified by ``out_dir``.
+
+    Parameters
+    ----------
+    input_files : string
+        Path to the input volumes. This path may contain wildcards to process
+        multiple inputs at once.
+    bvalues : string
+        Path to the bvalues files. This path may contain wildcards to use
+        multiple bvalues files at once.
+    bvectors : string
+        Path to the bvectors files. This path may contain wildcards to use
+        multiple bvectors files at once.
+    mask_files : string, optional
+        Path to the masks of the voxels fitted. This path may contain
+        wildcards to use multiple masks at once. (default: no mask)
+    out_dir : string, optional
+        Output directory (default input file directory)
+    b0_threshold : float, optional
+        Threshold used to find the b=0 volumes (default 0.0)
+
+    Outputs
+    -------
+    tensors : Nifti File
+        The tensors, in the lower triangular order of ``nifti1_symmat``.
+    fa : Nifti File
+        Fractional anisotropy.
+    md : Nifti File
+        Mean diffusivity.
+    ad : Nifti File
+        Axial diffusivity.
+    rd : Nifti File
+        Radial diffusivity.
+    rgb : Nifti File
+        Fractional anisotropy colored by the principal direction.
+    evecs : Nifti File
+        Eigenvectors of the tensors.
+    evals : Nifti File
+        Eigenvalues of the tensors.
+    """
+    from dipy.reconst.dti import TensorModel
+
+    for fpath, fbvals, fbvecs, mask_fpath in iter_inputs(
+            input_files, bvalues, bvectors, mask_files):
+        print('')
+        print('Fitting the tensor model on {0}'.format(fpath))
+        img, data, gtab, mask = _load_subject(fpath, fbvals, fbvecs,
+                                              mask_fpath, b0_threshold)
+        affine = img.get_affine()
+        tenfit = TensorModel(gtab).fit(data, mask)
+
+        fname, ext = split_image_name(fpath)
+        out_dir_path = choose_create_out_dir(out_dir, fpath)
+
+        tensors = tenfit.lower_triangular().astype(np.float32)
+        nib.save(nifti1_symmat(tensors, affine),
+                 join(out_dir_path, fname + '_tensors' + ext))
+        fa = np.clip(np.nan_to_num(tenfit.fa), 0, 1)
+        rgb = np.clip(255 * np.abs(fa[..., None] * tenfit.evecs[..., 0]),
+                      0, 255)
+        metrics = [('fa', fa), ('md', tenfit.md), ('ad', tenfit.ad),
+                   ('rd', tenfit.rd), ('rgb', rgb.astype(np.uint8)),
+                   ('evecs', tenfit.evecs), ('evals', tenfit.evals)]
+        for name, metric in metrics:
+            if metric.dtype != np.uint8:
+                metric = metric.astype(np.float32)
+            metric_path = join(out_dir_path, fname + '_' + name + ext)
+            nib.save(nib.Nifti1Image(metric, affine), metric_path)
+        print('Tensors and metrics saved in {0}'.format(out_dir_path))
+
+
+@workflow(outputs=['{name}_peaks', '{name}_gfa{ext}'],
+          inputs=['input_files', 'bvalues', 'bvectors', 'mask_files'])
+def csd_peaks_flow(input_files, bvalues, bvectors, mask_files='', out_dir='',
+                   b0_threshold=0.0, sh_order=8, roi_radius=10, fa_thr=0.7,
+                   relative_peak_threshold=0.5, min_separation_angle=25,
+                   npeaks=5):
+    """ Workflow extracting peaks with constrained spherical deconvolution.
+
+    For each file found by 'globing' ``input_files``, it estimates the
+    response function from the voxels of high FA, fits the CSD model and
+    saves its peaks (see ``dipy.io.peaks.save_peaks``) and the GFA map in a
+    directory specified by ``out_dir``.
+
+    Parameters
+    ----------
+    input_files : string
+        Path to the input volumes. This path may contain wildcards to process
+        multiple inputs at once.
+    bvalues : string
+        Path to the bvalues files. This path may contain wildcards to use
+        multiple bvalues files at once.
+    bvectors : string
+        Path to the bvectors files. This path may contain wildcards to use
+        multiple bvectors files at once.
+    mask_files : string, optional
+        Path to the masks of the voxels fitted. This path may contain
+        wildcards to use multiple masks at once. (default: no mask)
+    out_dir : string, optional
+        Output directory (default input file directory)
+    b0_threshold : float, optional
+        Threshold used to find the b=0 volumes (default 0.0)
+    sh_order : int, optional
+        Spherical harmonics order of the model (default 8)
+    roi_radius : int, optional
+        Radius of the cubic ROI, at the center of the volume, where the
+        response function is estimated (default 10)
+    fa_thr : float, optional
+        FA threshold of the voxels used to estimate the response function
+        (default 0.7)
+    relative_peak_threshold : float, optional
+        Only return peaks greater than ``relative_peak_threshold * m`` where
+        m is the largest peak (default 0.5)
+    min_separation_angle : float, optional
+        The minimum angle between directions [0, 90] (default 25)
+    npeaks : int, optional
+        Maximum number of peaks per voxel (default 5)
+
+    Outputs
+    -------
+    peaks : Directory
+        The peaks and metrics, read with ``dipy.io.peaks.load_peaks``.
+    gfa : Nifti File
+        Generalized fractional anisotropy.
+    """
+    from dipy.data import get_sphere
+    from dipy.direction.peaks import peaks_from_model
+    from dipy.reconst.csdeconv import (ConstrainedSphericalDeconvModel,
+                                       auto_response)
+
+    sphere = get_sphere('symmetric724')
+    for fpath, fbvals, fbvecs, mask_fpath in iter_inputs(
+            input_files, bvalues, bvectors, mask_files):
+        print('')
+        print('Extracting the CSD peaks of {0}'.format(fpath))
+        img, data, gtab, mask = _load_subject(fpath, fbvals, fbvecs,
+                                              mask_fpath, b0_threshold)
+        response, ratio = auto_response(gtab, data, roi_radius=roi_radius,
+                                        fa_thr=fa_thr)
+        csd_model = ConstrainedSphericalDeconvModel(gtab, response,
+                                                    sh_order=sh_order)
+
+        fname, ext = split_image_name(fpath)
+        out_dir_path = choose_create_out_dir(out_dir, fpath)
+        peaks_dir = join(out_dir_path, fname + '_peaks')
+        pam = peaks_from_model(csd_model, data, sphere,
+                               relative_peak_threshold, min_separation_angle,
+                               mask=mask, return_sh=True, sh_order=sh_order,
+                               npeaks=npeaks, out_dir=peaks_dir)
+        gfa_img = nib.Nifti1Image(np.asarray(pam.gfa, dtype=np.float32),
+                                  img.get_affine())
+        nib.save(gfa_img, join(out_dir_path, fname + '_gfa' + ext))
+        print('Peaks saved in {0}'.format(peaks_dir))
@@ -0,0 +1,307 @@
+""" Running workflows over many subjects
+
+A workflow (flow) is a function whose input files are given as glob
+patterns, such as ``median_otsu_flow``. The `workflow` decorator declares
+which parameters of the flow are input files and the names of the files it
+writes. With these, `run_flow` matches the input patterns subject by
+subject, skips the subjects whose outputs are up to date and runs the flow
+on the others, possibly on a pool of processes, recording the time and the
+memory used for every subject.
+"""
+from __future__ import division, print_function, absolute_import
+
+import inspect
+import json
+import hashlib
+import os
+import time
+import traceback
+from glob import glob
+from multiprocessing import Pool
+from os.path import join, exists, getmtime, isdir, dirname, basename
+
+from dipy.core.profile import peak_memory
+from dipy.workflows.utils import get_out_dir, split_image_name
+
+SKIP_CHECKS = ('mtime', 'hash', 'none')
+
+
+def workflow(outputs, inputs=None):
+    """ Declares the input and output files of a flow
+
+    Parameters
+    ----------
+    outputs : sequence of str
+        Names of the files (or directories) written for each subject, as
+        templates formatted with ``name`` and ``ext``, the base name and
+        extension of the first input file (see ``split_image_name``), e.g.
+        ``'{name}_fa{ext}'``. They are written in the output directory
+        chosen by ``choose_create_out_dir`` from the ``out_dir`` parameter of
+        the flow and the first input file.
+    inputs : sequence of str, optional
+        Names of the parameters of the flow which are input files. Default
+        is the positional parameters of the flow.
+    """
+    def decorate(flow):
+        flow.outputs = tuple(outputs)
+        flow.inputs = None if inputs is None else tuple(inputs)
+        return flow
+    return decorate
+
+
+def _getargspec(func):
+    try:
+        return inspect.getfullargspec(func)
+    except AttributeError:
+        return inspect.getargspec(func)
+
+
+def flow_inputs(flow):
+    """ Returns the names of the parameters of `flow` which are input
+    files """
+    inputs = getattr(flow, 'inputs', None)
+    if inputs is not None:
+        return list(inputs)
+    specs = _getargspec(flow)
+    nb_optional = len(specs.defaults) if specs.defaults else 0
+    return list(specs.args[:len(specs.args) - nb_optional])
+
+
+def flow_outputs(flow, in_file, out_dir=''):
+    """ Returns the paths of the files written by `flow` for a subject
+
+    Parameters
+    ----------
+    flow : function
+        Flow decorated with `workflow`.
+    in_file : str
+        First input file of the subject.
+    out_dir : str, optional
+        The ``out_dir`` parameter of the flow.
+    """
+    name, ext = split_image_name(in_file)
+    out_dir_path = get_out_dir(out_dir, in_file)
+    return [join(out_dir_path, template.format(name=name, ext=ext))
+            for template in flow.outputs]
+
+
+def iter_inputs(*patterns):
+    """ Matches glob patterns of input files subject by subject
+
+    The files matched by each pattern are sorted, and the i-th subject is
+    made of the i-th file of every pattern. A pattern matching a single
+    file (e.g. the b-values shared by all the subjects) is used for all the
+    subjects, and an empty pattern gives None for all the subjects.
+
+    Parameters
+    ----------
+    patterns : str
+        Glob patterns of the input files.
+
+    Yields
+    ------
+    in_files : tuple of str
+        The input files of a subject, one per pattern.
+    """
+    matches = []
+    for pattern in patterns:
+        if pattern:
+            files = sorted(glob(pattern))
+            if not files:
+                raise IOError('No file matches {0}'.format(pattern))
+            matches.append(files)
+        else:
+            matches.append(None)
+    sizes = set(len(files) for files in matches
+                if files is not None and len(files) > 1)
+    if len(sizes) > 1:
+        raise ValueError('The input patterns match different numbers of '
+                         'files: {0}'.format(patterns))
+    nb_subjects = sizes.pop() if sizes else 1
+    for i in range(nb_subjects):
+        yield tuple(None if files is None else files[i if len(files) > 1
+                                                     else 0]
+                    for files in matches)
+
+
+def file_hash(fname, block_size=2 ** 20):
+    """ Returns the md5 digest of a file, or of all the files of a
+    directory """
+    md5 = hashlib.md5()
+    if isdir(fname):
+        for name in sorted(os.listdir(fname)):
+            md5.update(name.encode('utf-8'))
+            md5.update(file_hash(join(fname, name), block_size).encode())
+        return md5.hexdigest()
+    with open(fname, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            md5.update(block)
+            block = f.read(block_size)
+    return md5.hexdigest()
+
+
+def _stamp_path(out_files):
+    return join(dirname(out_files[0]), '.' + basename(out_files[0]) +
+                '.stamp')
+
+
+def _normalize(params):
+    # Parameters as read back from a json file
+    return json.loads(json.dumps(params, sort_keys=True, default=repr))
+
+
+def is_up_to_date(in_files, out_files, check='mtime', params=None):
+    """ Checks whether the outputs of a subject need to be computed again
+
+    Parameters
+    ----------
+    in_files : sequence of str
+        The input files (None entries are ignored).
+    out_files : sequence of str
+        The output files.
+    check : {'mtime', 'hash', 'none'}, optional
+        With 'mtime', the outputs are up to date if they exist and are more
+        recent than the inputs. With 'hash', they are up to date if they
+        exist and the content of the inputs and the parameters have not
+        changed since they were computed (see `write_stamp`). With 'none',
+        the outputs are never up to date.
+    params : dict, optional
+        The parameters of the flow, compared with 'hash'.
+
+    Returns
+    -------
+    up_to_date : bool
+    """
+    if check not in SKIP_CHECKS:
+        raise ValueError('Unknown check {0}, use one of {1}'.format(
+            check, SKIP_CHECKS))
+    in_files = [f for f in in_files if f is not None]
+    if check == 'none' or not all(exists(f) for f in out_files):
+        return False
+    if check == 'mtime':
+        if not in_files:
+            return True
+        return (min(getmtime(f) for f in out_files) >=
+                max(getmtime(f) for f in in_files))
+
+    stamp = _stamp_path(out_files)
+    if not exists(stamp):
+        return False
+    with open(stamp) as f:
+        recorded = json.load(f)
+    return (recorded['params'] == _normalize(params or {}) and
+            recorded['inputs'] == dict((f, file_hash(f)) for f in in_files))
+
+
+def write_stamp(in_files, out_files, params=None):
+    """ Records the hashes of the inputs and the parameters used to compute
+    `out_files`, checked by ``is_up_to_date(..., check='hash')`` """
+    in_files = [f for f in in_files if f is not None]
+    record = {'inputs': dict((f, file_hash(f)) for f in in_files),
+              'params': _normalize(params or {})}
+    with open(_stamp_path(out_files), 'w') as f:
+        json.dump(record, f, sort_keys=True, indent=2)
+
+
+def _run_task(task):
+    """ Runs a flow for a subject and returns its record """
+    flow, kwargs, record = task
+    start = time.time()
+    try:
+        flow(**kwargs)
+        record['status'] = 'done'
+    except Exception:
+        record['status'] = 'failed'
+        record['error'] = traceback.format_exc()
+    record['time'] = time.time() - start
+    record['peak_memory'] = peak_memory()
+    return record
+
+
+def run_flow(flow, flow_args, processes=1, skip='mtime', log_file=None,
+             verbose=True):
+    """ Runs a flow for every subject matched by its input patterns
+
+    Parameters
+    ----------
+    flow : function
+        Flow decorated with `workflow`.
+    flow_args : dict
+        Arguments of the flow, with glob patterns for the input files (see
+        `iter_inputs`).
+    processes : int, optional
+        Number of subjects processed in parallel. With more than one
+        process, each subject is processed in a new process, so that the
+        recorded peak memory is the one of the subject. Default is 1, the
+        subjects are processed one after the other in the current process.
+    skip : {'mtime', 'hash', 'none'}, optional
+        How the subjects whose outputs are up to date are found, see
+        `is_up_to_date`. Default 'mtime'.
+    log_file : str, optional
+        JSON file where the records are saved.
+    verbose : bool, optional
+        Print a line per subject.
+
+    Returns
+    -------
+    records : list of dict
+        For every subject, its ``inputs`` and ``outputs``, its ``status``
+        ('done', 'skipped' or 'failed', with the traceback in ``error``),
+        and for the processed subjects the ``time`` spent (in seconds) and
+        the ``peak_memory`` of the process (in MB).
+    """
+    input_names = flow_inputs(flow)
+    params = dict((k, v) for k, v in flow_args.items()
+                  if k not in input_names)
+    out_dir = flow_args.get('out_dir', '')
+
+    records = []
+    tasks = []
+    for in_files in iter_inputs(*[flow_args.get(name, '')
+                                  for name in input_names]):
+        out_files = flow_outputs(flow, in_files[0], out_dir)
+        record = {'inputs': list(in_files), 'outputs': out_files}
+        records.append(record)
+        if is_up_to_date(in_files, out_files, skip, params):
+            record['status'] = 'skipped'
+            continue
+        kwargs = dict(params)
+        for name, fname in zip(input_names, in_files):
+            if fname is not None:
+                kwargs[name] = fname
+        tasks.append((flow, kwargs, record))
+
+    if processes > 1 and len(tasks) > 1:
+        pool = Pool(processes, maxtasksperchild=1)
+        try:
+            results = pool.map(_run_task, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for (_, _, record), result in zip(tasks, results):
+            record.update(result)
+    else:
+        for task in tasks:
+            _run_task(task)
+
+    for record in records:
+        if record['status'] == 'done' and skip == 'hash':
+            write_stamp(record['inputs'], record['outputs'], params)
+        if verbose:
+            _print_record(record)
+    if log_file is not None:
+        with open(log_file, 'w') as f:
+            json.dump(records, f, sort_keys=True, indent=2)
+    return records
+
+
+def _print_record(record):
+    msg = '{0}: {1}'.format(record['inputs'][0], record['status'])
+    if record['status'] != 'skipped':
+        msg += ' in {0:.2f} s'.format(record['time'])
+        if record['peak_memory'] is not None:
+            msg += ', peak memory {0:.0f} MB'.format(record['peak_memory'])
+    print(msg)
+    if record['status'] == 'failed':
+        print(record['error'])
@@ -1,15 +1,18 @@
 from __future__ import division, print_function, absolute_import
 
-from glob import glob
-from os.path import join, basename, splitext
+from os.path import join
 
-import nibabel as nib
 import numpy as np
 
-from dipy.workflows.utils import choose_create_out_dir
-from dipy.segment.mask import median_otsu
+from dipy.io.image import ImageDataProxy
+from dipy.utils.optpkg import LazyModule
+from dipy.workflows.utils import choose_create_out_dir, split_image_name
+from dipy.workflows.runner import workflow, iter_inputs
 
+nib = LazyModule('nibabel')
 
+
+@workflow(outputs=['{name}_mask{ext}'])
 def median_otsu_flow(input_files, out_dir='', save_masked=False,
                      median_radius=4, numpass=4, autocrop=False,
                      vol_idx=None, dilate=None):
@@ -51,20 +54,22 @@ def median_otsu_flow(input_files, out_dir='', save_masked=False,
             Volume representing the masked input. This file is saved
             save_masked is True.
     """
-    for fpath in glob(input_files):
+    # The flows import the modules doing the work when they run, so that
+    # their command line help is quick to show
+    from dipy.segment.mask import median_otsu
+
+    for fpath, in iter_inputs(input_files):
         print('')
         print('Applying median_otsu segmentation on {0}'.format(fpath))
         img = nib.load(fpath)
-        volume = img.get_data()
+        # Only the volumes used for the mask are read to compute it
+        volume = ImageDataProxy(img)
 
         masked, mask = median_otsu(volume, median_radius,
                                    numpass, autocrop,
                                    vol_idx, dilate)
 
-        fname, ext = splitext(basename(fpath))
-        if fname.endswith('.nii'):
-            fname, _ = splitext(fname)
-            ext = '.nii.gz'
+        fname, ext = split_image_name(fpath)
 
         mask_fname = fname + '_mask' + ext
 
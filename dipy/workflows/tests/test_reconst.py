@@ -0,0 +1,58 @@
+from os.path import join
+
+import numpy as np
+import nibabel as nib
+import numpy.testing as npt
+from nibabel.tmpdirs import InTemporaryDirectory
+
+from dipy.core.gradients import gradient_table
+from dipy.data import get_data
+from dipy.io.peaks import load_peaks
+from dipy.reconst.dti import TensorModel
+from dipy.workflows.reconst import dti_flow, csd_peaks_flow
+
+
+def _save_subject():
+    fimg, fbvals, fbvecs = get_data('small_64D')
+    bvals, bvecs = np.load(fbvals), np.load(fbvecs)
+    np.savetxt('bvals', bvals)
+    np.savetxt('bvecs', bvecs.T)
+    img = nib.load(fimg)
+    nib.save(img, 'subj.nii.gz')
+    return img.get_data(), gradient_table(bvals, bvecs)
+
+
+def test_dti_flow():
+    with InTemporaryDirectory():
+        data, gtab = _save_subject()
+        mask = data[..., 0] > data[..., 0].mean()
+        nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)),
+                 'mask.nii.gz')
+        dti_flow('subj.nii.gz', 'bvals', 'bvecs', 'mask.nii.gz', 'out')
+
+        tenfit = TensorModel(gtab).fit(data, mask)
+        fa = nib.load(join('out', 'subj_fa.nii.gz')).get_data()
+        npt.assert_array_almost_equal(fa, tenfit.fa, decimal=5)
+        evals = nib.load(join('out', 'subj_evals.nii.gz')).get_data()
+        npt.assert_array_almost_equal(evals, tenfit.evals)
+        tensors = nib.load(join('out', 'subj_tensors.nii.gz')).get_data()
+        npt.assert_equal(tensors.shape, data.shape[:3] + (1, 6))
+        rgb = nib.load(join('out', 'subj_rgb.nii.gz')).get_data()
+        npt.assert_equal(rgb.dtype, np.uint8)
+
+
+def test_csd_peaks_flow():
+    with InTemporaryDirectory():
+        data, gtab = _save_subject()
+        csd_peaks_flow('subj.nii.gz', 'bvals', 'bvecs', out_dir='out',
+                       sh_order=6, roi_radius=3, fa_thr=0.5, npeaks=3)
+        pam = load_peaks(join('out', 'subj_peaks'))
+        npt.assert_equal(pam.peak_dirs.shape, data.shape[:3] + (3, 3))
+        npt.assert_equal(pam.shm_coeff.shape, data.shape[:3] + (28,))
+        gfa = nib.load(join('out', 'subj_gfa.nii.gz')).get_data()
+        npt.assert_array_almost_equal(gfa, pam.gfa)
+        del pam
+
+
+if __name__ == '__main__':
+    npt.run_module_suite()
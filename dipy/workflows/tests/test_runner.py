@@ -0,0 +1,155 @@
+import json
+import os
+import time
+from os.path import join
+
+import numpy.testing as npt
+from nibabel.tmpdirs import InTemporaryDirectory
+
+from dipy.workflows.runner import (workflow, flow_inputs, flow_outputs,
+                                   iter_inputs, is_up_to_date, write_stamp,
+                                   run_flow)
+from dipy.workflows.utils import choose_create_out_dir
+
+
+@workflow(outputs=['{name}_copy{ext}', '{name}_size.txt'],
+          inputs=['input_files', 'extra_files'])
+def copy_flow(input_files, extra_files='', out_dir='', repeat=1):
+    """ Workflow used to test the runner.
+
+    Parameters
+    ----------
+    input_files : string
+        Path to the input files.
+    extra_files : string, optional
+        Path to extra files, appended to the copies.
+    out_dir : string, optional
+        Output directory (default input file directory)
+    repeat : int, optional
+        Number of copies of the input in the output (default 1)
+    """
+    for fpath, extra in iter_inputs(input_files, extra_files):
+        choose_create_out_dir(out_dir, fpath)
+        copy_path, size_path = flow_outputs(copy_flow, fpath, out_dir)
+        with open(fpath) as f:
+            text = f.read()
+        if text == 'fail':
+            raise ValueError('Failure of ' + fpath)
+        if extra is not None:
+            with open(extra) as f:
+                text += f.read()
+        with open(copy_path, 'w') as f:
+            f.write(text * repeat)
+        with open(size_path, 'w') as f:
+            f.write(str(len(text)))
+
+
+def positional_flow(input_files, masks, out_dir=''):
+    pass
+
+
+def _write(fname, text):
+    with open(fname, 'w') as f:
+        f.write(text)
+
+
+def test_flow_inputs_outputs():
+    npt.assert_equal(flow_inputs(copy_flow), ['input_files', 'extra_files'])
+    npt.assert_equal(flow_inputs(positional_flow), ['input_files', 'masks'])
+    npt.assert_equal(flow_outputs(copy_flow, join('data', 'subj.nii.gz'),
+                                  'out'),
+                     [join('data', 'out', 'subj_copy.nii.gz'),
+                      join('data', 'out', 'subj_size.txt')])
+
+
+def test_iter_inputs():
+    with InTemporaryDirectory():
+        for name in ['b.nii', 'a.nii', 'a.bval', 'b.bval', 'bvecs']:
+            _write(name, name)
+        npt.assert_equal(list(iter_inputs('*.nii', '*.bval', 'bvecs', '')),
+                         [('a.nii', 'a.bval', 'bvecs', None),
+                          ('b.nii', 'b.bval', 'bvecs', None)])
+        npt.assert_raises(ValueError, list, iter_inputs('*.nii', '*'))
+        npt.assert_raises(IOError, list, iter_inputs('*.nii', '*.bvec'))
+
+
+def test_is_up_to_date():
+    with InTemporaryDirectory():
+        _write('in.txt', 'input')
+        npt.assert_equal(is_up_to_date(['in.txt'], ['out.txt']), False)
+        _write('out.txt', 'output')
+        now = time.time()
+        os.utime('in.txt', (now - 10, now - 10))
+        npt.assert_equal(is_up_to_date(['in.txt', None], ['out.txt']), True)
+        npt.assert_equal(is_up_to_date(['in.txt'], ['out.txt'], 'none'),
+                         False)
+        os.utime('in.txt', (now + 10, now + 10))
+        npt.assert_equal(is_up_to_date(['in.txt'], ['out.txt']), False)
+
+        # The content of the inputs and the parameters are compared
+        params = {'order': 8, 'values': (1, 2)}
+        npt.assert_equal(is_up_to_date(['in.txt'], ['out.txt'], 'hash',
+                                       params), False)
+        write_stamp(['in.txt'], ['out.txt'], params)
+        npt.assert_equal(is_up_to_date(['in.txt'], ['out.txt'], 'hash',
+                                       params), True)
+        npt.assert_equal(is_up_to_date(['in.txt'], ['out.txt'], 'hash',
+                                       {'order': 6, 'values': (1, 2)}),
+                         False)
+        _write('in.txt', 'other input')
+        npt.assert_equal(is_up_to_date(['in.txt'], ['out.txt'], 'hash',
+                                       params), False)
+        npt.assert_raises(ValueError, is_up_to_date, ['in.txt'],
+                          ['out.txt'], 'size')
+
+
+def test_run_flow():
+    with InTemporaryDirectory():
+        for name in ['a', 'b', 'c']:
+            _write(name + '.txt', name)
+        _write('extra.txt', '!')
+        args = {'input_files': '[abc].txt', 'extra_files': 'extra.txt',
+                'out_dir': 'out', 'repeat': 2}
+        for processes in [1, 2]:
+            for skip in ['mtime', 'hash']:
+                records = run_flow(copy_flow, args, processes, skip,
+                                   'log.json', verbose=False)
+                npt.assert_equal([r['status'] for r in records],
+                                 ['done'] * 3)
+                for r, name in zip(records, ['a', 'b', 'c']):
+                    npt.assert_equal(r['inputs'],
+                                     [name + '.txt', 'extra.txt'])
+                    npt.assert_(r['time'] >= 0)
+                    with open(join('out', name + '_copy.txt')) as f:
+                        npt.assert_equal(f.read(), (name + '!') * 2)
+                with open('log.json') as f:
+                    npt.assert_equal(json.load(f), records)
+
+                records = run_flow(copy_flow, args, processes, skip,
+                                   verbose=False)
+                npt.assert_equal([r['status'] for r in records],
+                                 ['skipped'] * 3)
+                for name in ['a', 'b', 'c']:
+                    os.remove(join('out', name + '_copy.txt'))
+
+        # Only the subjects with new inputs or parameters are processed
+        run_flow(copy_flow, args, skip='hash', verbose=False)
+        _write('b.txt', 'B')
+        records = run_flow(copy_flow, args, skip='hash', verbose=False)
+        npt.assert_equal([r['status'] for r in records],
+                         ['skipped', 'done', 'skipped'])
+        args['repeat'] = 3
+        records = run_flow(copy_flow, args, skip='hash', verbose=False)
+        npt.assert_equal([r['status'] for r in records], ['done'] * 3)
+
+        # Failures are recorded without stopping the other subjects
+        _write('b.txt', 'fail')
+        records = run_flow(copy_flow, args, processes=2, skip='none',
+                           verbose=False)
+        npt.assert_equal([r['status'] for r in records],
+                         ['done', 'failed', 'done'])
+        npt.assert_('Failure of b.txt' in records[1]['error'])
+
+
+if __name__ == '__main__':
+    npt.run_module_suite()
@@ -0,0 +1,54 @@
+from os.path import join
+
+import numpy as np
+import nibabel as nib
+import numpy.testing as npt
+from nibabel.tmpdirs import InTemporaryDirectory
+
+from dipy.data import get_sphere
+from dipy.direction.peaks import PeaksAndMetrics
+from dipy.io.peaks import save_peaks
+from dipy.io.streamline import load_trk
+from dipy.workflows.tracking import local_tracking_flow
+
+
+def test_local_tracking_flow():
+    sphere = get_sphere('repulsion724')
+    shape = (10, 6, 6)
+    # A single bundle along the x axis
+    pam = PeaksAndMetrics()
+    pam.sphere = sphere
+    x_index = np.argmax(sphere.vertices[:, 0])
+    pam.peak_indices = np.zeros(shape + (2,), dtype=np.int32)
+    pam.peak_indices[..., 0] = x_index
+    pam.peak_indices[..., 1] = -1
+    pam.peak_dirs = sphere.vertices[pam.peak_indices]
+    pam.peak_dirs[..., 1, :] = 0
+    pam.peak_values = np.zeros(shape + (2,))
+    pam.peak_values[..., 0] = 1
+    pam.qa = pam.peak_values.copy()
+    pam.gfa = np.zeros(shape)
+    pam.gfa[1:-1, 2:4, 2:4] = 1
+
+    with InTemporaryDirectory():
+        save_peaks('subj_peaks', pam)
+        seeds = np.zeros(shape, dtype=np.uint8)
+        seeds[5, 2:4, 2:4] = 1
+        affine = np.diag([2., 2., 2., 1.])
+        nib.save(nib.Nifti1Image(seeds, affine), 'seeds.nii.gz')
+        local_tracking_flow('subj_peaks', 'seeds.nii.gz', 'out',
+                            stopping_thr=0.5, step_size=0.5)
+
+        streamlines, hdr = load_trk(join('out', 'subj_peaks_tracks.trk'))
+        npt.assert_equal(len(streamlines), 4)
+        npt.assert_array_equal(hdr['dim'], shape)
+        npt.assert_array_equal(hdr['voxel_size'], [2, 2, 2])
+        for s in streamlines:
+            # Along x, in voxmm, from the first to the last voxel of the
+            # bundle
+            npt.assert_array_less(np.abs(s[:, 1:] - s[0, 1:]), 1)
+            npt.assert_(s[:, 0].min() < 5 and s[:, 0].max() > 15)
+
+
+if __name__ == '__main__':
+    npt.run_module_suite()
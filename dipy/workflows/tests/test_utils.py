@@ -1,6 +1,6 @@
 import numpy.testing as npt
 from os.path import join
-from dipy.workflows.utils import choose_create_out_dir
+from dipy.workflows.utils import choose_create_out_dir, split_image_name
 from nibabel.tmpdirs import InTemporaryDirectory
 
 
@@ -16,3 +16,10 @@ def test_choose_create_out_dir():
 
         result_path = choose_create_out_dir(tmp_dir, '')
         npt.assert_equal(result_path, tmp_dir)
+
+
+def test_split_image_name():
+    npt.assert_equal(split_image_name(join('data', 'subj.nii.gz')),
+                     ('subj', '.nii.gz'))
+    npt.assert_equal(split_image_name('subj.nii'), ('subj', '.nii'))
+    npt.assert_equal(split_image_name('subj_peaks'), ('subj_peaks', ''))
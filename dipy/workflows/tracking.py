@@ -0,0 +1,83 @@
+from __future__ import division, print_function, absolute_import
+
+from os.path import join
+
+import numpy as np
+
+from dipy.io.bvectxt import orientation_to_string
+from dipy.io.peaks import load_peaks
+from dipy.utils.optpkg import LazyModule
+from dipy.workflows.utils import choose_create_out_dir, split_image_name
+from dipy.workflows.runner import workflow, iter_inputs
+
+nib = LazyModule('nibabel')
+
+
+@workflow(outputs=['{name}_tracks.trk'])
+def local_tracking_flow(peaks_dirs, seeding_files, out_dir='',
+                        stopping_thr=0.2, seed_density=1, step_size=0.5,
+                        max_cross=1):
+    """ Workflow for deterministic local tracking along peaks.
+
+    For each peaks directory found by 'globing' ``peaks_dirs`` (as written
+    by ``csd_peaks_flow``), it tracks from the voxels of the seeding mask
+    until the GFA falls below ``stopping_thr``, and saves the streamlines in
+    a TrackVis file in a directory specified by ``out_dir``.
+
+    Parameters
+    ----------
+    peaks_dirs : string
+        Path to the peaks directories. This path may contain wildcards to
+        process multiple inputs at once.
+    seeding_files : string
+        Path to the seeding masks, which also give the affine of the
+        peaks. This path may contain wildcards to use multiple masks at once.
+    out_dir : string, optional
+        Output directory (default peaks directory parent)
+    stopping_thr : float, optional
+        GFA under which the tracking stops (default 0.2)
+    seed_density : int, optional
+        Number of seeds along each axis of a voxel (default 1)
+    step_size : float, optional
+        Step size in mm (default 0.5)
+    max_cross : int, optional
+        Maximum number of directions tracked from each seed (default 1)
+
+    Outputs
+    -------
+    tracks : TrackVis File
+        The streamlines, in voxmm coordinates.
+    """
+    from dipy.io.streamline import write_trk
+    from dipy.tracking import utils
+    from dipy.tracking.local import LocalTracking, ThresholdTissueClassifier
+
+    for peaks_dir, seeding_fpath in iter_inputs(peaks_dirs, seeding_files):
+        print('')
+        print('Tracking along the peaks of {0}'.format(peaks_dir))
+        pam = load_peaks(peaks_dir)
+        seed_img = nib.load(seeding_fpath)
+        affine = seed_img.get_affine()
+        voxel_size = np.array(seed_img.get_header().get_zooms()[:3])
+
+        # Points in voxmm (TrackVis) coordinates, where the center of voxel
+        # (i, j, k) is at (i + .5, j + .5, k + .5) * voxel_size
+        trk_affine = np.diag(np.append(voxel_size, 1.))
+        trk_affine[:3, 3] = voxel_size / 2.
+        seeds = utils.seeds_from_mask(seed_img.get_data() > 0,
+                                      density=[seed_density] * 3,
+                                      affine=trk_affine)
+        classifier = ThresholdTissueClassifier(
+            np.ascontiguousarray(pam.gfa, dtype=np.float64), stopping_thr)
+        streamlines = LocalTracking(pam, classifier, seeds, trk_affine,
+                                    step_size=step_size, max_cross=max_cross)
+
+        fname, _ = split_image_name(peaks_dir)
+        out_dir_path = choose_create_out_dir(out_dir, peaks_dir)
+        header = {'dim': pam.gfa.shape, 'voxel_size': voxel_size,
+                  'vox_to_ras': affine,
+                  'voxel_order': orientation_to_string(
+                      nib.io_orientation(affine))}
+        tracks_path = join(out_dir_path, fname + '_tracks.trk')
+        write_trk(tracks_path, list(streamlines), header)
+        print('Streamlines saved as {0}'.format(tracks_path))
@@ -1,7 +1,25 @@
-from os.path import join, dirname, isabs, exists
+from os.path import join, dirname, isabs, exists, basename, splitext
 from os import makedirs
 
 
+def get_out_dir(out_dir, root_path):
+    """Returns the output path chosen by ``choose_create_out_dir``, without
+    creating it.
+
+    Parameters:
+    -----------
+    out_dir : string
+        The directory where you want your output saved.
+    root_path : string
+        Directory where input data is located.
+    """
+    if out_dir == '':
+        return dirname(root_path)
+    elif not isabs(out_dir):
+        return join(dirname(root_path), out_dir)
+    return out_dir
+
+
 def choose_create_out_dir(out_dir, root_path):
     """Analyses the parameters and returns the appropriate output path.
     It creates the directory if it does not exists.
@@ -13,13 +31,33 @@ def choose_create_out_dir(out_dir, root_path):
     root_path : string
         Directory where input data is located.
     """
-    if out_dir == '':
-        result_path = dirname(root_path)
-    elif not isabs(out_dir):
-        result_path = join(dirname(root_path), out_dir)
-        if not exists(result_path):
-            makedirs(result_path)
-    else:
-        result_path = out_dir
+    result_path = get_out_dir(out_dir, root_path)
+    if out_dir != '' and not isabs(out_dir) and not exists(result_path):
+        makedirs(result_path)
 
     return result_path
+
+
+def split_image_name(fpath):
+    """Splits the name of an image file in its base name and extension.
+
+    ``.nii.gz`` is kept as a single extension, other compressed or
+    uncompressed files are split as with ``os.path.splitext``.
+
+    Parameters:
+    -----------
+    fpath : string
+        Path of the file.
+
+    Returns:
+    --------
+    fname : string
+        Name of the file, without its directory and extension.
+    ext : string
+        Extension of the file.
+    """
+    fname, ext = splitext(basename(fpath))
+    if fname.endswith('.nii'):
+        fname, _ = splitext(fname)
+        ext = '.nii.gz'
+    return fname, ext
@@ -67,6 +67,7 @@ for modulename, other_sources, language in (
     ('dipy.reconst.recspeed', [], 'c'),
     ('dipy.reconst.vec_val_sum', [], 'c'),
     ('dipy.reconst.quick_squash', [], 'c'),
+    ('dipy.io.trkspeed', [], 'c'),
     ('dipy.tracking.distances', [], 'c'),
     ('dipy.tracking.streamlinespeed', [], 'c'),
     ('dipy.tracking.local.localtrack', [], 'c'),
@@ -80,6 +81,7 @@ for modulename, other_sources, language in (
     ('dipy.segment.metricspeed', [], 'c'),
     ('dipy.segment.clusteringspeed', [], 'c'),
     ('dipy.segment.clustering_algorithms', [], 'c'),
+    ('dipy.segment.medianspeed', [], 'c'),
     ('dipy.denoise.denspeed', [], 'c'),
     ('dipy.denoise.enhancement_kernel', [], 'c'),
     ('dipy.denoise.shift_twist_convolution', [], 'c'),
@@ -89,7 +91,8 @@ for modulename, other_sources, language in (
     ('dipy.align.crosscorr', [], 'c'),
     ('dipy.align.bundlemin', [], 'c'),
     ('dipy.align.transforms', [], 'c'),
-    ('dipy.align.parzenhist', [], 'c')):
+    ('dipy.align.parzenhist', [], 'c'),
+    ('dipy.utils.omp', [], 'c')):
 
     pyx_src = pjoin(*modulename.split('.')) + '.pyx'
     EXTS.append(Extension(modulename, [pyx_src] + other_sources,
@@ -164,6 +167,7 @@ def main(**extra_args):
                           'dipy.tests',
                           'dipy.align',
                           'dipy.align.tests',
+                          'dipy.align.benchmarks',
                           'dipy.core',
                           'dipy.core.tests',
                           'dipy.direction',
@@ -196,6 +200,7 @@ def main(**extra_args):
                           'dipy.sims',
                           'dipy.sims.tests',
                           'dipy.denoise',
+                          'dipy.denoise.benchmarks',
                           'dipy.denoise.tests',
                           'dipy.workflows',
                           'dipy.workflows.tests'],
@@ -215,7 +220,11 @@ def main(**extra_args):
           scripts      = [pjoin('bin', 'dipy_peak_extraction'),
                           pjoin('bin', 'dipy_fit_tensor'),
                           pjoin('bin', 'dipy_sh_estimate'),
-                          pjoin('bin', 'dipy_quickbundles')],
+                          pjoin('bin', 'dipy_quickbundles'),
+                          pjoin('bin', 'dipy_median_otsu'),
+                          pjoin('bin', 'dipy_reconst_dti'),
+                          pjoin('bin', 'dipy_reconst_csd'),
+                          pjoin('bin', 'dipy_track_local')],
           cmdclass = cmdclass,
           **extra_args
         )